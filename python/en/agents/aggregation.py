@@ -0,0 +1,148 @@
+import os
+import re
+from datetime import date, timedelta
+
+# Layout of the table the ESP8266 readings are stored in (override with environment variables).
+# The query builders import SQLAlchemy themselves, so these settings load without it (main.py --check).
+SENSOR_TABLE = os.getenv("SENSOR_TABLE", "sensor_data")
+SENSOR_VALUE_COLUMN = os.getenv("SENSOR_VALUE_COLUMN", "value")
+SENSOR_TIME_COLUMN = os.getenv("SENSOR_TIME_COLUMN", "timestamp")
+SENSOR_ID_COLUMN = os.getenv("SENSOR_ID_COLUMN")  # Optional, only for installations with several sensors
+
+# Rollup tables maintained by agents/rollups.py (count, sum, min and max per sensor and bucket)
+HOURLY_TABLE = f"{SENSOR_TABLE}_hourly"
+DAILY_TABLE = f"{SENSOR_TABLE}_daily"
+
+# Allowed aggregation buckets (values accepted by PostgreSQL's date_trunc)
+BUCKETS = ("hour", "day", "week", "month")
+MAX_WINDOW_DAYS = 3660
+
+IDENTIFIER_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+def quote_identifier(name):
+    """Validates a table/column name and returns it quoted for PostgreSQL."""
+    if not name or not IDENTIFIER_PATTERN.match(name):
+        raise ValueError(f"Invalid SQL identifier: {name!r}")
+    return f'"{name}"'
+
+def validate_window(window_days, bucket):
+    """Checks the window length and bucket size before any SQL is built."""
+    if isinstance(window_days, bool) or not isinstance(window_days, int):
+        raise ValueError(f"The window length must be an integer number of days, got {window_days!r}")
+    if not 1 <= window_days <= MAX_WINDOW_DAYS:
+        raise ValueError(f"The window length must be between 1 and {MAX_WINDOW_DAYS} days, got {window_days}")
+    if bucket not in BUCKETS:
+        raise ValueError(f"Unknown bucket {bucket!r}, expected one of: {', '.join(BUCKETS)}")
+
+def window_start(window_days):
+    """
+    First day of the last `window_days` days, today included (local date of the agents), so a
+    3-day window covers three dates. It is bound as an untyped ISO date instead of computed in
+    SQL: PostgreSQL gives it the type of the column, so the planner compares it with the bounds
+    of the time partitions (agents/schema.py) and only plans and scans the partitions of the window.
+    """
+    return (date.today() - timedelta(days=window_days - 1)).isoformat()
+
+def build_summary_query(window_days=3, bucket="day", sensor_id=None):
+    """
+    Builds the min/avg/max summary of the sensor values for the last `window_days` days,
+    grouped by `bucket`. Returns the prepared statement and its bound parameters.
+    """
+    from sqlalchemy import text
+    validate_window(window_days, bucket)
+
+    table = quote_identifier(SENSOR_TABLE)
+    value = quote_identifier(SENSOR_VALUE_COLUMN)
+    ts = quote_identifier(SENSOR_TIME_COLUMN)
+
+    # The bucket comes from the allow-list above, so it is safe to inline it
+    bucket_expr = f"date_trunc('{bucket}', {ts})"
+    if bucket != "hour":
+        bucket_expr = f"CAST({bucket_expr} AS DATE)"
+
+    conditions = [f"{ts} >= :window_start"]
+    parameters = {"window_start": window_start(window_days)}
+
+    if sensor_id is not None:
+        if not SENSOR_ID_COLUMN:
+            raise ValueError("A sensor filter was requested but SENSOR_ID_COLUMN is not configured")
+        conditions.append(f"{quote_identifier(SENSOR_ID_COLUMN)} = :sensor_id")
+        parameters["sensor_id"] = sensor_id
+
+    sql = (
+        f"SELECT {bucket_expr} AS date,\n"
+        f"       ROUND(MIN({value})::numeric, 2) AS min_value,\n"
+        f"       ROUND(AVG({value})::numeric, 2) AS avg_value,\n"
+        f"       ROUND(MAX({value})::numeric, 2) AS max_value\n"
+        f"FROM {table}\n"
+        f"WHERE {' AND '.join(conditions)}\n"
+        f"GROUP BY 1\n"
+        f"ORDER BY 1"
+    )
+    return text(sql), parameters
+
+def build_rollup_summary_query(window_days=3, bucket="day", sensor_id=None):
+    """
+    Same summary as build_summary_query, read from the hourly/daily rollup tables instead of
+    the raw readings, so its cost depends on the number of buckets in the window.
+    """
+    from sqlalchemy import text
+    validate_window(window_days, bucket)
+
+    if bucket == "hour":
+        table, bucket_expr = HOURLY_TABLE, "bucket_start"
+        time_column = "bucket_start"
+    else:
+        table, time_column = DAILY_TABLE, "bucket_date"
+        bucket_expr = "bucket_date" if bucket == "day" else f"CAST(date_trunc('{bucket}', bucket_date) AS DATE)"
+
+    conditions = [f"{time_column} >= :window_start"]
+    parameters = {"window_start": window_start(window_days)}
+
+    if sensor_id is not None:
+        if not SENSOR_ID_COLUMN:
+            raise ValueError("A sensor filter was requested but SENSOR_ID_COLUMN is not configured")
+        conditions.append("sensor_id = :sensor_id")
+        parameters["sensor_id"] = str(sensor_id)
+
+    # Buckets of several sensors (or several days for week/month) are merged from their counts and sums
+    sql = (
+        f"SELECT {bucket_expr} AS date,\n"
+        f"       ROUND(MIN(value_min)::numeric, 2) AS min_value,\n"
+        f"       ROUND((SUM(value_sum) / SUM(reading_count))::numeric, 2) AS avg_value,\n"
+        f"       ROUND(MAX(value_max)::numeric, 2) AS max_value\n"
+        f"FROM {quote_identifier(table)}\n"
+        f"WHERE {' AND '.join(conditions)}\n"
+        f"GROUP BY 1\n"
+        f"ORDER BY 1"
+    )
+    return text(sql), parameters
+
+def build_readings_query(window_days=3, sensor_id=None):
+    """
+    Builds the query of the raw readings of the last `window_days` days, oldest first
+    (one row per reading, with the sensor of each one when SENSOR_ID_COLUMN is configured).
+    """
+    from sqlalchemy import text
+    validate_window(window_days, "day")
+
+    value = quote_identifier(SENSOR_VALUE_COLUMN)
+    ts = quote_identifier(SENSOR_TIME_COLUMN)
+    sensor = f", CAST({quote_identifier(SENSOR_ID_COLUMN)} AS TEXT) AS sensor_id" if SENSOR_ID_COLUMN else ""
+
+    conditions = [f"{ts} >= :window_start"]
+    parameters = {"window_start": window_start(window_days)}
+
+    if sensor_id is not None:
+        if not SENSOR_ID_COLUMN:
+            raise ValueError("A sensor filter was requested but SENSOR_ID_COLUMN is not configured")
+        conditions.append(f"{quote_identifier(SENSOR_ID_COLUMN)} = :sensor_id")
+        parameters["sensor_id"] = sensor_id
+
+    sql = (
+        f"SELECT {ts} AS timestamp, {value} AS value{sensor}\n"
+        f"FROM {quote_identifier(SENSOR_TABLE)}\n"
+        f"WHERE {' AND '.join(conditions)}\n"
+        f"ORDER BY {ts}"
+    )
+    return text(sql), parameters
@@ -0,0 +1,168 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from agents import locales, metrics
+from agents.aggregation import build_readings_query
+from agents.db import get_engine
+from agents.report_data import SENSOR_MAX
+
+# Anomaly detection configuration (values on the sensor's 0-1023 scale, lower = wetter)
+ANOMALY_WINDOW_MINUTES = float(os.getenv("ANOMALY_WINDOW_MINUTES", "60"))  # Time span of the rolling median/MAD window...
+ANOMALY_MIN_READINGS = int(os.getenv("ANOMALY_MIN_READINGS", "7"))         # ...widened to hold at least this many readings
+ANOMALY_Z = float(os.getenv("ANOMALY_Z", "5"))                             # Robust z-score above which a reading is an outlier
+ANOMALY_DROP = float(os.getenv("ANOMALY_DROP", "150"))                     # Fall of the value that counts as a watering...
+ANOMALY_DROP_MINUTES = float(os.getenv("ANOMALY_DROP_MINUTES", "15"))      # ...when it happens within this many minutes
+ANOMALY_STUCK_MINUTES = float(os.getenv("ANOMALY_STUCK_MINUTES", "120"))   # Identical readings for this long...
+ANOMALY_STUCK_READINGS = int(os.getenv("ANOMALY_STUCK_READINGS", "6"))     # ...and at least this many of them = stuck sensor
+ANOMALY_VALID_MIN = int(os.getenv("ANOMALY_VALID_MIN", "1"))               # Readings at the ends of the scale come from
+ANOMALY_VALID_MAX = int(os.getenv("ANOMALY_VALID_MAX", str(SENSOR_MAX - 1)))  # a shorted or disconnected sensor
+ANOMALY_MAX_FINDINGS = int(os.getenv("ANOMALY_MAX_FINDINGS", "8"))         # Findings listed in the email, the rest are counted
+
+# Order in which the findings are listed, the most serious first
+KINDS = ("out_of_range", "stuck", "sudden_drop", "outlier")
+# Kinds that point to a sensor or plant problem, a sudden drop is usually just a watering
+FAULT_KINDS = ("out_of_range", "stuck", "outlier")
+
+def humidity(value):
+    """Estimated humidity percentage of a raw sensor value."""
+    return (SENSOR_MAX - value) / SENSOR_MAX * 100
+
+def load_readings(window_days=3, sensor_id=None, engine=None):
+    """Raw readings of the window as a DataFrame (timestamp, value[, sensor_id]), oldest first."""
+    query, parameters = build_readings_query(window_days=window_days, sensor_id=sensor_id)
+    with (engine or get_engine()).connect() as conn:
+        return pd.read_sql_query(query, conn, params=parameters, parse_dates=["timestamp"])
+
+def sampling_minutes(timestamps):
+    """Usual time between two readings in minutes (the device sends one per hour, the benchmarks one per minute)."""
+    if len(timestamps) < 2:
+        return 1.0
+    return max((timestamps[1:] - timestamps[:-1]).median().total_seconds() / 60, 1 / 60)
+
+def group_events(timestamps, values, reference, mask, kind):
+    """One row per run of consecutive flagged readings: its time span, value range and reference value."""
+    if not mask.any():
+        return pd.DataFrame()
+    run = np.cumsum(mask & ~np.r_[False, mask[:-1]])  # Increases at the first reading of every run
+    flagged = pd.DataFrame({"timestamp": timestamps[mask], "value": values[mask],
+                            "reference": reference[mask], "run": run[mask]})
+    events = flagged.groupby("run").agg(
+        start=("timestamp", "first"), end=("timestamp", "last"), readings=("value", "size"),
+        low=("value", "min"), high=("value", "max"), reference=("reference", "median"),
+    )
+    if kind == "sudden_drop":
+        events["reference"] = flagged.groupby("run")["reference"].max()  # The value before the watering
+    events.insert(0, "kind", kind)
+    return events.reset_index(drop=True)
+
+def detect_series(timestamps, values):
+    """Finds the anomalies of one sensor's readings (sorted by time). Returns a DataFrame of events."""
+    timestamps = pd.DatetimeIndex(timestamps)
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return pd.DataFrame()
+
+    # Each check runs on the readings the previous ones did not flag, so a faulty sensor is not
+    # also reported as outliers and a single spike is not taken for a watering
+    out_of_range = (values < ANOMALY_VALID_MIN) | (values > ANOMALY_VALID_MAX)
+
+    # At least ANOMALY_STUCK_READINGS identical consecutive readings for longer than ANOMALY_STUCK_MINUTES
+    change = np.r_[True, values[1:] != values[:-1]]
+    starts = np.flatnonzero(change)
+    ends = np.r_[starts[1:], len(values)] - 1
+    run_minutes = (timestamps[ends] - timestamps[starts]).total_seconds().to_numpy() / 60
+    long_run = (run_minutes >= ANOMALY_STUCK_MINUTES) & (ends - starts + 1 >= ANOMALY_STUCK_READINGS)
+    stuck = long_run[np.cumsum(change) - 1] & ~out_of_range
+
+    # Outliers: robust z-score against the rolling median and MAD (at least 1 unit, readings are integers).
+    # The window covers ANOMALY_WINDOW_MINUTES at the sampling rate of the series, and never fewer than
+    # ANOMALY_MIN_READINGS readings (an odd number, so it is centered on the reading)
+    window = pd.Series(np.where(out_of_range | stuck, np.nan, values))
+    interval = sampling_minutes(timestamps)
+    size = max(ANOMALY_MIN_READINGS, int(ANOMALY_WINDOW_MINUTES / interval)) | 1
+    median = window.rolling(size, center=True, min_periods=size // 2).median()
+    mad = (window - median).abs().rolling(size, center=True, min_periods=size // 2).median()
+    z = 0.6745 * (window - median) / mad.clip(lower=1)
+    outlier = (z.abs() > ANOMALY_Z).to_numpy()
+
+    # Watering: the value falls by ANOMALY_DROP below its maximum of the last ANOMALY_DROP_MINUTES, or of the
+    # previous reading when the sensor reports less often than that (1.5 intervals absorb the jitter)
+    valid = pd.Series(np.where(out_of_range | stuck | outlier, np.nan, values), index=timestamps)
+    drop_window = pd.Timedelta(minutes=max(ANOMALY_DROP_MINUTES, 1.5 * interval))
+    recent_max = valid.rolling(drop_window).max().to_numpy()
+    sudden_drop = (recent_max - valid.to_numpy()) >= ANOMALY_DROP
+
+    references = {"out_of_range": values, "stuck": values, "sudden_drop": recent_max, "outlier": median.to_numpy()}
+    masks = {"out_of_range": out_of_range, "stuck": stuck, "sudden_drop": sudden_drop, "outlier": outlier}
+    events = [group_events(timestamps, values, references[kind], masks[kind], kind) for kind in KINDS]
+    return pd.concat([event for event in events if not event.empty] or [pd.DataFrame()], ignore_index=True)
+
+def detect(readings):
+    """Finds the anomalies of every sensor in `readings` (timestamp, value[, sensor_id])."""
+    if "sensor_id" not in readings:
+        findings = detect_series(readings["timestamp"], readings["value"])
+    else:
+        findings = [
+            detect_series(group["timestamp"], group["value"]).assign(sensor_id=sensor)
+            for sensor, group in readings.groupby("sensor_id", sort=True)
+        ]
+        findings = pd.concat([f for f in findings if not f.empty] or [pd.DataFrame()], ignore_index=True)
+    if findings.empty:
+        return findings
+    findings["order"] = findings["kind"].map(KINDS.index)
+    return findings.sort_values(["order", "start"]).drop(columns="order").reset_index(drop=True)
+
+def find_anomalies(window_days=3, sensor_id=None, engine=None):
+    """Loads the raw readings of the window and returns their anomalies."""
+    with metrics.span("anomaly_detection") as detection_span:
+        readings = load_readings(window_days, sensor_id, engine)
+        findings = detect(readings)
+        detection_span.set("rows", len(readings))
+        detection_span.set("findings", len(findings))
+    print(f"[INFO] Anomaly detection: {len(findings)} findings in {len(readings)} readings")
+    return findings
+
+def format_period(start, end, language=None):
+    if start == end:
+        return start.strftime("%Y-%m-%d %H:%M")
+    end_format = "%H:%M" if start.date() == end.date() else "%Y-%m-%d %H:%M"
+    return locales.text(language, "period", start=f"{start:%Y-%m-%d %H:%M}", end=end.strftime(end_format))
+
+def value_range(low, high, unit=""):
+    return f"{low:.0f}{unit}" if round(low) == round(high) else f"{low:.0f}-{high:.0f}{unit}"
+
+def describe(finding, language=None):
+    """One line about `finding` in `language` (see agents/locales.py)."""
+    period = format_period(finding["start"], finding["end"], language)
+    sensor = f" (sensor {finding['sensor_id']})" if "sensor_id" in finding and pd.notna(finding["sensor_id"]) else ""
+    kind = finding["kind"]
+    if kind == "out_of_range":
+        values = {"values": value_range(finding["low"], finding["high"])}
+    elif kind == "stuck":
+        values = {"humidity": humidity(finding["low"])}
+    elif kind == "sudden_drop":
+        values = {"before": humidity(finding["reference"]), "after": humidity(finding["low"])}
+    else:
+        kind = "outlier"
+        values = {"values": value_range(humidity(finding["high"]), humidity(finding["low"]), "%"),
+                  "reference": humidity(finding["reference"])}
+    return locales.text(language, kind, period=period, sensor=sensor, readings=finding["readings"], **values)
+
+def describe_findings(findings, limit=ANOMALY_MAX_FINDINGS, language=None):
+    """Compact list of the findings for the email prompt, in `language`."""
+    if findings is None:
+        return locales.text(language, "anomalies_unavailable")
+    if findings.empty:
+        return locales.text(language, "anomalies_none")
+    lines = [f"- {describe(finding, language)}" for _, finding in findings.head(limit).iterrows()]
+    if len(findings) > limit:
+        lines.append(locales.text(language, "anomalies_more", count=len(findings) - limit))
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detects anomalies in the raw humidity readings.")
+    parser.add_argument("--days", type=int, default=3, help="Length of the analyzed window in days")
+    parser.add_argument("--sensor", help="Only analyze this sensor (requires SENSOR_ID_COLUMN)")
+    args = parser.parse_args()
+    print(describe_findings(find_anomalies(args.days, args.sensor), limit=1000))
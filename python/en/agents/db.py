@@ -0,0 +1,64 @@
+import os
+import threading
+from functools import lru_cache
+from sqlalchemy import create_engine, text
+
+# Database configuration
+DB_USER = os.getenv("DB_USER", "user_here")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "password_here")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5432")
+DB_NAME = os.getenv("DB_NAME", "database_name")
+
+# Connection pool configuration
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))              # Connections kept open between queries
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))        # Extra connections allowed under load
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))       # Seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))     # Reopen connections older than this (seconds)
+# Executions of the same statement on a connection before psycopg prepares it on the server,
+# "none" disables prepared statements (e.g. behind PgBouncer in transaction mode)
+DB_PREPARE_THRESHOLD = os.getenv("DB_PREPARE_THRESHOLD", "1")
+# Report stages reading the database at once (see main.py), kept within the pool so that with many
+# plants they wait their turn here rather than failing after DB_POOL_TIMEOUT
+DB_CONCURRENCY = int(os.getenv("DB_CONCURRENCY", str(DB_POOL_SIZE)))
+DB_SLOTS = threading.BoundedSemaphore(DB_CONCURRENCY)
+
+# Connection URI construction (psycopg 3 driver, needed for the prepared statements).
+# DATABASE_URL replaces the DB_* settings, e.g. to point the agents at a local test database.
+db_uri = os.getenv("DATABASE_URL", f"postgresql+psycopg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
+if db_uri.startswith("postgresql://"):
+    db_uri = "postgresql+psycopg://" + db_uri[len("postgresql://"):]
+
+def prepare_threshold():
+    if DB_PREPARE_THRESHOLD.lower() in ("", "none", "off"):
+        return None
+    return int(DB_PREPARE_THRESHOLD)
+
+@lru_cache(maxsize=None)
+def get_engine():
+    """Returns the pooled SQLAlchemy engine shared by every agent in the process."""
+    return create_engine(
+        db_uri,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,  # Connections dropped by the server are replaced before they are used
+        pool_use_lifo=True,  # Reuse the most recent connection, which already has the report statements prepared
+        connect_args={"prepare_threshold": prepare_threshold()},
+    )
+
+def check_health(engine=None):
+    """Runs a trivial query through the pool and returns the pool status, raises if the database is unreachable."""
+    engine = engine or get_engine()
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    return {"pool": engine.pool.status(), "checked_out": engine.pool.checkedout()}
+
+if __name__ == "__main__":
+    try:
+        status = check_health()
+        print(f"[INFO] Database reachable at {DB_HOST}:{DB_PORT}/{DB_NAME} - {status['pool']}")
+    except Exception as e:
+        print(f"[ERROR] Database not reachable at {DB_HOST}:{DB_PORT}/{DB_NAME}: {e}")
+        raise SystemExit(1)
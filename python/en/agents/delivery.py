@@ -0,0 +1,188 @@
+import atexit
+import contextvars
+import os
+import queue
+import smtplib
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from agents import metrics
+
+# SMTP server configuration (a local stand-in such as `python -m aiosmtpd -n -l localhost:8025`
+# can be used for tests with SMTP_HOST=localhost SMTP_PORT=8025 SMTP_STARTTLS=0)
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") != "0"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+
+# Delivery configuration
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "2"))                    # Sessions kept open and used in parallel
+SMTP_MESSAGES_PER_SESSION = int(os.getenv("SMTP_MESSAGES_PER_SESSION", "50"))  # Reconnect after this many messages
+SMTP_MAX_RETRIES = int(os.getenv("SMTP_MAX_RETRIES", "3"))
+SMTP_RETRY_DELAY = float(os.getenv("SMTP_RETRY_DELAY", "2"))              # Seconds, doubled after every retry
+
+class SMTPPool:
+    """
+    Keeps up to `size` authenticated SMTP sessions open, so a run that sends several emails pays
+    for the connection, STARTTLS and login once per session instead of once per email.
+    No more than `size` sessions are in use at once, other senders wait for one to be released.
+    """
+
+    def __init__(self, sender_email, sender_password, host=SMTP_HOST, port=SMTP_PORT, size=SMTP_POOL_SIZE):
+        self.sender_email = sender_email
+        self.sender_password = sender_password
+        self.host = host
+        self.port = port
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.sent = {}  # Messages sent per session, to reconnect before the server's limit
+        self.lock = threading.Lock()
+
+    def connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+        try:
+            if SMTP_STARTTLS:
+                server.starttls()
+            if self.sender_password and server.has_extn("auth"):
+                server.login(self.sender_email, self.sender_password)
+        except Exception:
+            server.close()
+            raise
+        print(f"[INFO] SMTP session opened with {self.host}:{self.port}")
+        return server
+
+    def acquire(self):
+        """Waits for a free slot and returns an idle session that still answers, or a new one."""
+        started = time.perf_counter()
+        self.slots.acquire()
+        metrics.add("smtp_wait_seconds", time.perf_counter() - started)
+        try:
+            while True:
+                try:
+                    server = self.idle.get_nowait()
+                except queue.Empty:
+                    return self.connect()
+                try:
+                    server.noop()
+                    return server
+                except (smtplib.SMTPException, OSError):
+                    self.forget(server)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, server):
+        with self.lock:
+            self.sent[id(server)] = self.sent.get(id(server), 0) + 1
+            worn_out = self.sent[id(server)] >= SMTP_MESSAGES_PER_SESSION
+        if worn_out or self.idle.qsize() >= self.size:
+            self.close_session(server)
+        else:
+            self.idle.put(server)
+        self.slots.release()
+
+    def discard(self, server):
+        self.forget(server)
+        self.slots.release()
+
+    def forget(self, server):
+        with self.lock:
+            self.sent.pop(id(server), None)
+        server.close()
+
+    def close_session(self, server):
+        with self.lock:
+            self.sent.pop(id(server), None)
+        try:
+            server.quit()  # Close SMTP connection
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def close(self):
+        while True:
+            try:
+                self.close_session(self.idle.get_nowait())
+            except queue.Empty:
+                return
+
+POOLS = {}
+POOLS_LOCK = threading.Lock()
+
+def get_pool(sender_email, sender_password):
+    """Returns the session pool of a sender, shared by every report sent from this process."""
+    with POOLS_LOCK:
+        key = (SMTP_HOST, SMTP_PORT, sender_email)
+        if key not in POOLS:
+            POOLS[key] = SMTPPool(sender_email, sender_password)
+        return POOLS[key]
+
+@atexit.register
+def close_pools():
+    for pool in POOLS.values():
+        pool.close()
+
+def is_temporary(error):
+    """
+    4xx replies (rate limits, greylisting) and dropped connections are worth retrying. SMTPException
+    is an OSError, so its subclasses are checked first: the rest of them (authentication, unsupported
+    commands) and any other OSError, such as a TLS certificate error, are permanent.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPException):
+        return False
+    return isinstance(error, (ConnectionError, TimeoutError, socket.gaierror))
+
+def session_usable(error):
+    """After a rejection sendmail resets the transaction, the session is kept unless the server is closing it (421)."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code != 421 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code != 421
+
+def send_payload(pool, payload, recipient):
+    """Sends one already rendered message to `recipient`, retrying temporary failures with backoff."""
+    message = f"To: {recipient}\r\n".encode("utf-8") + payload
+    for attempt in range(SMTP_MAX_RETRIES + 1):
+        server = None
+        try:
+            server = pool.acquire()
+            server.sendmail(pool.sender_email, recipient, message)
+            pool.release(server)
+            return True
+        except Exception as e:
+            if server is not None and session_usable(e):
+                pool.release(server)
+            elif server is not None:
+                pool.discard(server)
+            if not is_temporary(e) or attempt == SMTP_MAX_RETRIES:
+                print(f"[ERROR] Could not send the email to {recipient}: {e}")
+                return False
+            metrics.add("retries")
+            delay = SMTP_RETRY_DELAY * 2 ** attempt
+            print(f"[WARNING] Sending to {recipient} failed ({e}), retrying in {delay:.0f}s...")
+            time.sleep(delay)
+
+def deliver(msg, recipients, sender_email, sender_password):
+    """
+    Sends `msg` (without a To header) to every recipient through the sender's session pool.
+    The MIME payload is rendered once and reused for all of them. Returns {recipient: sent}.
+    """
+    pool = get_pool(sender_email, sender_password)
+    payload = msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))  # smtplib does not fix line endings of bytes
+    contexts = [contextvars.copy_context() for _ in recipients]  # Retries are counted in the caller's span
+    with ThreadPoolExecutor(max_workers=max(1, min(pool.size, len(recipients)))) as executor:
+        results = executor.map(lambda context, recipient: context.run(send_payload, pool, payload, recipient),
+                               contexts, recipients)
+        return dict(zip(recipients, results))
+
+def parse_recipients(recipients):
+    """Accepts a list or a comma/semicolon separated string of email addresses."""
+    if isinstance(recipients, str):
+        recipients = recipients.replace(";", ",").split(",")
+    return [recipient.strip() for recipient in recipients if recipient.strip()]
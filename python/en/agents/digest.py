@@ -0,0 +1,74 @@
+import os
+import re
+import numpy as np
+from agents import locales
+
+# Target soil humidity (%) of each species, the band the email compares the period with.
+# HUMIDITY_TARGET="40-70" sets the band of every plant instead.
+SPECIES_TARGETS = {
+    "monstera adansonii": (40, 70),
+    "monstera deliciosa": (40, 70),
+    "ficus lyrata": (35, 60),
+    "epipremnum aureum": (30, 60),
+    "calathea": (50, 80),
+    "sansevieria": (10, 35),
+}
+DEFAULT_TARGET = (30, 70)  # Species not listed above
+HUMIDITY_TARGET = os.getenv("HUMIDITY_TARGET")
+STABLE_SLOPE = 0.5  # Percentage points per day below which the humidity counts as stable
+TOKEN_PIECES = re.compile(r"[^\W\d_]+|\d{1,3}|(?:[^\w\s]|_)+|\n+")
+
+def target_band(species):
+    """Target humidity band (low, high) of `species`, in %."""
+    if HUMIDITY_TARGET:
+        low, high = (float(value) for value in HUMIDITY_TARGET.split("-", 1))
+        return low, high
+    return SPECIES_TARGETS.get(species.strip().lower(), DEFAULT_TARGET)
+
+def summarize(df_humidity, species):
+    """
+    Statistics of the whole period from the summary with humidity percentages: range, daily
+    averages, trend and the days outside the species' target band. Their size does not depend on
+    the length of the period, unlike the table they come from.
+    """
+    daily = df_humidity.groupby(df_humidity["date"].dt.normalize())["Humidity_avg"].mean()
+    days = (daily.index - daily.index[0]).days.to_numpy(dtype=float)
+    low, high = target_band(species)
+    return {
+        "start": daily.index[0],
+        "end": daily.index[-1],
+        "days": len(daily),
+        "min": df_humidity["Humidity_min"].min(),
+        "max": df_humidity["Humidity_max"].max(),
+        "mean": df_humidity["Humidity_avg"].mean(),
+        "driest_day": daily.idxmin(),
+        "driest": daily.min(),
+        "wettest_day": daily.idxmax(),
+        "wettest": daily.max(),
+        "last": daily.iloc[-1],
+        # Least-squares slope of the daily averages, in percentage points per day
+        "slope": np.polyfit(days, daily.to_numpy(), 1)[0] if len(daily) > 1 else 0.0,
+        "target": (low, high),
+        "days_below": int((daily < low).sum()),
+        "days_above": int((daily > high).sum()),
+    }
+
+def describe(stats, species, language=None):
+    """The statistics as the short list sent to the model, in `language` (see agents/locales.py)."""
+    slope = stats["slope"]
+    trend = "trend_stable" if abs(slope) < STABLE_SLOPE else "trend_drying" if slope < 0 else "trend_wetter"
+    low, high = stats["target"]
+    return locales.text(language, "digest", **stats, trend=locales.text(language, trend), species=species,
+                        low=low, high=high)
+
+def estimate_tokens(text):
+    """
+    Rough token count of `text` without loading the model's tokenizer. The text is split as BPE
+    tokenizers do before merging (words, groups of up to 3 digits, runs of punctuation and line
+    breaks); every piece counts as a token, plus one for every 6 letters of a long word or 4
+    characters of a long run of symbols. It errs on the high side, as a budget should.
+    """
+    tokens = 0
+    for piece in TOKEN_PIECES.findall(text):
+        tokens += 1 + len(piece) // (6 if piece[0].isalpha() else 4)
+    return tokens
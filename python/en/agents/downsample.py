@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+from agents.report_data import SUMMARY_COLUMNS
+
+def lttb(x, y, target):
+    """
+    Returns the indices of `target` points that keep the visual shape of the series (x, y),
+    using Largest-Triangle-Three-Buckets. The first and last points are always kept.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if target >= n or target < 3:
+        return np.arange(n)
+
+    # target - 2 buckets over the inner points, with the average point of each one
+    edges = np.linspace(1, n - 1, target - 1).astype(int)
+    counts = np.diff(edges)
+    mean_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / counts
+    mean_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / counts
+    # Third vertex of each bucket's triangles: the average of the next bucket (the last point for the last one)
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    selected = np.empty(target, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(target - 2):
+        start, end = edges[i], edges[i + 1]
+        # Area of the triangle (previous point, candidate, next average) for every candidate of the bucket
+        areas = np.abs((x[previous] - next_x[i]) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y[i] - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+    return selected
+
+def downsample_summary(df, target):
+    """
+    Reduces a summary to at most `target` rows by merging consecutive rows into buckets: the
+    minimum of the minimums, the mean of the averages and the maximum of the maximums, so the
+    min/max envelope keeps every extreme. Each bucket is dated by its first row.
+    """
+    if len(df) <= target:
+        return df
+    date, low, mean, high = SUMMARY_COLUMNS
+    starts = np.unique(np.linspace(0, len(df), target, endpoint=False).astype(int))
+    counts = np.diff(np.append(starts, len(df)))
+    return pd.DataFrame({
+        date: df[date].to_numpy()[starts],
+        low: np.minimum.reduceat(df[low].to_numpy(dtype=float), starts),
+        mean: np.add.reduceat(df[mean].to_numpy(dtype=float), starts) / counts,
+        high: np.maximum.reduceat(df[high].to_numpy(dtype=float), starts),
+    })
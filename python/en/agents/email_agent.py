@@ -1,137 +1,267 @@
-from langchain_ollama import OllamaLLM
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
-import pandas as pd
 import os
-import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.image import MIMEImage
 from datetime import datetime
+from getpass import getpass
 import re 
+from functools import lru_cache
+from agents import anomalies, digest, locales, metrics
+from agents.delivery import deliver, parse_recipients
+from agents.report_data import add_humidity_percentages, load_summary
 
-# Instantiate OllamaLLM
-ollama_llm = OllamaLLM(model="deepseek-r1:32b", base_url="http://YOUR_IP_OR_SERVER:PORT")
-
-# Prompt template for drafting the email
-# The user must enter the recipient's email at runtime
-email_template_prompt = PromptTemplate(
-    template=(
-        "You are an expert in botany and plant care, particularly for Monstera adansonii. "
-        "Based on the following soil moisture analysis for a Monstera adansonii, "
-        "write a VERY SHORT AND CONCISE email addressed to {recipient_email}. "
-        "The email should:\n\n"
-        "1. **Start ABSOLUTELY with: `Hello,` (without quotes, EXACTLY like this)**\n"
-        "2. **Summarize in a VERY CONCISE manner the evolution of soil moisture** over the analyzed dates (extracted from the Markdown table). Mention only the most relevant points.\n"
-        "3. **Directly and concisely analyze whether the moisture levels are suitable for a Monstera adansonii.** DO NOT give manual watering tips; JUST STATE WHETHER THE LEVELS ARE APPROPRIATE OR NOT.\n"
-        "4. **Briefly identify and mention any abnormal moisture values** (if present, be very direct).\n"
-        "5. **Attach a graph (mention that it is attached).** Be brief; just state that a soil moisture graph is attached.\n"
-        "6. **End the email with the following EXACT closing:** Best regards, GardenCare AI System\n\n"
-        "**IMPORTANT:**\n"
-        "- Use a professional, concise, and informative tone.\n"
-        "- Use **HTML formatting to bold key parts of the text.**\n"
-        "- **DO NOT INCLUDE the email subject in the email body.**\n"
-        "- Be **VERY BRIEF AND TO THE POINT throughout the email.**\n\n"
-        "<!DOCTYPE html>\n"
-        "<html>\n"
-        "<head>\n"
-        "    <meta charset='UTF-8'>\n"
-        "</head>\n"
-        "<body>\n"
-        "    <p><strong>Hello,</strong></p>\n"
-        "    <p>Analyzing the soil moisture data for your Monstera adansonii from [START DATE] to [END DATE]:</p>\n"
-        "    <ul>\n"
-        "        <li>Average moisture: between <strong>[MIN-MAX MOISTURE RANGE]%</strong>. <strong>[STATEMENT ON WHETHER LEVELS ARE ADEQUATE]</strong></li>\n"
-        "    </ul>\n"
-        "    <p><strong>[SUGGESTION BASED ON ANALYSIS].</strong></p>\n"
-        "    <p>[STATEMENT ON ABNORMAL VALUES, IF APPLICABLE, OTHERWISE OMIT].</p>\n"
-        "    <p>Attached is a graph with a detailed evolution of soil moisture.</p>\n"
-        "    <p><strong>Best regards,</strong></p>\n"
-        "    <p>GardenCare AI System</p>\n"
-        "</body>\n"
-        "</html>\n\n"
-        "Soil moisture data (Markdown table):\n"
-        "{markdown_table}\n\n"
-        "**RETURN ONLY THE COMPLETE HTML CODE OF THE EMAIL**"
-    ),
-    input_variables=["markdown_table", "recipient_email"]
-)
-
-email_chain = LLMChain(llm=ollama_llm, prompt=email_template_prompt)
-
-def analyze_humidity_and_draft_email():
+# Streaming of the email draft (EMAIL_STREAMING=0 waits for the complete response instead)
+EMAIL_STREAMING = os.getenv("EMAIL_STREAMING", "1") != "0"
+EMAIL_MAX_TOKENS = int(os.getenv("EMAIL_MAX_TOKENS", "4096"))  # Reasoning plus HTML, Ollama stops generating above this (num_predict)
+STREAM_CACHE_KEY = "email-stream"  # LangChain's cache does not cover stream(), the drafts are cached under this key
+PLANT_SPECIES = os.getenv("PLANT_SPECIES", "Monstera adansonii")  # Species of the plants without their own in the config
+# Estimated tokens of the prompt (see digest.estimate_tokens). The anomaly list is shortened to fit,
+# so a long report or a burst of anomalies cannot push the prompt out of the model's context.
+EMAIL_PROMPT_BUDGET = int(os.getenv("EMAIL_PROMPT_BUDGET", "1500"))
+
+BODY_PATTERN = re.compile(r"<body[^>]*>(.*?)</body>", re.DOTALL | re.IGNORECASE)
+
+@lru_cache(maxsize=None)
+def email_prompt(language):
     """
-    Main function to analyze humidity data, draft, and send the email.
+    Prompt template for drafting the email in `language` (the texts are in agents/locales.py), built
+    on first use so LangChain is only loaded when an email is drafted.
     """
-    # The user must enter the file paths
-    report_path_md = input("Enter the path to the humidity Markdown file: ").strip()
-    image_path_png = input("Enter the path to the humidity graph (.png): ").strip()
-    recipient_email = input("Enter the recipient's email: ").strip()
-    sender_email = input("Enter your Gmail sender email: ").strip()
-    sender_password = getpass("Enter your app password: ")  #Secure input
+    from langchain.prompts import PromptTemplate
+    return PromptTemplate(template=locales.LOCALES[language]["email_prompt"],
+                          input_variables=["digest", "anomalies", "recipient_email", "species"])
 
-    print(f"\n[DEBUG] Reading Markdown report from: {report_path_md}")
+def email_task(findings):
+    """
+    Task of agents/routing.py that drafts the email: the reasoning model only explains faults
+    (anomalies.FAULT_KINDS), a report with just waterings or without findings goes to the fast model.
+    """
+    if findings is None or findings.empty or not findings["kind"].isin(anomalies.FAULT_KINDS).any():
+        return "email"
+    return "email_anomalies"
 
-    # --- Read and process humidity data ---
+def ask_email_settings(recipient_email=None, sender_email=None, sender_password=None):
+    """Asks the user for the email settings that were not given."""
+    if recipient_email is None:
+        recipient_email = input("Enter the recipient's email (separate several with commas): ").strip()
+    if sender_email is None:
+        sender_email = input("Enter your Gmail sender email: ").strip()
+    if sender_password is None:
+        sender_password = getpass("Enter your app password: ")  #Secure input
+    return recipient_email, sender_email, sender_password
+
+def build_prompt(df_humidity, findings, recipient_email, species, language=None, budget=EMAIL_PROMPT_BUDGET):
+    """
+    Prompt values of the email in `language`: a digest of the period (see agents/digest.py) instead
+    of the whole table, so the prompt has the same size for 3 days or 3 months of readings, and as
+    many anomalies as fit in `budget` tokens. Returns the values and the estimated tokens of the prompt.
+    Raises ValueError if the prompt does not fit even with a single anomaly.
+    """
+    prompt = email_prompt(language or locales.LANGUAGE)
+    values = {"digest": digest.describe(digest.summarize(df_humidity, species), species, language),
+              "recipient_email": recipient_email, "species": species}
+    limit = anomalies.ANOMALY_MAX_FINDINGS
+    while True:
+        values["anomalies"] = anomalies.describe_findings(findings, limit, language)
+        tokens = digest.estimate_tokens(prompt.format(**values))
+        if tokens <= budget:
+            return values, tokens
+        if limit <= 1:
+            raise ValueError(f"The email prompt needs about {tokens} tokens, over EMAIL_PROMPT_BUDGET ({budget})")
+        limit //= 2
+        print(f"[WARNING] Email prompt over budget ({tokens} of {budget} tokens), listing only {limit} of the anomalies.")
+
+def draft_email(df_summary, recipient_email, findings=None, species=None, language=None):
+    """
+    Drafts the email body with the LLM from the summary and the anomalies found in the raw
+    readings (`findings`, see agents/anomalies.py), for a plant of `species` (PLANT_SPECIES by
+    default), in `language` (locales.LANGUAGE by default). Returns the HTML (None on errors).
+    """
+    language = language or locales.LANGUAGE
+    with metrics.span("email_drafting", streaming=EMAIL_STREAMING, rows=len(df_summary), task=email_task(findings),
+                      language=language):
+        return write_draft(df_summary, recipient_email, findings, species or PLANT_SPECIES, language)
+
+def write_draft(df_summary, recipient_email, findings, species, language):
     try:
-        df_humidity = pd.read_csv(report_path_md, sep='|', skiprows=[2], skipinitialspace=True, header=0)
-        df_humidity.columns = df_humidity.columns.str.strip()  # Clean column names
-        df_humidity = df_humidity.dropna(axis=1, how='all')  # Remove empty columns if any
+        df_humidity = add_humidity_percentages(df_summary)
         print("\n[DEBUG] Humidity DataFrame successfully loaded.")
-        print(df_humidity.to_markdown(index=False))  # Debug: Display table
     except Exception as e:
-        print(f"\n[ERROR] Error reading the Markdown file: {e}")
-        return
+        print(f"\n[ERROR] Error reading the humidity data: {e}")
+        return None
 
     # --- Generate the email with Langchain ---
-    markdown_table_content = df_humidity.to_markdown(index=False)
+    try:
+        prompt_values, prompt_tokens = build_prompt(df_humidity, findings, recipient_email, species, language)
+    except ValueError as e:
+        print(f"\n[ERROR] {e}")
+        return None
+    metrics.set_value("prompt_tokens", prompt_tokens)
+    print(prompt_values["digest"])  # Debug: Display the digest sent to the model
+    print(prompt_values["anomalies"])
 
     try:
-        print("\n[DEBUG] Generating email draft...")
-        email_draft = email_chain.run(markdown_table=markdown_table_content, recipient_email=recipient_email)
+        print(f"\n[DEBUG] Generating email draft (prompt of about {prompt_tokens} tokens)...")
+        from agents.llm import get_task_llm
+        ollama_llm = get_task_llm(email_task(findings))  # The clients are shared with the other agents
+        if EMAIL_STREAMING:
+            email_html = stream_email(email_prompt(language).format(**prompt_values), ollama_llm)
+        else:
+            from langchain.chains import LLMChain
+            email_chain = LLMChain(llm=ollama_llm, prompt=email_prompt(language),
+                                   llm_kwargs={"options": {"num_predict": EMAIL_MAX_TOKENS}})
+            email_draft = email_chain.run(**prompt_values)
+            email_html = extract_html(drop_reasoning(email_draft))
+        if not email_html:
+            print("\n[ERROR] The model did not return the email content.")
+            return None
         print("\n[DEBUG] Email draft generated.")
-
-        # --- Extract the email HTML content ---
-        match = re.search(r"<!DOCTYPE html>(.*?)</html>", email_draft, re.DOTALL | re.IGNORECASE)
-        extracted_email_html = match.group(0) if match else email_draft.strip()
+        return email_html
 
     except Exception as e:
         print(f"\n[ERROR] Error generating the email with Langchain: {e}")
-        return
+        return None
+
+def drop_reasoning(text):
+    """Removes deepseek-r1's <think> section (the whole text while it is still open)."""
+    if "</think>" in text:
+        return text.rsplit("</think>", 1)[1]
+    return "" if "<think>" in text else text
+
+def extract_html(text):
+    """Extracts the email HTML content."""
+    match = re.search(r"<!DOCTYPE html>(.*?)</html>", text, re.DOTALL | re.IGNORECASE)
+    return match.group(0) if match else text.strip()
+
+def stream_email(prompt, ollama_llm, max_tokens=EMAIL_MAX_TOKENS):
+    """
+    Streams the draft from `ollama_llm` and stops the generation as soon as the closing </html>
+    arrives after the reasoning. Ollama itself stops after `max_tokens` tokens (num_predict, the
+    same tokens as its eval_count). Returns the email HTML.
+    """
+    from langchain_core.outputs import Generation
+    from agents.llm_cache import SQLiteLLMCache
+    cache = ollama_llm.cache if isinstance(ollama_llm.cache, SQLiteLLMCache) else None
+    cached = cache.lookup(prompt, STREAM_CACHE_KEY) if cache else None
+    if cached:
+        return cached[0].text
 
-    # --- Prepare the email ---
+    text = ""
+    thinking = False
+    finished = False
+    chunks = ollama_llm.stream(prompt, options={"num_predict": max_tokens})
+    try:
+        for chunk in chunks:
+            text += chunk
+            recent = text[-len(chunk) - len("</think>"):].lower()  # Tags may be split across chunks
+            if "<think>" in recent:
+                thinking = True
+            if "</think>" in recent:
+                thinking = False
+            if not thinking and "</html>" in drop_reasoning(recent):  # The reasoning may end in the same chunk
+                finished = True
+                break
+    finally:
+        chunks.close()  # Closes the request, so Ollama stops generating
+    if not finished:
+        print(f"[WARNING] The draft ended before its closing </html> (limit of {max_tokens} tokens), it may be incomplete.")
+
+    email_html = extract_html(drop_reasoning(text))
+    if cache and finished:
+        cache.update(prompt, STREAM_CACHE_KEY, [Generation(text=email_html)])
+    return email_html
+
+def combine_drafts(drafts):
+    """
+    Joins the drafts of several languages ({language: HTML}) into a single email with their bodies
+    one after the other. A single draft is returned as it is.
+    """
+    if len(drafts) == 1:
+        return next(iter(drafts.values()))
+    sections = []
+    for language, email_html in drafts.items():
+        body = BODY_PATTERN.search(email_html)
+        sections.append(f'<div lang="{language}">\n{body.group(1).strip() if body else email_html}\n</div>')
+    return ("<!DOCTYPE html>\n<html>\n<head>\n    <meta charset='UTF-8'>\n</head>\n<body>\n"
+            + "\n<hr>\n".join(sections) + "\n</body>\n</html>")
+
+def build_message(email_html, image_path_png, sender_email, languages=None):
+    """
+    Assembles the MIME message with the HTML body and the graph attached (None on errors).
+    `image_path_png` may also be a list of graphs (one per language), and the subject is written in
+    every language of `languages`. The To header is added for each recipient when the message is delivered.
+    """
     msg = MIMEMultipart()
     msg['From'] = sender_email
-    msg['To'] = recipient_email
-    msg['Subject'] = f"Humidity Report {datetime.now().strftime('%d/%m/%Y')}"
-    msg.attach(MIMEText(extracted_email_html, 'html'))  # Attach email content as HTML
+    msg['Subject'] = " / ".join(locales.text(language, "subject", date=datetime.now()) for language in languages or [None])
+    msg.attach(MIMEText(email_html, 'html'))  # Attach email content as HTML
 
-    # --- Attach the image ---
+    # --- Attach the images ---
     try:
-        with open(image_path_png, 'rb') as img_file:
-            img = MIMEImage(img_file.read())
-            img.add_header('Content-Disposition', 'attachment', filename=os.path.basename(image_path_png))
-            msg.attach(img)
-        print(f"\n[DEBUG] Image attached: {image_path_png}")
+        for image_path in [image_path_png] if isinstance(image_path_png, str) else image_path_png:
+            with open(image_path, 'rb') as img_file:
+                img = MIMEImage(img_file.read())
+                img.add_header('Content-Disposition', 'attachment', filename=os.path.basename(image_path))
+                msg.attach(img)
+            print(f"\n[DEBUG] Image attached: {image_path}")
+        return msg
 
     except Exception as e:
         print(f"\n[ERROR] Error attaching the image: {e}")
-        return
+        return None
 
-    # --- Send the email ---
-    try:
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(sender_email, sender_password)
-        server.sendmail(sender_email, recipient_email, msg.as_string())
-        print("\n✅ Email successfully sent to:", recipient_email)
+def send_message(msg, sender_email, sender_password, recipient_email):
+    """
+    Sends the message to every recipient in `recipient_email` (comma-separated) through the
+    pooled SMTP sessions of agents/delivery.py. Returns True if all of them received it.
+    """
+    recipients = parse_recipients(recipient_email)
+    with metrics.span("smtp_send", recipients=len(recipients)) as send_span:
+        results = deliver(msg, recipients, sender_email, sender_password)
+        send_span.set("sent", sum(results.values()))
+    for recipient, sent in results.items():
+        if sent:
+            print("\n✅ Email successfully sent to:", recipient)
+    return bool(results) and all(results.values())
+
+def analyze_humidity_and_draft_email(df_summary=None, image_path_png=None, recipient_email=None,
+                                     sender_email=None, sender_password=None):
+    """
+    Main function to analyze humidity data, draft, and send the email.
+    `df_summary` is the query agent's DataFrame; if not given, it is read from its saved summary.
+    Any argument that is not given is asked to the user. Returns True if the email was sent.
+    """
+    # The user must enter the file paths
+    if df_summary is None:
+        summary_path_csv = input("Enter the path to the humidity summary data (.arrow or .csv): ").strip()
+    if image_path_png is None:
+        image_path_png = input("Enter the path to the humidity graph (.png): ").strip()
+    recipient_email, sender_email, sender_password = ask_email_settings(recipient_email, sender_email, sender_password)
+
+    # --- Read and process humidity data ---
+    if df_summary is None:
+        try:
+            print(f"\n[DEBUG] Reading summary data from: {summary_path_csv}")
+            df_summary = load_summary(summary_path_csv)
+        except Exception as e:
+            print(f"\n[ERROR] Error reading the humidity data: {e}")
+            return False
 
+    try:
+        findings = anomalies.find_anomalies(int(os.getenv("REPORT_WINDOW_DAYS", "3")), os.getenv("SENSOR_ID"))
     except Exception as e:
-        print(f"\n[ERROR] Error sending the email: {e}")
+        print(f"\n[WARNING] The raw readings could not be analyzed: {e}")
+        findings = None
 
-    finally:
-        if 'server' in locals():
-            server.quit()  # Close SMTP connection
+    email_html = draft_email(df_summary, recipient_email, findings)
+    if email_html is None:
+        return False
+    msg = build_message(email_html, image_path_png, sender_email)
+    if msg is None:
+        return False
+    return send_message(msg, sender_email, sender_password, recipient_email)
 
 if __name__ == "__main__":
-    analyze_humidity_and_draft_email()
+    with metrics.span("email_agent"):
+        analyze_humidity_and_draft_email()
+    metrics.export()
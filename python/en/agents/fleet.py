@@ -0,0 +1,38 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Reports of different plants running at the same time. The shared resources have their own
+# limits on top of this one: OLLAMA_SLOTS (per endpoint, agents/routing.py), DB_CONCURRENCY (agents/db.py) and
+# SMTP_POOL_SIZE (agents/delivery.py), so a plant waiting for the models does not hold the others.
+FLEET_CONCURRENCY = int(os.getenv("FLEET_CONCURRENCY", "8"))
+
+async def run_plants(jobs, run, concurrency):
+    # The reports are blocking code, each one runs in a worker thread while the event loop fans them out
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_plant(job):
+        async with semaphore:
+            try:
+                # to_thread copies the context, so the report's spans are children of the caller's span
+                return bool(await asyncio.to_thread(run, job))
+            except Exception as e:
+                print(f"[ERROR] The report of plant '{job['name']}' failed: {e}")
+                return False
+
+    results = await asyncio.gather(*(run_plant(job) for job in jobs))
+    return {job["name"]: result for job, result in zip(jobs, results)}
+
+def run_fleet(jobs, run, concurrency=FLEET_CONCURRENCY):
+    """
+    Runs `run(job)` for every plant of `jobs`, up to `concurrency` at a time. A plant that fails
+    does not stop the others. Returns {plant name: True if its report was sent}.
+    """
+    if not jobs:
+        return {}
+    results = asyncio.run(run_plants(jobs, run, max(1, min(concurrency, len(jobs)))))
+    failed = [name for name, sent in results.items() if not sent]
+    print(f"[INFO] Fleet: {len(results) - len(failed)} of {len(results)} reports sent"
+          + (f", failed: {', '.join(failed)}" if failed else ""))
+    return results
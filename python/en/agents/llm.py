@@ -0,0 +1,131 @@
+import os
+from contextlib import contextmanager
+from functools import lru_cache
+import httpx
+import ollama
+from langchain_core.language_models.llms import BaseLLM
+from langchain_ollama import OllamaLLM
+from agents import metrics, routing
+from agents.llm_cache import LLM_CACHE_ENABLED, SQLiteLLMCache
+from agents.metrics import LLMMetrics
+from agents.pipeline import limited
+
+# How long Ollama keeps a model loaded after a call (e.g. "30m", "-1" for ever), Ollama's default if not set
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE") or None
+if OLLAMA_KEEP_ALIVE and OLLAMA_KEEP_ALIVE.lstrip("-").isdigit():
+    OLLAMA_KEEP_ALIVE = int(OLLAMA_KEEP_ALIVE)  # Ollama reads a plain number as seconds, a string needs a unit
+
+def unreachable(error):
+    """Errors after which the request is worth sending to another endpoint."""
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code == 404 or error.status_code >= 500  # Model missing there, or server error
+    return isinstance(error, (ConnectionError, httpx.TransportError))
+
+@contextmanager
+def use(endpoint):
+    """Waits for one of the endpoint's slots. Queued requests count as load, so the next ones go elsewhere."""
+    with endpoint.lock:
+        endpoint.in_flight += 1
+    try:
+        with limited(endpoint.slots, "ollama"):
+            yield
+    finally:
+        with endpoint.lock:
+            endpoint.in_flight -= 1
+
+@lru_cache(maxsize=None)
+def endpoint_client(model, url):
+    return OllamaLLM(model=model, base_url=url, keep_alive=OLLAMA_KEEP_ALIVE)
+
+class RoutedOllamaLLM(BaseLLM):
+    """
+    Client of `model` on the endpoints of agents/routing.py. Each request goes to the least busy
+    healthy endpoint that serves the model; if it cannot be reached, or does not have the model,
+    the request goes to the next one (a stream only before its first token).
+    """
+
+    model: str
+
+    @property
+    def _llm_type(self):
+        return "ollama"
+
+    @property
+    def _identifying_params(self):
+        return {"model": self.model}  # Not the endpoint: a cached response is valid from any of them
+
+    def answered(self, endpoint):
+        endpoint.mark_up()
+        metrics.set_value("llm_endpoint", endpoint.url)
+
+    def failed_over(self, endpoint, error):
+        endpoint.mark_down(error)
+        metrics.add("llm_failovers")
+
+    def _generate(self, prompts, stop=None, run_manager=None, **kwargs):
+        error = None
+        for endpoint in routing.endpoints_for(self.model):
+            with use(endpoint):
+                try:
+                    result = endpoint_client(self.model, endpoint.url)._generate(
+                        prompts, stop=stop, run_manager=run_manager, **kwargs)
+                except Exception as e:
+                    if not unreachable(e):
+                        raise
+                    self.failed_over(endpoint, e)
+                    error = e
+                    continue
+            self.answered(endpoint)
+            return result
+        raise error
+
+    def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+        error = None
+        for endpoint in routing.endpoints_for(self.model):
+            with use(endpoint):  # Held until the stream ends or is closed
+                streamed = False
+                try:
+                    for chunk in endpoint_client(self.model, endpoint.url)._stream(
+                            prompt, stop=stop, run_manager=run_manager, **kwargs):
+                        streamed = True
+                        yield chunk
+                except Exception as e:
+                    if streamed or not unreachable(e):
+                        raise
+                    self.failed_over(endpoint, e)
+                    error = e
+                    continue
+            self.answered(endpoint)
+            return
+        raise error
+
+@lru_cache(maxsize=None)
+def get_llm(model):
+    """Returns the client for `model`, shared by every agent in the process."""
+    # Responses are cached on disk per model, so an identical prompt is only sent to Ollama once
+    cache = SQLiteLLMCache(namespace=model) if LLM_CACHE_ENABLED else None
+    # Latency and token counts of every call are added to the span of the agent that makes it
+    return RoutedOllamaLLM(model=model, cache=cache, callbacks=[LLMMetrics(model)])
+
+def get_task_llm(task):
+    """Returns the client of the model that runs `task` (see routing.task_tiers())."""
+    return get_llm(routing.model_for(task))
+
+def preload(model, keep_alive=OLLAMA_KEEP_ALIVE, timeout=600):
+    """
+    Loads `model` into the memory of every healthy endpoint that serves it, without generating
+    anything (a request with an empty prompt). Returns the number of endpoints it was loaded on.
+    """
+    request = {"model": model, "prompt": "", "stream": False}
+    if keep_alive is not None:
+        request["keep_alive"] = keep_alive
+    loaded = 0
+    for endpoint in routing.endpoints_for(model):
+        if routing.check(endpoint) is None:
+            continue
+        try:
+            routing.request(endpoint, "/api/generate", request, timeout=timeout)
+            loaded += 1
+        except Exception as e:
+            print(f"[WARNING] Could not load {model} on {endpoint.url}: {e}")
+    return loaded
@@ -0,0 +1,143 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from langchain_core.caches import BaseCache
+from langchain_core.outputs import Generation
+from agents import metrics
+
+# LLM response cache configuration
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") != "0"  # LLM_CACHE=0 always calls Ollama
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.expanduser("~/.cache/gardencare/llm_cache.sqlite3"))
+LLM_CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", "168"))  # Entries older than this are discarded
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))  # Least recently used entries are evicted above this
+
+# Hits and misses of every cache in the process, reported at the end of a run
+STATS = {"hits": 0, "misses": 0}
+STATS_LOCK = threading.Lock()
+
+def cache_key(namespace, prompt, llm_string):
+    """Content address of a response: the model and its parameters plus the prompt."""
+    return hashlib.sha256(f"{namespace}\x00{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+# Set by bypass() for the calls made from the current thread
+BYPASS = threading.local()
+
+@contextmanager
+def bypass(active=True):
+    """
+    Skips the cache lookups inside the block, the fresh responses still replace the cached ones.
+    Used for retries, which must not get the response that just failed back from the cache.
+    """
+    previous = getattr(BYPASS, "active", False)
+    BYPASS.active = active or previous
+    try:
+        yield
+    finally:
+        BYPASS.active = previous
+
+def count(outcome):
+    with STATS_LOCK:
+        STATS[outcome] += 1
+    metrics.add(f"llm_cache_{outcome}")
+
+class SQLiteLLMCache(BaseCache):
+    """
+    LangChain cache that keeps the Ollama responses in a SQLite file, so identical prompts
+    skip the model across runs. Entries expire after `ttl_hours` and the least recently
+    used ones are evicted when there are more than `max_entries`.
+
+    OllamaLLM leaves the model out of LangChain's llm_string, so each client gets its own
+    cache with the model and its parameters as `namespace`.
+    """
+
+    def __init__(self, namespace="", path=LLM_CACHE_PATH, ttl_hours=LLM_CACHE_TTL_HOURS,
+                 max_entries=LLM_CACHE_MAX_ENTRIES):
+        self.namespace = namespace
+        self.path = path
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self.connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, namespace TEXT, response TEXT NOT NULL, "
+                "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def connect(self):
+        # One short-lived connection per call, the agents may use the cache from several threads
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def lookup(self, prompt, llm_string):
+        if getattr(BYPASS, "active", False):
+            return None
+        key = cache_key(self.namespace, prompt, llm_string)
+        now = time.time()
+        with self.lock, self.connect() as conn:
+            row = conn.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                count("misses")
+                return None
+            conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+        count("hits")
+        return [Generation(**generation) for generation in json.loads(row[0])]
+
+    def update(self, prompt, llm_string, return_val):
+        response = json.dumps(
+            [{"text": generation.text, "generation_info": generation.generation_info} for generation in return_val],
+            default=str,
+        )
+        now = time.time()
+        with self.lock, self.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, namespace, response, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (cache_key(self.namespace, prompt, llm_string), self.namespace, response, now, now),
+            )
+            self.evict(conn, now)
+
+    def evict(self, conn, now):
+        conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        conn.execute(
+            "DELETE FROM llm_cache WHERE key NOT IN (SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+
+    def clear(self, **kwargs):
+        """Removes every cached response (of all the models, the file is shared)."""
+        with self.lock, self.connect() as conn:
+            conn.execute("DELETE FROM llm_cache")
+
+    def entries(self):
+        with self.connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+def report_stats():
+    """Prints the cache hits and misses of this run."""
+    if LLM_CACHE_ENABLED and (STATS["hits"] or STATS["misses"]):
+        print(f"[INFO] LLM cache: {STATS['hits']} hits, {STATS['misses']} misses")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspects or clears the LLM response cache.")
+    parser.add_argument("--clear", action="store_true", help="Remove every cached response")
+    args = parser.parse_args()
+    cache = SQLiteLLMCache()
+    if args.clear:
+        cache.clear()
+        print(f"[INFO] LLM cache cleared: {cache.path}")
+    else:
+        print(f"[INFO] LLM cache {cache.path}: {cache.entries()} entries")
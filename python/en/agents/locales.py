@@ -0,0 +1,174 @@
+import os
+
+# Language of this copy of the agents: the default of the reports and the language of the LLM-written chart
+LANGUAGE = "en"
+# Languages the reports are written in, separated by commas (e.g. "en,es"). The data and the analysis
+# are computed once, only the texts of each language are rendered from the same results.
+REPORT_LANGUAGES = os.getenv("REPORT_LANGUAGES", LANGUAGE)
+
+# Texts of the report in each language: the chart, the email subject and prompt, and the digest
+# and anomaly lines the prompt is filled with (str.format templates)
+LOCALES = {
+    "en": {
+        "chart_filename": "soil_humidity.png",
+        "chart_title": "Soil Humidity by Day",
+        "chart_xlabel": "Date",
+        "chart_ylabel": "Humidity Percentage (%)",
+        "chart_range": "Min/Max Range",
+        "chart_average": "Average Humidity",
+        "subject": "Humidity Report {date:%d/%m/%Y}",
+        # The user must enter the recipient's email at runtime
+        "email_prompt": (
+            "You are an expert in botany and plant care, particularly for {species}. "
+            "Based on the following soil moisture analysis for a {species}, "
+            "write a VERY SHORT AND CONCISE email addressed to {recipient_email}. "
+            "The email should:\n\n"
+            "1. **Start ABSOLUTELY with: `Hello,` (without quotes, EXACTLY like this)**\n"
+            "2. **Summarize in a VERY CONCISE manner the evolution of soil moisture** over the analyzed dates (from the statistics below). Mention only the most relevant points.\n"
+            "3. **Directly and concisely analyze whether the moisture levels are suitable for a {species}** (compare them with the target band below). DO NOT give manual watering tips; JUST STATE WHETHER THE LEVELS ARE APPROPRIATE OR NOT.\n"
+            "4. **Briefly mention the anomalies listed below** (they were detected in the raw readings, do not look for others in the table; if there are none, say so in one sentence).\n"
+            "5. **Attach a graph (mention that it is attached).** Be brief; just state that a soil moisture graph is attached.\n"
+            "6. **End the email with the following EXACT closing:** Best regards, GardenCare AI System\n\n"
+            "**IMPORTANT:**\n"
+            "- Use a professional, concise, and informative tone.\n"
+            "- Use **HTML formatting to bold key parts of the text.**\n"
+            "- **DO NOT INCLUDE the email subject in the email body.**\n"
+            "- Be **VERY BRIEF AND TO THE POINT throughout the email.**\n\n"
+            "<!DOCTYPE html>\n"
+            "<html>\n"
+            "<head>\n"
+            "    <meta charset='UTF-8'>\n"
+            "</head>\n"
+            "<body>\n"
+            "    <p><strong>Hello,</strong></p>\n"
+            "    <p>Analyzing the soil moisture data for your {species} from [START DATE] to [END DATE]:</p>\n"
+            "    <ul>\n"
+            "        <li>Average moisture: between <strong>[MIN-MAX MOISTURE RANGE]%</strong>. <strong>[STATEMENT ON WHETHER LEVELS ARE ADEQUATE]</strong></li>\n"
+            "    </ul>\n"
+            "    <p><strong>[SUGGESTION BASED ON ANALYSIS].</strong></p>\n"
+            "    <p>[STATEMENT ON ABNORMAL VALUES, IF APPLICABLE, OTHERWISE OMIT].</p>\n"
+            "    <p>Attached is a graph with a detailed evolution of soil moisture.</p>\n"
+            "    <p><strong>Best regards,</strong></p>\n"
+            "    <p>GardenCare AI System</p>\n"
+            "</body>\n"
+            "</html>\n\n"
+            "Soil moisture statistics of the period (humidity in %):\n"
+            "{digest}\n\n"
+            "Anomalies detected in the raw readings:\n"
+            "{anomalies}\n\n"
+            "**RETURN ONLY THE COMPLETE HTML CODE OF THE EMAIL**"
+        ),
+        "digest": (
+            "- Period: {start:%Y-%m-%d} to {end:%Y-%m-%d} ({days} days with data)\n"
+            "- Humidity range: {min:.1f}% to {max:.1f}%, average {mean:.1f}%\n"
+            "- Driest day: {driest_day:%Y-%m-%d} ({driest:.1f}%), wettest day: {wettest_day:%Y-%m-%d} "
+            "({wettest:.1f}%), last day: {last:.1f}%\n"
+            "- Trend: {slope:+.2f} percentage points per day ({trend})\n"
+            "- Target band for {species}: {low:g}% to {high:g}%; days below: {days_below}, days above: {days_above}"
+        ),
+        "trend_stable": "stable",
+        "trend_drying": "drying out",
+        "trend_wetter": "getting wetter",
+        "period": "{start} to {end}",
+        "out_of_range": ("{period}{sensor}: {readings} reading(s) at the end of the scale ({values}), "
+                         "the sensor may be disconnected or out of the soil"),
+        "stuck": "{period}{sensor}: the sensor repeated the same value ({humidity:.0f}% humidity) {readings} times, it may be stuck",
+        "sudden_drop": "{period}{sensor}: humidity rose quickly from {before:.0f}% to {after:.0f}% (watering or pump event)",
+        "outlier": ("{period}{sensor}: {readings} unusual reading(s) of {values} humidity, "
+                    "around {reference:.0f}% before and after"),
+        "anomalies_unavailable": "Not available (the raw readings could not be analyzed).",
+        "anomalies_none": "None: no abnormal values were detected in the raw readings.",
+        "anomalies_more": "- ... and {count} more findings of the same kinds",
+    },
+    "es": {
+        "chart_filename": "humedad_suelo.png",
+        "chart_title": "Humedad del Suelo por Día",
+        "chart_xlabel": "Fecha",
+        "chart_ylabel": "Porcentaje de Humedad (%)",
+        "chart_range": "Rango Min/Max",
+        "chart_average": "Humedad Promedio",
+        "subject": "Reporte humedad {date:%d/%m/%Y}",
+        # ⚠️ El usuario debe ingresar el correo del destinatario en tiempo de ejecución ⚠️
+        "email_prompt": (
+            "Eres un experto en botánica y cuidado de plantas, especialmente de {species}. "
+            "Basándote en el siguiente análisis de humedad del suelo para una planta de {species}, "
+            "redacta un email MUY CORTO Y CONCISO dirigido a {recipient_email}. "
+            "El email debe:\n\n"
+            "1. **Comienza el email ABSOLUTAMENTE con: `Hola,` (sin comillas, EXÁCTAMENTE así)**\n"
+            "2. **Resumir de forma MUY CONCISA la evolución de la humedad del suelo** durante las fechas analizadas (a partir de las estadísticas de abajo). Menciona solo lo más relevante.\n"
+            "3. **Analizar de forma DIRECTA Y CONCISA si los valores de humedad son adecuados para una {species}** (compáralos con la franja objetivo de abajo). NO des consejos de riego manual, SIMPLEMENTE INDICA SI LOS NIVELES SON ADECUADOS O NO.\n"
+            "4. **Mencionar de forma MUY BREVE las anomalías listadas abajo** (se detectaron en las lecturas brutas, no busques otras en la tabla; si no hay ninguna, indícalo en una sola frase).\n"
+            "5. **Adjuntar un gráfico (mencionar que se adjunta).** Sé breve, solo indica que se adjunta un gráfico de humedad.\n"
+            "6. **Cerrar el email con la siguiente despedida EXACTA:** Saludos cordiales, GardenCare AI System\n\n"
+            "**IMPORTANTE:**\n"
+            "- Utiliza un tono profesional, conciso e informativo.\n"
+            "- Utiliza **formato HTML para poner en negrita las partes importantes del texto.**\n"
+            "- **NO INCLUYAS el Asunto del email en el cuerpo del email.**\n"
+            "- Sé **MUY BREVE Y DIRECTO en todo el email.**\n\n"
+            "<!DOCTYPE html>\n"
+            "<html>\n"
+            "<head>\n"
+            "    <meta charset='UTF-8'>\n"
+            "</head>\n"
+            "<body>\n"
+            "    <p><strong>Hola,</strong></p>\n"
+            "    <p>Analizando los datos de humedad del suelo para su {species} del [FECHA INICIO] al [FECHA FIN]:</p>\n"
+            "    <ul>\n"
+            "        <li>Humedad promedio: entre <strong>[RANGO HUMEDAD MIN-MAX]%</strong>. <strong>[FRASE SI LOS VALORES SON ADECUADOS]</strong></li>\n"
+            "    </ul>\n"
+            "    <p><strong>[FRASE DE SUGERENCIA BASADA EN EL ANÁLISIS].</strong></p>\n"
+            "    <p>[FRASE VALORES ATÍPICOS, SI APLICA, SI NO, NO MENCIONAR NADA].</p>\n"
+            "    <p>Adjunto un gráfico con la evolución detallada de la humedad del suelo.</p>\n"
+            "    <p><strong>Saludos cordiales,</strong></p>\n"
+            "    <p>GardenCare AI System</p>\n"
+            "</body>\n"
+            "</html>\n\n"
+            "Estadísticas de humedad del suelo del período (humedad en %):\n"
+            "{digest}\n\n"
+            "Anomalías detectadas en las lecturas brutas:\n"
+            "{anomalies}\n\n"
+            "**DEVUELVE SOLO EL CÓDIGO HTML COMPLETO DEL EMAIL**"
+        ),
+        "digest": (
+            "- Período: {start:%Y-%m-%d} a {end:%Y-%m-%d} ({days} días con datos)\n"
+            "- Rango de humedad: {min:.1f}% a {max:.1f}%, promedio {mean:.1f}%\n"
+            "- Día más seco: {driest_day:%Y-%m-%d} ({driest:.1f}%), día más húmedo: {wettest_day:%Y-%m-%d} "
+            "({wettest:.1f}%), último día: {last:.1f}%\n"
+            "- Tendencia: {slope:+.2f} puntos porcentuales por día ({trend})\n"
+            "- Franja objetivo para {species}: {low:g}% a {high:g}%; días por debajo: {days_below}, "
+            "días por encima: {days_above}"
+        ),
+        "trend_stable": "estable",
+        "trend_drying": "secándose",
+        "trend_wetter": "humedeciéndose",
+        "period": "{start} a {end}",
+        "out_of_range": ("{period}{sensor}: {readings} lectura(s) en el extremo de la escala ({values}), "
+                         "el sensor puede estar desconectado o fuera de la tierra"),
+        "stuck": ("{period}{sensor}: el sensor repitió el mismo valor ({humidity:.0f}% de humedad) {readings} veces, "
+                  "puede estar trabado"),
+        "sudden_drop": ("{period}{sensor}: la humedad subió rápidamente de {before:.0f}% a {after:.0f}% "
+                        "(riego o encendido de la bomba)"),
+        "outlier": ("{period}{sensor}: {readings} lectura(s) atípica(s) de {values} de humedad, "
+                    "con alrededor de {reference:.0f}% antes y después"),
+        "anomalies_unavailable": "No disponible (no se pudieron analizar las lecturas brutas).",
+        "anomalies_none": "Ninguna: no se detectaron valores anormales en las lecturas brutas.",
+        "anomalies_more": "- ... y {count} hallazgos más de los mismos tipos",
+    },
+}
+
+def parse_languages(value=None):
+    """
+    Languages of a report from `value`, a comma-separated string or a list (REPORT_LANGUAGES by
+    default), without repeats. Raises ValueError for a language without a catalog in LOCALES.
+    """
+    if isinstance(value, str) or value is None:
+        value = (value or REPORT_LANGUAGES).split(",")
+    languages = list(dict.fromkeys(language.strip().lower() for language in value if language.strip()))
+    unknown = [language for language in languages if language not in LOCALES]
+    if unknown or not languages:
+        raise ValueError(f"Unknown report language {', '.join(unknown) or '(none)'}, expected one of: {', '.join(LOCALES)}")
+    return languages
+
+def text(language, key, **values):
+    """Text `key` of `language` (LANGUAGE if None) with `values` filled in."""
+    return LOCALES[language or LANGUAGE][key].format(**values)
@@ -0,0 +1,194 @@
+import argparse
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Metrics configuration
+METRICS_ENABLED = os.getenv("METRICS", "1") != "0"  # METRICS=0 keeps the spans in memory only
+METRICS_JSONL_PATH = os.getenv("METRICS_JSONL_PATH", os.path.expanduser("~/.cache/gardencare/spans.jsonl"))
+# Rewritten after every run, e.g. inside the directory of node_exporter's textfile collector
+METRICS_PROM_PATH = os.getenv("METRICS_PROM_PATH", os.path.expanduser("~/.cache/gardencare/gardencare.prom"))
+
+# Span the code of the current thread is running in (stages copy it into their worker threads)
+CURRENT = contextvars.ContextVar("current_span", default=None)
+
+# Finished spans of the current run
+SPANS = []
+SPANS_LOCK = threading.Lock()
+RUN = {"id": uuid.uuid4().hex[:12], "started": time.time()}
+
+class Span:
+    """A timed step of a report. `values` holds its counters (LLM tokens, retries, rows...)."""
+
+    def __init__(self, name, parent=None, **values):
+        self.name = name
+        self.id = uuid.uuid4().hex[:12]
+        self.parent = parent
+        self.values = dict(values)
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.error = None
+        self.lock = threading.Lock()
+
+    def add(self, key, amount=1):
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, key, value):
+        with self.lock:
+            self.values[key] = value
+
+    def record(self):
+        return {
+            "run_id": RUN["id"],
+            "span": self.name,
+            "span_id": self.id,
+            "parent_id": self.parent.id if self.parent else None,
+            "start": datetime.fromtimestamp(self.started_at, timezone.utc).isoformat(),
+            "duration_s": round(self.duration, 4),
+            "status": "error" if self.error else "ok",
+            **({"error": self.error} if self.error else {}),
+            **self.values,
+        }
+
+@contextmanager
+def span(name, **values):
+    """Times the block as a child of the current span. Exceptions mark it as failed and are re-raised."""
+    current = Span(name, CURRENT.get(), **values)
+    token = CURRENT.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.duration = time.perf_counter() - current.started
+        CURRENT.reset(token)
+        finish(current)
+
+def add(key, amount=1):
+    """Adds to a counter of the current span (ignored outside of a span)."""
+    current = CURRENT.get()
+    if current is not None:
+        current.add(key, amount)
+
+def set_value(key, value):
+    current = CURRENT.get()
+    if current is not None:
+        current.set(key, value)
+
+def finish(finished):
+    with SPANS_LOCK:
+        SPANS.append(finished)
+        if METRICS_ENABLED:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(METRICS_JSONL_PATH)), exist_ok=True)
+                with open(METRICS_JSONL_PATH, "a") as f:
+                    f.write(json.dumps(finished.record(), default=str) + "\n")
+            except OSError as e:
+                print(f"[WARNING] Could not write the span '{finished.name}': {e}")
+
+def new_run():
+    """Starts a new run id and forgets the spans of the previous run."""
+    with SPANS_LOCK:
+        SPANS.clear()
+        RUN.update(id=uuid.uuid4().hex[:12], started=time.time())
+
+class LLMMetrics(BaseCallbackHandler):
+    """Adds the latency and token counts of every call to `model` to the span the call is made from."""
+
+    def __init__(self, model):
+        self.model = model
+        self.calls = {}  # run_id: [started, streamed tokens]
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self.calls[run_id] = [time.perf_counter(), 0]
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if run_id in self.calls:
+            self.calls[run_id][1] += 1
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        info = (response.generations[0][0].generation_info or {}) if response.generations else {}
+        self.finish_call(run_id, info)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.finish_call(run_id, {})  # Also reached when a stream is closed early
+
+    def finish_call(self, run_id, info):
+        started, streamed = self.calls.pop(run_id, (None, 0))
+        if started is None:
+            return
+        add("llm_calls")
+        add("llm_seconds", time.perf_counter() - started)
+        add("llm_prompt_tokens", info.get("prompt_eval_count") or 0)
+        add("llm_completion_tokens", info.get("eval_count") or streamed)  # Ollama's count when the call finished
+        set_value("llm_model", self.model)
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def prometheus_text(spans):
+    """Aggregates the spans by name in the Prometheus text format (one gauge per counter)."""
+    totals = {}
+    for finished in spans:
+        total = totals.setdefault(finished.name, {"span_count": 0, "span_errors": 0, "span_seconds": 0.0})
+        total["span_count"] += 1
+        total["span_errors"] += finished.error is not None
+        total["span_seconds"] += finished.duration
+        for key, value in finished.values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                total[key] = total.get(key, 0) + value
+
+    lines = []
+    for metric in sorted({key for total in totals.values() for key in total}):
+        lines.append(f"# TYPE gardencare_{metric} gauge")
+        for name, total in sorted(totals.items()):
+            if metric in total:
+                lines.append(f'gardencare_{metric}{{span="{escape_label(name)}"}} {total[metric]:g}')
+    lines.append("# TYPE gardencare_last_run_timestamp_seconds gauge")
+    lines.append(f"gardencare_last_run_timestamp_seconds {RUN['started']:.0f}")
+    return "\n".join(lines) + "\n"
+
+def export(path=None):
+    """Writes the Prometheus file of the current run (replaced atomically, the collector may be reading it)."""
+    if not METRICS_ENABLED:
+        return
+    path = path or METRICS_PROM_PATH
+    with SPANS_LOCK:
+        content = prometheus_text(SPANS)
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(f"{path}.tmp", "w") as f:
+            f.write(content)
+        os.replace(f"{path}.tmp", path)
+        print(f"[INFO] Metrics saved to {METRICS_JSONL_PATH} and {path}")
+    except OSError as e:
+        print(f"[WARNING] Could not write the metrics file: {e}")
+
+def summarize(path=METRICS_JSONL_PATH, last=10):
+    """Prints where the time of the last `last` runs went, per span."""
+    import pandas as pd
+    spans = pd.read_json(path, lines=True)
+    runs = spans["run_id"].drop_duplicates().tail(last)
+    spans = spans[spans["run_id"].isin(runs)]
+    columns = [column for column in ("llm_calls", "llm_completion_tokens", "retries", "candidates", "rows") if column in spans]
+    table = spans.groupby("span").agg(
+        count=("span", "size"), p50_s=("duration_s", "median"), max_s=("duration_s", "max"),
+        **{column: (column, "sum") for column in columns},
+    ).sort_values("p50_s", ascending=False)
+    print(f"[INFO] Spans of the last {len(runs)} runs:")
+    print(table.to_markdown(floatfmt=".2f"))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarizes the spans recorded by the agents.")
+    parser.add_argument("--last", type=int, default=10, help="Number of runs to include")
+    args = parser.parse_args()
+    summarize(last=args.last)
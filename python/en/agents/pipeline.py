@@ -0,0 +1,53 @@
+import contextvars
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from agents import metrics
+
+def run_stages(stages, max_workers=None):
+    """
+    Runs `stages` ({name: (dependencies, function)}) on a thread pool. Each stage starts as soon
+    as all its dependencies have finished and is called with their results, in the order listed.
+    Returns {name: result}. If a stage fails, no new stage is started and its exception is raised
+    once the stages already running have finished. Each stage is recorded as a metrics span.
+    """
+    pending = dict(stages)
+    running = {}
+    results = {}
+    started = time.perf_counter()
+
+    def timed(name, function, *args):
+        stage_started = time.perf_counter()
+        with metrics.span(name):
+            result = function(*args)
+        print(f"[INFO] Stage '{name}' finished in {time.perf_counter() - stage_started:.1f}s "
+              f"(at {time.perf_counter() - started:.1f}s)")
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(stages)) as executor:
+        while pending or running:
+            for name, (dependencies, function) in list(pending.items()):
+                if all(dependency in results for dependency in dependencies):
+                    arguments = [results[dependency] for dependency in dependencies]
+                    # The stage runs in the caller's context, so its span is a child of the caller's span
+                    context = contextvars.copy_context()
+                    running[executor.submit(context.run, timed, name, function, *arguments)] = name
+                    del pending[name]
+            if not running:
+                raise ValueError(f"Stages with missing or circular dependencies: {', '.join(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    return results
+
+@contextmanager
+def limited(semaphore, resource):
+    """
+    Holds `semaphore` inside the block. The time spent waiting for it is added to the current
+    span as `<resource>_wait_seconds`, so a saturated resource shows up in the metrics.
+    """
+    started = time.perf_counter()
+    with semaphore:
+        metrics.add(f"{resource}_wait_seconds", time.perf_counter() - started)
+        yield
@@ -1,33 +1,101 @@
 import os
 import time
 import re
-from langchain_ollama import OllamaLLM
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
+from functools import lru_cache
+import matplotlib
+matplotlib.use("Agg")  # Render straight to file, no display needed
+import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+from agents import llm_cache, locales, metrics, plot_scripts, routing
+from agents.downsample import downsample_summary, lttb
+from agents.report_data import add_humidity_percentages, load_summary, render_markdown, summary_path
+from agents.sandbox import run_script
 
 def get_output_directory_path():
     output_path = input("Enter the full path of the output directory (e.g., /home/user/output): ")
     return output_path
 
-# Instantiate OllamaLLM
-ollama_llm = OllamaLLM(model="llama3.1", base_url="http://YOUR_IP_OR_SERVER:PORT")
-
-# Get the user's output directory path
-output_dir = get_output_directory_path()
-os.makedirs(output_dir, exist_ok=True)
-
-# Expected files
-expected_files = [
-    os.path.join(output_dir, "soil_humidity.png"),
-    os.path.join(output_dir, "estimated_humidity.md"),
-]
-
-# Visualization generation template (remains the same)
+# Expected files (the native charts of other languages are named in agents/locales.py)
+CHART_FILENAME = "soil_humidity.png"
+HUMIDITY_TABLE_FILENAME = "estimated_humidity.md"
+
+# The chart is rendered natively; PLOT_MODE=llm keeps the old LLM-generated script for custom charts
+PLOT_MODE = os.getenv("PLOT_MODE", "native")
+# Long windows are downsampled to this many points, so rendering time and PNG size do not grow with them
+PLOT_MAX_POINTS = int(os.getenv("PLOT_MAX_POINTS", "500"))
+MAX_LABELED_DATES = 14  # Up to this many rows every date gets its own tick
+PLOT_LLM_MAX_ROWS = int(os.getenv("PLOT_LLM_MAX_ROWS", "90"))  # The LLM copies the table into its script, it gets fewer rows
+
+def render_chart(df, output_dir, languages=None):
+    """
+    Writes estimated_humidity.md and the chart of each language of `languages` (locales.LANGUAGE
+    by default, soil_humidity.png) from the summary DataFrame. The data is prepared once, only the
+    labels change between languages. Returns {language: path of the PNG}.
+    """
+    languages = languages or [locales.LANGUAGE]
+    with metrics.span("chart_rendering", mode="native", rows=len(df), languages=len(languages)):
+        df = add_humidity_percentages(df)
+        os.makedirs(output_dir, exist_ok=True)
+
+        md_path = os.path.join(output_dir, HUMIDITY_TABLE_FILENAME)
+        with open(md_path, 'w') as f:
+            f.write(render_markdown(df))
+
+        # The band keeps the extremes of every bucket, the line the points that shape the average
+        band = add_humidity_percentages(downsample_summary(df, PLOT_MAX_POINTS))
+        line = df.iloc[lttb(df['date'].astype('int64'), df['Humidity_avg'], PLOT_MAX_POINTS)]
+        return {language: draw_chart(df, band, line, output_dir, language) for language in languages}
+
+def draw_chart(df, band, line, output_dir, language):
+    labels = locales.LOCALES[language]
+
+    # A Figure of its own instead of pyplot's global state, so several charts can render in parallel threads
+    fig = Figure(figsize=(12, 6))
+    ax = fig.subplots()
+    fig.patch.set_facecolor('#1E1E1E')
+    ax.set_facecolor('#1E1E1E')
+
+    ax.fill_between(band['date'], band['Humidity_min'], band['Humidity_max'],
+                    color='#A5D6A7', alpha=0.5, label=labels["chart_range"])
+
+    ax.plot(line['date'], line['Humidity_avg'], color='#4CAF50', linewidth=2, label=labels["chart_average"])
+
+    ax.set_xlabel(labels["chart_xlabel"], fontsize=12, fontweight='bold', color='white')
+    ax.set_ylabel(labels["chart_ylabel"], fontsize=12, fontweight='bold', color='white')
+    ax.set_title(labels["chart_title"], fontsize=16, fontweight='bold', color='white', pad=40)
+    set_date_ticks(ax, df['date'])
+    ax.tick_params(axis='y', colors='white')
+
+    legend = ax.legend(frameon=False, fontsize=11, loc='upper center', bbox_to_anchor=(0.5, 1.13), ncol=2)
+    for text in legend.get_texts():
+        text.set_color("white")
+
+    ax.grid(axis='y', linestyle='--', alpha=0.3, color='white')
+    fig.tight_layout()
+
+    png_path = os.path.join(output_dir, labels["chart_filename"])
+    fig.savefig(png_path)
+    return png_path
+
+def set_date_ticks(ax, dates):
+    """Labels every date of short series, longer ones get an automatic number of ticks."""
+    if len(dates) <= MAX_LABELED_DATES:
+        ax.set_xticks(dates)
+        ax.set_xticklabels(dates.dt.strftime('%Y-%m-%d'), fontsize=11, rotation=45, color='white')
+        return
+    locator = mdates.AutoDateLocator(minticks=4, maxticks=12)
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+    ax.tick_params(axis='x', labelsize=11, labelrotation=45, colors='white')
+    ax.xaxis.get_offset_text().set_color('white')
+
+# Visualization generation template, only used when PLOT_MODE=llm
 plot_template = """ 
 import os
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
 
 data = {data_placeholder}
 
@@ -57,8 +125,14 @@ ax.plot(df['Date'], df['Humidity_avg'], color='#4CAF50', linewidth=2, label='Ave
 ax.set_xlabel("Date", fontsize=12, fontweight='bold', color='white')
 ax.set_ylabel("Humidity Percentage (%)", fontsize=12, fontweight='bold', color='white')
 ax.set_title("Soil Humidity by Day", fontsize=16, fontweight='bold', color='white', pad=40)
-ax.set_xticks(df['Date'])
-ax.set_xticklabels(df['Date'].dt.strftime('%Y-%m-%d'), fontsize=11, rotation=45, color='white')
+if len(df) <= 14:
+    ax.set_xticks(df['Date'])
+    ax.set_xticklabels(df['Date'].dt.strftime('%Y-%m-%d'), fontsize=11, rotation=45, color='white')
+else:
+    locator = mdates.AutoDateLocator(minticks=4, maxticks=12)
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+    ax.tick_params(axis='x', labelsize=11, labelrotation=45, colors='white')
 ax.tick_params(axis='y', colors='white')
 
 legend = ax.legend(frameon=False, fontsize=11, loc='upper center', bbox_to_anchor=(0.5, 1.13), ncol=2)
@@ -73,60 +147,130 @@ plt.savefig(png_path)
 """
 
 # Prompt template
-visualization_template = PromptTemplate(
-    template=(
-        "You are an expert in data visualization in Python. You are provided with a report in markdown format "
-        "with an updated soil humidity data table. Your task is to extract the data from the table and generate "
-        "a complete Python script that uses the following template EXACTLY as a base for the graph:\n\n"
-        "{plot_template}\n\n"
-        "NOTE: Do not use the example data that appears in the template. Extract the actual table from the markdown report and replace "
-        "the {{data_placeholder}} variable with the corresponding Python dictionary. The dictionary should have the keys: "
-        "'Date', 'valor_minimo', 'valor_promedio', and 'valor_maximo', and their values should be lists with the extracted data.\n\n"
-        "Markdown Report:\n{report_markdown_content}\n\nPython Code:"
-    ),
-    input_variables=["plot_template", "report_markdown_content"]
+visualization_template = (
+    "You are an expert in data visualization in Python. You are provided with a report in markdown format "
+    "with an updated soil humidity data table. Your task is to extract the data from the table and generate "
+    "a complete Python script that uses the following template EXACTLY as a base for the graph:\n\n"
+    "{plot_template}\n\n"
+    "NOTE: Do not use the example data that appears in the template. Extract the actual table from the markdown report and replace "
+    "the {{data_placeholder}} variable with the corresponding Python dictionary. The dictionary should have the keys: "
+    "'Date', 'valor_minimo', 'valor_promedio', and 'valor_maximo', and their values should be lists with the extracted data.\n\n"
+    "Markdown Report:\n{report_markdown_content}\n\nPython Code:"
 )
 
-visualization_chain = LLMChain(llm=ollama_llm, prompt=visualization_template)
+@lru_cache(maxsize=None)
+def visualization_chain():
+    """The chain that writes the plotting script, built on first use: LangChain and the client only load in PLOT_MODE=llm."""
+    from langchain.chains import LLMChain
+    from langchain.prompts import PromptTemplate
+    from agents.llm import get_task_llm  # The client is shared with the other agents
+    prompt = PromptTemplate(template=visualization_template, input_variables=["plot_template", "report_markdown_content"])
+    return LLMChain(llm=get_task_llm("plot"), prompt=prompt)
 
 def extract_code_block(text):
     match = re.search(r"`(?:python)?\n(.*?)\n`", text, re.DOTALL)
     return match.group(1) if match else text
 
-def generate_graph(output_dir): # output_dir is added as a parameter
-    report_path = os.path.join(output_dir, "report_langchain_direct_db.md")
-    print(f"[INFO] Reading report from: {report_path}")
-
+def load_summary_data(output_dir):
+    """Reads the summary saved by the query agent (None if it cannot be read)."""
+    data_path = summary_path(output_dir)
+    print(f"[INFO] Reading summary data from: {data_path}")
     try:
-        with open(report_path, "r") as f:
-            report_markdown_content = f.read()
+        return load_summary(data_path)
     except Exception as e:
-        print(f"[ERROR] Could not read markdown file: {e}")
-        return False
+        print(f"[ERROR] Could not read summary data: {e}")
+        return None
+
+def generate_graph(output_dir, df=None): # output_dir is added as a parameter
+    """Generates the graph with an LLM-written script (PLOT_MODE=llm)."""
+    if df is None:
+        df = load_summary_data(output_dir)
+        if df is None:
+            return False
+
+    with metrics.span("chart_rendering", mode="llm", rows=len(df)):
+        return run_generated_code(df, output_dir)
+
+def run_generated_code(df, output_dir):
+    """
+    Draws the chart with the cached script for this template and data layout if there is one,
+    otherwise with a new LLM-written script, which is cached once it has produced the files.
+    The scripts run in a sandboxed worker process (agents/sandbox.py), never in the agent.
+    """
+    output_dir = os.path.abspath(output_dir)  # The worker runs in its own temporary directory
+    df_llm = downsample_summary(df, PLOT_LLM_MAX_ROWS)
+    data = plot_scripts.plot_data(df_llm)
+    inputs = {"PLOT_DATA": data, "OUTPUT_DIR": output_dir}
+    key = plot_scripts.script_key(plot_template, data, routing.model_for("plot"))
+
+    cached_script = plot_scripts.load_script(key)
+    if cached_script is not None:
+        print("[INFO] Running the cached plotting script with the new data...")
+        if run_sandboxed(cached_script, inputs, output_dir):
+            return True
+        plot_scripts.discard_script(key)
+        print("[WARNING] The cached script failed, generating a new one...")
+
+    report_markdown_content = render_markdown(df_llm)
 
     print("[INFO] Generating Python code...")
-    python_code = visualization_chain.run(plot_template=plot_template.replace("{output_dir_placeholder}", output_dir), report_markdown_content=report_markdown_content) # Replace {output_dir_placeholder}
+    python_code = visualization_chain().run(plot_template=plot_template.replace("{output_dir_placeholder}", output_dir), report_markdown_content=report_markdown_content) # Replace {output_dir_placeholder}
 
     python_code_clean = extract_code_block(python_code)
-    print("[INFO] Code generated. Executing...")
-
     try:
-        exec(python_code_clean)
-        print(f"[INFO] Files generated in {output_dir}")
-        return True
-    except Exception as e:
-        print(f"[ERROR] Error executing Python code: {e}")
+        script, reusable = plot_scripts.prepare_script(python_code_clean)
+    except (SyntaxError, ValueError) as e:
+        print(f"[ERROR] The generated code was refused: {e}")
+        return False
+    print("[INFO] Code generated. Executing in the sandbox...")
+
+    if not run_sandboxed(script, inputs, output_dir):
+        return False
+    if reusable:
+        plot_scripts.save_script(key, script)
+    return True
+
+def run_sandboxed(script, inputs, output_dir):
+    """Runs a plotting script in the sandbox, True if it finished and wrote the expected files."""
+    success, output = run_script(script, inputs)
+    if not success or not files_exist(output_dir):
+        last_line = output.strip().splitlines()[-1] if output.strip() else "the expected files were not written"
+        print(f"[ERROR] Error executing Python code: {last_line}")
         return False
+    print(f"[INFO] Files generated in {output_dir}")
+    return True
 
 def files_exist(output_dir):
     """ Checks if the expected files exist in the output directory """
     expected_files = [
-        os.path.join(output_dir, "soil_humidity.png"),
-        os.path.join(output_dir, "estimated_humidity.md"),
+        os.path.join(output_dir, CHART_FILENAME),
+        os.path.join(output_dir, HUMIDITY_TABLE_FILENAME),
     ]
     return all(os.path.exists(file) for file in expected_files)
 
-def main():
+def main(df=None, output_dir=None, languages=None):
+    """
+    Generates the chart files in `output_dir`, one chart per language of `languages`, and returns
+    {language: path of the PNG} (None on failure). The LLM-written chart is only in locales.LANGUAGE.
+    """
+    if output_dir is None:
+        output_dir = get_output_directory_path()
+
+    if PLOT_MODE == "llm":
+        png_path = main_llm(df, output_dir)
+        return {locales.LANGUAGE: png_path} if png_path else None
+
+    if df is None:
+        df = load_summary_data(output_dir)
+        if df is None:
+            return None
+
+    png_paths = render_chart(df, output_dir, languages)
+    print(f"[INFO] Files generated in {output_dir}")
+    return png_paths
+
+def main_llm(df, output_dir):
+    """Generates the files with LLM-written code, retrying until they exist."""
     max_attempts = 4  # Maximum number of attempts
     attempt = 0
 
@@ -138,7 +282,8 @@ def main():
             break
 
         print("[INFO] Generating files...")
-        success = generate_graph(output_dir) # output_dir is added
+        with llm_cache.bypass(attempt > 0):  # Retries ask the model again instead of reusing the failed script
+            success = generate_graph(output_dir, df) # output_dir is added
         
         if success and files_exist(output_dir): # output_dir is added
             print("[INFO] Files generated successfully.")
@@ -146,10 +291,15 @@ def main():
 
         print("[WARNING] Expected files were not generated. Retrying...")
         attempt += 1
+        metrics.add("retries")
         time.sleep(2)  # Wait a bit before retrying
 
     if not files_exist(output_dir): # output_dir is added
         print("[ERROR] Could not generate files after multiple attempts.")
+        return None
+    return os.path.join(output_dir, CHART_FILENAME)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with metrics.span("plot_agent"):
+        main()
+    metrics.export()
\ No newline at end of file
@@ -0,0 +1,109 @@
+import ast
+import hashlib
+import json
+import os
+import tempfile
+from agents import metrics
+from agents.report_data import SUMMARY_COLUMNS
+
+# Plotting scripts written by the LLM that already produced a chart, reused with the data of later reports
+PLOT_SCRIPT_CACHE_ENABLED = os.getenv("PLOT_SCRIPT_CACHE", "1") != "0"
+PLOT_SCRIPT_CACHE_DIR = os.getenv("PLOT_SCRIPT_CACHE_DIR", os.path.expanduser("~/.cache/gardencare/plot_scripts"))
+
+# Top-level assignments of the plot template that become inputs of the cached script
+INPUTS = {"data": "PLOT_DATA", "output_dir": "OUTPUT_DIR"}
+
+# What a plotting script may import and do with os: anything else is refused before it runs
+ALLOWED_MODULES = {"os", "math", "datetime", "numpy", "pandas", "matplotlib"}
+ALLOWED_OS_ATTRIBUTES = {"path", "makedirs"}
+FORBIDDEN_NAMES = {"eval", "exec", "compile", "__import__", "globals", "locals", "vars", "breakpoint", "input",
+                   "getattr", "setattr", "delattr", "__builtins__"}
+
+def plot_data(df):
+    """The summary as the dictionary of lists the plot template expects (JSON-serializable)."""
+    date, low, mean, high = SUMMARY_COLUMNS
+    return {
+        "Date": df[date].astype(str).tolist(),
+        "valor_minimo": df[low].astype(float).tolist(),
+        "valor_promedio": df[mean].astype(float).tolist(),
+        "valor_maximo": df[high].astype(float).tolist(),
+    }
+
+def script_key(template, data, model):
+    """Cache key: the template the script was written from, the model and the shape of its data."""
+    schema = {key: type(values[0]).__name__ if values else "empty" for key, values in data.items()}
+    content = json.dumps({"template": template, "schema": schema, "model": model}, sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()[:32]
+
+def check_script(tree):
+    """Raises ValueError if the script imports or calls anything a chart does not need."""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            modules = [node.module or ""]
+        else:
+            modules = []
+        for module in modules:
+            if module.split(".")[0] not in ALLOWED_MODULES:
+                raise ValueError(f"the script imports {module!r}")
+        if isinstance(node, ast.Name) and node.id in FORBIDDEN_NAMES:
+            raise ValueError(f"the script uses {node.id}()")
+        if (isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == "os"
+                and node.attr not in ALLOWED_OS_ATTRIBUTES):
+            raise ValueError(f"the script uses os.{node.attr}")
+        if isinstance(node, ast.Attribute) and node.attr.startswith("__"):
+            raise ValueError(f"the script uses {node.attr}")
+
+def prepare_script(code):
+    """
+    Checks the generated script and turns its `data = {...}` and `output_dir = ...` assignments
+    into the PLOT_DATA and OUTPUT_DIR inputs, so it can run again with other data.
+    Returns (script, reusable). Raises ValueError (or SyntaxError) for a script that must not run.
+    """
+    tree = ast.parse(code)
+    check_script(tree)
+    replaced = set()
+    for node in tree.body:
+        if (isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name)
+                and node.targets[0].id in INPUTS):
+            node.value = ast.Name(id=INPUTS[node.targets[0].id], ctx=ast.Load())
+            replaced.add(node.targets[0].id)
+    reusable = replaced == set(INPUTS)
+    return (ast.unparse(ast.fix_missing_locations(tree)) if reusable else code), reusable
+
+def cache_path(key):
+    return os.path.join(PLOT_SCRIPT_CACHE_DIR, f"{key}.py")
+
+def load_script(key):
+    """The cached script for `key`, None if there is none."""
+    if not PLOT_SCRIPT_CACHE_ENABLED:
+        return None
+    try:
+        with open(cache_path(key)) as f:
+            script = f.read()
+    except OSError:
+        metrics.add("plot_script_cache_misses")
+        return None
+    metrics.add("plot_script_cache_hits")
+    return script
+
+def save_script(key, script):
+    if not PLOT_SCRIPT_CACHE_ENABLED:
+        return
+    try:
+        os.makedirs(PLOT_SCRIPT_CACHE_DIR, exist_ok=True)
+        # A temporary file of its own, reports running in parallel may save the same script
+        with tempfile.NamedTemporaryFile("w", dir=PLOT_SCRIPT_CACHE_DIR, suffix=".tmp", delete=False) as f:
+            f.write(script)
+        os.replace(f.name, cache_path(key))
+        print(f"[INFO] Plotting script cached in {cache_path(key)}")
+    except OSError as e:
+        print(f"[WARNING] Could not cache the plotting script: {e}")
+
+def discard_script(key):
+    """Forgets a cached script that failed with new data, the next run asks the LLM for a new one."""
+    try:
+        os.remove(cache_path(key))
+    except OSError:
+        pass
@@ -1,110 +1,237 @@
-from langchain_ollama import OllamaLLM
-from langchain_community.utilities import SQLDatabase
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
+from sqlalchemy import text
+import pandas as pd
+import argparse
+import contextvars
 import os
-
-# Language model configuration
-ollama_llm = OllamaLLM(model="llama3.1", base_url="http://YOUR_IP_OR_SERVER:PORT")
-
-# Database configuration
-DB_USER = os.getenv("DB_USER", "user_here")
-DB_PASSWORD = os.getenv("DB_PASSWORD", "password_here")
-DB_HOST = os.getenv("DB_HOST", "localhost")
-DB_PORT = os.getenv("DB_PORT", "5432")
-DB_NAME = os.getenv("DB_NAME", "database_name")
-
-# Connection URI construction
-db_uri = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-database = SQLDatabase.from_uri(db_uri)
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from agents.aggregation import build_rollup_summary_query, build_summary_query
+from agents import llm_cache, metrics, schema
+from agents.db import get_engine
+from agents.rollups import refresh_rollups
+from agents.sql_validation import clean_sql, validate_sql
+from agents.report_data import SUMMARY_COLUMNS, normalize_summary, render_markdown, save_summary, summary_path
+
+# Output files (the Markdown report is only a view of the typed summary)
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", ".")
+REPORT_FILENAME = "report_langchain_direct_db.md"
+
+# Parameters of the built-in daily summary (the LLM is only used for ad-hoc questions)
+REPORT_WINDOW_DAYS = int(os.getenv("REPORT_WINDOW_DAYS", "3"))
+REPORT_BUCKET = os.getenv("REPORT_BUCKET", "day")
+SENSOR_ID = os.getenv("SENSOR_ID")  # Only used when SENSOR_ID_COLUMN is configured
+USE_LLM_SQL = os.getenv("USE_LLM_SQL", "0") == "1"  # Forces the old LLM-generated SQL path
+USE_ROLLUPS = os.getenv("USE_ROLLUPS", "1") == "1"  # Read the summary from the hourly/daily rollup tables
+SQL_CANDIDATES = int(os.getenv("SQL_CANDIDATES", "1"))  # >1 asks the LLM for several queries at once and runs the cheapest valid one
+SQL_CANDIDATE_ROUNDS = int(os.getenv("SQL_CANDIDATE_ROUNDS", "2"))  # Rounds of candidates before giving up
 
 # Template for generating the SQL query
-query_gen_template = PromptTemplate(
-    template=(
-        "You are an SQL expert. Given the following instruction, generate a valid SQL query for PostgreSQL.\n"
-        "The SQL query must be **only the SQL code**, without explanations, comments, or code block delimiters (like `sql or `).\n"
-        "Instruction: {instruction}\n"
-        "SQL Query:"
-    ),
-    input_variables=["instruction"]
+query_gen_template = (
+    "You are an SQL expert. Given the following instruction, generate a valid SQL query for PostgreSQL.\n"
+    "The SQL query must be **only the SQL code**, without explanations, comments, or code block delimiters (like `sql or `).\n"
+    "Instruction: {instruction}\n"
+    "SQL Query:"
 )
-query_gen_chain = LLMChain(llm=ollama_llm, prompt=query_gen_template)
-
-# Template for generating the report in Markdown format
-report_template = PromptTemplate(
-    template=(
-        "You are a data analyst. Based on the following results obtained from the database, "
-        "generate a detailed report in Markdown format. The report should include the date, minimum value, "
-        "average value, and maximum value for each date, and present the values with exactly two decimal places. "
-        "The results should be presented in a table with the following columns: 'date', 'min_value', 'avg_value', "
-        "and 'max_value'.\n\n"
-        "- Numeric values should be right-aligned.\n"
-        "- Ensure that numeric values (minimum, average, maximum) have two decimal places.\n"
-        "- Results should be in ascending order by date.\n\n"
-        "Results:\n{results}\n"
-        "Report:"
-    ),
-    input_variables=["results"]
+
+@lru_cache(maxsize=None)
+def query_gen_chain():
+    """
+    The SQL generation chain, built on first use. LangChain and the LLM client (the fast tier of
+    agents/routing.py, shared with the other agents) are only loaded when the LLM writes a query,
+    which the built-in summary never does.
+    """
+    from langchain.chains import LLMChain
+    from langchain.prompts import PromptTemplate
+    from agents.llm import get_task_llm
+    prompt = PromptTemplate(template=query_gen_template, input_variables=["instruction"])
+    return LLMChain(llm=get_task_llm("sql"), prompt=prompt)
+
+# Instruction used when the LLM path is forced for the regular report
+DEFAULT_INSTRUCTION = (
+    "Generate a valid SQL query for PostgreSQL that selects, for each date of the last three days, the date, minimum value, "
+    "average value, and maximum value of the 'value' column from the 'sensor_data' table, named 'date', 'min_value', 'avg_value' and 'max_value'. "
+    "The query should group the results by date (excluding the time) and round the minimum, average, and maximum values to two decimal places. "
+    "Also, the results should be ordered in ascending order by date. "
+    "Only respond with the SQL query, without explanations, observations, conclusions, or comments."
 )
-report_chain = LLMChain(llm=ollama_llm, prompt=report_template)
 
-def research_task():
+def research_task(instruction=DEFAULT_INSTRUCTION):
     """Generates the SQL query using LangChain."""
-    instruction = (
-        "Generate a valid SQL query for PostgreSQL that selects, for each date of the last three days, the date, minimum value, "
-        "average value, and maximum value of the 'value' column from the 'sensor_data' table. "
-        "The query should group the results by date (excluding the time) and round the minimum, average, and maximum values to two decimal places. "
-        "Also, the results should be ordered in ascending order by date. "
-        "Only respond with the SQL query, without explanations, observations, conclusions, or comments."
-    )
-    return query_gen_chain.run(instruction=instruction)
-
-def reporting_task(sql_query):
-    """Executes the SQL query and generates the report."""
+    with metrics.span("sql_generation", mode="llm"):
+        return query_gen_chain().run(instruction=instruction)
+
+def prepare_tables():
+    """Creates the next partitions and brings the rollups up to date before the summaries are read."""
+    try:
+        schema.maintain(get_engine())  # Keeps the next partitions ready, nothing to do on an unpartitioned table
+    except Exception as e:
+        print(f"[WARNING] Could not maintain the partitions of the readings table: {e}")
+    if USE_ROLLUPS:
+        with metrics.span("rollup_refresh"):
+            refresh_rollups(get_engine())  # Incremental, only the readings since the last refresh are aggregated
+
+def summary_task(sensor_id=None, prepare=True):
+    """
+    Builds the prepared summary query without calling the LLM (for `sensor_id`, SENSOR_ID by default).
+    `prepare=False` skips prepare_tables(), when it already ran for several reports at once.
+    """
+    sensor_id = sensor_id or SENSOR_ID
+    if prepare:
+        prepare_tables()
+    if USE_ROLLUPS:
+        with metrics.span("sql_generation", mode="rollups"):
+            return build_rollup_summary_query(window_days=REPORT_WINDOW_DAYS, bucket=REPORT_BUCKET, sensor_id=sensor_id)
+    with metrics.span("sql_generation", mode="builtin"):
+        return build_summary_query(window_days=REPORT_WINDOW_DAYS, bucket=REPORT_BUCKET, sensor_id=sensor_id)
+
+def reporting_task(sql_query, parameters=None):
+    """Executes the SQL query and returns the rows as a DataFrame."""
     print("\n[INFO] Executing SQL query:")
     print(sql_query)
-
-    # Execute the query in the database
-    results = database.run(sql_query)
-
-    print("\n[INFO] Results obtained:")
-    print(results)
-
-    return report_chain.run(results=results)
-
-def run_workflow():
+    if parameters:
+        print(f"[INFO] Parameters: {parameters}")
+
+    # Execute the query in the database (LLM-generated SQL arrives as a plain string and only gets to read)
+    read_only = isinstance(sql_query, str)
+    if read_only:
+        sql_query = text(clean_sql(sql_query))
+    # Committed instead of rolled back, so psycopg keeps the statement prepared on the pooled connection
+    with metrics.span("query_execution") as query_span, get_engine().begin() as conn:
+        if read_only:
+            conn.execute(text("SET TRANSACTION READ ONLY"))
+        results = pd.read_sql_query(sql_query, conn, params=parameters)
+        query_span.set("rows", len(results))
+
+    print(f"\n[INFO] Results obtained: {len(results)} rows")
+    return results
+
+def candidate_task(instruction, index, fresh, required_columns=None):
+    """
+    Generates one candidate query and checks it with EXPLAIN, without running it.
+    Returns (estimated cost, query), with a cost of None if the query was rejected.
+    """
+    # Only the first candidate of the first round may come from the cache, the others must be new queries
+    with llm_cache.bypass(fresh or index > 0):
+        sql_query = research_task(instruction)
+    try:
+        with metrics.span("sql_validation") as validation_span, get_engine().connect() as conn:
+            cost = validate_sql(conn, sql_query, required_columns)
+            validation_span.set("cost", cost)
+        return cost, sql_query
+    except Exception as e:
+        print(f"[INFO] Candidate query {index + 1} rejected: {str(getattr(e, 'orig', e)).splitlines()[0]}")
+        return None, sql_query
+
+def run_candidates(instruction, summary=False):
+    """
+    Asks the LLM for SQL_CANDIDATES queries at once and validates each one with EXPLAIN as soon as
+    it arrives, then runs the cheapest valid plan (the next one if it still fails). A new round is
+    only requested when no candidate works. Returns the results as a DataFrame, or None.
     """
-    Executes the complete workflow: generates the SQL query, executes it, and generates the report.
-    If the query fails, it attempts to regenerate and retry up to a maximum of 5 times.
+    required_columns = SUMMARY_COLUMNS if summary else None
+    for round_number in range(SQL_CANDIDATE_ROUNDS):
+        print(f"\n[INFO] Round {round_number+1} of {SQL_CANDIDATE_ROUNDS}: generating {SQL_CANDIDATES} candidate SQL queries.")
+        metrics.add("rounds")
+        metrics.add("candidates", SQL_CANDIDATES)
+        with ThreadPoolExecutor(max_workers=SQL_CANDIDATES) as executor:
+            # Each candidate runs in a copy of the caller's context, so its spans are children of the current span
+            futures = [
+                executor.submit(contextvars.copy_context().run, candidate_task, instruction, index, round_number > 0,
+                                required_columns)
+                for index in range(SQL_CANDIDATES)
+            ]
+            candidates = [future.result() for future in futures]
+
+        valid = {}
+        for cost, sql_query in candidates:
+            if cost is not None:
+                valid.setdefault(clean_sql(sql_query), cost)  # Identical queries are only tried once
+        print(f"[INFO] {len(valid)} different valid queries among {SQL_CANDIDATES} candidates.")
+
+        for sql_query, cost in sorted(valid.items(), key=lambda item: item[1]):
+            print(f"[INFO] Running the cheapest remaining plan (estimated cost {cost:.2f}).")
+            try:
+                results = reporting_task(sql_query)
+                if summary:
+                    results = normalize_summary(results[SUMMARY_COLUMNS])
+                return results
+            except Exception as e:
+                print(f"\n[ERROR] The query failed with error: {e}")
+    print("[ERROR] No candidate query could be executed. Aborting process.")
+    return None
+
+def run_attempts(question, use_llm, sensor_id=None, prepare=True):
     """
-    max_attempts = 5
+    Builds and executes the query one attempt at a time. LLM-written queries are regenerated
+    and retried up to 5 times. Returns the results as a DataFrame, or None.
+    """
+    max_attempts = 5 if use_llm else 1
     attempt = 0
-    report = None
 
     while attempt < max_attempts:
         print(f"\n[INFO] Attempt {attempt+1} of {max_attempts} to generate and execute the SQL query.")
-        sql_query = research_task()
+        if use_llm:
+            with llm_cache.bypass(attempt > 0):  # A retry must not get the failed query back from the cache
+                sql_query, parameters = research_task(question or DEFAULT_INSTRUCTION), None
+        else:
+            sql_query, parameters = summary_task(sensor_id, prepare)
 
         try:
-            report = reporting_task(sql_query)
-            print("\n[INFO] Report generated successfully.")
-            break  # If the query executes successfully, exit the loop.
+            results = reporting_task(sql_query, parameters)
+            if question is None:
+                results = normalize_summary(results[SUMMARY_COLUMNS])  # The summary must keep the expected columns
+            return results  # The query executed successfully, no more attempts
         except Exception as e:
             print(f"\n[ERROR] The query failed with error: {e}")
             attempt += 1
 
             if attempt < max_attempts:
+                metrics.add("retries")
                 print("[INFO] Regenerating query and retrying...")
             else:
                 print("[ERROR] Maximum number of attempts reached. Aborting process.")
-                return
+    return None
 
-    # Save the report to a file if obtained
-    if report:
-        report_path = os.getenv("REPORT_PATH", "results_report.md")
+def run_workflow(question=None, output_dir=None, sensor_id=None, prepare=True):
+    """
+    Executes the complete workflow: builds the SQL query, executes it, and generates the report.
+    The regular report uses the built-in summary query. Ad-hoc questions (or USE_LLM_SQL=1) go
+    through the LLM, which regenerates and retries a failed query up to a maximum of 5 times,
+    or with SQL_CANDIDATES > 1 writes several queries at once and only the cheapest valid one runs.
+    `sensor_id` selects the plant of the built-in summary (SENSOR_ID by default), and `prepare=False`
+    skips the partition and rollup maintenance when the caller already did it.
+    Returns the results as a DataFrame (None if the query could not be executed).
+    """
+    output_dir = output_dir or OUTPUT_DIR
+    use_llm = question is not None or USE_LLM_SQL
+
+    if use_llm and SQL_CANDIDATES > 1:
+        results = run_candidates(question or DEFAULT_INSTRUCTION, summary=question is None)
+    else:
+        results = run_attempts(question, use_llm, sensor_id, prepare)
+    if results is None:
+        return
+    print("\n[INFO] Report generated successfully.")
+
+    # Save the report and the typed summary used by the other agents
+    with metrics.span("report_formatting", rows=len(results)):
+        os.makedirs(output_dir, exist_ok=True)
+        report_path = os.getenv("REPORT_PATH", os.path.join(output_dir, REPORT_FILENAME))
         with open(report_path, "w") as f:
-            f.write(report)
+            f.write(render_markdown(results))
         print(f"\n[INFO] Report saved to {report_path}")
 
+        if question is None:
+            save_summary(results, summary_path(output_dir))
+            print(f"[INFO] Summary data saved to {summary_path(output_dir)}")
+
+    return results
+
 if __name__ == "__main__":
-    run_workflow()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Generates the soil humidity report from the database.")
+    parser.add_argument("--ask", metavar="QUESTION", help="Ad-hoc question answered with LLM-generated SQL")
+    args = parser.parse_args()
+    with metrics.span("query_agent"):
+        run_workflow(args.ask)
+    llm_cache.report_stats()
+    metrics.export()
@@ -0,0 +1,64 @@
+import os
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather  # Optional, pip install pyarrow
+except ImportError:
+    feather = None
+
+# Columns of the daily summary returned by the query agent
+SUMMARY_COLUMNS = ["date", "min_value", "avg_value", "max_value"]
+# Arrow IPC keeps the column types and is memory-mapped by the readers (CSV without pyarrow)
+SUMMARY_FILENAME = "humidity_summary.arrow" if feather else "humidity_summary.csv"
+
+# The HW-080 sensor returns 0 (wet) to 1023 (dry)
+SENSOR_MAX = 1023
+
+def summary_path(output_dir):
+    """Path of the typed summary shared between the agents."""
+    return os.path.join(output_dir, SUMMARY_FILENAME)
+
+def normalize_summary(df):
+    """Returns the summary with the expected column types, ordered by date."""
+    df = df.copy()
+    df["date"] = pd.to_datetime(df["date"])
+    for column in SUMMARY_COLUMNS[1:]:
+        df[column] = df[column].astype(float)
+    return df.sort_values("date").reset_index(drop=True)
+
+def save_summary(df, path):
+    """
+    Writes the summary once for the other agents. .arrow files are uncompressed Arrow IPC, so
+    readers map them instead of parsing them; the file is replaced atomically.
+    """
+    if path.endswith(".arrow"):
+        feather.write_feather(df, f"{path}.tmp", compression="uncompressed")  # Uncompressed, so it can be memory-mapped
+        os.replace(f"{path}.tmp", path)
+    else:
+        df.to_csv(path, index=False)
+
+def load_summary(path):
+    """Reads a summary saved as .arrow (memory-mapped), .parquet or .csv."""
+    if path.endswith((".arrow", ".feather")):
+        return normalize_summary(feather.read_table(path, memory_map=True).to_pandas())
+    if path.endswith(".parquet"):
+        return normalize_summary(pd.read_parquet(path))
+    return normalize_summary(pd.read_csv(path))
+
+def add_humidity_percentages(df):
+    """Converts the raw sensor values into estimated humidity percentages."""
+    df = df.copy()
+    df["Humidity_min"] = (SENSOR_MAX - df["max_value"]) / SENSOR_MAX * 100  # Highest reading = driest soil
+    df["Humidity_avg"] = (SENSOR_MAX - df["avg_value"]) / SENSOR_MAX * 100
+    df["Humidity_max"] = (SENSOR_MAX - df["min_value"]) / SENSOR_MAX * 100
+    return df
+
+def render_markdown(df):
+    """Renders a table as Markdown with two decimal places (numbers are right-aligned)."""
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            dates = df[column]
+            fmt = "%Y-%m-%d" if (dates == dates.dt.normalize()).all() else "%Y-%m-%d %H:%M"  # Hourly buckets keep the time
+            df[column] = dates.dt.strftime(fmt)
+    return df.to_markdown(index=False, floatfmt=".2f")
@@ -0,0 +1,159 @@
+import argparse
+import os
+from sqlalchemy import text
+from agents.aggregation import (
+    DAILY_TABLE, HOURLY_TABLE, SENSOR_ID_COLUMN, SENSOR_TABLE, SENSOR_TIME_COLUMN, SENSOR_VALUE_COLUMN,
+    quote_identifier,
+)
+from agents.db import get_engine
+
+# Table that keeps the high-water mark (latest raw timestamp already rolled up) and the oldest
+# reading written since the last refresh that falls before its window (set by the ingest service)
+STATE_TABLE = "rollup_state"
+
+# Minutes before the high-water mark that are recomputed on every refresh, so readings
+# committed late (with an older timestamp) still end up in the rollups
+ROLLUP_LATENESS_MINUTES = int(os.getenv("ROLLUP_LATENESS_MINUTES", "60"))
+
+def ensure_rollup_schema(conn):
+    """Creates the hourly/daily rollup tables and the state table if they do not exist."""
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {quote_identifier(HOURLY_TABLE)} (\n"
+        f"    sensor_id TEXT NOT NULL DEFAULT '',\n"
+        f"    bucket_start TIMESTAMP NOT NULL,\n"
+        f"    reading_count BIGINT NOT NULL,\n"
+        f"    value_sum DOUBLE PRECISION NOT NULL,\n"
+        f"    value_min DOUBLE PRECISION NOT NULL,\n"
+        f"    value_max DOUBLE PRECISION NOT NULL,\n"
+        f"    PRIMARY KEY (sensor_id, bucket_start)\n"
+        f")"
+    ))
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {quote_identifier(DAILY_TABLE)} (\n"
+        f"    sensor_id TEXT NOT NULL DEFAULT '',\n"
+        f"    bucket_date DATE NOT NULL,\n"
+        f"    reading_count BIGINT NOT NULL,\n"
+        f"    value_sum DOUBLE PRECISION NOT NULL,\n"
+        f"    value_min DOUBLE PRECISION NOT NULL,\n"
+        f"    value_max DOUBLE PRECISION NOT NULL,\n"
+        f"    PRIMARY KEY (sensor_id, bucket_date)\n"
+        f")"
+    ))
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {quote_identifier(STATE_TABLE)} (\n"
+        f"    name TEXT PRIMARY KEY,\n"
+        f"    high_water TIMESTAMPTZ NOT NULL,\n"
+        f"    late_since TIMESTAMPTZ\n"
+        f")"
+    ))
+    conn.execute(text(f"ALTER TABLE {quote_identifier(STATE_TABLE)} ADD COLUMN IF NOT EXISTS late_since TIMESTAMPTZ"))
+
+def mark_late_readings(cursor, oldest):
+    """
+    Called by the ingest service on the DB-API cursor of the transaction that writes a batch: if its
+    oldest reading falls before the window the next refresh recomputes (a backfill, a device that was
+    offline), the refresh goes back to it. Does nothing while the rollups are not in use.
+    """
+    cursor.execute("SAVEPOINT mark_late_readings")
+    try:
+        # A refresh in progress keeps the state row locked, this waits for it and then compares with its new mark
+        cursor.execute(
+            f"UPDATE {quote_identifier(STATE_TABLE)} SET late_since = LEAST(late_since, %s) "
+            f"WHERE name = %s AND %s < high_water - %s * INTERVAL '1 minute'",
+            (oldest, SENSOR_TABLE, oldest, ROLLUP_LATENESS_MINUTES),
+        )
+    except Exception:
+        cursor.execute("ROLLBACK TO SAVEPOINT mark_late_readings")  # No rollup tables yet
+    else:
+        cursor.execute("RELEASE SAVEPOINT mark_late_readings")
+
+def refresh_rollups(engine=None, rebuild=False):
+    """
+    Brings the rollup tables up to date with the raw readings newer than the high-water mark.
+    Only the hours after (high-water mark - lateness) are recomputed, so the cost depends on
+    the readings received since the last refresh, plus the hours since the oldest late reading
+    the ingest service wrote (see mark_late_readings). Returns the new high-water mark.
+    """
+    from agents import metrics  # Loads LangChain's callbacks, not needed by the ingest service's mark_late_readings
+    engine = engine or get_engine()
+    raw = quote_identifier(SENSOR_TABLE)
+    ts = quote_identifier(SENSOR_TIME_COLUMN)
+    value = quote_identifier(SENSOR_VALUE_COLUMN)
+    sensor = f"COALESCE(CAST({quote_identifier(SENSOR_ID_COLUMN)} AS TEXT), '')" if SENSOR_ID_COLUMN else "''"
+    hourly = quote_identifier(HOURLY_TABLE)
+    daily = quote_identifier(DAILY_TABLE)
+
+    with engine.begin() as conn:
+        # Only one refresh at a time, concurrent callers wait and then find nothing to do
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": SENSOR_TABLE})
+        # The lock comes first: CREATE TABLE IF NOT EXISTS can fail when another session creates the table at the same time
+        ensure_rollup_schema(conn)
+
+        if rebuild:
+            conn.execute(text(f"TRUNCATE {hourly}, {daily}"))
+            conn.execute(text(f"DELETE FROM {quote_identifier(STATE_TABLE)} WHERE name = :name"), {"name": SENSOR_TABLE})
+
+        # Locked until the commit, so a late batch written meanwhile marks itself for the next refresh
+        high_water, late_since = conn.execute(
+            text(f"SELECT high_water, late_since FROM {quote_identifier(STATE_TABLE)} WHERE name = :name FOR UPDATE"),
+            {"name": SENSOR_TABLE},
+        ).first() or (None, None)
+
+        if high_water is None:
+            new_high_water = conn.execute(text(f"SELECT MAX({ts}) FROM {raw}")).scalar()
+            start_condition, parameters = "", {}
+        else:
+            # The lateness window is recomputed even without newer readings, a late one may be the last to arrive
+            new_high_water = conn.execute(
+                text(f"SELECT MAX({ts}) FROM {raw} WHERE {ts} > :high_water"), {"high_water": high_water}
+            ).scalar() or high_water
+            start_condition = (
+                f"{ts} >= date_trunc('hour', LEAST(CAST(:high_water AS TIMESTAMPTZ) - :lateness * INTERVAL '1 minute', "
+                f"CAST(:late_since AS TIMESTAMPTZ))) AND "
+            )
+            parameters = {"high_water": high_water, "lateness": ROLLUP_LATENESS_MINUTES, "late_since": late_since}
+
+        if new_high_water is None:
+            print("[INFO] No readings to roll up.")
+            return None
+
+        parameters["new_high_water"] = new_high_water
+        hours = conn.execute(text(
+            f"INSERT INTO {hourly} (sensor_id, bucket_start, reading_count, value_sum, value_min, value_max)\n"
+            f"SELECT {sensor}, date_trunc('hour', {ts}), COUNT(*), SUM({value}), MIN({value}), MAX({value})\n"
+            f"FROM {raw}\n"
+            f"WHERE {start_condition}{ts} <= :new_high_water\n"
+            f"GROUP BY 1, 2\n"
+            f"ON CONFLICT (sensor_id, bucket_start) DO UPDATE SET\n"
+            f"    reading_count = EXCLUDED.reading_count, value_sum = EXCLUDED.value_sum,\n"
+            f"    value_min = EXCLUDED.value_min, value_max = EXCLUDED.value_max\n"
+            f"RETURNING bucket_start"
+        ), parameters).fetchall()
+
+        # Days touched by the refreshed hours are recomputed from the hourly rollup
+        first_hour = min((row[0] for row in hours), default=None)
+        conn.execute(text(
+            f"INSERT INTO {daily} (sensor_id, bucket_date, reading_count, value_sum, value_min, value_max)\n"
+            f"SELECT sensor_id, CAST(bucket_start AS DATE), SUM(reading_count), SUM(value_sum), MIN(value_min), MAX(value_max)\n"
+            f"FROM {hourly}\n"
+            f"WHERE bucket_start >= date_trunc('day', CAST(:first_hour AS TIMESTAMP))\n"
+            f"GROUP BY 1, 2\n"
+            f"ON CONFLICT (sensor_id, bucket_date) DO UPDATE SET\n"
+            f"    reading_count = EXCLUDED.reading_count, value_sum = EXCLUDED.value_sum,\n"
+            f"    value_min = EXCLUDED.value_min, value_max = EXCLUDED.value_max"
+        ), {"first_hour": first_hour})
+
+        conn.execute(text(
+            f"INSERT INTO {quote_identifier(STATE_TABLE)} (name, high_water) VALUES (:name, :high_water)\n"
+            f"ON CONFLICT (name) DO UPDATE SET high_water = EXCLUDED.high_water, late_since = NULL"
+        ), {"name": SENSOR_TABLE, "high_water": new_high_water})
+
+    metrics.add("rows", len(hours))
+    print(f"[INFO] Rollups refreshed: {len(hours)} hours updated, high-water mark {new_high_water}")
+    return new_high_water
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Updates the hourly and daily rollups of the sensor readings.")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute the rollups from all the raw readings")
+    args = parser.parse_args()
+    refresh_rollups(rebuild=args.rebuild)
@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+from functools import lru_cache
+
+# Ollama servers, separated by commas. `URL=model|model` limits a server to the models it has,
+# e.g. "http://gpu1:11434=deepseek-r1:32b|llama3.1,http://gpu2:11434=llama3.1"
+OLLAMA_ENDPOINTS = os.getenv("OLLAMA_ENDPOINTS") or os.getenv("OLLAMA_BASE_URL", "http://YOUR_IP_OR_SERVER:PORT")
+OLLAMA_SLOTS = int(os.getenv("OLLAMA_SLOTS", "4"))                 # Requests sent to each server at once
+OLLAMA_RETRY_SECONDS = float(os.getenv("OLLAMA_RETRY_SECONDS", "30"))  # A server that failed is skipped this long
+
+# Model tiers and the tier of each task. The reasoning model is slow and takes a large GPU,
+# it only writes the emails that have anomalies to explain.
+MODEL_TIERS = {
+    "fast": os.getenv("FAST_MODEL", "llama3.1"),
+    "reasoning": os.getenv("REASONING_MODEL", "deepseek-r1:32b"),
+}
+TASK_TIERS = {"sql": "fast", "plot": "fast", "email": "fast", "email_anomalies": "reasoning"}
+# e.g. MODEL_ROUTES="email=reasoning" drafts every email with the reasoning model
+MODEL_ROUTES = os.getenv("MODEL_ROUTES", "")
+
+class Endpoint:
+    """An Ollama server: the models it serves, its request slots and whether it answered lately."""
+
+    def __init__(self, url, models=None):
+        self.url = url.rstrip("/")
+        self.models = set(models or ())  # Empty: any model
+        self.slots = threading.BoundedSemaphore(OLLAMA_SLOTS)
+        self.in_flight = 0
+        self.down_until = 0.0
+        self.lock = threading.Lock()
+
+    def serves(self, model):
+        return not self.models or model in self.models
+
+    def healthy(self):
+        return time.monotonic() >= self.down_until
+
+    def mark_down(self, error):
+        with self.lock:
+            self.down_until = time.monotonic() + OLLAMA_RETRY_SECONDS
+        print(f"[WARNING] Ollama at {self.url} failed ({error}), skipped for {OLLAMA_RETRY_SECONDS:.0f}s")
+
+    def mark_up(self):
+        self.down_until = 0.0
+
+    def __repr__(self):
+        return f"Endpoint({self.url!r})"
+
+def parse_endpoints(value):
+    """The servers of an OLLAMA_ENDPOINTS value. Raises ValueError on an entry that is not an http(s) URL."""
+    endpoints = []
+    for item in value.split(","):
+        url, _, models = item.strip().partition("=")
+        if not url:
+            continue
+        address = urllib.parse.urlsplit(url)
+        if address.scheme not in ("http", "https") or not address.netloc:
+            raise ValueError(f"Invalid endpoint {item.strip()!r} in OLLAMA_ENDPOINTS, expected http://HOST:PORT[=model|model]")
+        endpoints.append(Endpoint(url, [model for model in models.split("|") if model]))
+    if not endpoints:
+        raise ValueError("OLLAMA_ENDPOINTS does not list any Ollama server")
+    return endpoints
+
+@lru_cache(maxsize=None)
+def endpoints():
+    """The Ollama servers, parsed from OLLAMA_ENDPOINTS on first use and shared by every client."""
+    return parse_endpoints(OLLAMA_ENDPOINTS)
+
+@lru_cache(maxsize=None)
+def task_tiers():
+    """TASK_TIERS with the MODEL_ROUTES applied, parsed on first use. Raises ValueError on a malformed route."""
+    tiers = dict(TASK_TIERS)
+    for route in MODEL_ROUTES.replace(" ", "").split(","):
+        if not route:
+            continue
+        task, _, tier = route.partition("=")
+        if task not in TASK_TIERS or not tier:
+            raise ValueError(f"Invalid route {route!r} in MODEL_ROUTES, expected TASK=TIER or TASK=MODEL "
+                             f"with a task of {', '.join(TASK_TIERS)}")
+        tiers[task] = tier
+    return tiers
+
+def model_for(task):
+    """Model that runs `task` (see task_tiers(), a route may also name a model instead of a tier)."""
+    tier = task_tiers()[task]
+    return MODEL_TIERS.get(tier, tier)
+
+def validate():
+    """
+    Parses MODEL_ROUTES and OLLAMA_ENDPOINTS and checks that the model of every task has a server,
+    without connecting to any. Raises ValueError on an invalid setting.
+    """
+    for task in task_tiers():
+        endpoints_for(model_for(task))
+
+def endpoints_for(model):
+    """
+    Servers to try for a request to `model`, in order: the healthy ones with the fewest requests
+    in flight first, then the ones that failed lately (the soonest to be retried first).
+    """
+    serving = [endpoint for endpoint in endpoints() if endpoint.serves(model)]
+    if not serving:
+        raise ValueError(f"No Ollama endpoint serves {model} (OLLAMA_ENDPOINTS)")
+    healthy = sorted((endpoint for endpoint in serving if endpoint.healthy()), key=lambda endpoint: endpoint.in_flight)
+    failed = sorted((endpoint for endpoint in serving if not endpoint.healthy()), key=lambda endpoint: endpoint.down_until)
+    return healthy + failed
+
+def request(endpoint, path, payload=None, timeout=10):
+    """Calls the Ollama API of `endpoint` (GET without a payload) and returns the decoded JSON."""
+    data = json.dumps(payload).encode() if payload is not None else None
+    http_request = urllib.request.Request(f"{endpoint.url}{path}", data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(http_request, timeout=timeout) as response:
+        return json.loads(response.read().decode() or "{}")
+
+def check(endpoint):
+    """Asks `endpoint` for its models, marking it up or down. Returns the model names, None if it is down."""
+    try:
+        models = [model["name"] for model in request(endpoint, "/api/tags").get("models", [])]
+    except Exception as e:
+        endpoint.mark_down(e)
+        return None
+    endpoint.mark_up()
+    return models
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checks the Ollama endpoints and shows the model of each task.")
+    parser.parse_args()
+    try:
+        validate()
+    except ValueError as e:
+        raise SystemExit(f"[ERROR] Invalid model routing: {e}")
+    for task, tier in task_tiers().items():
+        print(f"[INFO] {task}: {tier} tier, {model_for(task)}")
+    for endpoint in endpoints():
+        models = check(endpoint)
+        if models is None:
+            print(f"[ERROR] {endpoint.url}: not reachable")
+        else:
+            print(f"[INFO] {endpoint.url}: up, {len(models)} models ({', '.join(sorted(models))})")
@@ -0,0 +1,66 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+
+# Limits of the worker process that runs generated code
+SANDBOX_TIMEOUT = float(os.getenv("SANDBOX_TIMEOUT", "60"))           # Wall-clock seconds before the worker is killed
+SANDBOX_CPU_SECONDS = int(os.getenv("SANDBOX_CPU_SECONDS", "30"))     # CPU time of the worker
+SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", "2048"))       # Address space of the worker
+SANDBOX_MAX_FILE_MB = int(os.getenv("SANDBOX_MAX_FILE_MB", "50"))     # Largest file the worker may write
+
+# Runs inside the worker: applies the limits, then runs the script with the inputs as its globals.
+# The limits are set by the worker itself (no preexec_fn, which is unsafe while the pipeline runs threads).
+RUNNER = """
+import json, runpy, sys
+try:
+    import resource
+    cpu, memory, file_size = (int(value) for value in sys.argv[3:6])
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu))
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (file_size, file_size))
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+except ImportError:
+    pass  # No resource module (Windows): only the timeout applies
+with open(sys.argv[2]) as f:
+    inputs = json.load(f)
+runpy.run_path(sys.argv[1], init_globals=inputs, run_name="__main__")
+"""
+
+def run_script(code, inputs=None, timeout=SANDBOX_TIMEOUT):
+    """
+    Runs `code` in a separate Python process with CPU, memory, file size and time limits, with
+    the JSON-serializable `inputs` as global variables. Returns (success, output of the process).
+    A script that hangs or runs out of memory only costs its own process.
+    """
+    with tempfile.TemporaryDirectory(prefix="gardencare-sandbox-") as workdir:
+        script_path = os.path.join(workdir, "script.py")
+        inputs_path = os.path.join(workdir, "inputs.json")
+        with open(script_path, "w") as f:
+            f.write(code)
+        with open(inputs_path, "w") as f:
+            json.dump(inputs or {}, f)
+
+        env = dict(os.environ, MPLBACKEND="Agg", OPENBLAS_NUM_THREADS="1", OMP_NUM_THREADS="1")
+        command = [
+            sys.executable, "-I", "-c", RUNNER, script_path, inputs_path,
+            str(SANDBOX_CPU_SECONDS), str(SANDBOX_MEMORY_MB * 1024 * 1024), str(SANDBOX_MAX_FILE_MB * 1024 * 1024),
+        ]
+        # Its own session, so a timeout also kills whatever the script started
+        process = subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   stdin=subprocess.DEVNULL, text=True, start_new_session=True)
+        try:
+            output, _ = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            if hasattr(os, "killpg"):
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+            output, _ = process.communicate()
+            return False, f"{output}\nKilled after {timeout:.0f}s"
+
+    if process.returncode < 0:
+        output += f"\nKilled by signal {-process.returncode} (CPU or memory limit)"
+    return process.returncode == 0, output
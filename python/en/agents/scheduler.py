@@ -0,0 +1,170 @@
+import json
+import os
+import signal
+import threading
+from datetime import datetime, timedelta
+from agents import locales
+from agents.aggregation import SENSOR_ID_COLUMN
+
+# Daemon configuration: a JSON file with one entry per plant, or a single plant from the environment
+DAEMON_CONFIG = os.getenv("DAEMON_CONFIG")
+REPORT_SCHEDULE = os.getenv("REPORT_SCHEDULE", "0 8 * * *")                   # Cron expression of the reports
+DAEMON_WARMUP_SECONDS = float(os.getenv("DAEMON_WARMUP_SECONDS", "120"))     # Models are loaded this long before a report
+
+# Settings of a report and the environment variables they default to (the password only comes from there)
+JOB_SETTINGS = {
+    "output_dir": "OUTPUT_DIR",
+    "sensor_id": "SENSOR_ID",
+    "species": "PLANT_SPECIES",
+    "recipients": "EMAIL_RECIPIENTS",
+    "sender_email": "SENDER_EMAIL",
+    "sender_password": "SENDER_PASSWORD",
+    "languages": "REPORT_LANGUAGES",
+}
+REQUIRED_SETTINGS = ("output_dir", "recipients", "sender_email", "sender_password")
+
+ALIASES = {"@hourly": "0 * * * *", "@daily": "0 0 * * *", "@weekly": "0 0 * * 0", "@monthly": "0 0 1 * *"}
+FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))  # minute, hour, day of month, month, day of week
+MAX_SEARCH_DAYS = 5 * 366  # Long enough for a 29 February
+
+def parse_field(field, low, high):
+    """Values of one cron field: `*`, `5`, `1-5`, `*/15`, `1-31/2` and comma-separated lists of them."""
+    values = set()
+    for part in field.split(","):
+        spec, _, step = part.partition("/")
+        if spec == "*":
+            start, end = low, high
+        elif "-" in spec:
+            start, end = (int(value) for value in spec.split("-", 1))
+        else:
+            start = end = int(spec)
+        step = int(step) if step else 1
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(f"invalid cron field {field!r} (values go from {low} to {high})")
+        values.update(range(start, end + 1, step))
+    return values
+
+class Schedule:
+    """A cron expression (`minute hour day-of-month month day-of-week`, or @hourly, @daily...)."""
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"invalid cron expression {expression!r}: it needs 5 fields")
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            parse_field(field, low, high) for field, (low, high) in zip(fields, FIELD_RANGES)
+        )
+        self.weekdays = {day % 7 for day in weekdays}  # 0 and 7 are both Sunday
+        # As in cron, when both day fields are restricted a day matching either of them is enough
+        self.any_day = fields[2] != "*" and fields[4] != "*"
+
+    def day_matches(self, moment):
+        in_month = moment.day in self.days
+        in_week = (moment.weekday() + 1) % 7 in self.weekdays
+        return (in_month or in_week) if self.any_day else (in_month and in_week)
+
+    def next_after(self, moment):
+        """First minute after `moment` that matches the expression."""
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=MAX_SEARCH_DAYS)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self.day_matches(moment):
+                moment = (moment + timedelta(days=1)).replace(hour=0, minute=0)
+            elif moment.hour not in self.hours:
+                moment = (moment + timedelta(hours=1)).replace(minute=0)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError(f"the cron expression {self.expression!r} never matches")
+
+    def __str__(self):
+        return self.expression
+
+def load_jobs(path=None):
+    """
+    Reads the plants to report on: a JSON list (or {"plants": [...]}) of objects with a name, a
+    schedule and any of the JOB_SETTINGS, each one defaulting to its environment variable
+    ("languages" may be a list or a comma-separated string).
+    Without a file there is a single plant configured from the environment.
+    Raises ValueError if a plant misses a setting, or if several plants cannot be told apart
+    (same sensor or output directory), so the daemon does not fail at report time.
+    """
+    entries = [{}]
+    path = path or DAEMON_CONFIG
+    if path:
+        with open(path) as f:
+            entries = json.load(f)
+        if isinstance(entries, dict):
+            entries = entries.get("plants", [])
+        if not entries:
+            raise ValueError(f"{path} does not list any plant")
+
+    jobs = []
+    for index, entry in enumerate(entries):
+        job = {key: os.getenv(variable) for key, variable in JOB_SETTINGS.items()}
+        job.update({key: value for key, value in entry.items() if key != "sender_password"})
+        job["name"] = str(entry.get("name") or f"plant-{index + 1}")
+        job["schedule"] = Schedule(entry.get("schedule", REPORT_SCHEDULE))
+        missing = [key for key in REQUIRED_SETTINGS if not job.get(key)]
+        if missing:
+            raise ValueError(f"Plant '{job['name']}' has no {', '.join(JOB_SETTINGS[key] for key in missing)}")
+        job["languages"] = locales.parse_languages(job["languages"])  # A list or "en,es"
+        jobs.append(job)
+
+    if len(jobs) > 1:
+        if not SENSOR_ID_COLUMN:
+            raise ValueError("Several plants need SENSOR_ID_COLUMN, the column that tells their readings apart")
+        for key in ("name", "sensor_id", "output_dir"):
+            values = [str(job.get(key)) for job in jobs if job.get(key) is not None]
+            if len(values) < len(jobs) or len(set(values)) < len(values):
+                raise ValueError(f"Every plant needs a different {key}")
+    return jobs
+
+def run_forever(jobs, run, warm_up=None, warmup_seconds=DAEMON_WARMUP_SECONDS, stop=None):
+    """
+    Calls `run(due_jobs)` with the plants whose schedule matches until SIGTERM or SIGINT (or `stop`
+    is set), all the plants due at the same time in one call. `warm_up()` is called `warmup_seconds`
+    before each report, so the models are already loaded when it starts. A failed run is logged and
+    the plants keep their schedule. Reports that become due while others are running start when
+    they finish; missed times are skipped.
+    """
+    stop = stop or threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: stop.set())
+
+    next_runs = {job["name"]: job["schedule"].next_after(datetime.now()) for job in jobs}
+    for job in jobs:
+        print(f"[INFO] Plant '{job['name']}' ({job['schedule']}): next report at {next_runs[job['name']]:%Y-%m-%d %H:%M}")
+    warmed_for = None
+
+    while not stop.is_set():
+        due = min(next_runs.values())
+        warm_at = due - timedelta(seconds=warmup_seconds)
+        now = datetime.now()
+        if warm_up and warmed_for != due and now >= warm_at:
+            warmed_for = due
+            try:
+                warm_up()
+            except Exception as e:
+                print(f"[WARNING] Warm-up before the report of {due:%H:%M} failed: {e}")
+            continue
+        wake_at = warm_at if warm_up and warmed_for != due else due
+        if now < wake_at:
+            stop.wait(min((wake_at - now).total_seconds(), 60))  # Re-checked every minute, the clock may jump
+            continue
+
+        due_jobs = [job for job in jobs if next_runs[job["name"]] <= now]
+        try:
+            run(due_jobs)
+        except Exception as e:
+            print(f"[ERROR] The reports of {', '.join(job['name'] for job in due_jobs)} failed: {e}")
+        finished = datetime.now()
+        for job in due_jobs:
+            next_runs[job["name"]] = job["schedule"].next_after(finished)
+            print(f"[INFO] Plant '{job['name']}': next report at {next_runs[job['name']]:%Y-%m-%d %H:%M}")
+    print("[INFO] Scheduler stopped.")
@@ -0,0 +1,257 @@
+import argparse
+import os
+import re
+from datetime import date, timedelta
+from sqlalchemy import text
+from agents import metrics
+from agents.aggregation import SENSOR_TABLE, SENSOR_TIME_COLUMN, quote_identifier
+from agents.db import get_engine
+
+# Time partitioning of the readings table
+PARTITION_INTERVAL = os.getenv("PARTITION_INTERVAL", "month")                  # "month" or "day" (very busy installations)
+PARTITIONS_AHEAD = int(os.getenv("PARTITIONS_AHEAD", "2"))                     # Future partitions kept ready for new readings
+PARTITION_RETENTION_DAYS = int(os.getenv("PARTITION_RETENTION_DAYS", "0"))     # Raw readings older than this are dropped, 0 keeps them all
+BRIN_PAGES_PER_RANGE = int(os.getenv("BRIN_PAGES_PER_RANGE", "32"))            # Table pages summarized by each entry of the BRIN index
+
+INTERVALS = ("month", "day")
+
+# Partitions are named after their first day, e.g. sensor_data_p202610 or sensor_data_p20261018.
+# Rows outside every partition (or without a timestamp) land in sensor_data_default.
+DEFAULT_PARTITION = f"{SENSOR_TABLE}_default"
+UNPARTITIONED_TABLE = f"{SENSOR_TABLE}_unpartitioned"  # The original table, kept by the migration
+PARTITION_PATTERN = re.compile(rf"^{re.escape(SENSOR_TABLE)}_p(\d{{6}}|\d{{8}})$")
+
+def period_start(day, interval):
+    return day.replace(day=1) if interval == "month" else day
+
+def next_period(start, interval):
+    if interval == "day":
+        return start + timedelta(days=1)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def period_ahead(day, interval, ahead):
+    """Start of the period `ahead` periods after the one of `day`."""
+    start = period_start(day, interval)
+    for _ in range(ahead):
+        start = next_period(start, interval)
+    return start
+
+def partition_name(start, interval):
+    return f"{SENSOR_TABLE}_p{start:%Y%m}" if interval == "month" else f"{SENSOR_TABLE}_p{start:%Y%m%d}"
+
+def parse_partition_name(name):
+    """(start, interval) of one of our partitions, None for any other table."""
+    match = PARTITION_PATTERN.match(name)
+    if not match:
+        return None
+    digits = match.group(1)
+    if len(digits) == 6:
+        return date(int(digits[:4]), int(digits[4:]), 1), "month"
+    return date(int(digits[:4]), int(digits[4:6]), int(digits[6:])), "day"
+
+def table_kind(conn, table=SENSOR_TABLE):
+    """'p' for a partitioned table, 'r' for a regular one, None if it does not exist."""
+    return conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"), {"table": quote_identifier(table)}
+    ).scalar()
+
+def list_partitions(conn):
+    return conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid\n"
+        "WHERE i.inhparent = to_regclass(:table)\n"
+        "ORDER BY c.relname"
+    ), {"table": quote_identifier(SENSOR_TABLE)}).scalars().all()
+
+def partition_interval(conn, default=PARTITION_INTERVAL):
+    """Interval of the existing partitions, so a changed PARTITION_INTERVAL never creates overlapping ones."""
+    for name in list_partitions(conn):
+        parsed = parse_partition_name(name)
+        if parsed:
+            return parsed[1]
+    return default
+
+def ensure_brin_index(conn, table=SENSOR_TABLE):
+    """
+    Creates a BRIN index on the timestamp unless the table already has one. Readings arrive in time
+    order, so a few kilobytes of block ranges are enough to skip most of a large partition, and on a
+    partitioned table the index is created on every partition, present and future.
+    """
+    exists = conn.execute(text(
+        "SELECT 1 FROM pg_indexes WHERE tablename = :table AND indexdef LIKE '%USING brin%'"
+    ), {"table": table}).first()
+    if exists:
+        return False
+    conn.execute(text(
+        f"CREATE INDEX {quote_identifier(table + '_brin')} ON {quote_identifier(table)}\n"
+        f"USING brin ({quote_identifier(SENSOR_TIME_COLUMN)}) WITH (pages_per_range = {BRIN_PAGES_PER_RANGE})"
+    ))
+    return True
+
+def create_partition(conn, start, interval):
+    """
+    Creates the partition of the period starting at `start` if it does not exist. Readings of that
+    period already in the default partition are moved into it before it is attached.
+    """
+    name = partition_name(start, interval)
+    if table_kind(conn, name):
+        return None
+    end = next_period(start, interval)
+    table = quote_identifier(SENSOR_TABLE)
+    partition = quote_identifier(name)
+    ts = quote_identifier(SENSOR_TIME_COLUMN)
+    # The bounds are dates formatted above, not user input
+    in_period = f"{ts} >= '{start.isoformat()}' AND {ts} < '{end.isoformat()}'"
+
+    conn.execute(text(f"CREATE TABLE {partition} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    if table_kind(conn, DEFAULT_PARTITION):
+        default = quote_identifier(DEFAULT_PARTITION)
+        conn.execute(text(f"INSERT INTO {partition} SELECT * FROM {default} WHERE {in_period}"))
+        conn.execute(text(f"DELETE FROM {default} WHERE {in_period}"))
+    conn.execute(text(
+        f"ALTER TABLE {table} ATTACH PARTITION {partition}\n"
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+    return name
+
+def ensure_partitions(conn, first, last, interval):
+    """Creates the missing partitions from the period of `first` to the period of `last`. Returns their names."""
+    created = []
+    start = period_start(first, interval)
+    while start <= last:
+        name = create_partition(conn, start, interval)
+        if name:
+            created.append(name)
+        start = next_period(start, interval)
+    return created
+
+def drop_expired_partitions(conn, retention_days):
+    """
+    Drops the partitions whose whole period is older than `retention_days` days, and the expired
+    readings of the default partition. The hourly and daily rollups keep their summaries.
+    """
+    if retention_days <= 0:
+        return []
+    cutoff = date.today() - timedelta(days=retention_days)
+    dropped = []
+    for name in list_partitions(conn):
+        parsed = parse_partition_name(name)
+        if parsed and next_period(*parsed) <= cutoff:
+            conn.execute(text(f"DROP TABLE {quote_identifier(name)}"))
+            dropped.append(name)
+    if table_kind(conn, DEFAULT_PARTITION):
+        conn.execute(
+            text(f"DELETE FROM {quote_identifier(DEFAULT_PARTITION)} WHERE {quote_identifier(SENSOR_TIME_COLUMN)} < :cutoff"),
+            {"cutoff": cutoff},
+        )
+    return dropped
+
+def lock_schema(conn):
+    """Only one migration or maintenance at a time (released at the end of the transaction)."""
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": f"{SENSOR_TABLE}_schema"})
+
+def move_sequences(conn, old, new):
+    """Hands the id sequences of the old table over to the new one, so its ids keep counting from the last one."""
+    columns = conn.execute(text(
+        "SELECT attname FROM pg_attribute WHERE attrelid = to_regclass(:table) AND attnum > 0 AND NOT attisdropped"
+    ), {"table": quote_identifier(old)}).scalars().all()
+    for column in columns:
+        sequences = [
+            conn.execute(text("SELECT pg_get_serial_sequence(:table, :column)"),
+                         {"table": quote_identifier(table), "column": column}).scalar()
+            for table in (old, new)
+        ]
+        if sequences[0] is None:
+            continue
+        if sequences[1] is None:  # SERIAL: the new table's default still calls the old sequence
+            conn.execute(text(f"ALTER SEQUENCE {sequences[0]} OWNED BY {quote_identifier(new)}.{quote_identifier(column)}"))
+        else:  # Identity column: the new table got its own sequence
+            conn.execute(
+                text(f"SELECT setval(:sequence, MAX({quote_identifier(column)})) FROM {quote_identifier(new)} "
+                     f"HAVING MAX({quote_identifier(column)}) IS NOT NULL"),
+                {"sequence": sequences[1]},
+            )
+
+def migrate(engine=None, interval=PARTITION_INTERVAL, ahead=PARTITIONS_AHEAD):
+    """
+    Turns the readings table into a table partitioned by time range (one partition per month or
+    day, plus a default partition) with a BRIN index on the timestamp, and copies the readings into it.
+    The original table is kept as sensor_data_unpartitioned until it is dropped by hand. Its
+    primary key is not carried over: PostgreSQL only allows unique keys that include the timestamp.
+    Returns False if the table was already partitioned.
+    """
+    if interval not in INTERVALS:
+        raise ValueError(f"Unknown partition interval {interval!r}, expected one of: {', '.join(INTERVALS)}")
+    table = quote_identifier(SENSOR_TABLE)
+    old = quote_identifier(UNPARTITIONED_TABLE)
+    ts = quote_identifier(SENSOR_TIME_COLUMN)
+
+    with metrics.span("partition_migration", interval=interval) as migration_span, (engine or get_engine()).begin() as conn:
+        lock_schema(conn)
+        kind = table_kind(conn)
+        if kind is None:
+            raise ValueError(f"The table {SENSOR_TABLE} does not exist")
+        if kind == "p":
+            print(f"[INFO] {SENSOR_TABLE} is already partitioned.")
+            return False
+        if table_kind(conn, UNPARTITIONED_TABLE):
+            raise ValueError(f"{UNPARTITIONED_TABLE} already exists, drop or rename it before migrating again")
+
+        # Writers wait for the migration and then insert into the partitioned table
+        conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+        conn.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+        conn.execute(text(
+            f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS INCLUDING STORAGE)\n"
+            f"PARTITION BY RANGE ({ts})"
+        ))
+        conn.execute(text(f"CREATE TABLE {quote_identifier(DEFAULT_PARTITION)} PARTITION OF {table} DEFAULT"))
+
+        first, last = conn.execute(text(f"SELECT MIN({ts}), MAX({ts}) FROM {old}")).one()
+        today = date.today()
+        first_day = first.date() if first is not None else today
+        last_day = max(last.date() if last is not None else today, period_ahead(today, interval, ahead))
+        created = ensure_partitions(conn, first_day, last_day, interval)
+        ensure_brin_index(conn)
+
+        rows = conn.execute(text(f"INSERT INTO {table} OVERRIDING SYSTEM VALUE SELECT * FROM {old}")).rowcount
+        move_sequences(conn, UNPARTITIONED_TABLE, SENSOR_TABLE)
+        conn.execute(text(f"ANALYZE {table}"))
+        migration_span.set("rows", rows)
+        migration_span.set("partitions", len(created))
+
+    print(f"[INFO] {SENSOR_TABLE} partitioned by {interval}: {rows} readings copied into {len(created)} partitions.")
+    print(f"[INFO] The original table was kept as {UNPARTITIONED_TABLE}, drop it once the reports look right.")
+    return True
+
+def maintain(engine=None, ahead=PARTITIONS_AHEAD, retention_days=PARTITION_RETENTION_DAYS):
+    """
+    Creates the partitions of the current period and the next `ahead` ones, and drops the expired
+    ones. Does nothing for a table that is not partitioned. Returns {"created": [...], "dropped": [...]}.
+    """
+    with (engine or get_engine()).begin() as conn:
+        if table_kind(conn) != "p":
+            return {"created": [], "dropped": []}
+        with metrics.span("partition_maintenance") as maintenance_span:
+            lock_schema(conn)
+            interval = partition_interval(conn)
+            ensure_brin_index(conn)
+            created = ensure_partitions(conn, date.today(), period_ahead(date.today(), interval, ahead), interval)
+            dropped = drop_expired_partitions(conn, retention_days)
+            maintenance_span.set("created", len(created))
+            maintenance_span.set("dropped", len(dropped))
+
+    if created or dropped:
+        print(f"[INFO] Partitions of {SENSOR_TABLE}: created {', '.join(created) or 'none'}, "
+              f"dropped {', '.join(dropped) or 'none'}")
+    return {"created": created, "dropped": dropped}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Partitions the readings table by time and maintains its partitions.")
+    parser.add_argument("--migrate", action="store_true", help="Convert the readings table into a partitioned table")
+    parser.add_argument("--interval", choices=INTERVALS, default=PARTITION_INTERVAL, help="Period of each partition")
+    parser.add_argument("--retention-days", type=int, default=PARTITION_RETENTION_DAYS,
+                        help="Drop the partitions older than this many days (0 keeps them all)")
+    args = parser.parse_args()
+    if args.migrate:
+        migrate(interval=args.interval)
+    result = maintain(retention_days=args.retention_days)
+    print(f"[INFO] {len(result['created'])} partitions created, {len(result['dropped'])} dropped.")
@@ -0,0 +1,66 @@
+import json
+import re
+from sqlalchemy import text
+from agents import schema
+from agents.aggregation import DAILY_TABLE, HOURLY_TABLE, SENSOR_TABLE
+
+# Tables an LLM-written query may read (plus the partitions of the readings table)
+ALLOWED_TABLES = {SENSOR_TABLE, HOURLY_TABLE, DAILY_TABLE, schema.DEFAULT_PARTITION}
+
+# A report query only reads: statements and functions that write, lock or reach outside the database are refused
+FORBIDDEN_KEYWORDS = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|MERGE|UPSERT|INTO|DROP|ALTER|CREATE|TRUNCATE|GRANT|REVOKE|COPY|CALL|DO|"
+    r"VACUUM|ANALYZE|CLUSTER|REINDEX|LOCK|SET|RESET|EXECUTE|PREPARE|DEALLOCATE|LISTEN|NOTIFY|COMMIT|ROLLBACK)\b",
+    re.IGNORECASE,
+)
+FORBIDDEN_FUNCTIONS = re.compile(r"\b(pg_\w+|lo_\w+|dblink\w*|set_config)\s*\(", re.IGNORECASE)
+
+def clean_sql(sql):
+    """Removes the code fences and the trailing semicolon the model sometimes adds."""
+    sql = re.sub(r"^```(?:sql)?\s*|\s*```$", "", sql.strip(), flags=re.IGNORECASE).strip()
+    return sql.rstrip(";").strip()
+
+def check_read_only(sql):
+    """Raises ValueError unless `sql` is a single SELECT (or WITH ... SELECT) statement."""
+    if not re.match(r"^(SELECT|WITH)\b", sql, re.IGNORECASE):
+        raise ValueError("the query is not a SELECT")
+    if ";" in sql:
+        raise ValueError("the query has more than one statement")
+    match = FORBIDDEN_KEYWORDS.search(sql) or FORBIDDEN_FUNCTIONS.search(sql)
+    if match:
+        raise ValueError(f"the query uses {match.group(1)!r}, which is not allowed")
+
+def plan_relations(plan):
+    """Names of the tables scanned anywhere in an EXPLAIN (FORMAT JSON) plan."""
+    if "Relation Name" in plan:
+        yield plan["Relation Name"]
+    for child in plan.get("Plans", []):
+        yield from plan_relations(child)
+
+def allowed_relation(name):
+    return name in ALLOWED_TABLES or schema.parse_partition_name(name) is not None
+
+def validate_sql(conn, sql, required_columns=None):
+    """
+    Checks an LLM-written query without running it: read-only and single statement, planned by
+    PostgreSQL with EXPLAIN (so syntax, table and column errors show up), reading only the allowed
+    tables and, if given, returning `required_columns`. Returns the planner's estimated total cost,
+    raises ValueError or the database error otherwise.
+    """
+    sql = clean_sql(sql)
+    check_read_only(sql)
+    conn.execute(text("SET TRANSACTION READ ONLY"))
+
+    plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+    plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+    refused = sorted({name for name in plan_relations(plan) if not allowed_relation(name)})
+    if refused:
+        raise ValueError(f"the query reads tables that are not allowed: {', '.join(refused)}")
+
+    if required_columns:
+        # LIMIT 0 stops the executor before it reads a row, only the result columns come back
+        columns = list(conn.execute(text(f"SELECT * FROM ({sql}) AS candidate LIMIT 0")).keys())
+        missing = [column for column in required_columns if column not in columns]
+        if missing:
+            raise ValueError(f"the query does not return the columns {', '.join(missing)}")
+    return plan["Total Cost"]
@@ -0,0 +1,178 @@
+import argparse
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from agents.aggregation import build_summary_query
+
+# Canned email: a reasoning section, the HTML and a tail that streaming mode should never receive
+EMAIL_REASONING = "<think>\n" + "Let me look at the humidity values for each day. " * 40 + "\n</think>\n\n"
+EMAIL_HTML = (
+    "<!DOCTYPE html>\n<html>\n<head>\n    <meta charset='UTF-8'>\n</head>\n<body>\n"
+    "    <p><strong>Hello,</strong></p>\n"
+    "    <p>The soil moisture stayed within the expected range for the analyzed days.</p>\n"
+    "    <p>Attached is a graph with a detailed evolution of soil moisture.</p>\n"
+    "    <p><strong>Best regards,</strong></p>\n    <p>GardenCare AI System</p>\n</body>\n</html>"
+)
+EMAIL_TAIL = "\n\nI hope this email is useful. " * 20
+
+def canned_sql():
+    """The built-in summary query with its parameters inlined, as a well-behaved model would write it."""
+    query, parameters = build_summary_query()
+    return str(query.bindparams(**parameters).compile(compile_kwargs={"literal_binds": True}))
+
+def canned_plot_code(prompt):
+    """Fills the plot template found in the prompt with the Markdown table found in the prompt."""
+    template = prompt.split("base for the graph:\n\n", 1)[1].split("\n\nNOTE:", 1)[0]
+    table = prompt.split("Markdown Report:\n", 1)[1].split("\n\nPython Code:", 1)[0]
+    data = {"Date": [], "valor_minimo": [], "valor_promedio": [], "valor_maximo": []}
+    for line in table.splitlines()[2:]:  # Skip the header and the separator line
+        cells = [cell.strip() for cell in line.strip("|").split("|")]
+        for key, cell in zip(data, cells):
+            data[key].append(cell if key == "Date" else float(cell))
+    return "```python\n" + template.replace("{data_placeholder}", repr(data)) + "\n```"
+
+def canned_response(prompt):
+    """Picks the response of the chain the prompt comes from."""
+    if "Python Code:" in prompt:
+        return canned_plot_code(prompt)
+    if "HTML" in prompt:
+        return EMAIL_REASONING + EMAIL_HTML + EMAIL_TAIL
+    return canned_sql()
+
+def tokenize(text):
+    """Splits a response in token-sized chunks (words and the whitespace before them)."""
+    return re.findall(r"\s*\S+|\s+", text)
+
+class FakeOllama:
+    """
+    Ollama-compatible stand-in for /api/generate that streams canned responses at
+    `tokens_per_second` (0 = as fast as possible) and counts the calls (per model) and tokens sent.
+    `prompt_tokens_per_second` simulates the time the model takes to read the prompt before the first token.
+    An empty prompt only "loads" the model, as in Ollama, and /api/tags answers health checks.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, tokens_per_second=0, responder=canned_response,
+                 prompt_tokens_per_second=0):
+        self.tokens_per_second = tokens_per_second
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.responder = responder
+        self.calls = 0
+        self.tokens = 0
+        self.prompt_tokens = 0
+        self.model_calls = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.handler_class())
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake-ollama", daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def counters(self):
+        with self.lock:
+            return self.calls, self.tokens, self.prompt_tokens
+
+    def handler_class(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def handle(self):
+                try:
+                    super().handle()
+                except ConnectionResetError:
+                    pass  # Keep-alive connection closed by the client
+
+            def do_GET(self):
+                if self.path != "/api/tags":
+                    self.send_error(404)
+                    return
+                self.send_json({"models": []})
+
+            def do_POST(self):
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                if self.path != "/api/generate":
+                    self.send_error(404)
+                    return
+                if not request.get("prompt"):
+                    self.send_json({"model": request["model"], "response": "", "done": True, "done_reason": "load"})
+                    return
+                prompt_tokens = len(tokenize(request["prompt"]))
+                with fake.lock:
+                    fake.calls += 1
+                    fake.prompt_tokens += prompt_tokens
+                    fake.model_calls[request["model"]] = fake.model_calls.get(request["model"], 0) + 1
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                try:
+                    if fake.prompt_tokens_per_second:
+                        time.sleep(prompt_tokens / fake.prompt_tokens_per_second)
+                    tokens = tokenize(fake.responder(request["prompt"]))
+                    limit = (request.get("options") or {}).get("num_predict")  # Like Ollama, stops after num_predict tokens (-1: no limit)
+                    done_reason = "length" if limit is not None and 0 <= limit < len(tokens) else "stop"
+                    if done_reason == "length":
+                        tokens = tokens[:limit]
+                    for token in tokens:
+                        self.write_chunk(request, token, done=False)
+                        with fake.lock:
+                            fake.tokens += 1
+                        if fake.tokens_per_second:
+                            time.sleep(1 / fake.tokens_per_second)
+                    self.write_chunk(request, "", done=True, done_reason=done_reason, prompt_eval_count=prompt_tokens,
+                                     eval_count=len(tokens))
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # The client stopped the generation
+
+            def send_json(self, content):
+                body = json.dumps(content).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def write_chunk(self, request, token, done, done_reason="stop", **counts):
+                line = json.dumps({
+                    "model": request["model"],
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                    "response": token,
+                    "done": done,
+                    **({"done_reason": done_reason, **counts} if done else {}),
+                }).encode("utf-8") + b"\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+                self.wfile.flush()
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Runs an Ollama stand-in with canned responses for offline runs.")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="Simulated generation speed (0 = instant)")
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=0, help="Simulated prompt reading speed (0 = instant)")
+    args = parser.parse_args()
+    fake = FakeOllama(port=args.port, tokens_per_second=args.tokens_per_second,
+                      prompt_tokens_per_second=args.prompt_tokens_per_second)
+    print(f"[INFO] Fake Ollama listening on {fake.url} (use it with OLLAMA_ENDPOINTS={fake.url})")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        fake.server.server_close()
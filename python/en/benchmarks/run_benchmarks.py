@@ -0,0 +1,217 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from benchmarks.fake_ollama import FakeOllama
+
+# Each stage is timed on its own, with the same inputs the pipeline would give it
+STAGES = ("query", "query_raw", "query_llm", "query_llm_candidates", "rollup_refresh", "anomalies", "plot", "plot_bilingual",
+          "plot_llm", "email_draft")
+
+# Counters the agents add to their spans (agents/metrics.py), summed over the spans of each run:
+# regenerated queries or charts, and the SQL candidates and rounds of SQL_CANDIDATES mode
+SPAN_COUNTERS = ("retries", "candidates", "rounds")
+
+def start_database(db_url):
+    """Returns the URL of the benchmark database, starting a throwaway PostgreSQL (pgserver) if none is given."""
+    if db_url:
+        return db_url, None
+    try:
+        import pgserver  # Optional, pip install pgserver
+    except ImportError:
+        sys.exit("[ERROR] Set BENCH_DB_URL to a disposable local PostgreSQL database, or pip install pgserver.")
+    data_dir = tempfile.mkdtemp(prefix="gardencare-bench-")
+    server = pgserver.get_server(data_dir, cleanup_mode="delete")
+    return server.get_uri(), server
+
+def silenced(quiet):
+    return contextlib.redirect_stdout(io.StringIO()) if quiet else contextlib.nullcontext()
+
+def measure(function, fake, repeat, quiet=True):
+    """
+    Runs `function` once untimed to measure its peak Python memory (and warm it up), then
+    `repeat` timed times. Returns the peak memory and the latency, LLM calls and span counters of every timed run.
+    """
+    tracemalloc.start()
+    with silenced(quiet):
+        function()
+    peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+
+    from agents import metrics
+    runs = []
+    for _ in range(repeat):
+        metrics.new_run()
+        calls_before, tokens_before, prompt_tokens_before = fake.counters()
+        started = time.perf_counter()
+        with silenced(quiet), metrics.span("benchmark"):
+            result = function()
+        elapsed = time.perf_counter() - started
+        calls_after, tokens_after, prompt_tokens_after = fake.counters()
+        runs.append({
+            "seconds": elapsed,
+            "ok": result is not None and result is not False,
+            "llm_calls": calls_after - calls_before,
+            "llm_tokens": tokens_after - tokens_before,
+            "prompt_tokens": prompt_tokens_after - prompt_tokens_before,
+            **{counter: sum(span.values.get(counter, 0) for span in metrics.SPANS) for counter in SPAN_COUNTERS},
+        })
+    return peak_mb, runs
+
+def summarize(stage, peak_mb, runs):
+    seconds = np.array([run["seconds"] for run in runs]) * 1000
+    llm_calls = [run["llm_calls"] for run in runs]
+    return {
+        "stage": stage,
+        "runs": len(runs),
+        "failed": sum(not run["ok"] for run in runs),
+        "p50_ms": np.percentile(seconds, 50),
+        "p95_ms": np.percentile(seconds, 95),
+        "max_ms": seconds.max(),
+        "llm_calls": sum(llm_calls),
+        **{counter: sum(run[counter] for run in runs) for counter in SPAN_COUNTERS},
+        "llm_tokens": sum(run["llm_tokens"] for run in runs),
+        "prompt_tokens": sum(run["prompt_tokens"] for run in runs),
+        "peak_mb": peak_mb,
+    }
+
+def run_scale(days, readings_per_hour, sensors, stages, repeat, fake, quiet, partition=None):
+    # Imported here, after main() has pointed the agents at the benchmark database and fake Ollama
+    from sqlalchemy import text
+    from agents import anomalies, email_agent, plot_agent, query_agent, rollups, schema
+    from agents.aggregation import SENSOR_TABLE, SENSOR_TIME_COLUMN, SENSOR_VALUE_COLUMN, quote_identifier
+    from agents.db import get_engine
+    from benchmarks.seed_data import seed
+
+    engine = get_engine()
+    readings = seed(engine, days, readings_per_hour, sensors)
+    if partition:
+        with contextlib.redirect_stdout(io.StringIO()):
+            schema.migrate(engine, interval=partition)
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP TABLE {quote_identifier(schema.UNPARTITIONED_TABLE)}"))
+    with contextlib.redirect_stdout(io.StringIO()):
+        rebuild_started = time.perf_counter()
+        rollups.refresh_rollups(engine, rebuild=True)
+        rebuild_seconds = time.perf_counter() - rebuild_started
+
+    output_dir = tempfile.mkdtemp(prefix="gardencare-bench-out-")
+    query_agent.REPORT_WINDOW_DAYS = days
+    with contextlib.redirect_stdout(io.StringIO()):
+        df_summary = query_agent.run_workflow(output_dir=output_dir)
+
+    def query_with(**settings):
+        def run():
+            previous = {name: getattr(query_agent, name) for name in settings}
+            for name, value in settings.items():
+                setattr(query_agent, name, value)
+            try:
+                return query_agent.run_workflow(output_dir=output_dir)
+            finally:
+                for name, value in previous.items():
+                    setattr(query_agent, name, value)
+        return run
+
+    def rollup_refresh():
+        # A new reading since the last refresh, the usual case between two reports
+        with engine.begin() as conn:
+            conn.execute(text(
+                f"INSERT INTO {quote_identifier(SENSOR_TABLE)} ({quote_identifier(SENSOR_TIME_COLUMN)}, "
+                f"{quote_identifier(SENSOR_VALUE_COLUMN)}) VALUES (now(), 600)"
+            ))
+        return rollups.refresh_rollups(engine)
+
+    def plot_llm():
+        for name in (plot_agent.CHART_FILENAME, plot_agent.HUMIDITY_TABLE_FILENAME):
+            path = os.path.join(output_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+        return plot_agent.main_llm(df_summary, output_dir)
+
+    functions = {
+        "query": query_with(),
+        "query_raw": query_with(USE_ROLLUPS=False),
+        "query_llm": query_with(USE_LLM_SQL=True),
+        "query_llm_candidates": query_with(USE_LLM_SQL=True, SQL_CANDIDATES=3),
+        "rollup_refresh": rollup_refresh,
+        "anomalies": lambda: anomalies.find_anomalies(days, engine=engine),
+        "plot": lambda: plot_agent.render_chart(df_summary, output_dir),
+        "plot_bilingual": lambda: plot_agent.render_chart(df_summary, output_dir, ["en", "es"]),
+        "plot_llm": plot_llm,
+        "email_draft": lambda: email_agent.draft_email(df_summary, "bench@example.com"),
+    }
+
+    results = [{"stage": "rollup_rebuild", "runs": 1, "failed": 0, "p50_ms": rebuild_seconds * 1000,
+                "p95_ms": rebuild_seconds * 1000, "max_ms": rebuild_seconds * 1000, "llm_calls": 0,
+                **dict.fromkeys(SPAN_COUNTERS, 0), "llm_tokens": 0, "prompt_tokens": 0, "peak_mb": float("nan")}]
+    for stage in stages:
+        results.append(summarize(stage, *measure(functions[stage], fake, repeat, quiet)))
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+    scale = {"days": days, "readings_per_hour": readings_per_hour, "sensors": sensors, "partition": partition or "none",
+             "readings": readings}
+    return [{**scale, **result} for result in results]
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the agent stages with a fake Ollama and a local PostgreSQL.")
+    parser.add_argument("--days", default="3,30,365", help="Comma-separated list of data sizes, in days")
+    parser.add_argument("--readings-per-hour", type=int, default=60)
+    parser.add_argument("--sensors", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of every stage per data size")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Comma-separated subset of: {', '.join(STAGES)}")
+    parser.add_argument("--partition", choices=("month", "day"), help="Partition the readings table by time after seeding it")
+    parser.add_argument("--tokens-per-second", type=float, default=0, help="Simulated LLM speed (0 = instant)")
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=0,
+                        help="Simulated prompt reading speed, the time to the first token (0 = instant)")
+    parser.add_argument("--llm-cache", action="store_true", help="Keep the LLM response cache enabled")
+    parser.add_argument("--json", metavar="PATH", help="Also write the results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the agents")
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(sorted(unknown))}")
+
+    fake = FakeOllama(tokens_per_second=args.tokens_per_second,
+                      prompt_tokens_per_second=args.prompt_tokens_per_second).start()
+    db_url, db_server = start_database(os.getenv("BENCH_DB_URL"))
+
+    # The agents read their configuration when imported
+    os.environ["DATABASE_URL"] = db_url
+    os.environ["OLLAMA_ENDPOINTS"] = fake.url
+    os.environ.setdefault("SENSOR_ID_COLUMN", "sensor_id")
+    os.environ["METRICS"] = "0"  # Keep the benchmark runs out of the report metrics
+    if not args.llm_cache:
+        os.environ["LLM_CACHE"] = "0"
+
+    results = []
+    try:
+        for days in (int(value) for value in args.days.split(",")):
+            print(f"[INFO] Benchmarking {days} days x {args.readings_per_hour} readings/hour x {args.sensors} sensors...")
+            scale_results = run_scale(days, args.readings_per_hour, args.sensors, stages, args.repeat, fake,
+                                      quiet=not args.verbose, partition=args.partition)
+            results.extend(scale_results)
+            table = pd.DataFrame(scale_results).drop(columns=["days", "readings_per_hour", "sensors", "partition"])
+            print(table.to_markdown(index=False, floatfmt=".1f"))
+            print()
+    finally:
+        fake.stop()
+        if db_server is not None:
+            db_server.cleanup()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, default=float)
+        print(f"[INFO] Results saved to {args.json}")
+
+if __name__ == "__main__":
+    main()
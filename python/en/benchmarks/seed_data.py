@@ -0,0 +1,48 @@
+import argparse
+import os
+import sys
+from sqlalchemy import create_engine, text
+from agents.aggregation import SENSOR_ID_COLUMN, SENSOR_TABLE, SENSOR_TIME_COLUMN, SENSOR_VALUE_COLUMN, quote_identifier
+
+def seed(engine, days, readings_per_hour, sensors):
+    """
+    Recreates the readings table with `days` of synthetic readings (a daily drying/watering cycle
+    plus noise) for `sensors` sensors at `readings_per_hour`. Returns the number of readings.
+    Only meant for benchmark databases: the table is dropped first.
+    """
+    table = quote_identifier(SENSOR_TABLE)
+    ts = quote_identifier(SENSOR_TIME_COLUMN)
+    value = quote_identifier(SENSOR_VALUE_COLUMN)
+    sensor_definition = f", {quote_identifier(SENSOR_ID_COLUMN)} TEXT" if SENSOR_ID_COLUMN else ""
+    sensor_column = f", {quote_identifier(SENSOR_ID_COLUMN)}" if SENSOR_ID_COLUMN else ""
+    sensor_value = ", 'plant-' || sensor" if SENSOR_ID_COLUMN else ""
+
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        conn.execute(text(
+            f"CREATE TABLE {table} (id SERIAL PRIMARY KEY, {value} INTEGER NOT NULL, "
+            f"{ts} TIMESTAMPTZ NOT NULL DEFAULT now(){sensor_definition})"
+        ))
+        # Readings up to now, so the report window always has data
+        conn.execute(text(
+            f"INSERT INTO {table} ({ts}, {value}{sensor_column})\n"
+            f"SELECT moment, (650 + 150 * sin(extract(epoch FROM moment) / 86400 * 2 * pi() + sensor)\n"
+            f"                + random() * 40)::int{sensor_value}\n"
+            f"FROM generate_series(now() - :days * INTERVAL '1 day', now(), INTERVAL '1 hour' / :per_hour) AS moment,\n"
+            f"     generate_series(1, :sensors) AS sensor"
+        ), {"days": days, "per_hour": readings_per_hour, "sensors": sensors})
+        conn.execute(text(f"CREATE INDEX ON {table} ({ts})"))
+        conn.execute(text(f"ANALYZE {table}"))
+        return conn.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fills the readings table of a TEST database with synthetic data.")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--readings-per-hour", type=int, default=60)
+    parser.add_argument("--sensors", type=int, default=1)
+    parser.add_argument("--db-url", default=os.getenv("BENCH_DB_URL"), help="Disposable database to seed, its readings table is dropped (default: BENCH_DB_URL)")
+    args = parser.parse_args()
+    if not args.db_url:
+        sys.exit("[ERROR] Pass --db-url or set BENCH_DB_URL to a disposable database: seeding drops its readings table, so the agents' database is never used.")
+    count = seed(create_engine(args.db_url), args.days, args.readings_per_hour, args.sensors)
+    print(f"[INFO] {count} readings written to {SENSOR_TABLE}")
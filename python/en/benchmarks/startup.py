@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+# Commands timed from a fresh interpreter, as a user or cron would start them
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMMANDS = {
+    "main --check": ["main.py", "--check"],
+    "main --help": ["main.py", "--help"],
+    "import agents.scheduler": ["-c", "import agents.scheduler"],
+    "import agents.query_agent": ["-c", "import agents.query_agent"],
+    "import agents.plot_agent": ["-c", "import agents.plot_agent"],
+    "import agents.anomalies": ["-c", "import agents.anomalies"],
+    "import agents.email_agent": ["-c", "import agents.email_agent"],
+}
+BUDGETED_COMMAND = "main --check"
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+def run(arguments, importtime=False):
+    """Runs the interpreter with `arguments` and returns its wall time in seconds and its stderr."""
+    command = [sys.executable, *(["-X", "importtime"] if importtime else []), *arguments]
+    started = time.perf_counter()
+    completed = subprocess.run(command, cwd=PROJECT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - started
+    if completed.returncode not in (0, 1):  # --check exits with 1 on an invalid configuration, still a valid timing
+        raise RuntimeError(f"{' '.join(arguments)} failed: {completed.stderr.strip().splitlines()[-1:]}")
+    return elapsed, completed.stderr
+
+def slowest_imports(stderr, top):
+    """
+    Packages of a -X importtime report, slowest first: the cumulative milliseconds of every place
+    where something outside the package imported it. The project's own modules are left out.
+    """
+    entries = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            entries.append((len(match.group(3)), match.group(4).split(".")[0], int(match.group(2)) / 1000))
+    packages = {}
+    importers = []  # (depth, package) of the modules above the current one, the report lists them after it
+    for depth, package, cumulative_ms in reversed(entries):
+        while importers and importers[-1][0] >= depth:
+            importers.pop()
+        if package != "agents" and (not importers or importers[-1][1] != package):
+            packages[package] = packages.get(package, 0) + cumulative_ms
+        importers.append((depth, package))
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return [{"package": package, "cumulative_ms": cumulative_ms} for package, cumulative_ms in slowest]
+
+def main():
+    parser = argparse.ArgumentParser(description="Measures how long the entry points take to start, each in a fresh interpreter.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs of every command")
+    parser.add_argument("--commands", default=",".join(COMMANDS), help=f"Comma-separated subset of: {', '.join(COMMANDS)}")
+    parser.add_argument("--budget-ms", type=float, default=500,
+                        help=f"Exit with an error if the p50 of '{BUDGETED_COMMAND}' is slower than this")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imported packages shown for every command")
+    parser.add_argument("--json", metavar="PATH", help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    commands = [command.strip() for command in args.commands.split(",") if command.strip()]
+    unknown = set(commands) - set(COMMANDS)
+    if unknown:
+        parser.error(f"Unknown commands: {', '.join(sorted(unknown))}")
+
+    # No database or Ollama is needed: the commands only import modules and read the configuration
+    results = []
+    imports = {}
+    for name in commands:
+        run(COMMANDS[name])  # Warms the bytecode and the OS file cache, like every start after the first
+        seconds = np.array([run(COMMANDS[name])[0] for _ in range(args.repeat)]) * 1000
+        results.append({"command": name, "runs": args.repeat, "p50_ms": np.percentile(seconds, 50),
+                        "p95_ms": np.percentile(seconds, 95), "max_ms": seconds.max()})
+        imports[name] = slowest_imports(run(COMMANDS[name], importtime=True)[1], args.top)
+
+    print(pd.DataFrame(results).to_markdown(index=False, floatfmt=".1f"))
+    for name in commands:
+        print(f"\n[INFO] Slowest imports of '{name}':")
+        print(pd.DataFrame(imports[name], columns=["package", "cumulative_ms"]).to_markdown(index=False, floatfmt=".1f"))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"results": results, "imports": imports}, f, indent=2, default=float)
+        print(f"[INFO] Results saved to {args.json}")
+
+    budgeted = next((result for result in results if result["command"] == BUDGETED_COMMAND), None)
+    if budgeted is not None and budgeted["p50_ms"] > args.budget_ms:
+        print(f"[ERROR] '{BUDGETED_COMMAND}' took {budgeted['p50_ms']:.0f} ms, over the budget of {args.budget_ms:.0f} ms")
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+import csv
+import io
+import json
+import math
+import os
+import signal
+import sys
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from sqlalchemy import create_engine, exc, text
+from agents.aggregation import SENSOR_ID_COLUMN, SENSOR_TABLE, SENSOR_TIME_COLUMN, SENSOR_VALUE_COLUMN, quote_identifier
+from agents.db import get_engine
+from agents.report_data import SENSOR_MAX
+from agents.rollups import mark_late_readings
+
+# Ingest service configuration
+INGEST_HOST = os.getenv("INGEST_HOST", "0.0.0.0")
+INGEST_PORT = int(os.getenv("INGEST_PORT", "8080"))
+INGEST_DB_URL = os.getenv("INGEST_DB_URL")  # e.g. sqlite:///readings.db for local tests, default is the agents' PostgreSQL
+FLUSH_SIZE = int(os.getenv("INGEST_FLUSH_SIZE", "500"))  # Readings buffered before a flush is triggered
+FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "2.0"))  # Maximum seconds a reading waits in the buffer
+MAX_BUFFERED = int(os.getenv("INGEST_MAX_BUFFERED", "100000"))  # Above this the service answers 503 until the DB catches up
+FLUSH_RETRIES = int(os.getenv("INGEST_FLUSH_RETRIES", "3"))  # Failed flushes of a batch before it is split to find the rejected readings
+
+def columns():
+    """Columns written for each reading: (timestamp, value[, sensor id])."""
+    names = [SENSOR_TIME_COLUMN, SENSOR_VALUE_COLUMN]
+    if SENSOR_ID_COLUMN:
+        names.append(SENSOR_ID_COLUMN)
+    return names
+
+def parse_reading(value, timestamp=None, sensor_id=None, received_at=None):
+    """Validates one reading and returns it as a row tuple (ValueError if it is not an analogRead value)."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid sensor value: {value!r}")
+    if not math.isfinite(value) or not 0 <= value <= SENSOR_MAX:
+        raise ValueError(f"Sensor value outside the analogRead range 0-{SENSOR_MAX}: {value!r}")
+    if value.is_integer():
+        value = int(value)  # analogRead() values, keeps COPY working on integer columns
+    if timestamp:
+        timestamp = datetime.fromisoformat(str(timestamp))
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.astimezone()  # Naive timestamps are taken as local time
+    else:
+        timestamp = received_at or datetime.now().astimezone()
+    row = (timestamp, value)
+    if SENSOR_ID_COLUMN:
+        row += (None if sensor_id in (None, "") else str(sensor_id),)
+    return row
+
+def parse_form(body):
+    """`value=...` (and optionally `sensor_id=...`) as sent by config.ino."""
+    fields = parse_qs(body.decode("utf-8"))
+    return [parse_reading(fields.get("value", [None])[0], fields.get("timestamp", [None])[0],
+                          fields.get("sensor_id", [None])[0])]
+
+def parse_json(body):
+    """A list of readings (or {"readings": [...]}) with `value` and optional `timestamp`/`sensor_id`."""
+    payload = json.loads(body)
+    if isinstance(payload, dict):
+        payload = payload.get("readings", [payload])
+    received_at = datetime.now().astimezone()
+    return [parse_reading(item.get("value"), item.get("timestamp"), item.get("sensor_id"), received_at)
+            for item in payload]
+
+def parse_csv(body):
+    """One reading per line: value[,timestamp[,sensor_id]], with an optional header line."""
+    received_at = datetime.now().astimezone()
+    rows = []
+    for fields in csv.reader(io.StringIO(body.decode("utf-8"))):
+        if not fields or (not rows and fields[0].strip().lower() == "value"):
+            continue
+        fields = [field.strip() for field in fields] + [None, None]
+        rows.append(parse_reading(fields[0], fields[1], fields[2], received_at))
+    return rows
+
+def copy_rows(raw_connection, rows):
+    """Writes the rows with PostgreSQL's COPY (psycopg 3 or psycopg2), in the same transaction as their rollup mark."""
+    column_list = ", ".join(quote_identifier(name) for name in columns())
+    copy_sql = f"COPY {quote_identifier(SENSOR_TABLE)} ({column_list}) FROM STDIN"
+    cursor = raw_connection.cursor()
+    try:
+        if hasattr(cursor, "copy"):  # psycopg 3
+            with cursor.copy(copy_sql) as copy:
+                for row in rows:
+                    copy.write_row(row)
+        else:  # psycopg2
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows((timestamp.isoformat(),) + tuple(rest) for timestamp, *rest in rows)
+            buffer.seek(0)
+            cursor.copy_expert(f"{copy_sql} WITH (FORMAT csv)", buffer)
+        mark_late_readings(cursor, min(row[0] for row in rows))  # Backfills older than the rollup window
+        raw_connection.commit()
+    finally:
+        cursor.close()
+
+def write_batch(engine, rows):
+    """Flushes a batch of readings: COPY on PostgreSQL, a multi-row insert elsewhere (SQLite)."""
+    if engine.dialect.name == "postgresql":
+        raw_connection = engine.raw_connection()  # Checked out from (and returned to) the engine's pool
+        try:
+            copy_rows(raw_connection, rows)
+        finally:
+            raw_connection.close()
+        return
+
+    names = columns()
+    insert = text(
+        f"INSERT INTO {quote_identifier(SENSOR_TABLE)} ({', '.join(quote_identifier(name) for name in names)}) "
+        f"VALUES ({', '.join(':' + name for name in names)})"
+    )
+    with engine.begin() as conn:
+        conn.execute(insert, [dict(zip(names, row)) for row in rows])
+
+def database_unavailable(engine, error):
+    """True for connection errors, after which the same rows can be written later (not for rows the database rejects)."""
+    dbapi = getattr(engine.dialect, "dbapi", None)
+    unavailable = (exc.OperationalError, exc.InterfaceError)
+    if dbapi is not None:
+        unavailable += (dbapi.OperationalError, dbapi.InterfaceError)
+    return isinstance(error, unavailable)
+
+def ensure_sqlite_table(engine):
+    """Creates the readings table in SQLite mode, so the service can be tested without PostgreSQL."""
+    definitions = [f"{quote_identifier(SENSOR_TIME_COLUMN)} TIMESTAMP NOT NULL",
+                   f"{quote_identifier(SENSOR_VALUE_COLUMN)} REAL NOT NULL"]
+    if SENSOR_ID_COLUMN:
+        definitions.append(f"{quote_identifier(SENSOR_ID_COLUMN)} TEXT")
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {quote_identifier(SENSOR_TABLE)} ({', '.join(definitions)})"))
+
+class ReadingBuffer:
+    """
+    Buffers readings in memory and writes them in batches from a background thread,
+    when FLUSH_SIZE readings are waiting or every FLUSH_INTERVAL seconds.
+    """
+
+    def __init__(self, engine, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.engine = engine
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.rows = []
+        self.flushed = 0
+        self.dropped = 0
+        self.failed_flushes = 0  # Consecutive failed flushes, reset by a successful one
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake_up = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="ingest-flush", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def add(self, rows):
+        """Queues readings, returns False if the buffer is full."""
+        with self.lock:
+            if len(self.rows) + len(rows) > MAX_BUFFERED:
+                return False
+            self.rows.extend(rows)
+            if len(self.rows) >= self.flush_size:
+                self.wake_up.set()
+        return True
+
+    def pending(self):
+        with self.lock:
+            return len(self.rows)
+
+    def requeue(self, rows):
+        with self.lock:
+            self.rows[:0] = rows
+
+    def flush(self):
+        """
+        Writes everything buffered so far. While the database is unavailable the batch is kept for
+        the next flush, up to FLUSH_RETRIES times; any other failure (or one retried too often) splits
+        the batch to drop only the readings the database rejects, so one bad row cannot block the rest.
+        """
+        with self.flush_lock:
+            with self.lock:
+                batch, self.rows = self.rows, []
+            if not batch:
+                return 0
+            try:
+                write_batch(self.engine, batch)
+            except Exception as e:
+                self.failed_flushes += 1
+                if database_unavailable(self.engine, e) and self.failed_flushes <= FLUSH_RETRIES:
+                    print(f"[ERROR] Could not write {len(batch)} readings, keeping them for the next flush: {e}")
+                    self.requeue(batch)
+                    return 0
+                print(f"[WARNING] Could not write {len(batch)} readings, writing them in smaller batches: {e}")
+                return self.write_isolating(batch)
+            self.failed_flushes = 0
+            self.flushed += len(batch)
+            print(f"[INFO] Flushed {len(batch)} readings ({self.flushed} in total)")
+            return len(batch)
+
+    def write_isolating(self, batch):
+        """
+        Writes the batch in halves, and the failing halves in halves again, until every reading the
+        database rejects is alone and can be logged and dropped. If the database becomes unavailable
+        the readings not written yet go back to the buffer. Returns the number of readings written.
+        """
+        written = 0
+        parts = [batch]
+        while parts:
+            rows = parts.pop(0)
+            try:
+                write_batch(self.engine, rows)
+                written += len(rows)
+            except Exception as e:
+                if database_unavailable(self.engine, e):
+                    print(f"[ERROR] Database unavailable, keeping {len(rows) + sum(map(len, parts))} readings for the next flush: {e}")
+                    self.requeue(rows + [row for part in parts for row in part])
+                    break
+                if len(rows) == 1:
+                    self.dropped += 1
+                    print(f"[ERROR] Dropping a reading rejected by the database {rows[0]}: {e}")
+                else:
+                    parts[:0] = [rows[:len(rows) // 2], rows[len(rows) // 2:]]
+        else:
+            self.failed_flushes = 0
+        self.flushed += written
+        print(f"[INFO] Flushed {written} readings ({self.flushed} in total, {self.dropped} dropped)")
+        return written
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wake_up.wait(self.flush_interval)
+            self.wake_up.clear()
+            self.flush()
+
+    def close(self):
+        self.stopped.set()
+        self.wake_up.set()
+        self.thread.join()
+        self.flush()
+
+class IngestHandler(BaseHTTPRequestHandler):
+    buffer = None  # Set by serve()
+
+    def send_text(self, status, body, content_type="text/plain"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_text(404, "Not found")
+            return
+        status = {"pending": self.buffer.pending(), "flushed": self.buffer.flushed, "dropped": self.buffer.dropped}
+        self.send_text(200, json.dumps(status), "application/json")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip()
+        try:
+            if self.path == "/insert.php" or content_type == "application/x-www-form-urlencoded":
+                rows = parse_form(body)
+            elif content_type == "application/json":
+                rows = parse_json(body)
+            elif content_type == "text/csv":
+                rows = parse_csv(body)
+            else:
+                self.send_text(415, f"Unsupported content type: {content_type}")
+                return
+        except (ValueError, TypeError, AttributeError) as e:
+            self.send_text(400, f"Invalid readings: {e}")
+            return
+
+        if not self.buffer.add(rows):
+            self.send_text(503, "Buffer full, retry later")
+            return
+        self.send_text(200, f"OK {len(rows)}")
+
+    def log_message(self, format, *args):
+        pass  # One line per reading would flood the output
+
+def serve(host=INGEST_HOST, port=INGEST_PORT):
+    """Runs the ingest service until interrupted, flushing the remaining readings on exit."""
+    if INGEST_DB_URL:
+        engine = create_engine(INGEST_DB_URL)
+        if engine.dialect.name == "sqlite":
+            ensure_sqlite_table(engine)
+    else:
+        engine = get_engine()
+
+    buffer = ReadingBuffer(engine)
+    buffer.start()
+    IngestHandler.buffer = buffer
+    server = ThreadingHTTPServer((host, port), IngestHandler)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # Flush the buffer when stopped by a service manager
+    print(f"[INFO] Ingest service listening on http://{host}:{port} ({engine.dialect.name})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[INFO] Stopping ingest service...")
+    finally:
+        server.server_close()
+        buffer.close()
+
+if __name__ == "__main__":
+    serve()
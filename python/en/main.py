@@ -1,27 +1,140 @@
+import argparse
 import os
-import subprocess
+from datetime import datetime
+from functools import partial
+from agents import locales, routing, scheduler
 
-# The user must enter the output directory for the generated files (replace with your own path)
-OUTPUT_DIR = input("Enter the output directory for the generated files (e.g., /path/to/your/directory): ").strip()
+# The agents run as stages of this process: they share the LLM clients and the DB engine,
+# and each stage receives the results of the stages it depends on in memory.
+# The chart and the email draft only need the query results, so they run in parallel
+# and are joined when the message is assembled. The anomaly check reads the raw readings
+# while the query runs, and its findings go into the email draft.
+# Every stage receives the settings of the report (`job`, see agents/scheduler.py). The stages that
+# read the database wait for one of its DB_CONCURRENCY slots, so many plants can run at once.
+# A report in several languages (job["languages"]) queries and analyzes the data once: the charts
+# of every language are rendered from the same summary and the drafts run in parallel.
+# Only the configuration modules are imported up front: the agents (LangChain, pandas, Matplotlib,
+# SQLAlchemy) are imported by the functions that run them, so `--check` and `--help` start at once.
 
-def run_query_agent():
-    print("[INFO] Running Query_agent.py...")
-    subprocess.run(["python3", "Query_agent.py"], check=True)
+def run_query_agent(job):
+    from agents import db, query_agent
+    from agents.pipeline import limited
+    print("[INFO] Running query agent...")
+    with limited(db.DB_SLOTS, "db"):
+        df_summary = query_agent.run_workflow(output_dir=job["output_dir"], sensor_id=job["sensor_id"],
+                                              prepare=job.get("prepare", True))
+    if df_summary is None:
+        raise RuntimeError("The query agent did not return any data")
+    return df_summary
 
-def run_plot_agent():
-    print("[INFO] Running Plot_agent.py...")
-    subprocess.run(["python3", "Plot_agent.py"], check=True)
+def run_plot_agent(job, df_summary):
+    from agents import plot_agent
+    print("[INFO] Running plot agent...")
+    png_paths = plot_agent.main(df_summary, job["output_dir"], job["languages"])
+    if png_paths is None:
+        raise RuntimeError("The plot agent did not generate the graph")
+    return png_paths
 
-def run_email_agent():
-    print("[INFO] Running Email_agent.py...")
-    subprocess.run(["python3", "Email_agent.py"], check=True)
+def run_anomaly_detection(job):
+    from agents import anomalies, db, query_agent
+    from agents.pipeline import limited
+    print("[INFO] Looking for anomalies in the raw readings...")
+    with limited(db.DB_SLOTS, "db"):
+        return anomalies.find_anomalies(query_agent.REPORT_WINDOW_DAYS, job["sensor_id"])
 
-def cleanup_files():
-    # Ensure that OUTPUT_DIR is correctly provided by the user.
+def run_email_draft(job, language, df_summary, findings):
+    from agents import email_agent
+    print(f"[INFO] Drafting the email ({language})...")
+    email_html = email_agent.draft_email(df_summary, job["recipients"], findings, job["species"], language)
+    if email_html is None:
+        raise RuntimeError(f"The email agent did not draft the email ({language})")
+    return email_html
+
+def run_email_send(job, png_paths, *drafts):
+    from agents import email_agent
+    print("[INFO] Sending the email...")
+    email_html = email_agent.combine_drafts(dict(zip(job["languages"], drafts)))
+    msg = email_agent.build_message(email_html, list(png_paths.values()), job["sender_email"], job["languages"])
+    if msg is None or not email_agent.send_message(msg, job["sender_email"], job["sender_password"], job["recipients"]):
+        raise RuntimeError("The email agent did not send the report")
+
+STAGES = {
+    "query": ((), run_query_agent),                     # Executes the query and Markdown report process
+    "anomalies": ((), run_anomaly_detection),           # Checks the raw readings while the summary is built
+    "plot": (("query",), run_plot_agent),               # Executes the graph generation (PNG and Markdown update)
+    "draft": (("query", "anomalies"), run_email_draft), # Drafts the email with the LLM, once per language
+    "send": (("plot", "draft"), run_email_send),        # Attaches the graphs and sends the email
+}
+
+def report_stages(job):
+    """
+    The STAGES of the report described by `job`. The draft stage is repeated for every language
+    of the report ("draft_en", "draft_es"...) and the email is sent once all of them finished.
+    """
+    stages = {}
+    for name, (dependencies, function) in STAGES.items():
+        if name != "draft":
+            stages[name] = (dependencies, partial(function, job))
+            continue
+        for language in job["languages"]:
+            stages[f"draft_{language}"] = (dependencies, partial(function, job, language))
+    stages["send"] = (("plot", *(f"draft_{language}" for language in job["languages"])), partial(run_email_send, job))
+    return stages
+
+def env_settings():
+    """Settings of a single report taken from the environment, the missing ones are None."""
+    job = {key: os.getenv(variable) for key, variable in scheduler.JOB_SETTINGS.items()}
+    job["name"] = "report"
+    job["languages"] = locales.parse_languages(job["languages"])
+    return job
+
+def ask_settings():
+    """Settings of a single report: taken from the environment, the missing ones are asked to the user."""
+    from agents import email_agent
+    job = env_settings()
+    if not job["output_dir"]:
+        # The user must enter the output directory for the generated files (replace with your own path)
+        job["output_dir"] = input("Enter the output directory for the generated files (e.g., /path/to/your/directory): ").strip()
+    # Asked up front, the email is drafted while other stages are running
+    job["recipients"], job["sender_email"], job["sender_password"] = email_agent.ask_email_settings(
+        job["recipients"], job["sender_email"], job["sender_password"])
+    return job
+
+def report_models():
+    """
+    Models the report will call with the current settings. The reasoning model only drafts the
+    emails of plants with anomalies, it is loaded when one needs it instead of before every report.
+    """
+    from agents import plot_agent, query_agent
+    models = {routing.model_for("email")}
+    if query_agent.USE_LLM_SQL:
+        models.add(routing.model_for("sql"))
+    if plot_agent.PLOT_MODE == "llm":
+        models.add(routing.model_for("plot"))
+    return sorted(models)
+
+def warm_up():
+    """
+    Loads the models into Ollama and opens a database connection before a scheduled report.
+    The agents are imported then too, so the report does not wait for them.
+    """
+    from agents import anomalies, db, email_agent, llm, plot_agent, query_agent
+    for model in report_models():
+        print(f"[INFO] Loading {model} into Ollama...")
+        llm.preload(model)
+    db.check_health()
+
+def cleanup_files(output_dir, languages=()):
+    from agents import plot_agent
+    # Ensure that the output directory is correctly provided by the user.
     files_to_delete = [
-        os.path.join(OUTPUT_DIR, "humedad_estimado.md"),
-        os.path.join(OUTPUT_DIR, "humedad_suelo.png")
+        os.path.join(output_dir, plot_agent.HUMIDITY_TABLE_FILENAME),
+        os.path.join(output_dir, plot_agent.CHART_FILENAME)
     ]
+    for language in languages:  # The charts of the other languages of the report
+        chart_path = os.path.join(output_dir, locales.LOCALES[language]["chart_filename"])
+        if chart_path not in files_to_delete:
+            files_to_delete.append(chart_path)
     for file_path in files_to_delete:
         if os.path.exists(file_path):
             os.remove(file_path)
@@ -29,15 +142,105 @@ def cleanup_files():
         else:
             print(f"[INFO] File not found (already removed): {file_path}")
 
-def main():
+def run_report(job):
+    """Runs the whole report for `job`. Returns True if the email was sent."""
+    from agents import metrics
+    from agents.pipeline import run_stages
+    try:
+        with metrics.span("report", plant=job["name"]):
+            run_stages(report_stages(job))
+        return True
+    except Exception as e:
+        print(f"[ERROR] An error occurred during the report of '{job['name']}': {e}")
+        return False
+    finally:
+        cleanup_files(job["output_dir"], job["languages"])  # Removes the generated files at the end of the process
+
+def run_reports(jobs):
+    """
+    Runs the reports of `jobs` at once: the partitions and rollups are brought up to date once,
+    then every plant runs its own report (agents/fleet.py). Returns {plant name: sent}.
+    """
+    # Every agent is imported here, before the plants start, instead of by their threads at the same time
+    from agents import anomalies, email_agent, fleet, llm_cache, metrics, plot_agent, query_agent
+    metrics.new_run()
     try:
-        run_query_agent()   # Executes the query generation and Markdown report process
-        run_plot_agent()    # Executes the graph generation (PNG and Markdown update)
-        run_email_agent()   # Executes the email drafting and sending process
-    except subprocess.CalledProcessError as e:
-        print(f"[ERROR] An error occurred during execution: {e}")
+        with metrics.span("fleet", plants=len(jobs)):
+            try:
+                query_agent.prepare_tables()
+            except Exception as e:
+                print(f"[ERROR] Could not bring the readings tables up to date: {e}")
+                return {job["name"]: False for job in jobs}
+            return fleet.run_fleet([dict(job, prepare=False) for job in jobs], run_report)
     finally:
-        cleanup_files()     # Removes the generated files at the end of the process
+        llm_cache.report_stats()
+        metrics.export()
+
+def check(args):
+    """
+    Validates the settings of the chosen mode and shows what it would run, without importing the
+    agents or connecting to anything (`python3 -m agents.db` and `python3 -m agents.routing` check
+    the connections). Returns the exit code.
+    """
+    try:
+        if args.daemon or args.fleet:
+            jobs = scheduler.load_jobs(args.config)
+        else:
+            jobs = [env_settings()]
+            missing = [scheduler.JOB_SETTINGS[key] for key in scheduler.REQUIRED_SETTINGS if not jobs[0][key]]
+            if missing:
+                print(f"[INFO] Not set, asked at startup: {', '.join(missing)}")
+        now = datetime.now()
+        for job in jobs:
+            when = f"schedule {job['schedule']}, next report {job['schedule'].next_after(now):%Y-%m-%d %H:%M}" \
+                if args.daemon else "report now"
+            print(f"[INFO] {job['name']}: sensor {job['sensor_id'] or 'any'}, {job['species'] or 'default species'}, "
+                  f"languages {', '.join(job['languages'])}, {when}")
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] Invalid plant configuration: {e}")
+        return 1
+    try:
+        routing.validate()
+    except ValueError as e:
+        print(f"[ERROR] Invalid model routing: {e}")
+        return 1
+    for task in routing.task_tiers():
+        print(f"[INFO] {task}: {routing.model_for(task)}")
+    print(f"[INFO] Ollama endpoints: {', '.join(endpoint.url for endpoint in routing.endpoints())}")
+    print("[INFO] Configuration OK")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Generates and emails the soil humidity report.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Keep running and send the reports on their schedule, without asking anything")
+    parser.add_argument("--fleet", action="store_true", help="Send the report of every plant of the config now")
+    parser.add_argument("--config", help="JSON file with the plants and their schedules (DAEMON_CONFIG)")
+    parser.add_argument("--check", "--dry-run", action="store_true",
+                        help="Validate the settings of the chosen mode and show what would run, without loading the agents")
+    args = parser.parse_args()
+
+    if args.check:
+        raise SystemExit(check(args))
+
+    try:
+        routing.validate()  # Fails before any question is asked or any plant is loaded
+    except ValueError as e:
+        print(f"[ERROR] Invalid model routing: {e}")
+        raise SystemExit(1)
+    if not (args.daemon or args.fleet):
+        run_reports([ask_settings()])
+        return
+    try:
+        jobs = scheduler.load_jobs(args.config)
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] Invalid plant configuration: {e}")
+        raise SystemExit(1)
+    if args.fleet:
+        results = run_reports(jobs)
+        raise SystemExit(0 if all(results.values()) else 1)
+    # The Ollama clients, the database engine and the SMTP sessions are kept between reports
+    scheduler.run_forever(jobs, run_reports, warm_up)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,92 @@
+import smtplib
+import socket
+import ssl
+import pytest
+from agents import delivery
+from agents.delivery import is_temporary, parse_recipients, send_payload, session_usable
+
+@pytest.mark.parametrize("error", [
+    smtplib.SMTPServerDisconnected("connection lost"),
+    smtplib.SMTPConnectError(421, "too many connections"),
+    smtplib.SMTPSenderRefused(451, "try again later", "me@example.com"),
+    smtplib.SMTPDataError(452, "mailbox full"),
+    smtplib.SMTPRecipientsRefused({"a@example.com": (450, b"greylisted"), "b@example.com": (421, b"busy")}),
+    ConnectionResetError(),
+    TimeoutError(),
+    socket.gaierror(socket.EAI_AGAIN, "temporary failure in name resolution"),
+])
+def test_temporary_errors(error):
+    assert is_temporary(error)
+
+@pytest.mark.parametrize("error", [
+    smtplib.SMTPAuthenticationError(535, "bad credentials"),
+    smtplib.SMTPConnectError(554, "no service"),
+    smtplib.SMTPDataError(550, "rejected"),
+    smtplib.SMTPRecipientsRefused({"a@example.com": (450, b"greylisted"), "b@example.com": (550, b"no such user")}),
+    smtplib.SMTPNotSupportedError("SMTPUTF8 not supported"),
+    smtplib.SMTPException("unexpected"),
+    ssl.SSLCertVerificationError("certificate verify failed"),
+    OSError("unexpected"),
+    ValueError("not a network error"),
+])
+def test_permanent_errors(error):
+    assert not is_temporary(error)
+
+def test_session_usable():
+    assert session_usable(smtplib.SMTPDataError(452, "mailbox full"))
+    assert not session_usable(smtplib.SMTPDataError(421, "closing connection"))
+    assert not session_usable(smtplib.SMTPRecipientsRefused({"a@example.com": (421, b"closing")}))
+    assert not session_usable(smtplib.SMTPServerDisconnected())
+
+def test_parse_recipients():
+    assert parse_recipients(" a@example.com; b@example.com,,c@example.com ") == ["a@example.com", "b@example.com", "c@example.com"]
+    assert parse_recipients(["a@example.com", " ", "b@example.com "]) == ["a@example.com", "b@example.com"]
+
+class FakeServer:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.sent = []
+
+    def sendmail(self, sender, recipient, message):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent.append(recipient)
+
+class FakePool:
+    """Hands out a single fake session and records what happens to it."""
+
+    sender_email = "me@example.com"
+
+    def __init__(self, errors=()):
+        self.server = FakeServer(errors)
+        self.released = self.discarded = 0
+
+    def acquire(self):
+        return self.server
+
+    def release(self, server):
+        self.released += 1
+
+    def discard(self, server):
+        self.discarded += 1
+
+@pytest.fixture(autouse=True)
+def no_waiting(monkeypatch):
+    monkeypatch.setattr(delivery, "SMTP_MAX_RETRIES", 2)
+    monkeypatch.setattr(delivery.time, "sleep", lambda seconds: None)
+
+def test_send_payload_retries_temporary_errors():
+    pool = FakePool([smtplib.SMTPServerDisconnected(), smtplib.SMTPDataError(451, "try again")])
+    assert send_payload(pool, b"Subject: test\r\n\r\nbody", "a@example.com")
+    assert pool.server.sent == ["a@example.com"]
+    assert pool.discarded == 1 and pool.released == 2  # The dropped session is replaced, the 451 one is reused
+
+def test_send_payload_stops_on_permanent_errors():
+    pool = FakePool([smtplib.SMTPAuthenticationError(535, "bad credentials")])
+    assert not send_payload(pool, b"body", "a@example.com")
+    assert pool.server.errors == [] and pool.server.sent == []
+
+def test_send_payload_gives_up_after_the_retries():
+    pool = FakePool([smtplib.SMTPDataError(451, "try again")] * 3)
+    assert not send_payload(pool, b"body", "a@example.com")
+    assert pool.server.sent == []
@@ -0,0 +1,59 @@
+import pytest
+from agents.email_agent import drop_reasoning, stream_email
+
+EMAIL = "<!DOCTYPE html>\n<html><body><p>Water the monstera tomorrow.</p></body></html>"
+
+class FakeOllama:
+    """Streams the given chunks and records how many were read before the request was closed."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.cache = None
+        self.read = 0
+        self.closed = False
+        self.options = None
+
+    def stream(self, prompt, options=None):
+        self.options = options
+        def generate():
+            try:
+                for chunk in self.chunks:
+                    self.read += 1
+                    yield chunk
+            finally:
+                self.closed = True
+        return generate()
+
+def chunks_of(text, size):
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+TAIL = ["\nThe model keeps writing"] * 20  # Generated after </html> until num_predict runs out
+
+@pytest.mark.parametrize("chunks", [
+    chunks_of(EMAIL, 5) + TAIL,
+    chunks_of("<think>Dry soil, mention watering.</think>\n" + EMAIL, 7) + TAIL,
+    ["<think>Dry soil.", "</think>\n" + EMAIL] + TAIL,  # The reasoning ends in the chunk with the whole email
+    ["<think>Dry soil.</think>" + EMAIL] + TAIL,  # Both tags in the only chunk
+    ["<think>Dry soil.</thi", "nk>" + EMAIL[:-4], "tml>"] + TAIL,  # Tags split across chunks
+])
+def test_generation_stops_at_the_closing_html(chunks):
+    llm = FakeOllama(chunks)
+    assert stream_email("prompt", llm, max_tokens=100) == EMAIL
+    assert llm.read == len(chunks) - len(TAIL) and llm.closed
+    assert llm.options == {"num_predict": 100}
+
+def test_html_inside_the_reasoning_does_not_stop_the_generation():
+    chunks = ["<think>It should end with </html> like this.", "</think>\n", EMAIL] + TAIL
+    llm = FakeOllama(chunks)
+    assert stream_email("prompt", llm) == EMAIL
+    assert llm.read == 3
+
+def test_unfinished_draft_is_returned_with_a_warning(capsys):
+    llm = FakeOllama(["<think>Still thinking"] * 3)
+    assert stream_email("prompt", llm) == ""
+    assert "[WARNING]" in capsys.readouterr().out
+
+def test_drop_reasoning():
+    assert drop_reasoning("<think>a</think>b") == "b"
+    assert drop_reasoning("<think>still open") == ""
+    assert drop_reasoning("no reasoning") == "no reasoning"
@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+import pytest
+from langchain_core.outputs import Generation
+from agents import llm_cache
+from agents.llm_cache import SQLiteLLMCache
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Replaces the cache's clock, so the tests can move time forward."""
+    clock = Clock()
+    monkeypatch.setattr(llm_cache, "time", SimpleNamespace(time=clock.time))
+    return clock
+
+def make_cache(tmp_path, **settings):
+    return SQLiteLLMCache(namespace="llama3.1", path=str(tmp_path / "cache.sqlite3"), **settings)
+
+def store(cache, prompt, text=None):
+    cache.update(prompt, "params", [Generation(text=text or f"answer to {prompt}")])
+
+def cached_text(cache, prompt):
+    result = cache.lookup(prompt, "params")
+    return result[0].text if result else None
+
+def test_hit_after_update(tmp_path, clock):
+    cache = make_cache(tmp_path)
+    assert cached_text(cache, "q") is None
+    store(cache, "q")
+    assert cached_text(cache, "q") == "answer to q"
+    assert cache.lookup("q", "other params") is None
+    assert cached_text(make_cache(tmp_path), "q") == "answer to q"  # Kept on disk for the next run
+    other_model = SQLiteLLMCache(namespace="deepseek-r1:32b", path=cache.path)
+    assert other_model.lookup("q", "params") is None
+
+def test_entries_expire_after_the_ttl(tmp_path, clock):
+    cache = make_cache(tmp_path, ttl_hours=1)
+    store(cache, "old")
+    clock.now += 1800
+    store(cache, "new")
+    clock.now += 1801  # "old" is now 1 hour and 1 second old
+    assert cached_text(cache, "old") is None
+    assert cached_text(cache, "new") == "answer to new"
+    assert cache.entries() == 1  # The expired entry was deleted
+
+def test_least_recently_used_entries_are_evicted(tmp_path, clock):
+    cache = make_cache(tmp_path, max_entries=2)
+    store(cache, "a")
+    clock.now += 1
+    store(cache, "b")
+    clock.now += 1
+    assert cached_text(cache, "a") == "answer to a"  # "b" is now the least recently used
+    clock.now += 1
+    store(cache, "c")
+    assert cache.entries() == 2
+    assert cached_text(cache, "b") is None
+    assert cached_text(cache, "a") == "answer to a"
+    assert cached_text(cache, "c") == "answer to c"
+
+def test_bypass_skips_lookups_but_keeps_updating(tmp_path, clock):
+    cache = make_cache(tmp_path)
+    store(cache, "q", "failed answer")
+    with llm_cache.bypass():
+        assert cached_text(cache, "q") is None
+        store(cache, "q", "fresh answer")
+    with llm_cache.bypass(False):
+        assert cached_text(cache, "q") == "fresh answer"
@@ -0,0 +1,38 @@
+from datetime import datetime
+import pytest
+from agents.scheduler import Schedule, parse_field
+
+def test_parse_field():
+    assert parse_field("*", 0, 6) == set(range(7))
+    assert parse_field("5", 0, 59) == {5}
+    assert parse_field("1-5", 0, 7) == {1, 2, 3, 4, 5}
+    assert parse_field("*/15", 0, 59) == {0, 15, 30, 45}
+    assert parse_field("1-31/10,15", 1, 31) == {1, 11, 15, 21, 31}
+
+@pytest.mark.parametrize("field", ["60", "5-1", "*/0", "a", "1-", ""])
+def test_invalid_fields_are_refused(field):
+    with pytest.raises(ValueError):
+        parse_field(field, 0, 59)
+
+@pytest.mark.parametrize("expression", ["0 8 * *", "0 8 * * * *", "0 24 * * *", "0 8 0 * *", "0 8 * 13 *", "@yearly"])
+def test_invalid_expressions_are_refused(expression):
+    with pytest.raises(ValueError, match="invalid cron"):
+        Schedule(expression)
+
+@pytest.mark.parametrize("expression, moment, expected", [
+    ("0 8 * * *", "2024-05-01 07:59:30", "2024-05-01 08:00"),
+    ("0 8 * * *", "2024-05-01 08:00:00", "2024-05-02 08:00"),  # Strictly after the given minute
+    ("*/15 * * * *", "2024-05-01 10:16", "2024-05-01 10:30"),
+    ("@hourly", "2024-12-31 23:05", "2025-01-01 00:00"),
+    ("30 6 * * 1-5", "2024-05-03 07:00", "2024-05-06 06:30"),  # Friday after the report, next is Monday
+    ("0 9 * * 7", "2024-05-01 00:00", "2024-05-05 09:00"),  # 7 is Sunday too
+    ("0 0 1 * 1", "2024-05-01 00:00", "2024-05-06 00:00"),  # The 1st of the month or a Monday
+    ("0 0 31 * *", "2024-04-15 00:00", "2024-05-31 00:00"),  # April has no 31st
+    ("0 12 29 2 *", "2025-03-01 00:00", "2028-02-29 12:00"),
+])
+def test_next_after(expression, moment, expected):
+    assert Schedule(expression).next_after(datetime.fromisoformat(moment)) == datetime.fromisoformat(expected)
+
+def test_expression_that_never_matches():
+    with pytest.raises(ValueError, match="never matches"):
+        Schedule("0 0 31 2 *").next_after(datetime(2024, 5, 1))
@@ -0,0 +1,85 @@
+import json
+import pytest
+from agents.aggregation import DAILY_TABLE, SENSOR_TABLE
+from agents.schema import DEFAULT_PARTITION
+from agents.sql_validation import check_read_only, clean_sql, validate_sql
+
+class Result:
+    def __init__(self, value=None, columns=()):
+        self.value = value
+        self.columns = list(columns)
+
+    def scalar(self):
+        return self.value
+
+    def keys(self):
+        return self.columns
+
+class FakeConnection:
+    """Answers EXPLAIN with a fixed plan and LIMIT 0 with fixed columns, and records the statements."""
+
+    def __init__(self, plan, columns=()):
+        self.plan = plan
+        self.columns = columns
+        self.statements = []
+
+    def execute(self, statement):
+        sql = str(statement)
+        self.statements.append(sql)
+        if sql.startswith("EXPLAIN"):
+            return Result(json.dumps([{"Plan": self.plan}]))
+        return Result(columns=self.columns)
+
+def scan(*tables, cost=42.0):
+    return {"Node Type": "Append", "Total Cost": cost,
+            "Plans": [{"Node Type": "Seq Scan", "Relation Name": table} for table in tables]}
+
+def test_clean_sql_removes_fences_and_semicolon():
+    assert clean_sql("```sql\nSELECT 1;\n```") == "SELECT 1"
+    assert clean_sql("  SELECT 1 ;  ") == "SELECT 1"
+
+@pytest.mark.parametrize("sql", [
+    f"SELECT * FROM {SENSOR_TABLE}",
+    f"WITH days AS (SELECT * FROM {DAILY_TABLE}) SELECT * FROM days",
+    f"select value as updated_value, created_at from {SENSOR_TABLE}",  # Keywords inside a name are fine
+])
+def test_read_only_queries_pass(sql):
+    check_read_only(sql)
+
+@pytest.mark.parametrize("sql, reason", [
+    (f"DELETE FROM {SENSOR_TABLE}", "not a SELECT"),
+    (f"SELECT 1; DROP TABLE {SENSOR_TABLE}", "more than one statement"),
+    (f"WITH gone AS (DELETE FROM {SENSOR_TABLE} RETURNING *) SELECT * FROM gone", "'DELETE'"),
+    (f"SELECT * INTO copy FROM {SENSOR_TABLE}", "'INTO'"),
+    (f"SELECT * FROM {SENSOR_TABLE} FOR UPDATE", "'UPDATE'"),
+    ("SELECT pg_sleep(60)", "'pg_sleep'"),
+    ("SELECT set_config('work_mem', '1TB', false)", "'set_config'"),
+    ("SELECT lo_import('/etc/passwd')", "'lo_import'"),
+])
+def test_writing_or_unsafe_queries_are_refused(sql, reason):
+    with pytest.raises(ValueError, match=reason):
+        check_read_only(sql)
+
+def test_validate_returns_the_plan_cost_without_running_the_query():
+    conn = FakeConnection(scan(SENSOR_TABLE, DEFAULT_PARTITION, f"{SENSOR_TABLE}_p202405", cost=12.5))
+    assert validate_sql(conn, f"SELECT * FROM {SENSOR_TABLE};") == 12.5
+    assert conn.statements == ["SET TRANSACTION READ ONLY", f"EXPLAIN (FORMAT JSON) SELECT * FROM {SENSOR_TABLE}"]
+
+def test_tables_outside_the_allow_list_are_refused():
+    conn = FakeConnection(scan(SENSOR_TABLE, "users", "pg_authid"))
+    with pytest.raises(ValueError, match="not allowed: pg_authid, users"):
+        validate_sql(conn, f"SELECT * FROM {SENSOR_TABLE}")
+
+def test_tables_that_only_look_like_partitions_are_refused():
+    conn = FakeConnection(scan(f"{SENSOR_TABLE}_backup", f"{SENSOR_TABLE}_p2024"))
+    with pytest.raises(ValueError, match="not allowed"):
+        validate_sql(conn, f"SELECT * FROM {SENSOR_TABLE}")
+
+def test_required_columns_are_checked():
+    required = ["date", "min_value", "avg_value", "max_value"]
+    conn = FakeConnection(scan(DAILY_TABLE), columns=["date", "min_value", "max_value"])
+    with pytest.raises(ValueError, match="does not return the columns avg_value"):
+        validate_sql(conn, f"SELECT * FROM {DAILY_TABLE}", required)
+    conn.columns = required
+    assert validate_sql(conn, f"SELECT * FROM {DAILY_TABLE}", required) == 42.0
+    assert conn.statements[-1].endswith("AS candidate LIMIT 0")
@@ -0,0 +1,149 @@
+import os
+import re
+from datetime import date, timedelta
+
+# Estructura de la tabla donde se guardan las lecturas del ESP8266 (se puede cambiar con variables de entorno).
+# Los constructores de consultas importan SQLAlchemy ellos mismos, así estos ajustes se cargan sin él (main.py --check).
+SENSOR_TABLE = os.getenv("SENSOR_TABLE", "datos_sensor")
+SENSOR_VALUE_COLUMN = os.getenv("SENSOR_VALUE_COLUMN", "valor")
+SENSOR_TIME_COLUMN = os.getenv("SENSOR_TIME_COLUMN", "fecha_hora")
+SENSOR_ID_COLUMN = os.getenv("SENSOR_ID_COLUMN")  # Opcional, solo para instalaciones con varios sensores
+
+# Tablas de agregados que mantiene agents/rollups.py (cantidad, suma, mínimo y máximo por sensor y periodo)
+HOURLY_TABLE = f"{SENSOR_TABLE}_por_hora"
+DAILY_TABLE = f"{SENSOR_TABLE}_por_dia"
+
+# Agrupaciones permitidas (valores aceptados por date_trunc de PostgreSQL)
+BUCKETS = ("hour", "day", "week", "month")
+MAX_WINDOW_DAYS = 3660
+
+IDENTIFIER_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+def quote_identifier(name):
+    """Valida un nombre de tabla/columna y lo devuelve entre comillas para PostgreSQL."""
+    if not name or not IDENTIFIER_PATTERN.match(name):
+        raise ValueError(f"Identificador SQL no válido: {name!r}")
+    return f'"{name}"'
+
+def validate_window(window_days, bucket):
+    """Comprueba la longitud de la ventana y la agrupación antes de construir el SQL."""
+    if isinstance(window_days, bool) or not isinstance(window_days, int):
+        raise ValueError(f"La ventana debe ser un número entero de días, se recibió {window_days!r}")
+    if not 1 <= window_days <= MAX_WINDOW_DAYS:
+        raise ValueError(f"La ventana debe estar entre 1 y {MAX_WINDOW_DAYS} días, se recibió {window_days}")
+    if bucket not in BUCKETS:
+        raise ValueError(f"Agrupación desconocida {bucket!r}, se esperaba una de: {', '.join(BUCKETS)}")
+
+def window_start(window_days):
+    """
+    Primer día de los últimos `window_days` días, hoy incluido (fecha local de los agentes), así una
+    ventana de 3 días cubre tres fechas. Se envía como una fecha ISO sin tipo en lugar de
+    calcularlo en SQL: PostgreSQL le da el tipo de la columna, así el planificador la compara con
+    los límites de las particiones por tiempo (agents/schema.py) y solo planifica y recorre las
+    particiones de la ventana.
+    """
+    return (date.today() - timedelta(days=window_days - 1)).isoformat()
+
+def build_summary_query(window_days=3, bucket="day", sensor_id=None):
+    """
+    Construye el resumen mínimo/promedio/máximo de los valores del sensor de los últimos
+    `window_days` días, agrupado por `bucket`. Devuelve la consulta preparada y sus parámetros.
+    """
+    from sqlalchemy import text
+    validate_window(window_days, bucket)
+
+    table = quote_identifier(SENSOR_TABLE)
+    value = quote_identifier(SENSOR_VALUE_COLUMN)
+    ts = quote_identifier(SENSOR_TIME_COLUMN)
+
+    # La agrupación viene de la lista permitida de arriba, así que se puede incluir directamente
+    bucket_expr = f"date_trunc('{bucket}', {ts})"
+    if bucket != "hour":
+        bucket_expr = f"CAST({bucket_expr} AS DATE)"
+
+    conditions = [f"{ts} >= :window_start"]
+    parameters = {"window_start": window_start(window_days)}
+
+    if sensor_id is not None:
+        if not SENSOR_ID_COLUMN:
+            raise ValueError("Se pidió filtrar por sensor pero SENSOR_ID_COLUMN no está configurado")
+        conditions.append(f"{quote_identifier(SENSOR_ID_COLUMN)} = :sensor_id")
+        parameters["sensor_id"] = sensor_id
+
+    sql = (
+        f"SELECT {bucket_expr} AS fecha,\n"
+        f"       ROUND(MIN({value})::numeric, 2) AS valor_minimo,\n"
+        f"       ROUND(AVG({value})::numeric, 2) AS valor_promedio,\n"
+        f"       ROUND(MAX({value})::numeric, 2) AS valor_maximo\n"
+        f"FROM {table}\n"
+        f"WHERE {' AND '.join(conditions)}\n"
+        f"GROUP BY 1\n"
+        f"ORDER BY 1"
+    )
+    return text(sql), parameters
+
+def build_rollup_summary_query(window_days=3, bucket="day", sensor_id=None):
+    """
+    Mismo resumen que build_summary_query, leído de las tablas de agregados por hora/día en lugar
+    de las lecturas brutas, así que su coste depende del número de periodos de la ventana.
+    """
+    from sqlalchemy import text
+    validate_window(window_days, bucket)
+
+    if bucket == "hour":
+        table, bucket_expr = HOURLY_TABLE, "inicio_hora"
+        time_column = "inicio_hora"
+    else:
+        table, time_column = DAILY_TABLE, "fecha"
+        bucket_expr = "fecha" if bucket == "day" else f"CAST(date_trunc('{bucket}', fecha) AS DATE)"
+
+    conditions = [f"{time_column} >= :window_start"]
+    parameters = {"window_start": window_start(window_days)}
+
+    if sensor_id is not None:
+        if not SENSOR_ID_COLUMN:
+            raise ValueError("Se pidió filtrar por sensor pero SENSOR_ID_COLUMN no está configurado")
+        conditions.append("id_sensor = :sensor_id")
+        parameters["sensor_id"] = str(sensor_id)
+
+    # Los periodos de varios sensores (o varios días para semana/mes) se combinan a partir de sus cantidades y sumas
+    sql = (
+        f"SELECT {bucket_expr} AS fecha,\n"
+        f"       ROUND(MIN(valor_min)::numeric, 2) AS valor_minimo,\n"
+        f"       ROUND((SUM(suma_valor) / SUM(cantidad_lecturas))::numeric, 2) AS valor_promedio,\n"
+        f"       ROUND(MAX(valor_max)::numeric, 2) AS valor_maximo\n"
+        f"FROM {quote_identifier(table)}\n"
+        f"WHERE {' AND '.join(conditions)}\n"
+        f"GROUP BY 1\n"
+        f"ORDER BY 1"
+    )
+    return text(sql), parameters
+
+def build_readings_query(window_days=3, sensor_id=None):
+    """
+    Construye la consulta de las lecturas brutas de los últimos `window_days` días, de la más antigua
+    a la más reciente (una fila por lectura, con el sensor de cada una si SENSOR_ID_COLUMN está configurada).
+    """
+    from sqlalchemy import text
+    validate_window(window_days, "day")
+
+    value = quote_identifier(SENSOR_VALUE_COLUMN)
+    ts = quote_identifier(SENSOR_TIME_COLUMN)
+    sensor = f", CAST({quote_identifier(SENSOR_ID_COLUMN)} AS TEXT) AS id_sensor" if SENSOR_ID_COLUMN else ""
+
+    conditions = [f"{ts} >= :window_start"]
+    parameters = {"window_start": window_start(window_days)}
+
+    if sensor_id is not None:
+        if not SENSOR_ID_COLUMN:
+            raise ValueError("Se pidió filtrar por sensor pero SENSOR_ID_COLUMN no está configurado")
+        conditions.append(f"{quote_identifier(SENSOR_ID_COLUMN)} = :sensor_id")
+        parameters["sensor_id"] = sensor_id
+
+    sql = (
+        f"SELECT {ts} AS fecha_hora, {value} AS valor{sensor}\n"
+        f"FROM {quote_identifier(SENSOR_TABLE)}\n"
+        f"WHERE {' AND '.join(conditions)}\n"
+        f"ORDER BY {ts}"
+    )
+    return text(sql), parameters
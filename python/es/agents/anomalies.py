@@ -0,0 +1,168 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from agents import locales, metrics
+from agents.aggregation import build_readings_query
+from agents.db import get_engine
+from agents.report_data import SENSOR_MAX
+
+# Configuración de la detección de anomalías (valores en la escala 0-1023 del sensor, menor = más húmedo)
+ANOMALY_WINDOW_MINUTES = float(os.getenv("ANOMALY_WINDOW_MINUTES", "60"))  # Duración de la ventana móvil de mediana/MAD...
+ANOMALY_MIN_READINGS = int(os.getenv("ANOMALY_MIN_READINGS", "7"))         # ...ampliada para contener al menos estas lecturas
+ANOMALY_Z = float(os.getenv("ANOMALY_Z", "5"))                             # z-score robusto a partir del cual una lectura es atípica
+ANOMALY_DROP = float(os.getenv("ANOMALY_DROP", "150"))                     # Caída del valor que cuenta como un riego...
+ANOMALY_DROP_MINUTES = float(os.getenv("ANOMALY_DROP_MINUTES", "15"))      # ...cuando ocurre en esta cantidad de minutos
+ANOMALY_STUCK_MINUTES = float(os.getenv("ANOMALY_STUCK_MINUTES", "120"))   # Lecturas idénticas durante este tiempo...
+ANOMALY_STUCK_READINGS = int(os.getenv("ANOMALY_STUCK_READINGS", "6"))     # ...y al menos esta cantidad de ellas = sensor trabado
+ANOMALY_VALID_MIN = int(os.getenv("ANOMALY_VALID_MIN", "1"))               # Las lecturas en los extremos de la escala vienen
+ANOMALY_VALID_MAX = int(os.getenv("ANOMALY_VALID_MAX", str(SENSOR_MAX - 1)))  # de un sensor en cortocircuito o desconectado
+ANOMALY_MAX_FINDINGS = int(os.getenv("ANOMALY_MAX_FINDINGS", "8"))         # Hallazgos listados en el email, el resto se cuentan
+
+# Orden en que se listan los hallazgos, los más graves primero
+KINDS = ("out_of_range", "stuck", "sudden_drop", "outlier")
+# Tipos que indican un problema del sensor o de la planta, una caída brusca suele ser solo un riego
+FAULT_KINDS = ("out_of_range", "stuck", "outlier")
+
+def humidity(value):
+    """Porcentaje de humedad estimado de un valor bruto del sensor."""
+    return (SENSOR_MAX - value) / SENSOR_MAX * 100
+
+def load_readings(window_days=3, sensor_id=None, engine=None):
+    """Lecturas brutas de la ventana como DataFrame (fecha_hora, valor[, id_sensor]), la más antigua primero."""
+    query, parameters = build_readings_query(window_days=window_days, sensor_id=sensor_id)
+    with (engine or get_engine()).connect() as conn:
+        return pd.read_sql_query(query, conn, params=parameters, parse_dates=["fecha_hora"])
+
+def sampling_minutes(timestamps):
+    """Tiempo habitual entre dos lecturas en minutos (el dispositivo envía una por hora, los benchmarks una por minuto)."""
+    if len(timestamps) < 2:
+        return 1.0
+    return max((timestamps[1:] - timestamps[:-1]).median().total_seconds() / 60, 1 / 60)
+
+def group_events(timestamps, values, reference, mask, kind):
+    """Una fila por cada racha de lecturas marcadas consecutivas: su periodo, rango de valores y valor de referencia."""
+    if not mask.any():
+        return pd.DataFrame()
+    run = np.cumsum(mask & ~np.r_[False, mask[:-1]])  # Aumenta en la primera lectura de cada racha
+    flagged = pd.DataFrame({"timestamp": timestamps[mask], "value": values[mask],
+                            "reference": reference[mask], "run": run[mask]})
+    events = flagged.groupby("run").agg(
+        start=("timestamp", "first"), end=("timestamp", "last"), readings=("value", "size"),
+        low=("value", "min"), high=("value", "max"), reference=("reference", "median"),
+    )
+    if kind == "sudden_drop":
+        events["reference"] = flagged.groupby("run")["reference"].max()  # El valor antes del riego
+    events.insert(0, "kind", kind)
+    return events.reset_index(drop=True)
+
+def detect_series(timestamps, values):
+    """Busca las anomalías de las lecturas de un sensor (ordenadas por tiempo). Devuelve un DataFrame de eventos."""
+    timestamps = pd.DatetimeIndex(timestamps)
+    values = np.asarray(values, dtype=float)
+    if len(values) == 0:
+        return pd.DataFrame()
+
+    # Cada control se ejecuta sobre las lecturas que los anteriores no marcaron, así un sensor con fallas
+    # no se reporta además como atípico y un pico aislado no se confunde con un riego
+    out_of_range = (values < ANOMALY_VALID_MIN) | (values > ANOMALY_VALID_MAX)
+
+    # Al menos ANOMALY_STUCK_READINGS lecturas consecutivas idénticas durante más de ANOMALY_STUCK_MINUTES
+    change = np.r_[True, values[1:] != values[:-1]]
+    starts = np.flatnonzero(change)
+    ends = np.r_[starts[1:], len(values)] - 1
+    run_minutes = (timestamps[ends] - timestamps[starts]).total_seconds().to_numpy() / 60
+    long_run = (run_minutes >= ANOMALY_STUCK_MINUTES) & (ends - starts + 1 >= ANOMALY_STUCK_READINGS)
+    stuck = long_run[np.cumsum(change) - 1] & ~out_of_range
+
+    # Atípicos: z-score robusto contra la mediana y la MAD móviles (al menos 1 unidad, las lecturas son enteras).
+    # La ventana cubre ANOMALY_WINDOW_MINUTES al ritmo de muestreo de la serie, y nunca menos de
+    # ANOMALY_MIN_READINGS lecturas (una cantidad impar, así queda centrada en la lectura)
+    window = pd.Series(np.where(out_of_range | stuck, np.nan, values))
+    interval = sampling_minutes(timestamps)
+    size = max(ANOMALY_MIN_READINGS, int(ANOMALY_WINDOW_MINUTES / interval)) | 1
+    median = window.rolling(size, center=True, min_periods=size // 2).median()
+    mad = (window - median).abs().rolling(size, center=True, min_periods=size // 2).median()
+    z = 0.6745 * (window - median) / mad.clip(lower=1)
+    outlier = (z.abs() > ANOMALY_Z).to_numpy()
+
+    # Riego: el valor cae ANOMALY_DROP por debajo de su máximo de los últimos ANOMALY_DROP_MINUTES, o de la
+    # lectura anterior cuando el sensor informa con menos frecuencia (1,5 intervalos absorben las variaciones)
+    valid = pd.Series(np.where(out_of_range | stuck | outlier, np.nan, values), index=timestamps)
+    drop_window = pd.Timedelta(minutes=max(ANOMALY_DROP_MINUTES, 1.5 * interval))
+    recent_max = valid.rolling(drop_window).max().to_numpy()
+    sudden_drop = (recent_max - valid.to_numpy()) >= ANOMALY_DROP
+
+    references = {"out_of_range": values, "stuck": values, "sudden_drop": recent_max, "outlier": median.to_numpy()}
+    masks = {"out_of_range": out_of_range, "stuck": stuck, "sudden_drop": sudden_drop, "outlier": outlier}
+    events = [group_events(timestamps, values, references[kind], masks[kind], kind) for kind in KINDS]
+    return pd.concat([event for event in events if not event.empty] or [pd.DataFrame()], ignore_index=True)
+
+def detect(readings):
+    """Busca las anomalías de cada sensor en `readings` (fecha_hora, valor[, id_sensor])."""
+    if "id_sensor" not in readings:
+        findings = detect_series(readings["fecha_hora"], readings["valor"])
+    else:
+        findings = [
+            detect_series(group["fecha_hora"], group["valor"]).assign(id_sensor=sensor)
+            for sensor, group in readings.groupby("id_sensor", sort=True)
+        ]
+        findings = pd.concat([f for f in findings if not f.empty] or [pd.DataFrame()], ignore_index=True)
+    if findings.empty:
+        return findings
+    findings["order"] = findings["kind"].map(KINDS.index)
+    return findings.sort_values(["order", "start"]).drop(columns="order").reset_index(drop=True)
+
+def find_anomalies(window_days=3, sensor_id=None, engine=None):
+    """Carga las lecturas brutas de la ventana y devuelve sus anomalías."""
+    with metrics.span("anomaly_detection") as detection_span:
+        readings = load_readings(window_days, sensor_id, engine)
+        findings = detect(readings)
+        detection_span.set("rows", len(readings))
+        detection_span.set("findings", len(findings))
+    print(f"[INFO] Detección de anomalías: {len(findings)} hallazgos en {len(readings)} lecturas")
+    return findings
+
+def format_period(start, end, language=None):
+    if start == end:
+        return start.strftime("%Y-%m-%d %H:%M")
+    end_format = "%H:%M" if start.date() == end.date() else "%Y-%m-%d %H:%M"
+    return locales.text(language, "period", start=f"{start:%Y-%m-%d %H:%M}", end=end.strftime(end_format))
+
+def value_range(low, high, unit=""):
+    return f"{low:.0f}{unit}" if round(low) == round(high) else f"{low:.0f}-{high:.0f}{unit}"
+
+def describe(finding, language=None):
+    """Una línea sobre `finding` en `language` (ver agents/locales.py)."""
+    period = format_period(finding["start"], finding["end"], language)
+    sensor = f" (sensor {finding['id_sensor']})" if "id_sensor" in finding and pd.notna(finding["id_sensor"]) else ""
+    kind = finding["kind"]
+    if kind == "out_of_range":
+        values = {"values": value_range(finding["low"], finding["high"])}
+    elif kind == "stuck":
+        values = {"humidity": humidity(finding["low"])}
+    elif kind == "sudden_drop":
+        values = {"before": humidity(finding["reference"]), "after": humidity(finding["low"])}
+    else:
+        kind = "outlier"
+        values = {"values": value_range(humidity(finding["high"]), humidity(finding["low"]), "%"),
+                  "reference": humidity(finding["reference"])}
+    return locales.text(language, kind, period=period, sensor=sensor, readings=finding["readings"], **values)
+
+def describe_findings(findings, limit=ANOMALY_MAX_FINDINGS, language=None):
+    """Lista compacta de los hallazgos para el prompt del email, en `language`."""
+    if findings is None:
+        return locales.text(language, "anomalies_unavailable")
+    if findings.empty:
+        return locales.text(language, "anomalies_none")
+    lines = [f"- {describe(finding, language)}" for _, finding in findings.head(limit).iterrows()]
+    if len(findings) > limit:
+        lines.append(locales.text(language, "anomalies_more", count=len(findings) - limit))
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Detecta anomalías en las lecturas brutas de humedad.")
+    parser.add_argument("--days", type=int, default=3, help="Largo de la ventana analizada en días")
+    parser.add_argument("--sensor", help="Analizar solo este sensor (requiere SENSOR_ID_COLUMN)")
+    args = parser.parse_args()
+    print(describe_findings(find_anomalies(args.days, args.sensor), limit=1000))
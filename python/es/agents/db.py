@@ -0,0 +1,64 @@
+import os
+import threading
+from functools import lru_cache
+from sqlalchemy import create_engine, text
+
+# Configuración de la base de datos
+DB_USER = os.getenv("DB_USER", "usuario_aqui")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "contraseña_aqui")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5432")
+DB_NAME = os.getenv("DB_NAME", "nombre_base_datos")
+
+# Configuración del pool de conexiones
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))              # Conexiones que se mantienen abiertas entre consultas
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))        # Conexiones adicionales permitidas con carga
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))       # Segundos de espera por una conexión libre
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))     # Reabrir las conexiones más antiguas que esto (segundos)
+# Ejecuciones de la misma consulta en una conexión antes de que psycopg la prepare en el servidor,
+# "none" desactiva las consultas preparadas (ej: detrás de PgBouncer en modo transacción)
+DB_PREPARE_THRESHOLD = os.getenv("DB_PREPARE_THRESHOLD", "1")
+# Etapas de reporte que leen la base de datos a la vez (ver main.py), dentro del pool para que con muchas
+# plantas esperen su turno aquí en lugar de fallar tras DB_POOL_TIMEOUT
+DB_CONCURRENCY = int(os.getenv("DB_CONCURRENCY", str(DB_POOL_SIZE)))
+DB_SLOTS = threading.BoundedSemaphore(DB_CONCURRENCY)
+
+# Construcción de la URI de conexión (driver psycopg 3, necesario para las consultas preparadas).
+# DATABASE_URL reemplaza la configuración DB_*, ej: para usar una base de datos local de pruebas.
+db_uri = os.getenv("DATABASE_URL", f"postgresql+psycopg://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
+if db_uri.startswith("postgresql://"):
+    db_uri = "postgresql+psycopg://" + db_uri[len("postgresql://"):]
+
+def prepare_threshold():
+    if DB_PREPARE_THRESHOLD.lower() in ("", "none", "off"):
+        return None
+    return int(DB_PREPARE_THRESHOLD)
+
+@lru_cache(maxsize=None)
+def get_engine():
+    """Devuelve el engine de SQLAlchemy con pool que comparten todos los agentes del proceso."""
+    return create_engine(
+        db_uri,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,  # Las conexiones cerradas por el servidor se reemplazan antes de usarlas
+        pool_use_lifo=True,  # Reutilizar la conexión más reciente, que ya tiene preparadas las consultas del reporte
+        connect_args={"prepare_threshold": prepare_threshold()},
+    )
+
+def check_health(engine=None):
+    """Ejecuta una consulta trivial a través del pool y devuelve su estado, lanza una excepción si la base de datos no responde."""
+    engine = engine or get_engine()
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    return {"pool": engine.pool.status(), "checked_out": engine.pool.checkedout()}
+
+if __name__ == "__main__":
+    try:
+        status = check_health()
+        print(f"[INFO] Base de datos accesible en {DB_HOST}:{DB_PORT}/{DB_NAME} - {status['pool']}")
+    except Exception as e:
+        print(f"[ERROR] Base de datos no accesible en {DB_HOST}:{DB_PORT}/{DB_NAME}: {e}")
+        raise SystemExit(1)
@@ -0,0 +1,188 @@
+import atexit
+import contextvars
+import os
+import queue
+import smtplib
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from agents import metrics
+
+# Configuración del servidor SMTP (para pruebas se puede usar un servidor local como
+# `python -m aiosmtpd -n -l localhost:8025` con SMTP_HOST=localhost SMTP_PORT=8025 SMTP_STARTTLS=0)
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "1") != "0"
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+
+# Configuración del envío
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "2"))                    # Sesiones que se mantienen abiertas y se usan en paralelo
+SMTP_MESSAGES_PER_SESSION = int(os.getenv("SMTP_MESSAGES_PER_SESSION", "50"))  # Reconectar tras esta cantidad de mensajes
+SMTP_MAX_RETRIES = int(os.getenv("SMTP_MAX_RETRIES", "3"))
+SMTP_RETRY_DELAY = float(os.getenv("SMTP_RETRY_DELAY", "2"))              # Segundos, se duplica tras cada reintento
+
+class SMTPPool:
+    """
+    Mantiene abiertas hasta `size` sesiones SMTP autenticadas, así una ejecución que envía varios
+    emails paga la conexión, STARTTLS y el login una vez por sesión en lugar de una vez por email.
+    No se usan más de `size` sesiones a la vez, los demás envíos esperan a que se libere una.
+    """
+
+    def __init__(self, sender_email, sender_password, host=SMTP_HOST, port=SMTP_PORT, size=SMTP_POOL_SIZE):
+        self.sender_email = sender_email
+        self.sender_password = sender_password
+        self.host = host
+        self.port = port
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.sent = {}  # Mensajes enviados por sesión, para reconectar antes del límite del servidor
+        self.lock = threading.Lock()
+
+    def connect(self):
+        server = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+        try:
+            if SMTP_STARTTLS:
+                server.starttls()
+            if self.sender_password and server.has_extn("auth"):
+                server.login(self.sender_email, self.sender_password)
+        except Exception:
+            server.close()
+            raise
+        print(f"[INFO] Sesión SMTP abierta con {self.host}:{self.port}")
+        return server
+
+    def acquire(self):
+        """Espera un turno libre y devuelve una sesión libre que siga respondiendo, o una nueva."""
+        started = time.perf_counter()
+        self.slots.acquire()
+        metrics.add("smtp_wait_seconds", time.perf_counter() - started)
+        try:
+            while True:
+                try:
+                    server = self.idle.get_nowait()
+                except queue.Empty:
+                    return self.connect()
+                try:
+                    server.noop()
+                    return server
+                except (smtplib.SMTPException, OSError):
+                    self.forget(server)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, server):
+        with self.lock:
+            self.sent[id(server)] = self.sent.get(id(server), 0) + 1
+            worn_out = self.sent[id(server)] >= SMTP_MESSAGES_PER_SESSION
+        if worn_out or self.idle.qsize() >= self.size:
+            self.close_session(server)
+        else:
+            self.idle.put(server)
+        self.slots.release()
+
+    def discard(self, server):
+        self.forget(server)
+        self.slots.release()
+
+    def forget(self, server):
+        with self.lock:
+            self.sent.pop(id(server), None)
+        server.close()
+
+    def close_session(self, server):
+        with self.lock:
+            self.sent.pop(id(server), None)
+        try:
+            server.quit()  # Cerrar conexión SMTP
+        except (smtplib.SMTPException, OSError):
+            server.close()
+
+    def close(self):
+        while True:
+            try:
+                self.close_session(self.idle.get_nowait())
+            except queue.Empty:
+                return
+
+POOLS = {}
+POOLS_LOCK = threading.Lock()
+
+def get_pool(sender_email, sender_password):
+    """Devuelve el pool de sesiones de un remitente, compartido por todos los reportes enviados desde este proceso."""
+    with POOLS_LOCK:
+        key = (SMTP_HOST, SMTP_PORT, sender_email)
+        if key not in POOLS:
+            POOLS[key] = SMTPPool(sender_email, sender_password)
+        return POOLS[key]
+
+@atexit.register
+def close_pools():
+    for pool in POOLS.values():
+        pool.close()
+
+def is_temporary(error):
+    """
+    Vale la pena reintentar las respuestas 4xx (límites de envío, greylisting) y las conexiones caídas.
+    SMTPException es un OSError, así que sus subclases se comprueban primero: el resto (autenticación,
+    comandos no soportados) y cualquier otro OSError, como un error de certificado TLS, son permanentes.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPServerDisconnected):
+        return True
+    if isinstance(error, smtplib.SMTPException):
+        return False
+    return isinstance(error, (ConnectionError, TimeoutError, socket.gaierror))
+
+def session_usable(error):
+    """Tras un rechazo sendmail reinicia la transacción, la sesión se conserva salvo que el servidor la esté cerrando (421)."""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code != 421 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code != 421
+
+def send_payload(pool, payload, recipient):
+    """Envía un mensaje ya generado a `recipient`, reintentando los fallos temporales con espera creciente."""
+    message = f"To: {recipient}\r\n".encode("utf-8") + payload
+    for attempt in range(SMTP_MAX_RETRIES + 1):
+        server = None
+        try:
+            server = pool.acquire()
+            server.sendmail(pool.sender_email, recipient, message)
+            pool.release(server)
+            return True
+        except Exception as e:
+            if server is not None and session_usable(e):
+                pool.release(server)
+            elif server is not None:
+                pool.discard(server)
+            if not is_temporary(e) or attempt == SMTP_MAX_RETRIES:
+                print(f"[ERROR] No se pudo enviar el email a {recipient}: {e}")
+                return False
+            metrics.add("retries")
+            delay = SMTP_RETRY_DELAY * 2 ** attempt
+            print(f"[WARNING] Falló el envío a {recipient} ({e}), reintentando en {delay:.0f}s...")
+            time.sleep(delay)
+
+def deliver(msg, recipients, sender_email, sender_password):
+    """
+    Envía `msg` (sin cabecera To) a cada destinatario a través del pool de sesiones del remitente.
+    El contenido MIME se genera una sola vez y se reutiliza para todos. Devuelve {destinatario: enviado}.
+    """
+    pool = get_pool(sender_email, sender_password)
+    payload = msg.as_bytes(policy=msg.policy.clone(linesep="\r\n"))  # smtplib no corrige los fines de línea de los bytes
+    contexts = [contextvars.copy_context() for _ in recipients]  # Los reintentos se cuentan en el span del llamador
+    with ThreadPoolExecutor(max_workers=max(1, min(pool.size, len(recipients)))) as executor:
+        results = executor.map(lambda context, recipient: context.run(send_payload, pool, payload, recipient),
+                               contexts, recipients)
+        return dict(zip(recipients, results))
+
+def parse_recipients(recipients):
+    """Acepta una lista o un texto con direcciones de email separadas por comas o punto y coma."""
+    if isinstance(recipients, str):
+        recipients = recipients.replace(";", ",").split(",")
+    return [recipient.strip() for recipient in recipients if recipient.strip()]
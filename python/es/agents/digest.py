@@ -0,0 +1,75 @@
+import os
+import re
+import numpy as np
+from agents import locales
+
+# Humedad del suelo objetivo (%) de cada especie, la franja con la que el email compara el período.
+# HUMIDITY_TARGET="40-70" fija la franja de todas las plantas.
+SPECIES_TARGETS = {
+    "monstera adansonii": (40, 70),
+    "monstera deliciosa": (40, 70),
+    "ficus lyrata": (35, 60),
+    "epipremnum aureum": (30, 60),
+    "calathea": (50, 80),
+    "sansevieria": (10, 35),
+}
+DEFAULT_TARGET = (30, 70)  # Especies que no están en la lista
+HUMIDITY_TARGET = os.getenv("HUMIDITY_TARGET")
+STABLE_SLOPE = 0.5  # Puntos porcentuales por día por debajo de los que la humedad se considera estable
+TOKEN_PIECES = re.compile(r"[^\W\d_]+|\d{1,3}|(?:[^\w\s]|_)+|\n+")
+
+def target_band(species):
+    """Franja de humedad objetivo (mínima, máxima) de `species`, en %."""
+    if HUMIDITY_TARGET:
+        low, high = (float(value) for value in HUMIDITY_TARGET.split("-", 1))
+        return low, high
+    return SPECIES_TARGETS.get(species.strip().lower(), DEFAULT_TARGET)
+
+def summarize(df_humidity, species):
+    """
+    Estadísticas de todo el período a partir del resumen con porcentajes de humedad: rango, promedios
+    diarios, tendencia y días fuera de la franja objetivo de la especie. Su tamaño no depende de la
+    duración del período, a diferencia de la tabla de la que salen.
+    """
+    daily = df_humidity.groupby(df_humidity["fecha"].dt.normalize())["Humedad_prom"].mean()
+    days = (daily.index - daily.index[0]).days.to_numpy(dtype=float)
+    low, high = target_band(species)
+    return {
+        "start": daily.index[0],
+        "end": daily.index[-1],
+        "days": len(daily),
+        "min": df_humidity["Humedad_min"].min(),
+        "max": df_humidity["Humedad_max"].max(),
+        "mean": df_humidity["Humedad_prom"].mean(),
+        "driest_day": daily.idxmin(),
+        "driest": daily.min(),
+        "wettest_day": daily.idxmax(),
+        "wettest": daily.max(),
+        "last": daily.iloc[-1],
+        # Pendiente por mínimos cuadrados de los promedios diarios, en puntos porcentuales por día
+        "slope": np.polyfit(days, daily.to_numpy(), 1)[0] if len(daily) > 1 else 0.0,
+        "target": (low, high),
+        "days_below": int((daily < low).sum()),
+        "days_above": int((daily > high).sum()),
+    }
+
+def describe(stats, species, language=None):
+    """Las estadísticas como la lista breve que se envía al modelo, en `language` (ver agents/locales.py)."""
+    slope = stats["slope"]
+    trend = "trend_stable" if abs(slope) < STABLE_SLOPE else "trend_drying" if slope < 0 else "trend_wetter"
+    low, high = stats["target"]
+    return locales.text(language, "digest", **stats, trend=locales.text(language, trend), species=species,
+                        low=low, high=high)
+
+def estimate_tokens(text):
+    """
+    Cantidad aproximada de tokens de `text` sin cargar el tokenizador del modelo. El texto se divide
+    como hacen los tokenizadores BPE antes de unir (palabras, grupos de hasta 3 dígitos, secuencias
+    de signos y saltos de línea); cada trozo cuenta como un token, más uno por cada 6 letras de una
+    palabra larga o 4 caracteres de una secuencia larga de signos. Se equivoca por exceso, como
+    conviene a un presupuesto.
+    """
+    tokens = 0
+    for piece in TOKEN_PIECES.findall(text):
+        tokens += 1 + len(piece) // (6 if piece[0].isalpha() else 4)
+    return tokens
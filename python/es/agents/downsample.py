@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+from agents.report_data import SUMMARY_COLUMNS
+
+def lttb(x, y, target):
+    """
+    Devuelve los índices de `target` puntos que mantienen la forma visual de la serie (x, y),
+    usando Largest-Triangle-Three-Buckets. El primer y el último punto siempre se mantienen.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if target >= n or target < 3:
+        return np.arange(n)
+
+    # target - 2 grupos sobre los puntos interiores, con el punto promedio de cada uno
+    edges = np.linspace(1, n - 1, target - 1).astype(int)
+    counts = np.diff(edges)
+    mean_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1) / counts
+    mean_y = np.add.reduceat(y[1:n - 1], edges[:-1] - 1) / counts
+    # Tercer vértice de los triángulos de cada grupo: el promedio del grupo siguiente (el último punto para el último)
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    selected = np.empty(target, dtype=int)
+    selected[0], selected[-1] = 0, n - 1
+    previous = 0
+    for i in range(target - 2):
+        start, end = edges[i], edges[i + 1]
+        # Área del triángulo (punto anterior, candidato, promedio siguiente) para cada candidato del grupo
+        areas = np.abs((x[previous] - next_x[i]) * (y[start:end] - y[previous])
+                       - (x[previous] - x[start:end]) * (next_y[i] - y[previous]))
+        previous = start + int(np.argmax(areas))
+        selected[i + 1] = previous
+    return selected
+
+def downsample_summary(df, target):
+    """
+    Reduce un resumen a como máximo `target` filas uniendo filas consecutivas en grupos: el
+    mínimo de los mínimos, la media de los promedios y el máximo de los máximos, así la
+    envolvente mín/máx mantiene todos los extremos. Cada grupo toma la fecha de su primera fila.
+    """
+    if len(df) <= target:
+        return df
+    date, low, mean, high = SUMMARY_COLUMNS
+    starts = np.unique(np.linspace(0, len(df), target, endpoint=False).astype(int))
+    counts = np.diff(np.append(starts, len(df)))
+    return pd.DataFrame({
+        date: df[date].to_numpy()[starts],
+        low: np.minimum.reduceat(df[low].to_numpy(dtype=float), starts),
+        mean: np.add.reduceat(df[mean].to_numpy(dtype=float), starts) / counts,
+        high: np.maximum.reduceat(df[high].to_numpy(dtype=float), starts),
+    })
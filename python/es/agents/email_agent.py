@@ -1,137 +1,268 @@
-from langchain_ollama import OllamaLLM
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
-import pandas as pd
 import os
-import smtplib
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 from email.mime.image import MIMEImage
 from datetime import datetime
+from getpass import getpass
 import re 
+from functools import lru_cache
+from agents import anomalies, digest, locales, metrics
+from agents.delivery import deliver, parse_recipients
+from agents.report_data import add_humidity_percentages, load_summary
 
-# Instanciamos OllamaLLM
-ollama_llm = OllamaLLM(model="deepseek-r1:32b", base_url="http://TU_IP_O_SERVIDOR:PUERTO")
-
-# Prompt template para la redacción del email
-# ⚠️ El usuario debe ingresar el correo del destinatario en tiempo de ejecución ⚠️
-email_template_prompt = PromptTemplate(
-    template=(
-        "Eres un experto en botánica y cuidado de plantas, especialmente de Monstera adansonii. "
-        "Basándote en el siguiente análisis de humedad del suelo para una planta de Monstera adansonii, "
-        "redacta un email MUY CORTO Y CONCISO dirigido a {recipient_email}. "
-        "El email debe:\n\n"
-        "1. **Comienza el email ABSOLUTAMENTE con: `Hola,` (sin comillas, EXÁCTAMENTE así)**\n"
-        "2. **Resumir de forma MUY CONCISA la evolución de la humedad del suelo** durante las fechas analizadas (extraídas de la tabla Markdown). Menciona solo lo más relevante.\n"
-        "3. **Analizar de forma DIRECTA Y CONCISA si los valores de humedad son adecuados para una Monstera adansonii.** NO des consejos de riego manual, SIMPLEMENTE INDICA SI LOS NIVELES SON ADECUADOS O NO.\n"
-        "4. **Identificar y mencionar de forma MUY BREVE si se detectan valores de humedad atípicos** (si los hay, sé muy directo).\n"
-        "5. **Adjuntar un gráfico (mencionar que se adjunta).** Sé breve, solo indica que se adjunta un gráfico de humedad.\n"
-        "6. **Cerrar el email con la siguiente despedida EXACTA:** Saludos cordiales, GardenCare AI System\n\n"
-        "**IMPORTANTE:**\n"
-        "- Utiliza un tono profesional, conciso e informativo.\n"
-        "- Utiliza **formato HTML para poner en negrita las partes importantes del texto.**\n"
-        "- **NO INCLUYAS el Asunto del email en el cuerpo del email.**\n"
-        "- Sé **MUY BREVE Y DIRECTO en todo el email.**\n\n"
-        "<!DOCTYPE html>\n"
-        "<html>\n"
-        "<head>\n"
-        "    <meta charset='UTF-8'>\n"
-        "</head>\n"
-        "<body>\n"
-        "    <p><strong>Hola,</strong></p>\n"
-        "    <p>Analizando los datos de humedad del suelo para su Monstera adansonii del [FECHA INICIO] al [FECHA FIN]:</p>\n"
-        "    <ul>\n"
-        "        <li>Humedad promedio: entre <strong>[RANGO HUMEDAD MIN-MAX]%</strong>. <strong>[FRASE SI LOS VALORES SON ADECUADOS]</strong></li>\n"
-        "    </ul>\n"
-        "    <p><strong>[FRASE DE SUGERENCIA BASADA EN EL ANÁLISIS].</strong></p>\n"
-        "    <p>[FRASE VALORES ATÍPICOS, SI APLICA, SI NO, NO MENCIONAR NADA].</p>\n"
-        "    <p>Adjunto un gráfico con la evolución detallada de la humedad del suelo.</p>\n"
-        "    <p><strong>Saludos cordiales,</strong></p>\n"
-        "    <p>GardenCare AI System</p>\n"
-        "</body>\n"
-        "</html>\n\n"
-        "Datos de humedad del suelo (tabla Markdown):\n"
-        "{markdown_table}\n\n"
-        "**DEVUELVE SOLO EL CÓDIGO HTML COMPLETO DEL EMAIL**"
-    ),
-    input_variables=["markdown_table", "recipient_email"]
-)
-
-email_chain = LLMChain(llm=ollama_llm, prompt=email_template_prompt)
-
-def analyze_humidity_and_draft_email():
+# Streaming del borrador del email (EMAIL_STREAMING=0 espera la respuesta completa)
+EMAIL_STREAMING = os.getenv("EMAIL_STREAMING", "1") != "0"
+EMAIL_MAX_TOKENS = int(os.getenv("EMAIL_MAX_TOKENS", "4096"))  # Razonamiento más HTML, Ollama deja de generar por encima de esto (num_predict)
+STREAM_CACHE_KEY = "email-stream"  # La caché de LangChain no cubre stream(), los borradores se guardan con esta clave
+PLANT_SPECIES = os.getenv("PLANT_SPECIES", "Monstera adansonii")  # Especie de las plantas sin una propia en la configuración
+# Tokens estimados del prompt (ver digest.estimate_tokens). La lista de anomalías se acorta para que quepa,
+# así un reporte largo o una ráfaga de anomalías no puede sacar el prompt del contexto del modelo.
+EMAIL_PROMPT_BUDGET = int(os.getenv("EMAIL_PROMPT_BUDGET", "1500"))
+
+BODY_PATTERN = re.compile(r"<body[^>]*>(.*?)</body>", re.DOTALL | re.IGNORECASE)
+
+@lru_cache(maxsize=None)
+def email_prompt(language):
     """
-    Función principal para analizar los datos de humedad, redactar y enviar el email.
+    Prompt template para la redacción del email en `language` (los textos están en agents/locales.py),
+    creado al usarlo por primera vez para que LangChain solo se cargue al redactar un email.
     """
-    # El usuario debe ingresar las rutas de los archivos
-    report_path_md = input("Ingrese la ruta del archivo Markdown de humedad: ").strip()
-    image_path_png = input("Ingrese la ruta del gráfico de humedad (.png): ").strip()
-    recipient_email = input("Ingrese el correo del destinatario: ").strip()
-    sender_email = input("Ingrese su correo de Gmail remitente: ").strip()
-    sender_password = getpass("Ingrese contraseña de aplicación): ")  # Entrada segura
+    from langchain.prompts import PromptTemplate
+    return PromptTemplate(template=locales.LOCALES[language]["email_prompt"],
+                          input_variables=["digest", "anomalies", "recipient_email", "species"])
 
-    print(f"\n[DEBUG] Leyendo reporte Markdown desde: {report_path_md}")
+def email_task(findings):
+    """
+    Tarea de agents/routing.py que redacta el email: el modelo de razonamiento solo explica fallos
+    (anomalies.FAULT_KINDS), un reporte con solo riegos o sin hallazgos va al modelo rápido.
+    """
+    if findings is None or findings.empty or not findings["kind"].isin(anomalies.FAULT_KINDS).any():
+        return "email"
+    return "email_anomalies"
 
-    # --- Leer y procesar los datos de humedad ---
+def ask_email_settings(recipient_email=None, sender_email=None, sender_password=None):
+    """Pide al usuario los datos del email que no se hayan pasado."""
+    if recipient_email is None:
+        recipient_email = input("Ingrese el correo del destinatario (separe varios con comas): ").strip()
+    if sender_email is None:
+        sender_email = input("Ingrese su correo de Gmail remitente: ").strip()
+    if sender_password is None:
+        sender_password = getpass("Ingrese contraseña de aplicación): ")  # Entrada segura
+    return recipient_email, sender_email, sender_password
+
+def build_prompt(df_humidity, findings, recipient_email, species, language=None, budget=EMAIL_PROMPT_BUDGET):
+    """
+    Valores del prompt del email en `language`: un resumen del período (ver agents/digest.py) en lugar
+    de la tabla completa, así el prompt tiene el mismo tamaño con 3 días o 3 meses de lecturas, y tantas
+    anomalías como quepan en `budget` tokens. Devuelve los valores y los tokens estimados del prompt.
+    Lanza ValueError si el prompt no cabe ni siquiera con una sola anomalía.
+    """
+    prompt = email_prompt(language or locales.LANGUAGE)
+    values = {"digest": digest.describe(digest.summarize(df_humidity, species), species, language),
+              "recipient_email": recipient_email, "species": species}
+    limit = anomalies.ANOMALY_MAX_FINDINGS
+    while True:
+        values["anomalies"] = anomalies.describe_findings(findings, limit, language)
+        tokens = digest.estimate_tokens(prompt.format(**values))
+        if tokens <= budget:
+            return values, tokens
+        if limit <= 1:
+            raise ValueError(f"El prompt del email necesita unos {tokens} tokens, más que EMAIL_PROMPT_BUDGET ({budget})")
+        limit //= 2
+        print(f"[WARNING] Prompt del email por encima del presupuesto ({tokens} de {budget} tokens), "
+              f"se listan solo {limit} de las anomalías.")
+
+def draft_email(df_summary, recipient_email, findings=None, species=None, language=None):
+    """
+    Redacta el cuerpo del email con el LLM a partir del resumen y de las anomalías encontradas en las
+    lecturas brutas (`findings`, ver agents/anomalies.py), para una planta de `species` (PLANT_SPECIES
+    por defecto), en `language` (locales.LANGUAGE por defecto). Devuelve el HTML (None si hay errores).
+    """
+    language = language or locales.LANGUAGE
+    with metrics.span("email_drafting", streaming=EMAIL_STREAMING, rows=len(df_summary), task=email_task(findings),
+                      language=language):
+        return write_draft(df_summary, recipient_email, findings, species or PLANT_SPECIES, language)
+
+def write_draft(df_summary, recipient_email, findings, species, language):
     try:
-        df_humidity = pd.read_csv(report_path_md, sep='|', skiprows=[2], skipinitialspace=True, header=0)
-        df_humidity.columns = df_humidity.columns.str.strip()  # Limpiar nombres de columnas
-        df_humidity = df_humidity.dropna(axis=1, how='all')  # Eliminar columnas vacías si existen
+        df_humidity = add_humidity_percentages(df_summary)
         print("\n[DEBUG] DataFrame de humedad leído exitosamente.")
-        print(df_humidity.to_markdown(index=False))  # Debug: Mostrar tabla
     except Exception as e:
-        print(f"\n[ERROR] Error al leer el archivo Markdown: {e}")
-        return
+        print(f"\n[ERROR] Error al leer los datos de humedad: {e}")
+        return None
 
     # --- Generar el email con Langchain ---
-    markdown_table_content = df_humidity.to_markdown(index=False)
+    try:
+        prompt_values, prompt_tokens = build_prompt(df_humidity, findings, recipient_email, species, language)
+    except ValueError as e:
+        print(f"\n[ERROR] {e}")
+        return None
+    metrics.set_value("prompt_tokens", prompt_tokens)
+    print(prompt_values["digest"])  # Debug: Mostrar el resumen enviado al modelo
+    print(prompt_values["anomalies"])
 
     try:
-        print("\n[DEBUG] Generando borrador de email...")
-        email_draft = email_chain.run(markdown_table=markdown_table_content, recipient_email=recipient_email)
+        print(f"\n[DEBUG] Generando borrador de email (prompt de unos {prompt_tokens} tokens)...")
+        from agents.llm import get_task_llm
+        ollama_llm = get_task_llm(email_task(findings))  # Los clientes se comparten con los demás agentes
+        if EMAIL_STREAMING:
+            email_html = stream_email(email_prompt(language).format(**prompt_values), ollama_llm)
+        else:
+            from langchain.chains import LLMChain
+            email_chain = LLMChain(llm=ollama_llm, prompt=email_prompt(language),
+                                   llm_kwargs={"options": {"num_predict": EMAIL_MAX_TOKENS}})
+            email_draft = email_chain.run(**prompt_values)
+            email_html = extract_html(drop_reasoning(email_draft))
+        if not email_html:
+            print("\n[ERROR] El modelo no devolvió el contenido del email.")
+            return None
         print("\n[DEBUG] Borrador de email generado.")
-
-        # --- Extraer el HTML del email ---
-        match = re.search(r"<!DOCTYPE html>(.*?)</html>", email_draft, re.DOTALL | re.IGNORECASE)
-        extracted_email_html = match.group(0) if match else email_draft.strip()
+        return email_html
 
     except Exception as e:
         print(f"\n[ERROR] Error al generar el email con Langchain: {e}")
-        return
+        return None
+
+def drop_reasoning(text):
+    """Quita la sección <think> de deepseek-r1 (todo el texto mientras sigue abierta)."""
+    if "</think>" in text:
+        return text.rsplit("</think>", 1)[1]
+    return "" if "<think>" in text else text
+
+def extract_html(text):
+    """Extrae el HTML del email."""
+    match = re.search(r"<!DOCTYPE html>(.*?)</html>", text, re.DOTALL | re.IGNORECASE)
+    return match.group(0) if match else text.strip()
+
+def stream_email(prompt, ollama_llm, max_tokens=EMAIL_MAX_TOKENS):
+    """
+    Recibe el borrador en streaming desde `ollama_llm` y detiene la generación en cuanto llega el
+    </html> de cierre después del razonamiento. Ollama se detiene por sí mismo tras `max_tokens` tokens
+    (num_predict, los mismos tokens que su eval_count). Devuelve el HTML del email.
+    """
+    from langchain_core.outputs import Generation
+    from agents.llm_cache import SQLiteLLMCache
+    cache = ollama_llm.cache if isinstance(ollama_llm.cache, SQLiteLLMCache) else None
+    cached = cache.lookup(prompt, STREAM_CACHE_KEY) if cache else None
+    if cached:
+        return cached[0].text
 
-    # --- Preparar el email ---
+    text = ""
+    thinking = False
+    finished = False
+    chunks = ollama_llm.stream(prompt, options={"num_predict": max_tokens})
+    try:
+        for chunk in chunks:
+            text += chunk
+            recent = text[-len(chunk) - len("</think>"):].lower()  # Las etiquetas pueden llegar partidas entre fragmentos
+            if "<think>" in recent:
+                thinking = True
+            if "</think>" in recent:
+                thinking = False
+            if not thinking and "</html>" in drop_reasoning(recent):  # El razonamiento puede terminar en el mismo fragmento
+                finished = True
+                break
+    finally:
+        chunks.close()  # Cierra la petición, así Ollama deja de generar
+    if not finished:
+        print(f"[WARNING] El borrador terminó antes de su </html> de cierre (límite de {max_tokens} tokens), puede estar incompleto.")
+
+    email_html = extract_html(drop_reasoning(text))
+    if cache and finished:
+        cache.update(prompt, STREAM_CACHE_KEY, [Generation(text=email_html)])
+    return email_html
+
+def combine_drafts(drafts):
+    """
+    Une los borradores de varios idiomas ({idioma: HTML}) en un único email con sus cuerpos uno
+    después del otro. Un solo borrador se devuelve tal cual.
+    """
+    if len(drafts) == 1:
+        return next(iter(drafts.values()))
+    sections = []
+    for language, email_html in drafts.items():
+        body = BODY_PATTERN.search(email_html)
+        sections.append(f'<div lang="{language}">\n{body.group(1).strip() if body else email_html}\n</div>')
+    return ("<!DOCTYPE html>\n<html>\n<head>\n    <meta charset='UTF-8'>\n</head>\n<body>\n"
+            + "\n<hr>\n".join(sections) + "\n</body>\n</html>")
+
+def build_message(email_html, image_path_png, sender_email, languages=None):
+    """
+    Arma el mensaje MIME con el cuerpo HTML y el gráfico adjunto (None si hay errores).
+    `image_path_png` también puede ser una lista de gráficos (uno por idioma), y el asunto se escribe
+    en cada idioma de `languages`. La cabecera To se agrega para cada destinatario al entregar el mensaje.
+    """
     msg = MIMEMultipart()
     msg['From'] = sender_email
-    msg['To'] = recipient_email
-    msg['Subject'] = f"Reporte humedad {datetime.now().strftime('%d/%m/%Y')}"
-    msg.attach(MIMEText(extracted_email_html, 'html'))  # Agregar email en HTML
+    msg['Subject'] = " / ".join(locales.text(language, "subject", date=datetime.now()) for language in languages or [None])
+    msg.attach(MIMEText(email_html, 'html'))  # Agregar email en HTML
 
-    # --- Adjuntar la imagen ---
+    # --- Adjuntar las imágenes ---
     try:
-        with open(image_path_png, 'rb') as img_file:
-            img = MIMEImage(img_file.read())
-            img.add_header('Content-Disposition', 'attachment', filename=os.path.basename(image_path_png))
-            msg.attach(img)
-        print(f"\n[DEBUG] Imagen adjuntada: {image_path_png}")
+        for image_path in [image_path_png] if isinstance(image_path_png, str) else image_path_png:
+            with open(image_path, 'rb') as img_file:
+                img = MIMEImage(img_file.read())
+                img.add_header('Content-Disposition', 'attachment', filename=os.path.basename(image_path))
+                msg.attach(img)
+            print(f"\n[DEBUG] Imagen adjuntada: {image_path}")
+        return msg
 
     except Exception as e:
         print(f"\n[ERROR] Error al adjuntar la imagen: {e}")
-        return
+        return None
 
-    # --- Enviar el email ---
-    try:
-        server = smtplib.SMTP('smtp.gmail.com', 587)
-        server.starttls()
-        server.login(sender_email, sender_password)
-        server.sendmail(sender_email, recipient_email, msg.as_string())
-        print("\n✅ Email enviado exitosamente a:", recipient_email)
+def send_message(msg, sender_email, sender_password, recipient_email):
+    """
+    Envía el mensaje a cada destinatario de `recipient_email` (separados por comas) a través de
+    las sesiones SMTP reutilizables de agents/delivery.py. Devuelve True si todos lo recibieron.
+    """
+    recipients = parse_recipients(recipient_email)
+    with metrics.span("smtp_send", recipients=len(recipients)) as send_span:
+        results = deliver(msg, recipients, sender_email, sender_password)
+        send_span.set("sent", sum(results.values()))
+    for recipient, sent in results.items():
+        if sent:
+            print("\n✅ Email enviado exitosamente a:", recipient)
+    return bool(results) and all(results.values())
+
+def analyze_humidity_and_draft_email(df_summary=None, image_path_png=None, recipient_email=None,
+                                     sender_email=None, sender_password=None):
+    """
+    Función principal para analizar los datos de humedad, redactar y enviar el email.
+    `df_summary` es el DataFrame del agente de consultas; si no se pasa, se lee del resumen guardado.
+    Los argumentos que no se pasen se piden al usuario. Devuelve True si el email se envió.
+    """
+    # El usuario debe ingresar las rutas de los archivos
+    if df_summary is None:
+        summary_path_csv = input("Ingrese la ruta de los datos del resumen de humedad (.arrow o .csv): ").strip()
+    if image_path_png is None:
+        image_path_png = input("Ingrese la ruta del gráfico de humedad (.png): ").strip()
+    recipient_email, sender_email, sender_password = ask_email_settings(recipient_email, sender_email, sender_password)
+
+    # --- Leer y procesar los datos de humedad ---
+    if df_summary is None:
+        try:
+            print(f"\n[DEBUG] Leyendo datos del resumen desde: {summary_path_csv}")
+            df_summary = load_summary(summary_path_csv)
+        except Exception as e:
+            print(f"\n[ERROR] Error al leer los datos de humedad: {e}")
+            return False
 
+    try:
+        findings = anomalies.find_anomalies(int(os.getenv("REPORT_WINDOW_DAYS", "3")), os.getenv("SENSOR_ID"))
     except Exception as e:
-        print(f"\n[ERROR] Error al enviar el email: {e}")
+        print(f"\n[WARNING] No se pudieron analizar las lecturas brutas: {e}")
+        findings = None
 
-    finally:
-        if 'server' in locals():
-            server.quit()  # Cerrar conexión SMTP
+    email_html = draft_email(df_summary, recipient_email, findings)
+    if email_html is None:
+        return False
+    msg = build_message(email_html, image_path_png, sender_email)
+    if msg is None:
+        return False
+    return send_message(msg, sender_email, sender_password, recipient_email)
 
 if __name__ == "__main__":
-    analyze_humidity_and_draft_email()
\ No newline at end of file
+    with metrics.span("email_agent"):
+        analyze_humidity_and_draft_email()
+    metrics.export()
\ No newline at end of file
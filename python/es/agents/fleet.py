@@ -0,0 +1,38 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# Reportes de distintas plantas que se ejecutan a la vez. Los recursos compartidos tienen sus propios
+# límites además de este: OLLAMA_SLOTS (por endpoint, agents/routing.py), DB_CONCURRENCY (agents/db.py) y
+# SMTP_POOL_SIZE (agents/delivery.py), así una planta que espera a los modelos no frena a las demás.
+FLEET_CONCURRENCY = int(os.getenv("FLEET_CONCURRENCY", "8"))
+
+async def run_plants(jobs, run, concurrency):
+    # Los reportes son código bloqueante, cada uno se ejecuta en un hilo mientras el event loop los reparte
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_plant(job):
+        async with semaphore:
+            try:
+                # to_thread copia el contexto, así los spans del reporte son hijos del span de quien llama
+                return bool(await asyncio.to_thread(run, job))
+            except Exception as e:
+                print(f"[ERROR] Falló el reporte de la planta '{job['name']}': {e}")
+                return False
+
+    results = await asyncio.gather(*(run_plant(job) for job in jobs))
+    return {job["name"]: result for job, result in zip(jobs, results)}
+
+def run_fleet(jobs, run, concurrency=FLEET_CONCURRENCY):
+    """
+    Ejecuta `run(job)` para cada planta de `jobs`, hasta `concurrency` a la vez. Una planta que falla
+    no detiene a las demás. Devuelve {nombre de la planta: True si se envió su reporte}.
+    """
+    if not jobs:
+        return {}
+    results = asyncio.run(run_plants(jobs, run, max(1, min(concurrency, len(jobs)))))
+    failed = [name for name, sent in results.items() if not sent]
+    print(f"[INFO] Flota: {len(results) - len(failed)} de {len(results)} reportes enviados"
+          + (f", fallidos: {', '.join(failed)}" if failed else ""))
+    return results
@@ -0,0 +1,131 @@
+import os
+from contextlib import contextmanager
+from functools import lru_cache
+import httpx
+import ollama
+from langchain_core.language_models.llms import BaseLLM
+from langchain_ollama import OllamaLLM
+from agents import metrics, routing
+from agents.llm_cache import LLM_CACHE_ENABLED, SQLiteLLMCache
+from agents.metrics import LLMMetrics
+from agents.pipeline import limited
+
+# Cuánto tiempo mantiene Ollama un modelo cargado tras una llamada (ej. "30m", "-1" para siempre), el de Ollama si no se define
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE") or None
+if OLLAMA_KEEP_ALIVE and OLLAMA_KEEP_ALIVE.lstrip("-").isdigit():
+    OLLAMA_KEEP_ALIVE = int(OLLAMA_KEEP_ALIVE)  # Ollama lee un número como segundos, un texto necesita unidad
+
+def unreachable(error):
+    """Errores tras los que vale la pena enviar la petición a otro endpoint."""
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code == 404 or error.status_code >= 500  # Falta el modelo allí, o error del servidor
+    return isinstance(error, (ConnectionError, httpx.TransportError))
+
+@contextmanager
+def use(endpoint):
+    """Espera uno de los huecos del endpoint. Las peticiones en cola cuentan como carga, así las siguientes van a otro."""
+    with endpoint.lock:
+        endpoint.in_flight += 1
+    try:
+        with limited(endpoint.slots, "ollama"):
+            yield
+    finally:
+        with endpoint.lock:
+            endpoint.in_flight -= 1
+
+@lru_cache(maxsize=None)
+def endpoint_client(model, url):
+    return OllamaLLM(model=model, base_url=url, keep_alive=OLLAMA_KEEP_ALIVE)
+
+class RoutedOllamaLLM(BaseLLM):
+    """
+    Cliente de `model` en los endpoints de agents/routing.py. Cada petición va al endpoint sano menos
+    ocupado que sirve el modelo; si no responde, o no tiene el modelo, la petición pasa al siguiente
+    (un stream solo antes de su primer token).
+    """
+
+    model: str
+
+    @property
+    def _llm_type(self):
+        return "ollama"
+
+    @property
+    def _identifying_params(self):
+        return {"model": self.model}  # Sin el endpoint: una respuesta en caché vale desde cualquiera de ellos
+
+    def answered(self, endpoint):
+        endpoint.mark_up()
+        metrics.set_value("llm_endpoint", endpoint.url)
+
+    def failed_over(self, endpoint, error):
+        endpoint.mark_down(error)
+        metrics.add("llm_failovers")
+
+    def _generate(self, prompts, stop=None, run_manager=None, **kwargs):
+        error = None
+        for endpoint in routing.endpoints_for(self.model):
+            with use(endpoint):
+                try:
+                    result = endpoint_client(self.model, endpoint.url)._generate(
+                        prompts, stop=stop, run_manager=run_manager, **kwargs)
+                except Exception as e:
+                    if not unreachable(e):
+                        raise
+                    self.failed_over(endpoint, e)
+                    error = e
+                    continue
+            self.answered(endpoint)
+            return result
+        raise error
+
+    def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+        error = None
+        for endpoint in routing.endpoints_for(self.model):
+            with use(endpoint):  # Se mantiene hasta que el stream termina o se cierra
+                streamed = False
+                try:
+                    for chunk in endpoint_client(self.model, endpoint.url)._stream(
+                            prompt, stop=stop, run_manager=run_manager, **kwargs):
+                        streamed = True
+                        yield chunk
+                except Exception as e:
+                    if streamed or not unreachable(e):
+                        raise
+                    self.failed_over(endpoint, e)
+                    error = e
+                    continue
+            self.answered(endpoint)
+            return
+        raise error
+
+@lru_cache(maxsize=None)
+def get_llm(model):
+    """Devuelve el cliente de `model`, compartido por todos los agentes del proceso."""
+    # Las respuestas se guardan en disco por modelo, así un prompt idéntico solo se envía una vez a Ollama
+    cache = SQLiteLLMCache(namespace=model) if LLM_CACHE_ENABLED else None
+    # La latencia y los tokens de cada llamada se suman al span del agente que la hace
+    return RoutedOllamaLLM(model=model, cache=cache, callbacks=[LLMMetrics(model)])
+
+def get_task_llm(task):
+    """Devuelve el cliente del modelo que ejecuta `task` (ver routing.task_tiers())."""
+    return get_llm(routing.model_for(task))
+
+def preload(model, keep_alive=OLLAMA_KEEP_ALIVE, timeout=600):
+    """
+    Carga `model` en la memoria de cada endpoint sano que lo sirve, sin generar nada (una petición
+    con el prompt vacío). Devuelve el número de endpoints en los que se cargó.
+    """
+    request = {"model": model, "prompt": "", "stream": False}
+    if keep_alive is not None:
+        request["keep_alive"] = keep_alive
+    loaded = 0
+    for endpoint in routing.endpoints_for(model):
+        if routing.check(endpoint) is None:
+            continue
+        try:
+            routing.request(endpoint, "/api/generate", request, timeout=timeout)
+            loaded += 1
+        except Exception as e:
+            print(f"[WARNING] No se pudo cargar {model} en {endpoint.url}: {e}")
+    return loaded
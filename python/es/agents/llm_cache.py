@@ -0,0 +1,143 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from langchain_core.caches import BaseCache
+from langchain_core.outputs import Generation
+from agents import metrics
+
+# Configuración de la caché de respuestas del LLM
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE", "1") != "0"  # LLM_CACHE=0 siempre llama a Ollama
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.expanduser("~/.cache/gardencare/llm_cache.sqlite3"))
+LLM_CACHE_TTL_HOURS = float(os.getenv("LLM_CACHE_TTL_HOURS", "168"))  # Las entradas más antiguas que esto se descartan
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000"))  # Por encima de esto se eliminan las entradas usadas hace más tiempo
+
+# Aciertos y fallos de todas las cachés del proceso, se muestran al final de una ejecución
+STATS = {"hits": 0, "misses": 0}
+STATS_LOCK = threading.Lock()
+
+def cache_key(namespace, prompt, llm_string):
+    """Dirección por contenido de una respuesta: el modelo y sus parámetros más el prompt."""
+    return hashlib.sha256(f"{namespace}\x00{llm_string}\x00{prompt}".encode("utf-8")).hexdigest()
+
+# Lo activa bypass() para las llamadas hechas desde el hilo actual
+BYPASS = threading.local()
+
+@contextmanager
+def bypass(active=True):
+    """
+    Omite las búsquedas en la caché dentro del bloque, las respuestas nuevas siguen reemplazando a las guardadas.
+    Se usa en los reintentos, que no deben recibir de la caché la respuesta que acaba de fallar.
+    """
+    previous = getattr(BYPASS, "active", False)
+    BYPASS.active = active or previous
+    try:
+        yield
+    finally:
+        BYPASS.active = previous
+
+def count(outcome):
+    with STATS_LOCK:
+        STATS[outcome] += 1
+    metrics.add(f"llm_cache_{outcome}")
+
+class SQLiteLLMCache(BaseCache):
+    """
+    Caché de LangChain que guarda las respuestas de Ollama en un archivo SQLite, así los prompts
+    idénticos no pasan por el modelo entre ejecuciones. Las entradas caducan tras `ttl_hours` y las
+    usadas hace más tiempo se eliminan cuando hay más de `max_entries`.
+
+    OllamaLLM no incluye el modelo en el llm_string de LangChain, así que cada cliente tiene su
+    propia caché con el modelo y sus parámetros como `namespace`.
+    """
+
+    def __init__(self, namespace="", path=LLM_CACHE_PATH, ttl_hours=LLM_CACHE_TTL_HOURS,
+                 max_entries=LLM_CACHE_MAX_ENTRIES):
+        self.namespace = namespace
+        self.path = path
+        self.ttl_seconds = ttl_hours * 3600
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self.connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache ("
+                "key TEXT PRIMARY KEY, namespace TEXT, response TEXT NOT NULL, "
+                "created_at REAL NOT NULL, last_used REAL NOT NULL)"
+            )
+
+    @contextmanager
+    def connect(self):
+        # Una conexión corta por llamada, los agentes pueden usar la caché desde varios hilos
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def lookup(self, prompt, llm_string):
+        if getattr(BYPASS, "active", False):
+            return None
+        key = cache_key(self.namespace, prompt, llm_string)
+        now = time.time()
+        with self.lock, self.connect() as conn:
+            row = conn.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl_seconds:
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                count("misses")
+                return None
+            conn.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+        count("hits")
+        return [Generation(**generation) for generation in json.loads(row[0])]
+
+    def update(self, prompt, llm_string, return_val):
+        response = json.dumps(
+            [{"text": generation.text, "generation_info": generation.generation_info} for generation in return_val],
+            default=str,
+        )
+        now = time.time()
+        with self.lock, self.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, namespace, response, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (cache_key(self.namespace, prompt, llm_string), self.namespace, response, now, now),
+            )
+            self.evict(conn, now)
+
+    def evict(self, conn, now):
+        conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        conn.execute(
+            "DELETE FROM llm_cache WHERE key NOT IN (SELECT key FROM llm_cache ORDER BY last_used DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+
+    def clear(self, **kwargs):
+        """Elimina todas las respuestas guardadas (de todos los modelos, el archivo es compartido)."""
+        with self.lock, self.connect() as conn:
+            conn.execute("DELETE FROM llm_cache")
+
+    def entries(self):
+        with self.connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+def report_stats():
+    """Muestra los aciertos y fallos de la caché en esta ejecución."""
+    if LLM_CACHE_ENABLED and (STATS["hits"] or STATS["misses"]):
+        print(f"[INFO] Caché del LLM: {STATS['hits']} aciertos, {STATS['misses']} fallos")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consulta o vacía la caché de respuestas del LLM.")
+    parser.add_argument("--clear", action="store_true", help="Eliminar todas las respuestas guardadas")
+    args = parser.parse_args()
+    cache = SQLiteLLMCache()
+    if args.clear:
+        cache.clear()
+        print(f"[INFO] Caché del LLM vaciada: {cache.path}")
+    else:
+        print(f"[INFO] Caché del LLM {cache.path}: {cache.entries()} entradas")
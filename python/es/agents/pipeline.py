@@ -0,0 +1,54 @@
+import contextvars
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from agents import metrics
+
+def run_stages(stages, max_workers=None):
+    """
+    Ejecuta `stages` ({nombre: (dependencias, función)}) en un pool de hilos. Cada etapa empieza en
+    cuanto terminan todas sus dependencias y recibe sus resultados, en el orden indicado.
+    Devuelve {nombre: resultado}. Si una etapa falla, no se inicia ninguna etapa nueva y su excepción
+    se lanza cuando terminan las etapas que ya estaban en ejecución.
+    Cada etapa se registra como un span de métricas.
+    """
+    pending = dict(stages)
+    running = {}
+    results = {}
+    started = time.perf_counter()
+
+    def timed(name, function, *args):
+        stage_started = time.perf_counter()
+        with metrics.span(name):
+            result = function(*args)
+        print(f"[INFO] Etapa '{name}' terminada en {time.perf_counter() - stage_started:.1f}s "
+              f"(a los {time.perf_counter() - started:.1f}s)")
+        return result
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(stages)) as executor:
+        while pending or running:
+            for name, (dependencies, function) in list(pending.items()):
+                if all(dependency in results for dependency in dependencies):
+                    arguments = [results[dependency] for dependency in dependencies]
+                    # La etapa se ejecuta en el contexto del llamador, así su span es hijo del span del llamador
+                    context = contextvars.copy_context()
+                    running[executor.submit(context.run, timed, name, function, *arguments)] = name
+                    del pending[name]
+            if not running:
+                raise ValueError(f"Etapas con dependencias inexistentes o circulares: {', '.join(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                results[running.pop(future)] = future.result()
+    return results
+
+@contextmanager
+def limited(semaphore, resource):
+    """
+    Mantiene `semaphore` dentro del bloque. El tiempo de espera se suma al span actual como
+    `<resource>_wait_seconds`, así un recurso saturado se ve en las métricas.
+    """
+    started = time.perf_counter()
+    with semaphore:
+        metrics.add(f"{resource}_wait_seconds", time.perf_counter() - started)
+        yield
@@ -1,33 +1,101 @@
 import os
 import time
 import re
-from langchain_ollama import OllamaLLM
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
+from functools import lru_cache
+import matplotlib
+matplotlib.use("Agg")  # Dibujar directamente a archivo, sin pantalla
+import matplotlib.dates as mdates
+from matplotlib.figure import Figure
+from agents import llm_cache, locales, metrics, plot_scripts, routing
+from agents.downsample import downsample_summary, lttb
+from agents.report_data import add_humidity_percentages, load_summary, render_markdown, summary_path
+from agents.sandbox import run_script
 
 def obtener_ruta_directorio_salida():
     ruta_salida = input("Introduce la ruta completa del directorio de salida (ej: /home/usuario/salida): ")
     return ruta_salida
 
-# Instanciamos OllamaLLM
-ollama_llm = OllamaLLM(model="llama3.1", base_url="http://TU_IP_O_SERVIDOR:PUERTO")
-
-# Obtenemos la ruta del directorio de salida del usuario
-output_dir = obtener_ruta_directorio_salida()
-os.makedirs(output_dir, exist_ok=True)
-
-# Archivos esperados
-expected_files = [
-    os.path.join(output_dir, "humedad_suelo.png"),
-    os.path.join(output_dir, "humedad_estimado.md"),
-]
-
-# Plantilla de generación de visualización (se mantiene igual)
+# Archivos esperados (los gráficos nativos de otros idiomas se nombran en agents/locales.py)
+CHART_FILENAME = "humedad_suelo.png"
+HUMIDITY_TABLE_FILENAME = "humedad_estimado.md"
+
+# El gráfico se dibuja de forma nativa; PLOT_MODE=llm mantiene el script generado por el LLM para gráficos personalizados
+PLOT_MODE = os.getenv("PLOT_MODE", "native")
+# Las ventanas largas se reducen a esta cantidad de puntos, así el tiempo de dibujo y el tamaño del PNG no crecen con ellas
+PLOT_MAX_POINTS = int(os.getenv("PLOT_MAX_POINTS", "500"))
+MAX_LABELED_DATES = 14  # Hasta esta cantidad de filas cada fecha tiene su propia marca
+PLOT_LLM_MAX_ROWS = int(os.getenv("PLOT_LLM_MAX_ROWS", "90"))  # El LLM copia la tabla en su script, recibe menos filas
+
+def render_chart(df, output_dir, languages=None):
+    """
+    Escribe humedad_estimado.md y el gráfico de cada idioma de `languages` (locales.LANGUAGE por
+    defecto, humedad_suelo.png) a partir del DataFrame del resumen. Los datos se preparan una sola
+    vez, solo las etiquetas cambian entre idiomas. Devuelve {idioma: ruta del PNG}.
+    """
+    languages = languages or [locales.LANGUAGE]
+    with metrics.span("chart_rendering", mode="native", rows=len(df), languages=len(languages)):
+        df = add_humidity_percentages(df)
+        os.makedirs(output_dir, exist_ok=True)
+
+        md_path = os.path.join(output_dir, HUMIDITY_TABLE_FILENAME)
+        with open(md_path, 'w') as f:
+            f.write(render_markdown(df))
+
+        # La banda mantiene los extremos de cada grupo, la línea los puntos que dan forma al promedio
+        band = add_humidity_percentages(downsample_summary(df, PLOT_MAX_POINTS))
+        line = df.iloc[lttb(df['fecha'].astype('int64'), df['Humedad_prom'], PLOT_MAX_POINTS)]
+        return {language: draw_chart(df, band, line, output_dir, language) for language in languages}
+
+def draw_chart(df, band, line, output_dir, language):
+    labels = locales.LOCALES[language]
+
+    # Una Figure propia en lugar del estado global de pyplot, así varios gráficos se pueden dibujar en hilos paralelos
+    fig = Figure(figsize=(12, 6))
+    ax = fig.subplots()
+    fig.patch.set_facecolor('#1E1E1E')
+    ax.set_facecolor('#1E1E1E')
+
+    ax.fill_between(band['fecha'], band['Humedad_min'], band['Humedad_max'],
+                    color='#A5D6A7', alpha=0.5, label=labels["chart_range"])
+
+    ax.plot(line['fecha'], line['Humedad_prom'], color='#4CAF50', linewidth=2, label=labels["chart_average"])
+
+    ax.set_xlabel(labels["chart_xlabel"], fontsize=12, fontweight='bold', color='white')
+    ax.set_ylabel(labels["chart_ylabel"], fontsize=12, fontweight='bold', color='white')
+    ax.set_title(labels["chart_title"], fontsize=16, fontweight='bold', color='white', pad=40)
+    set_date_ticks(ax, df['fecha'])
+    ax.tick_params(axis='y', colors='white')
+
+    legend = ax.legend(frameon=False, fontsize=11, loc='upper center', bbox_to_anchor=(0.5, 1.13), ncol=2)
+    for text in legend.get_texts():
+        text.set_color("white")
+
+    ax.grid(axis='y', linestyle='--', alpha=0.3, color='white')
+    fig.tight_layout()
+
+    png_path = os.path.join(output_dir, labels["chart_filename"])
+    fig.savefig(png_path)
+    return png_path
+
+def set_date_ticks(ax, dates):
+    """Etiqueta cada fecha de las series cortas, las más largas reciben una cantidad automática de marcas."""
+    if len(dates) <= MAX_LABELED_DATES:
+        ax.set_xticks(dates)
+        ax.set_xticklabels(dates.dt.strftime('%Y-%m-%d'), fontsize=11, rotation=45, color='white')
+        return
+    locator = mdates.AutoDateLocator(minticks=4, maxticks=12)
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+    ax.tick_params(axis='x', labelsize=11, labelrotation=45, colors='white')
+    ax.xaxis.get_offset_text().set_color('white')
+
+# Plantilla de generación de visualización, solo se usa con PLOT_MODE=llm
 plot_template = """ 
 import os
 import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
+import matplotlib.dates as mdates
 
 data = {data_placeholder}
 
@@ -57,8 +125,14 @@ ax.plot(df['Fecha'], df['Humedad_prom'], color='#4CAF50', linewidth=2, label='Hu
 ax.set_xlabel("Fecha", fontsize=12, fontweight='bold', color='white')
 ax.set_ylabel("Porcentaje de Humedad (%)", fontsize=12, fontweight='bold', color='white')
 ax.set_title("Humedad del Suelo por Día", fontsize=16, fontweight='bold', color='white', pad=40)
-ax.set_xticks(df['Fecha'])
-ax.set_xticklabels(df['Fecha'].dt.strftime('%Y-%m-%d'), fontsize=11, rotation=45, color='white')
+if len(df) <= 14:
+    ax.set_xticks(df['Fecha'])
+    ax.set_xticklabels(df['Fecha'].dt.strftime('%Y-%m-%d'), fontsize=11, rotation=45, color='white')
+else:
+    locator = mdates.AutoDateLocator(minticks=4, maxticks=12)
+    ax.xaxis.set_major_locator(locator)
+    ax.xaxis.set_major_formatter(mdates.ConciseDateFormatter(locator))
+    ax.tick_params(axis='x', labelsize=11, labelrotation=45, colors='white')
 ax.tick_params(axis='y', colors='white')
 
 legend = ax.legend(frameon=False, fontsize=11, loc='upper center', bbox_to_anchor=(0.5, 1.13), ncol=2)
@@ -73,60 +147,130 @@ plt.savefig(png_path)
 """
 
 # Prompt template
-visualization_template = PromptTemplate(
-    template=(
-        "Eres un experto en visualización de datos en Python. Se te proporciona un reporte en formato markdown "
-        "con una tabla de datos actualizada de humedad del suelo. Tu tarea es extraer los datos de la tabla y generar "
-        "un script de Python completo que use la siguiente plantilla EXACTAMENTE como base para el gráfico:\n\n"
-        "{plot_template}\n\n"
-        "NOTA: No utilices los datos de ejemplo que aparecen en la plantilla. Extrae la tabla real del reporte markdown y reemplaza "
-        "la variable {{data_placeholder}} con el diccionario de Python correspondiente. El diccionario debe tener las claves: "
-        "'Fecha', 'valor_minimo', 'valor_promedio' y 'valor_maximo', y sus valores deben ser listas con los datos extraídos.\n\n"
-        "Reporte Markdown:\n{report_markdown_content}\n\nCódigo Python:"
-    ),
-    input_variables=["plot_template", "report_markdown_content"]
+visualization_template = (
+    "Eres un experto en visualización de datos en Python. Se te proporciona un reporte en formato markdown "
+    "con una tabla de datos actualizada de humedad del suelo. Tu tarea es extraer los datos de la tabla y generar "
+    "un script de Python completo que use la siguiente plantilla EXACTAMENTE como base para el gráfico:\n\n"
+    "{plot_template}\n\n"
+    "NOTA: No utilices los datos de ejemplo que aparecen en la plantilla. Extrae la tabla real del reporte markdown y reemplaza "
+    "la variable {{data_placeholder}} con el diccionario de Python correspondiente. El diccionario debe tener las claves: "
+    "'Fecha', 'valor_minimo', 'valor_promedio' y 'valor_maximo', y sus valores deben ser listas con los datos extraídos.\n\n"
+    "Reporte Markdown:\n{report_markdown_content}\n\nCódigo Python:"
 )
 
-visualization_chain = LLMChain(llm=ollama_llm, prompt=visualization_template)
+@lru_cache(maxsize=None)
+def visualization_chain():
+    """La cadena que escribe el script del gráfico, creada al usarla: LangChain y el cliente solo se cargan con PLOT_MODE=llm."""
+    from langchain.chains import LLMChain
+    from langchain.prompts import PromptTemplate
+    from agents.llm import get_task_llm  # El cliente se comparte con los demás agentes
+    prompt = PromptTemplate(template=visualization_template, input_variables=["plot_template", "report_markdown_content"])
+    return LLMChain(llm=get_task_llm("plot"), prompt=prompt)
 
 def extract_code_block(text):
     match = re.search(r"`(?:python)?\n(.*?)\n`", text, re.DOTALL)
     return match.group(1) if match else text
 
-def generate_graph(output_dir): # Se agrega el output_dir como parametro
-    report_path = os.path.join(output_dir, "report_langchain_direct_db.md")
-    print(f"[INFO] Leyendo reporte desde: {report_path}")
-
+def load_summary_data(output_dir):
+    """Lee el resumen guardado por el agente de consultas (None si no se puede leer)."""
+    data_path = summary_path(output_dir)
+    print(f"[INFO] Leyendo datos del resumen desde: {data_path}")
     try:
-        with open(report_path, "r") as f:
-            report_markdown_content = f.read()
+        return load_summary(data_path)
     except Exception as e:
-        print(f"[ERROR] No se pudo leer el archivo markdown: {e}")
-        return False
+        print(f"[ERROR] No se pudieron leer los datos del resumen: {e}")
+        return None
+
+def generate_graph(output_dir, df=None): # Se agrega el output_dir como parametro
+    """Genera el gráfico con un script escrito por el LLM (PLOT_MODE=llm)."""
+    if df is None:
+        df = load_summary_data(output_dir)
+        if df is None:
+            return False
+
+    with metrics.span("chart_rendering", mode="llm", rows=len(df)):
+        return run_generated_code(df, output_dir)
+
+def run_generated_code(df, output_dir):
+    """
+    Dibuja el gráfico con el script guardado para esta plantilla y forma de datos si existe, si no
+    con un script nuevo escrito por el LLM, que se guarda en cuanto genera los archivos. Los
+    scripts se ejecutan en un proceso trabajador aislado (agents/sandbox.py), nunca en el agente.
+    """
+    output_dir = os.path.abspath(output_dir)  # El trabajador se ejecuta en su propio directorio temporal
+    df_llm = downsample_summary(df, PLOT_LLM_MAX_ROWS)
+    data = plot_scripts.plot_data(df_llm)
+    inputs = {"PLOT_DATA": data, "OUTPUT_DIR": output_dir}
+    key = plot_scripts.script_key(plot_template, data, routing.model_for("plot"))
+
+    cached_script = plot_scripts.load_script(key)
+    if cached_script is not None:
+        print("[INFO] Ejecutando el script de gráficos guardado con los datos nuevos...")
+        if run_sandboxed(cached_script, inputs, output_dir):
+            return True
+        plot_scripts.discard_script(key)
+        print("[WARNING] El script guardado falló, generando uno nuevo...")
+
+    report_markdown_content = render_markdown(df_llm)
 
     print("[INFO] Generando código Python...")
-    python_code = visualization_chain.run(plot_template=plot_template.replace("{output_dir_placeholder}", output_dir), report_markdown_content=report_markdown_content) # Se remplaza el {output_dir_placeholder}
+    python_code = visualization_chain().run(plot_template=plot_template.replace("{output_dir_placeholder}", output_dir), report_markdown_content=report_markdown_content) # Se remplaza el {output_dir_placeholder}
 
     python_code_clean = extract_code_block(python_code)
-    print("[INFO] Código generado. Ejecutándolo...")
-
     try:
-        exec(python_code_clean)
-        print(f"[INFO] Archivos generados en {output_dir}")
-        return True
-    except Exception as e:
-        print(f"[ERROR] Error al ejecutar el código Python: {e}")
+        script, reusable = plot_scripts.prepare_script(python_code_clean)
+    except (SyntaxError, ValueError) as e:
+        print(f"[ERROR] Se rechazó el código generado: {e}")
+        return False
+    print("[INFO] Código generado. Ejecutándolo en el entorno aislado...")
+
+    if not run_sandboxed(script, inputs, output_dir):
+        return False
+    if reusable:
+        plot_scripts.save_script(key, script)
+    return True
+
+def run_sandboxed(script, inputs, output_dir):
+    """Ejecuta un script de gráficos en el entorno aislado, True si terminó y escribió los archivos esperados."""
+    success, output = run_script(script, inputs)
+    if not success or not files_exist(output_dir):
+        last_line = output.strip().splitlines()[-1] if output.strip() else "no se escribieron los archivos esperados"
+        print(f"[ERROR] Error al ejecutar el código Python: {last_line}")
         return False
+    print(f"[INFO] Archivos generados en {output_dir}")
+    return True
 
 def files_exist(output_dir):
     """ Verifica si los archivos esperados existen en el directorio de salida """
     expected_files = [
-        os.path.join(output_dir, "humedad_suelo.png"),
-        os.path.join(output_dir, "humedad_estimado.md"),
+        os.path.join(output_dir, CHART_FILENAME),
+        os.path.join(output_dir, HUMIDITY_TABLE_FILENAME),
     ]
     return all(os.path.exists(file) for file in expected_files)
 
-def main():
+def main(df=None, output_dir=None, languages=None):
+    """
+    Genera los archivos del gráfico en `output_dir`, un gráfico por idioma de `languages`, y devuelve
+    {idioma: ruta del PNG} (None si falla). El gráfico escrito por el LLM solo está en locales.LANGUAGE.
+    """
+    if output_dir is None:
+        output_dir = obtener_ruta_directorio_salida()
+
+    if PLOT_MODE == "llm":
+        png_path = main_llm(df, output_dir)
+        return {locales.LANGUAGE: png_path} if png_path else None
+
+    if df is None:
+        df = load_summary_data(output_dir)
+        if df is None:
+            return None
+
+    png_paths = render_chart(df, output_dir, languages)
+    print(f"[INFO] Archivos generados en {output_dir}")
+    return png_paths
+
+def main_llm(df, output_dir):
+    """Genera los archivos con código escrito por el LLM, reintentando hasta que existan."""
     max_attempts = 4  # Número máximo de intentos
     attempt = 0
 
@@ -138,7 +282,8 @@ def main():
             break
 
         print("[INFO] Generando archivos...")
-        success = generate_graph(output_dir) # Se agrega el output_dir
+        with llm_cache.bypass(attempt > 0):  # Los reintentos vuelven a consultar al modelo en lugar de reutilizar el script que falló
+            success = generate_graph(output_dir, df) # Se agrega el output_dir
         
         if success and files_exist(output_dir): # Se agrega el output_dir
             print("[INFO] Archivos generados exitosamente.")
@@ -146,10 +291,15 @@ def main():
 
         print("[WARNING] No se generaron los archivos esperados. Reintentando...")
         attempt += 1
+        metrics.add("retries")
         time.sleep(2)  # Esperar un poco antes de reintentar
 
     if not files_exist(output_dir): # Se agrega el output_dir
         print("[ERROR] No se pudieron generar los archivos después de varios intentos.")
+        return None
+    return os.path.join(output_dir, CHART_FILENAME)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    with metrics.span("plot_agent"):
+        main()
+    metrics.export()
\ No newline at end of file
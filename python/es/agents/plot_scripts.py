@@ -0,0 +1,109 @@
+import ast
+import hashlib
+import json
+import os
+import tempfile
+from agents import metrics
+from agents.report_data import SUMMARY_COLUMNS
+
+# Scripts de gráficos escritos por el LLM que ya generaron un gráfico, reutilizados con los datos de los reportes siguientes
+PLOT_SCRIPT_CACHE_ENABLED = os.getenv("PLOT_SCRIPT_CACHE", "1") != "0"
+PLOT_SCRIPT_CACHE_DIR = os.getenv("PLOT_SCRIPT_CACHE_DIR", os.path.expanduser("~/.cache/gardencare/plot_scripts"))
+
+# Asignaciones de primer nivel de la plantilla que pasan a ser entradas del script guardado
+INPUTS = {"data": "PLOT_DATA", "output_dir": "OUTPUT_DIR"}
+
+# Lo que un script de gráficos puede importar y usar de os: todo lo demás se rechaza antes de ejecutarlo
+ALLOWED_MODULES = {"os", "math", "datetime", "numpy", "pandas", "matplotlib"}
+ALLOWED_OS_ATTRIBUTES = {"path", "makedirs"}
+FORBIDDEN_NAMES = {"eval", "exec", "compile", "__import__", "globals", "locals", "vars", "breakpoint", "input",
+                   "getattr", "setattr", "delattr", "__builtins__"}
+
+def plot_data(df):
+    """El resumen como el diccionario de listas que espera la plantilla del gráfico (serializable a JSON)."""
+    date, low, mean, high = SUMMARY_COLUMNS
+    return {
+        "Fecha": df[date].astype(str).tolist(),
+        "valor_minimo": df[low].astype(float).tolist(),
+        "valor_promedio": df[mean].astype(float).tolist(),
+        "valor_maximo": df[high].astype(float).tolist(),
+    }
+
+def script_key(template, data, model):
+    """Clave de la caché: la plantilla de la que salió el script, el modelo y la forma de sus datos."""
+    schema = {key: type(values[0]).__name__ if values else "empty" for key, values in data.items()}
+    content = json.dumps({"template": template, "schema": schema, "model": model}, sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()[:32]
+
+def check_script(tree):
+    """Lanza ValueError si el script importa o llama a algo que un gráfico no necesita."""
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            modules = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            modules = [node.module or ""]
+        else:
+            modules = []
+        for module in modules:
+            if module.split(".")[0] not in ALLOWED_MODULES:
+                raise ValueError(f"el script importa {module!r}")
+        if isinstance(node, ast.Name) and node.id in FORBIDDEN_NAMES:
+            raise ValueError(f"el script usa {node.id}()")
+        if (isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == "os"
+                and node.attr not in ALLOWED_OS_ATTRIBUTES):
+            raise ValueError(f"el script usa os.{node.attr}")
+        if isinstance(node, ast.Attribute) and node.attr.startswith("__"):
+            raise ValueError(f"el script usa {node.attr}")
+
+def prepare_script(code):
+    """
+    Comprueba el script generado y convierte sus asignaciones `data = {...}` y `output_dir = ...`
+    en las entradas PLOT_DATA y OUTPUT_DIR, así puede volver a ejecutarse con otros datos.
+    Devuelve (script, reutilizable). Lanza ValueError (o SyntaxError) si el script no debe ejecutarse.
+    """
+    tree = ast.parse(code)
+    check_script(tree)
+    replaced = set()
+    for node in tree.body:
+        if (isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name)
+                and node.targets[0].id in INPUTS):
+            node.value = ast.Name(id=INPUTS[node.targets[0].id], ctx=ast.Load())
+            replaced.add(node.targets[0].id)
+    reusable = replaced == set(INPUTS)
+    return (ast.unparse(ast.fix_missing_locations(tree)) if reusable else code), reusable
+
+def cache_path(key):
+    return os.path.join(PLOT_SCRIPT_CACHE_DIR, f"{key}.py")
+
+def load_script(key):
+    """El script guardado para `key`, None si no hay ninguno."""
+    if not PLOT_SCRIPT_CACHE_ENABLED:
+        return None
+    try:
+        with open(cache_path(key)) as f:
+            script = f.read()
+    except OSError:
+        metrics.add("plot_script_cache_misses")
+        return None
+    metrics.add("plot_script_cache_hits")
+    return script
+
+def save_script(key, script):
+    if not PLOT_SCRIPT_CACHE_ENABLED:
+        return
+    try:
+        os.makedirs(PLOT_SCRIPT_CACHE_DIR, exist_ok=True)
+        # Un archivo temporal propio, reportes en paralelo pueden guardar el mismo script
+        with tempfile.NamedTemporaryFile("w", dir=PLOT_SCRIPT_CACHE_DIR, suffix=".tmp", delete=False) as f:
+            f.write(script)
+        os.replace(f.name, cache_path(key))
+        print(f"[INFO] Script de gráficos guardado en {cache_path(key)}")
+    except OSError as e:
+        print(f"[WARNING] No se pudo guardar el script de gráficos: {e}")
+
+def discard_script(key):
+    """Olvida un script guardado que falló con datos nuevos, la próxima ejecución le pide uno nuevo al LLM."""
+    try:
+        os.remove(cache_path(key))
+    except OSError:
+        pass
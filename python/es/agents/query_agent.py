@@ -1,110 +1,238 @@
-from langchain_ollama import OllamaLLM
-from langchain_community.utilities import SQLDatabase
-from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
+from sqlalchemy import text
+import pandas as pd
+import argparse
+import contextvars
 import os
-
-# Configuración del modelo de lenguaje
-ollama_llm = OllamaLLM(model="llama3.1", base_url="http://TU_IP_O_SERVIDOR:PUERTO")
-
-# Configuración de la base de datos
-DB_USER = os.getenv("DB_USER", "usuario_aqui")
-DB_PASSWORD = os.getenv("DB_PASSWORD", "contraseña_aqui")
-DB_HOST = os.getenv("DB_HOST", "localhost")
-DB_PORT = os.getenv("DB_PORT", "5432")
-DB_NAME = os.getenv("DB_NAME", "nombre_base_datos")
-
-# Construcción de la URI de conexión
-db_uri = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
-database = SQLDatabase.from_uri(db_uri)
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from agents.aggregation import build_rollup_summary_query, build_summary_query
+from agents import llm_cache, metrics, schema
+from agents.db import get_engine
+from agents.rollups import refresh_rollups
+from agents.sql_validation import clean_sql, validate_sql
+from agents.report_data import SUMMARY_COLUMNS, normalize_summary, render_markdown, save_summary, summary_path
+
+# Archivos de salida (el reporte Markdown es solo una vista del resumen tipado)
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", ".")
+REPORT_FILENAME = "report_langchain_direct_db.md"
+
+# Parámetros del resumen diario integrado (el LLM solo se usa para preguntas puntuales)
+REPORT_WINDOW_DAYS = int(os.getenv("REPORT_WINDOW_DAYS", "3"))
+REPORT_BUCKET = os.getenv("REPORT_BUCKET", "day")
+SENSOR_ID = os.getenv("SENSOR_ID")  # Solo se usa si SENSOR_ID_COLUMN está configurado
+USE_LLM_SQL = os.getenv("USE_LLM_SQL", "0") == "1"  # Fuerza el camino antiguo con SQL generado por el LLM
+USE_ROLLUPS = os.getenv("USE_ROLLUPS", "1") == "1"  # Leer el resumen de las tablas de agregados por hora/día
+SQL_CANDIDATES = int(os.getenv("SQL_CANDIDATES", "1"))  # >1 pide al LLM varias consultas a la vez y ejecuta la válida más barata
+SQL_CANDIDATE_ROUNDS = int(os.getenv("SQL_CANDIDATE_ROUNDS", "2"))  # Rondas de candidatas antes de rendirse
 
 # Plantilla para generar la consulta SQL
-query_gen_template = PromptTemplate(
-    template=(
-        "Eres un experto en SQL. Dada la siguiente instrucción, genera una consulta SQL válida para PostgreSQL.\n"
-        "La consulta SQL debe ser **solo el código SQL**, sin explicaciones, comentarios, ni delimitadores de bloque de código (como `sql o `).\n"
-        "Instrucción: {instruction}\n"
-        "Consulta SQL:"
-    ),
-    input_variables=["instruction"]
+query_gen_template = (
+    "Eres un experto en SQL. Dada la siguiente instrucción, genera una consulta SQL válida para PostgreSQL.\n"
+    "La consulta SQL debe ser **solo el código SQL**, sin explicaciones, comentarios, ni delimitadores de bloque de código (como `sql o `).\n"
+    "Instrucción: {instruction}\n"
+    "Consulta SQL:"
 )
-query_gen_chain = LLMChain(llm=ollama_llm, prompt=query_gen_template)
-
-# Plantilla para generar el reporte en formato Markdown
-report_template = PromptTemplate(
-    template=(
-        "Eres un analista de datos. A partir de los siguientes resultados obtenidos de la base de datos, "
-        "genera un reporte detallado en formato markdown. El reporte debe incluir la fecha, el valor mínimo, "
-        "el valor promedio y el valor máximo para cada fecha, y debe presentar los valores con exactamente dos decimales. "
-        "Los resultados deben ser presentados en una tabla con las siguientes columnas: 'fecha', 'valor_minimo', 'valor_promedio' "
-        "y 'valor_maximo'.\n\n"
-        "- Los valores numéricos deben estar alineados a la derecha.\n"
-        "- Asegúrate de que los valores numéricos (mínimo, promedio, máximo) tengan dos decimales.\n"
-        "- Los resultados deben estar en orden ascendente según la fecha.\n\n"
-        "Resultados:\n{results}\n"
-        "Reporte:"
-    ),
-    input_variables=["results"]
+
+@lru_cache(maxsize=None)
+def query_gen_chain():
+    """
+    La cadena que genera el SQL, creada al usarla por primera vez. LangChain y el cliente del LLM
+    (el nivel rápido de agents/routing.py, compartido con los demás agentes) solo se cargan cuando
+    el LLM escribe una consulta, cosa que el resumen incluido nunca hace.
+    """
+    from langchain.chains import LLMChain
+    from langchain.prompts import PromptTemplate
+    from agents.llm import get_task_llm
+    prompt = PromptTemplate(template=query_gen_template, input_variables=["instruction"])
+    return LLMChain(llm=get_task_llm("sql"), prompt=prompt)
+
+
+# Instrucción usada cuando se fuerza el camino del LLM para el reporte habitual
+DEFAULT_INSTRUCTION = (
+    "Genera una consulta SQL válida para PostgreSQL que seleccione, para cada fecha de los últimos tres días, la fecha, el valor mínimo, "
+    "el valor promedio y el valor máximo de la columna 'valor' de la tabla 'datos_sensor', con los nombres 'fecha', 'valor_minimo', 'valor_promedio' y 'valor_maximo'. "
+    "La consulta debe agrupar los resultados por fecha (sin incluir la hora) y redondear los valores mínimo, promedio y máximo a dos decimales. "
+    "Además, los resultados deben ordenarse en orden ascendente por fecha. "
+    "Solo responde con la consulta SQL, sin explicaciones, observaciones, conclusiones ni comentarios."
 )
-report_chain = LLMChain(llm=ollama_llm, prompt=report_template)
 
-def research_task():
+def research_task(instruction=DEFAULT_INSTRUCTION):
     """Genera la consulta SQL usando LangChain."""
-    instruction = (
-        "Genera una consulta SQL válida para PostgreSQL que seleccione, para cada fecha de los últimos tres días, la fecha, el valor mínimo, "
-        "el valor promedio y el valor máximo de la columna 'valor' de la tabla 'datos_sensor'. "
-        "La consulta debe agrupar los resultados por fecha (sin incluir la hora) y redondear los valores mínimo, promedio y máximo a dos decimales. "
-        "Además, los resultados deben ordenarse en orden ascendente por fecha. "
-        "Solo responde con la consulta SQL, sin explicaciones, observaciones, conclusiones ni comentarios."
-    )
-    return query_gen_chain.run(instruction=instruction)
-
-def reporting_task(sql_query):
-    """Ejecuta la consulta SQL y genera el reporte."""
+    with metrics.span("sql_generation", mode="llm"):
+        return query_gen_chain().run(instruction=instruction)
+
+def prepare_tables():
+    """Crea las próximas particiones y actualiza los rollups antes de leer los resúmenes."""
+    try:
+        schema.maintain(get_engine())  # Deja listas las próximas particiones, no hace nada si la tabla no está particionada
+    except Exception as e:
+        print(f"[WARNING] No se pudieron mantener las particiones de la tabla de lecturas: {e}")
+    if USE_ROLLUPS:
+        with metrics.span("rollup_refresh"):
+            refresh_rollups(get_engine())  # Incremental, solo se agregan las lecturas desde la última actualización
+
+def summary_task(sensor_id=None, prepare=True):
+    """
+    Construye la consulta preparada del resumen sin llamar al LLM (de `sensor_id`, SENSOR_ID por defecto).
+    `prepare=False` omite prepare_tables(), cuando ya se ejecutó para varios reportes a la vez.
+    """
+    sensor_id = sensor_id or SENSOR_ID
+    if prepare:
+        prepare_tables()
+    if USE_ROLLUPS:
+        with metrics.span("sql_generation", mode="rollups"):
+            return build_rollup_summary_query(window_days=REPORT_WINDOW_DAYS, bucket=REPORT_BUCKET, sensor_id=sensor_id)
+    with metrics.span("sql_generation", mode="builtin"):
+        return build_summary_query(window_days=REPORT_WINDOW_DAYS, bucket=REPORT_BUCKET, sensor_id=sensor_id)
+
+def reporting_task(sql_query, parameters=None):
+    """Ejecuta la consulta SQL y devuelve las filas como DataFrame."""
     print("\n[INFO] Ejecutando consulta SQL:")
     print(sql_query)
-
-    # Ejecutar la consulta en la base de datos
-    results = database.run(sql_query)
-
-    print("\n[INFO] Resultados obtenidos:")
-    print(results)
-
-    return report_chain.run(results=results)
-
-def run_workflow():
+    if parameters:
+        print(f"[INFO] Parámetros: {parameters}")
+
+    # Ejecutar la consulta en la base de datos (el SQL generado por el LLM llega como texto plano y solo puede leer)
+    read_only = isinstance(sql_query, str)
+    if read_only:
+        sql_query = text(clean_sql(sql_query))
+    # Se confirma en lugar de deshacer, así psycopg mantiene la consulta preparada en la conexión del pool
+    with metrics.span("query_execution") as query_span, get_engine().begin() as conn:
+        if read_only:
+            conn.execute(text("SET TRANSACTION READ ONLY"))
+        results = pd.read_sql_query(sql_query, conn, params=parameters)
+        query_span.set("rows", len(results))
+
+    print(f"\n[INFO] Resultados obtenidos: {len(results)} filas")
+    return results
+
+def candidate_task(instruction, index, fresh, required_columns=None):
+    """
+    Genera una consulta candidata y la comprueba con EXPLAIN, sin ejecutarla.
+    Devuelve (costo estimado, consulta), con costo None si la consulta fue rechazada.
+    """
+    # Solo la primera candidata de la primera ronda puede venir de la caché, las demás deben ser consultas nuevas
+    with llm_cache.bypass(fresh or index > 0):
+        sql_query = research_task(instruction)
+    try:
+        with metrics.span("sql_validation") as validation_span, get_engine().connect() as conn:
+            cost = validate_sql(conn, sql_query, required_columns)
+            validation_span.set("cost", cost)
+        return cost, sql_query
+    except Exception as e:
+        print(f"[INFO] Consulta candidata {index + 1} rechazada: {str(getattr(e, 'orig', e)).splitlines()[0]}")
+        return None, sql_query
+
+def run_candidates(instruction, summary=False):
+    """
+    Pide al LLM SQL_CANDIDATES consultas a la vez y valida cada una con EXPLAIN en cuanto llega,
+    luego ejecuta el plan válido más barato (el siguiente si aun así falla). Solo se pide una ronda
+    nueva cuando ninguna candidata funciona. Devuelve los resultados como DataFrame, o None.
     """
-    Ejecuta el flujo de trabajo completo: genera la consulta SQL, la ejecuta y genera el reporte.
-    Si la query falla, se intenta regenerarla y reintentarlo hasta un máximo de 5 veces.
+    required_columns = SUMMARY_COLUMNS if summary else None
+    for round_number in range(SQL_CANDIDATE_ROUNDS):
+        print(f"\n[INFO] Ronda {round_number+1} de {SQL_CANDIDATE_ROUNDS}: generando {SQL_CANDIDATES} consultas SQL candidatas.")
+        metrics.add("rounds")
+        metrics.add("candidates", SQL_CANDIDATES)
+        with ThreadPoolExecutor(max_workers=SQL_CANDIDATES) as executor:
+            # Cada candidata se ejecuta en una copia del contexto del llamador, así sus spans son hijos del span actual
+            futures = [
+                executor.submit(contextvars.copy_context().run, candidate_task, instruction, index, round_number > 0,
+                                required_columns)
+                for index in range(SQL_CANDIDATES)
+            ]
+            candidates = [future.result() for future in futures]
+
+        valid = {}
+        for cost, sql_query in candidates:
+            if cost is not None:
+                valid.setdefault(clean_sql(sql_query), cost)  # Las consultas idénticas solo se prueban una vez
+        print(f"[INFO] {len(valid)} consultas válidas distintas entre {SQL_CANDIDATES} candidatas.")
+
+        for sql_query, cost in sorted(valid.items(), key=lambda item: item[1]):
+            print(f"[INFO] Ejecutando el plan restante más barato (costo estimado {cost:.2f}).")
+            try:
+                results = reporting_task(sql_query)
+                if summary:
+                    results = normalize_summary(results[SUMMARY_COLUMNS])
+                return results
+            except Exception as e:
+                print(f"\n[ERROR] La consulta falló con el error: {e}")
+    print("[ERROR] No se pudo ejecutar ninguna consulta candidata. Abortando el proceso.")
+    return None
+
+def run_attempts(question, use_llm, sensor_id=None, prepare=True):
     """
-    max_attempts = 5
+    Construye y ejecuta la consulta de a un intento por vez. Las consultas escritas por el LLM
+    se regeneran y reintentan hasta 5 veces. Devuelve los resultados como DataFrame, o None.
+    """
+    max_attempts = 5 if use_llm else 1
     attempt = 0
-    report = None
 
     while attempt < max_attempts:
         print(f"\n[INFO] Intento {attempt+1} de {max_attempts} para generar y ejecutar la consulta SQL.")
-        sql_query = research_task()
+        if use_llm:
+            with llm_cache.bypass(attempt > 0):  # Un reintento no debe recibir de la caché la consulta que falló
+                sql_query, parameters = research_task(question or DEFAULT_INSTRUCTION), None
+        else:
+            sql_query, parameters = summary_task(sensor_id, prepare)
 
         try:
-            report = reporting_task(sql_query)
-            print("\n[INFO] Reporte generado con éxito.")
-            break  # Si la consulta se ejecuta correctamente, salir del bucle.
+            results = reporting_task(sql_query, parameters)
+            if question is None:
+                results = normalize_summary(results[SUMMARY_COLUMNS])  # El resumen debe mantener las columnas esperadas
+            return results  # La consulta se ejecutó correctamente, no hacen falta más intentos
         except Exception as e:
             print(f"\n[ERROR] La consulta falló con el error: {e}")
             attempt += 1
 
             if attempt < max_attempts:
+                metrics.add("retries")
                 print("[INFO] Regenerando consulta y reintentando...")
             else:
                 print("[ERROR] Se alcanzó el número máximo de intentos. Abortando el proceso.")
-                return
+    return None
 
-    # Guardar el reporte en un archivo si se obtuvo
-    if report:
-        report_path = os.getenv("REPORT_PATH", "reporte_resultados.md")
+def run_workflow(question=None, output_dir=None, sensor_id=None, prepare=True):
+    """
+    Ejecuta el flujo de trabajo completo: construye la consulta SQL, la ejecuta y genera el reporte.
+    El reporte habitual usa la consulta de resumen integrada. Las preguntas puntuales (o USE_LLM_SQL=1)
+    pasan por el LLM, que regenera y reintenta la query fallida hasta un máximo de 5 veces, o con
+    SQL_CANDIDATES > 1 escribe varias consultas a la vez y solo se ejecuta la válida más barata.
+    `sensor_id` elige la planta del resumen integrado (SENSOR_ID por defecto), y `prepare=False` omite
+    el mantenimiento de particiones y rollups cuando quien llama ya lo hizo.
+    Devuelve los resultados como DataFrame (None si no se pudo ejecutar la consulta).
+    """
+    output_dir = output_dir or OUTPUT_DIR
+    use_llm = question is not None or USE_LLM_SQL
+
+    if use_llm and SQL_CANDIDATES > 1:
+        results = run_candidates(question or DEFAULT_INSTRUCTION, summary=question is None)
+    else:
+        results = run_attempts(question, use_llm, sensor_id, prepare)
+    if results is None:
+        return
+    print("\n[INFO] Reporte generado con éxito.")
+
+    # Guardar el reporte y el resumen tipado que usan los demás agentes
+    with metrics.span("report_formatting", rows=len(results)):
+        os.makedirs(output_dir, exist_ok=True)
+        report_path = os.getenv("REPORT_PATH", os.path.join(output_dir, REPORT_FILENAME))
         with open(report_path, "w") as f:
-            f.write(report)
+            f.write(render_markdown(results))
         print(f"\n[INFO] Reporte guardado en {report_path}")
 
+        if question is None:
+            save_summary(results, summary_path(output_dir))
+            print(f"[INFO] Datos del resumen guardados en {summary_path(output_dir)}")
+
+    return results
+
 if __name__ == "__main__":
-    run_workflow()
+    parser = argparse.ArgumentParser(description="Genera el reporte de humedad del suelo a partir de la base de datos.")
+    parser.add_argument("--ask", metavar="PREGUNTA", help="Pregunta puntual respondida con SQL generado por el LLM")
+    args = parser.parse_args()
+    with metrics.span("query_agent"):
+        run_workflow(args.ask)
+    llm_cache.report_stats()
+    metrics.export()
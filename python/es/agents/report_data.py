@@ -0,0 +1,64 @@
+import os
+import pandas as pd
+
+try:
+    import pyarrow.feather as feather  # Opcional, pip install pyarrow
+except ImportError:
+    feather = None
+
+# Columnas del resumen diario que devuelve el agente de consultas
+SUMMARY_COLUMNS = ["fecha", "valor_minimo", "valor_promedio", "valor_maximo"]
+# Arrow IPC mantiene los tipos de las columnas y los lectores lo mapean en memoria (CSV sin pyarrow)
+SUMMARY_FILENAME = "resumen_humedad.arrow" if feather else "resumen_humedad.csv"
+
+# El sensor HW-080 devuelve de 0 (húmedo) a 1023 (seco)
+SENSOR_MAX = 1023
+
+def summary_path(output_dir):
+    """Ruta del resumen tipado que comparten los agentes."""
+    return os.path.join(output_dir, SUMMARY_FILENAME)
+
+def normalize_summary(df):
+    """Devuelve el resumen con los tipos de columna esperados, ordenado por fecha."""
+    df = df.copy()
+    df["fecha"] = pd.to_datetime(df["fecha"])
+    for column in SUMMARY_COLUMNS[1:]:
+        df[column] = df[column].astype(float)
+    return df.sort_values("fecha").reset_index(drop=True)
+
+def save_summary(df, path):
+    """
+    Escribe el resumen una sola vez para los demás agentes. Los archivos .arrow son Arrow IPC sin
+    comprimir, así los lectores los mapean en lugar de parsearlos; el archivo se reemplaza de forma atómica.
+    """
+    if path.endswith(".arrow"):
+        feather.write_feather(df, f"{path}.tmp", compression="uncompressed")  # Sin comprimir, así se puede mapear en memoria
+        os.replace(f"{path}.tmp", path)
+    else:
+        df.to_csv(path, index=False)
+
+def load_summary(path):
+    """Lee un resumen guardado como .arrow (mapeado en memoria), .parquet o .csv."""
+    if path.endswith((".arrow", ".feather")):
+        return normalize_summary(feather.read_table(path, memory_map=True).to_pandas())
+    if path.endswith(".parquet"):
+        return normalize_summary(pd.read_parquet(path))
+    return normalize_summary(pd.read_csv(path))
+
+def add_humidity_percentages(df):
+    """Convierte los valores brutos del sensor en porcentajes de humedad estimados."""
+    df = df.copy()
+    df["Humedad_min"] = (SENSOR_MAX - df["valor_maximo"]) / SENSOR_MAX * 100  # Lectura más alta = suelo más seco
+    df["Humedad_prom"] = (SENSOR_MAX - df["valor_promedio"]) / SENSOR_MAX * 100
+    df["Humedad_max"] = (SENSOR_MAX - df["valor_minimo"]) / SENSOR_MAX * 100
+    return df
+
+def render_markdown(df):
+    """Genera una tabla Markdown con dos decimales (los números quedan alineados a la derecha)."""
+    df = df.copy()
+    for column in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[column]):
+            dates = df[column]
+            fmt = "%Y-%m-%d" if (dates == dates.dt.normalize()).all() else "%Y-%m-%d %H:%M"  # Las agrupaciones por hora conservan la hora
+            df[column] = dates.dt.strftime(fmt)
+    return df.to_markdown(index=False, floatfmt=".2f")
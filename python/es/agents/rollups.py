@@ -0,0 +1,160 @@
+import argparse
+import os
+from sqlalchemy import text
+from agents.aggregation import (
+    DAILY_TABLE, HOURLY_TABLE, SENSOR_ID_COLUMN, SENSOR_TABLE, SENSOR_TIME_COLUMN, SENSOR_VALUE_COLUMN,
+    quote_identifier,
+)
+from agents.db import get_engine
+
+# Tabla que guarda la marca de agua (última fecha bruta ya agregada) y la lectura más antigua escrita
+# desde la última actualización que queda antes de su ventana (la marca el servicio de ingesta)
+STATE_TABLE = "estado_rollups"
+
+# Minutos antes de la marca de agua que se recalculan en cada actualización, para que las lecturas
+# confirmadas con retraso (con una fecha anterior) también entren en los agregados
+ROLLUP_LATENESS_MINUTES = int(os.getenv("ROLLUP_LATENESS_MINUTES", "60"))
+
+def ensure_rollup_schema(conn):
+    """Crea las tablas de agregados por hora/día y la tabla de estado si no existen."""
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {quote_identifier(HOURLY_TABLE)} (\n"
+        f"    id_sensor TEXT NOT NULL DEFAULT '',\n"
+        f"    inicio_hora TIMESTAMP NOT NULL,\n"
+        f"    cantidad_lecturas BIGINT NOT NULL,\n"
+        f"    suma_valor DOUBLE PRECISION NOT NULL,\n"
+        f"    valor_min DOUBLE PRECISION NOT NULL,\n"
+        f"    valor_max DOUBLE PRECISION NOT NULL,\n"
+        f"    PRIMARY KEY (id_sensor, inicio_hora)\n"
+        f")"
+    ))
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {quote_identifier(DAILY_TABLE)} (\n"
+        f"    id_sensor TEXT NOT NULL DEFAULT '',\n"
+        f"    fecha DATE NOT NULL,\n"
+        f"    cantidad_lecturas BIGINT NOT NULL,\n"
+        f"    suma_valor DOUBLE PRECISION NOT NULL,\n"
+        f"    valor_min DOUBLE PRECISION NOT NULL,\n"
+        f"    valor_max DOUBLE PRECISION NOT NULL,\n"
+        f"    PRIMARY KEY (id_sensor, fecha)\n"
+        f")"
+    ))
+    conn.execute(text(
+        f"CREATE TABLE IF NOT EXISTS {quote_identifier(STATE_TABLE)} (\n"
+        f"    nombre TEXT PRIMARY KEY,\n"
+        f"    marca_agua TIMESTAMPTZ NOT NULL,\n"
+        f"    tardias_desde TIMESTAMPTZ\n"
+        f")"
+    ))
+    conn.execute(text(f"ALTER TABLE {quote_identifier(STATE_TABLE)} ADD COLUMN IF NOT EXISTS tardias_desde TIMESTAMPTZ"))
+
+def mark_late_readings(cursor, oldest):
+    """
+    La llama el servicio de ingesta con el cursor DB-API de la transacción que escribe un lote: si su
+    lectura más antigua queda antes de la ventana que recalcula la próxima actualización (una carga
+    atrasada, un dispositivo que estuvo desconectado), la actualización vuelve hasta ella. No hace nada
+    mientras los agregados no se usan.
+    """
+    cursor.execute("SAVEPOINT mark_late_readings")
+    try:
+        # Una actualización en curso mantiene bloqueada la fila de estado, esto la espera y compara con su nueva marca
+        cursor.execute(
+            f"UPDATE {quote_identifier(STATE_TABLE)} SET tardias_desde = LEAST(tardias_desde, %s) "
+            f"WHERE nombre = %s AND %s < marca_agua - %s * INTERVAL '1 minute'",
+            (oldest, SENSOR_TABLE, oldest, ROLLUP_LATENESS_MINUTES),
+        )
+    except Exception:
+        cursor.execute("ROLLBACK TO SAVEPOINT mark_late_readings")  # Todavía no hay tablas de agregados
+    else:
+        cursor.execute("RELEASE SAVEPOINT mark_late_readings")
+
+def refresh_rollups(engine=None, rebuild=False):
+    """
+    Actualiza las tablas de agregados con las lecturas brutas posteriores a la marca de agua.
+    Solo se recalculan las horas posteriores a (marca de agua - retraso), así que el coste depende
+    de las lecturas recibidas desde la última actualización, más las horas desde la lectura tardía más
+    antigua que escribió el servicio de ingesta (ver mark_late_readings). Devuelve la nueva marca de agua.
+    """
+    from agents import metrics  # Carga los callbacks de LangChain, que no necesita mark_late_readings en el servicio de ingesta
+    engine = engine or get_engine()
+    raw = quote_identifier(SENSOR_TABLE)
+    ts = quote_identifier(SENSOR_TIME_COLUMN)
+    value = quote_identifier(SENSOR_VALUE_COLUMN)
+    sensor = f"COALESCE(CAST({quote_identifier(SENSOR_ID_COLUMN)} AS TEXT), '')" if SENSOR_ID_COLUMN else "''"
+    hourly = quote_identifier(HOURLY_TABLE)
+    daily = quote_identifier(DAILY_TABLE)
+
+    with engine.begin() as conn:
+        # Solo una actualización a la vez, las llamadas concurrentes esperan y luego no encuentran nada que hacer
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": SENSOR_TABLE})
+        # El bloqueo va primero: CREATE TABLE IF NOT EXISTS puede fallar si otra sesión crea la tabla a la vez
+        ensure_rollup_schema(conn)
+
+        if rebuild:
+            conn.execute(text(f"TRUNCATE {hourly}, {daily}"))
+            conn.execute(text(f"DELETE FROM {quote_identifier(STATE_TABLE)} WHERE nombre = :name"), {"name": SENSOR_TABLE})
+
+        # Bloqueada hasta el commit, así un lote tardío escrito mientras tanto se marca para la próxima actualización
+        high_water, late_since = conn.execute(
+            text(f"SELECT marca_agua, tardias_desde FROM {quote_identifier(STATE_TABLE)} WHERE nombre = :name FOR UPDATE"),
+            {"name": SENSOR_TABLE},
+        ).first() or (None, None)
+
+        if high_water is None:
+            new_high_water = conn.execute(text(f"SELECT MAX({ts}) FROM {raw}")).scalar()
+            start_condition, parameters = "", {}
+        else:
+            # La ventana de retraso se recalcula aunque no haya lecturas nuevas, una tardía puede ser la última en llegar
+            new_high_water = conn.execute(
+                text(f"SELECT MAX({ts}) FROM {raw} WHERE {ts} > :high_water"), {"high_water": high_water}
+            ).scalar() or high_water
+            start_condition = (
+                f"{ts} >= date_trunc('hour', LEAST(CAST(:high_water AS TIMESTAMPTZ) - :lateness * INTERVAL '1 minute', "
+                f"CAST(:late_since AS TIMESTAMPTZ))) AND "
+            )
+            parameters = {"high_water": high_water, "lateness": ROLLUP_LATENESS_MINUTES, "late_since": late_since}
+
+        if new_high_water is None:
+            print("[INFO] No hay lecturas para agregar.")
+            return None
+
+        parameters["new_high_water"] = new_high_water
+        hours = conn.execute(text(
+            f"INSERT INTO {hourly} (id_sensor, inicio_hora, cantidad_lecturas, suma_valor, valor_min, valor_max)\n"
+            f"SELECT {sensor}, date_trunc('hour', {ts}), COUNT(*), SUM({value}), MIN({value}), MAX({value})\n"
+            f"FROM {raw}\n"
+            f"WHERE {start_condition}{ts} <= :new_high_water\n"
+            f"GROUP BY 1, 2\n"
+            f"ON CONFLICT (id_sensor, inicio_hora) DO UPDATE SET\n"
+            f"    cantidad_lecturas = EXCLUDED.cantidad_lecturas, suma_valor = EXCLUDED.suma_valor,\n"
+            f"    valor_min = EXCLUDED.valor_min, valor_max = EXCLUDED.valor_max\n"
+            f"RETURNING inicio_hora"
+        ), parameters).fetchall()
+
+        # Los días afectados por las horas actualizadas se recalculan a partir de los agregados por hora
+        first_hour = min((row[0] for row in hours), default=None)
+        conn.execute(text(
+            f"INSERT INTO {daily} (id_sensor, fecha, cantidad_lecturas, suma_valor, valor_min, valor_max)\n"
+            f"SELECT id_sensor, CAST(inicio_hora AS DATE), SUM(cantidad_lecturas), SUM(suma_valor), MIN(valor_min), MAX(valor_max)\n"
+            f"FROM {hourly}\n"
+            f"WHERE inicio_hora >= date_trunc('day', CAST(:first_hour AS TIMESTAMP))\n"
+            f"GROUP BY 1, 2\n"
+            f"ON CONFLICT (id_sensor, fecha) DO UPDATE SET\n"
+            f"    cantidad_lecturas = EXCLUDED.cantidad_lecturas, suma_valor = EXCLUDED.suma_valor,\n"
+            f"    valor_min = EXCLUDED.valor_min, valor_max = EXCLUDED.valor_max"
+        ), {"first_hour": first_hour})
+
+        conn.execute(text(
+            f"INSERT INTO {quote_identifier(STATE_TABLE)} (nombre, marca_agua) VALUES (:name, :high_water)\n"
+            f"ON CONFLICT (nombre) DO UPDATE SET marca_agua = EXCLUDED.marca_agua, tardias_desde = NULL"
+        ), {"name": SENSOR_TABLE, "high_water": new_high_water})
+
+    metrics.add("rows", len(hours))
+    print(f"[INFO] Agregados actualizados: {len(hours)} horas actualizadas, marca de agua {new_high_water}")
+    return new_high_water
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Actualiza los agregados por hora y por día de las lecturas del sensor.")
+    parser.add_argument("--rebuild", action="store_true", help="Recalcular los agregados a partir de todas las lecturas brutas")
+    args = parser.parse_args()
+    refresh_rollups(rebuild=args.rebuild)
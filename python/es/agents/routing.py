@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+from functools import lru_cache
+
+# Servidores de Ollama, separados por comas. `URL=modelo|modelo` limita un servidor a los modelos que tiene,
+# ej. "http://gpu1:11434=deepseek-r1:32b|llama3.1,http://gpu2:11434=llama3.1"
+OLLAMA_ENDPOINTS = os.getenv("OLLAMA_ENDPOINTS") or os.getenv("OLLAMA_BASE_URL", "http://TU_IP_O_SERVIDOR:PUERTO")
+OLLAMA_SLOTS = int(os.getenv("OLLAMA_SLOTS", "4"))                 # Peticiones enviadas a cada servidor a la vez
+OLLAMA_RETRY_SECONDS = float(os.getenv("OLLAMA_RETRY_SECONDS", "30"))  # Un servidor que falló se salta este tiempo
+
+# Niveles de modelo y el nivel de cada tarea. El modelo de razonamiento es lento y ocupa una GPU grande,
+# solo redacta los correos que tienen anomalías que explicar.
+MODEL_TIERS = {
+    "fast": os.getenv("FAST_MODEL", "llama3.1"),
+    "reasoning": os.getenv("REASONING_MODEL", "deepseek-r1:32b"),
+}
+TASK_TIERS = {"sql": "fast", "plot": "fast", "email": "fast", "email_anomalies": "reasoning"}
+# ej. MODEL_ROUTES="email=reasoning" redacta todos los correos con el modelo de razonamiento
+MODEL_ROUTES = os.getenv("MODEL_ROUTES", "")
+
+class Endpoint:
+    """Un servidor de Ollama: los modelos que sirve, sus huecos de peticiones y si respondió últimamente."""
+
+    def __init__(self, url, models=None):
+        self.url = url.rstrip("/")
+        self.models = set(models or ())  # Vacío: cualquier modelo
+        self.slots = threading.BoundedSemaphore(OLLAMA_SLOTS)
+        self.in_flight = 0
+        self.down_until = 0.0
+        self.lock = threading.Lock()
+
+    def serves(self, model):
+        return not self.models or model in self.models
+
+    def healthy(self):
+        return time.monotonic() >= self.down_until
+
+    def mark_down(self, error):
+        with self.lock:
+            self.down_until = time.monotonic() + OLLAMA_RETRY_SECONDS
+        print(f"[WARNING] Ollama en {self.url} falló ({error}), se salta durante {OLLAMA_RETRY_SECONDS:.0f}s")
+
+    def mark_up(self):
+        self.down_until = 0.0
+
+    def __repr__(self):
+        return f"Endpoint({self.url!r})"
+
+def parse_endpoints(value):
+    """Los servidores de un valor de OLLAMA_ENDPOINTS. Lanza ValueError si una entrada no es una URL http(s)."""
+    endpoints = []
+    for item in value.split(","):
+        url, _, models = item.strip().partition("=")
+        if not url:
+            continue
+        address = urllib.parse.urlsplit(url)
+        if address.scheme not in ("http", "https") or not address.netloc:
+            raise ValueError(f"Endpoint inválido {item.strip()!r} en OLLAMA_ENDPOINTS, se esperaba http://HOST:PUERTO[=modelo|modelo]")
+        endpoints.append(Endpoint(url, [model for model in models.split("|") if model]))
+    if not endpoints:
+        raise ValueError("OLLAMA_ENDPOINTS no indica ningún servidor de Ollama")
+    return endpoints
+
+@lru_cache(maxsize=None)
+def endpoints():
+    """Los servidores de Ollama, leídos de OLLAMA_ENDPOINTS al usarlos por primera vez y compartidos por todos los clientes."""
+    return parse_endpoints(OLLAMA_ENDPOINTS)
+
+@lru_cache(maxsize=None)
+def task_tiers():
+    """TASK_TIERS con las MODEL_ROUTES aplicadas, leídas al usarlas por primera vez. Lanza ValueError si una ruta está mal escrita."""
+    tiers = dict(TASK_TIERS)
+    for route in MODEL_ROUTES.replace(" ", "").split(","):
+        if not route:
+            continue
+        task, _, tier = route.partition("=")
+        if task not in TASK_TIERS or not tier:
+            raise ValueError(f"Ruta inválida {route!r} en MODEL_ROUTES, se esperaba TAREA=NIVEL o TAREA=MODELO "
+                             f"con una tarea de {', '.join(TASK_TIERS)}")
+        tiers[task] = tier
+    return tiers
+
+def model_for(task):
+    """Modelo que ejecuta `task` (ver task_tiers(), una ruta también puede nombrar un modelo en lugar de un nivel)."""
+    tier = task_tiers()[task]
+    return MODEL_TIERS.get(tier, tier)
+
+def validate():
+    """
+    Lee MODEL_ROUTES y OLLAMA_ENDPOINTS y comprueba que el modelo de cada tarea tiene un servidor,
+    sin conectarse a ninguno. Lanza ValueError si una configuración no es válida.
+    """
+    for task in task_tiers():
+        endpoints_for(model_for(task))
+
+def endpoints_for(model):
+    """
+    Servidores a probar para una petición a `model`, en orden: los sanos con menos peticiones en
+    curso primero, luego los que fallaron últimamente (los que antes se reintentan primero).
+    """
+    serving = [endpoint for endpoint in endpoints() if endpoint.serves(model)]
+    if not serving:
+        raise ValueError(f"Ningún endpoint de Ollama sirve {model} (OLLAMA_ENDPOINTS)")
+    healthy = sorted((endpoint for endpoint in serving if endpoint.healthy()), key=lambda endpoint: endpoint.in_flight)
+    failed = sorted((endpoint for endpoint in serving if not endpoint.healthy()), key=lambda endpoint: endpoint.down_until)
+    return healthy + failed
+
+def request(endpoint, path, payload=None, timeout=10):
+    """Llama a la API de Ollama de `endpoint` (GET sin payload) y devuelve el JSON decodificado."""
+    data = json.dumps(payload).encode() if payload is not None else None
+    http_request = urllib.request.Request(f"{endpoint.url}{path}", data=data, headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(http_request, timeout=timeout) as response:
+        return json.loads(response.read().decode() or "{}")
+
+def check(endpoint):
+    """Pide a `endpoint` sus modelos y lo marca como activo o caído. Devuelve los nombres, None si está caído."""
+    try:
+        models = [model["name"] for model in request(endpoint, "/api/tags").get("models", [])]
+    except Exception as e:
+        endpoint.mark_down(e)
+        return None
+    endpoint.mark_up()
+    return models
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Comprueba los endpoints de Ollama y muestra el modelo de cada tarea.")
+    parser.parse_args()
+    try:
+        validate()
+    except ValueError as e:
+        raise SystemExit(f"[ERROR] Enrutado de modelos inválido: {e}")
+    for task, tier in task_tiers().items():
+        print(f"[INFO] {task}: nivel {tier}, {model_for(task)}")
+    for endpoint in endpoints():
+        models = check(endpoint)
+        if models is None:
+            print(f"[ERROR] {endpoint.url}: no responde")
+        else:
+            print(f"[INFO] {endpoint.url}: activo, {len(models)} modelos ({', '.join(sorted(models))})")
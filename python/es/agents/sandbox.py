@@ -0,0 +1,66 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+
+# Límites del proceso trabajador que ejecuta el código generado
+SANDBOX_TIMEOUT = float(os.getenv("SANDBOX_TIMEOUT", "60"))           # Segundos reales antes de matar al trabajador
+SANDBOX_CPU_SECONDS = int(os.getenv("SANDBOX_CPU_SECONDS", "30"))     # Tiempo de CPU del trabajador
+SANDBOX_MEMORY_MB = int(os.getenv("SANDBOX_MEMORY_MB", "2048"))       # Espacio de direcciones del trabajador
+SANDBOX_MAX_FILE_MB = int(os.getenv("SANDBOX_MAX_FILE_MB", "50"))     # Archivo más grande que puede escribir el trabajador
+
+# Se ejecuta dentro del trabajador: aplica los límites y luego ejecuta el script con las entradas como globales.
+# Los límites los pone el propio trabajador (sin preexec_fn, que no es seguro mientras el pipeline usa hilos).
+RUNNER = """
+import json, runpy, sys
+try:
+    import resource
+    cpu, memory, file_size = (int(value) for value in sys.argv[3:6])
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu))
+    resource.setrlimit(resource.RLIMIT_AS, (memory, memory))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (file_size, file_size))
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+except ImportError:
+    pass  # Sin módulo resource (Windows): solo se aplica el tiempo máximo
+with open(sys.argv[2]) as f:
+    inputs = json.load(f)
+runpy.run_path(sys.argv[1], init_globals=inputs, run_name="__main__")
+"""
+
+def run_script(code, inputs=None, timeout=SANDBOX_TIMEOUT):
+    """
+    Ejecuta `code` en un proceso Python aparte con límites de CPU, memoria, tamaño de archivo y
+    tiempo, con las `inputs` (serializables a JSON) como variables globales. Devuelve (éxito, salida
+    del proceso). Un script que se cuelga o se queda sin memoria solo afecta a su propio proceso.
+    """
+    with tempfile.TemporaryDirectory(prefix="gardencare-sandbox-") as workdir:
+        script_path = os.path.join(workdir, "script.py")
+        inputs_path = os.path.join(workdir, "inputs.json")
+        with open(script_path, "w") as f:
+            f.write(code)
+        with open(inputs_path, "w") as f:
+            json.dump(inputs or {}, f)
+
+        env = dict(os.environ, MPLBACKEND="Agg", OPENBLAS_NUM_THREADS="1", OMP_NUM_THREADS="1")
+        command = [
+            sys.executable, "-I", "-c", RUNNER, script_path, inputs_path,
+            str(SANDBOX_CPU_SECONDS), str(SANDBOX_MEMORY_MB * 1024 * 1024), str(SANDBOX_MAX_FILE_MB * 1024 * 1024),
+        ]
+        # Su propia sesión, así al vencer el tiempo también se mata lo que haya iniciado el script
+        process = subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   stdin=subprocess.DEVNULL, text=True, start_new_session=True)
+        try:
+            output, _ = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            if hasattr(os, "killpg"):
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+            output, _ = process.communicate()
+            return False, f"{output}\nTerminado tras {timeout:.0f}s"
+
+    if process.returncode < 0:
+        output += f"\nTerminado por la señal {-process.returncode} (límite de CPU o memoria)"
+    return process.returncode == 0, output
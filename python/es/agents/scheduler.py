@@ -0,0 +1,170 @@
+import json
+import os
+import signal
+import threading
+from datetime import datetime, timedelta
+from agents import locales
+from agents.aggregation import SENSOR_ID_COLUMN
+
+# Configuración del daemon: un archivo JSON con una entrada por planta, o una sola planta desde el entorno
+DAEMON_CONFIG = os.getenv("DAEMON_CONFIG")
+REPORT_SCHEDULE = os.getenv("REPORT_SCHEDULE", "0 8 * * *")                   # Expresión cron de los reportes
+DAEMON_WARMUP_SECONDS = float(os.getenv("DAEMON_WARMUP_SECONDS", "120"))     # Los modelos se cargan este tiempo antes de un reporte
+
+# Ajustes de un reporte y las variables de entorno que usan por defecto (la contraseña solo sale de ahí)
+JOB_SETTINGS = {
+    "output_dir": "OUTPUT_DIR",
+    "sensor_id": "SENSOR_ID",
+    "species": "PLANT_SPECIES",
+    "recipients": "EMAIL_RECIPIENTS",
+    "sender_email": "SENDER_EMAIL",
+    "sender_password": "SENDER_PASSWORD",
+    "languages": "REPORT_LANGUAGES",
+}
+REQUIRED_SETTINGS = ("output_dir", "recipients", "sender_email", "sender_password")
+
+ALIASES = {"@hourly": "0 * * * *", "@daily": "0 0 * * *", "@weekly": "0 0 * * 0", "@monthly": "0 0 1 * *"}
+FIELD_RANGES = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))  # minuto, hora, día del mes, mes, día de la semana
+MAX_SEARCH_DAYS = 5 * 366  # Suficiente para un 29 de febrero
+
+def parse_field(field, low, high):
+    """Valores de un campo cron: `*`, `5`, `1-5`, `*/15`, `1-31/2` y listas de ellos separadas por comas."""
+    values = set()
+    for part in field.split(","):
+        spec, _, step = part.partition("/")
+        if spec == "*":
+            start, end = low, high
+        elif "-" in spec:
+            start, end = (int(value) for value in spec.split("-", 1))
+        else:
+            start = end = int(spec)
+        step = int(step) if step else 1
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(f"campo cron inválido {field!r} (los valores van de {low} a {high})")
+        values.update(range(start, end + 1, step))
+    return values
+
+class Schedule:
+    """Una expresión cron (`minuto hora día-del-mes mes día-de-la-semana`, o @hourly, @daily...)."""
+
+    def __init__(self, expression):
+        self.expression = expression
+        fields = ALIASES.get(expression.strip(), expression).split()
+        if len(fields) != 5:
+            raise ValueError(f"expresión cron inválida {expression!r}: necesita 5 campos")
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            parse_field(field, low, high) for field, (low, high) in zip(fields, FIELD_RANGES)
+        )
+        self.weekdays = {day % 7 for day in weekdays}  # 0 y 7 son ambos domingo
+        # Como en cron, si los dos campos de día están restringidos basta con que el día cumpla uno de ellos
+        self.any_day = fields[2] != "*" and fields[4] != "*"
+
+    def day_matches(self, moment):
+        in_month = moment.day in self.days
+        in_week = (moment.weekday() + 1) % 7 in self.weekdays
+        return (in_month or in_week) if self.any_day else (in_month and in_week)
+
+    def next_after(self, moment):
+        """Primer minuto después de `moment` que cumple la expresión."""
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment + timedelta(days=MAX_SEARCH_DAYS)
+        while moment < limit:
+            if moment.month not in self.months:
+                moment = (moment.replace(day=1) + timedelta(days=32)).replace(day=1, hour=0, minute=0)
+            elif not self.day_matches(moment):
+                moment = (moment + timedelta(days=1)).replace(hour=0, minute=0)
+            elif moment.hour not in self.hours:
+                moment = (moment + timedelta(hours=1)).replace(minute=0)
+            elif moment.minute not in self.minutes:
+                moment += timedelta(minutes=1)
+            else:
+                return moment
+        raise ValueError(f"la expresión cron {self.expression!r} nunca se cumple")
+
+    def __str__(self):
+        return self.expression
+
+def load_jobs(path=None):
+    """
+    Lee las plantas a reportar: una lista JSON (o {"plants": [...]}) de objetos con un nombre, un
+    horario y cualquiera de los JOB_SETTINGS, cada uno con su variable de entorno por defecto
+    ("languages" puede ser una lista o un texto separado por comas).
+    Sin archivo hay una sola planta configurada desde el entorno.
+    Lanza ValueError si a una planta le falta un ajuste, o si no se pueden distinguir varias plantas
+    (mismo sensor o directorio de salida), así el daemon no falla a la hora del reporte.
+    """
+    entries = [{}]
+    path = path or DAEMON_CONFIG
+    if path:
+        with open(path) as f:
+            entries = json.load(f)
+        if isinstance(entries, dict):
+            entries = entries.get("plants", [])
+        if not entries:
+            raise ValueError(f"{path} no lista ninguna planta")
+
+    jobs = []
+    for index, entry in enumerate(entries):
+        job = {key: os.getenv(variable) for key, variable in JOB_SETTINGS.items()}
+        job.update({key: value for key, value in entry.items() if key != "sender_password"})
+        job["name"] = str(entry.get("name") or f"plant-{index + 1}")
+        job["schedule"] = Schedule(entry.get("schedule", REPORT_SCHEDULE))
+        missing = [key for key in REQUIRED_SETTINGS if not job.get(key)]
+        if missing:
+            raise ValueError(f"A la planta '{job['name']}' le falta {', '.join(JOB_SETTINGS[key] for key in missing)}")
+        job["languages"] = locales.parse_languages(job["languages"])  # Una lista o "es,en"
+        jobs.append(job)
+
+    if len(jobs) > 1:
+        if not SENSOR_ID_COLUMN:
+            raise ValueError("Varias plantas necesitan SENSOR_ID_COLUMN, la columna que distingue sus lecturas")
+        for key in ("name", "sensor_id", "output_dir"):
+            values = [str(job.get(key)) for job in jobs if job.get(key) is not None]
+            if len(values) < len(jobs) or len(set(values)) < len(values):
+                raise ValueError(f"Cada planta necesita un {key} distinto")
+    return jobs
+
+def run_forever(jobs, run, warm_up=None, warmup_seconds=DAEMON_WARMUP_SECONDS, stop=None):
+    """
+    Llama a `run(due_jobs)` con las plantas cuyo horario se cumple hasta SIGTERM o SIGINT (o hasta que
+    se active `stop`), todas las plantas que vencen a la vez en una sola llamada. `warm_up()` se llama
+    `warmup_seconds` antes de cada reporte, así los modelos ya están cargados cuando empieza. Una
+    ejecución fallida se registra y las plantas mantienen su horario. Los reportes que vencen mientras
+    otros se ejecutan empiezan cuando estos terminan; las horas perdidas se saltan.
+    """
+    stop = stop or threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: stop.set())
+
+    next_runs = {job["name"]: job["schedule"].next_after(datetime.now()) for job in jobs}
+    for job in jobs:
+        print(f"[INFO] Planta '{job['name']}' ({job['schedule']}): próximo reporte a las {next_runs[job['name']]:%Y-%m-%d %H:%M}")
+    warmed_for = None
+
+    while not stop.is_set():
+        due = min(next_runs.values())
+        warm_at = due - timedelta(seconds=warmup_seconds)
+        now = datetime.now()
+        if warm_up and warmed_for != due and now >= warm_at:
+            warmed_for = due
+            try:
+                warm_up()
+            except Exception as e:
+                print(f"[WARNING] Falló la preparación antes del reporte de las {due:%H:%M}: {e}")
+            continue
+        wake_at = warm_at if warm_up and warmed_for != due else due
+        if now < wake_at:
+            stop.wait(min((wake_at - now).total_seconds(), 60))  # Se revisa cada minuto, el reloj puede saltar
+            continue
+
+        due_jobs = [job for job in jobs if next_runs[job["name"]] <= now]
+        try:
+            run(due_jobs)
+        except Exception as e:
+            print(f"[ERROR] Fallaron los reportes de {', '.join(job['name'] for job in due_jobs)}: {e}")
+        finished = datetime.now()
+        for job in due_jobs:
+            next_runs[job["name"]] = job["schedule"].next_after(finished)
+            print(f"[INFO] Planta '{job['name']}': próximo reporte a las {next_runs[job['name']]:%Y-%m-%d %H:%M}")
+    print("[INFO] Planificador detenido.")
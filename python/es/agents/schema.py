@@ -0,0 +1,258 @@
+import argparse
+import os
+import re
+from datetime import date, timedelta
+from sqlalchemy import text
+from agents import metrics
+from agents.aggregation import SENSOR_TABLE, SENSOR_TIME_COLUMN, quote_identifier
+from agents.db import get_engine
+
+# Particionado por tiempo de la tabla de lecturas
+PARTITION_INTERVAL = os.getenv("PARTITION_INTERVAL", "month")                  # "month" o "day" (instalaciones con muchas lecturas)
+PARTITIONS_AHEAD = int(os.getenv("PARTITIONS_AHEAD", "2"))                     # Particiones futuras listas para las lecturas nuevas
+PARTITION_RETENTION_DAYS = int(os.getenv("PARTITION_RETENTION_DAYS", "0"))     # Se borran las lecturas más antiguas, 0 las conserva todas
+BRIN_PAGES_PER_RANGE = int(os.getenv("BRIN_PAGES_PER_RANGE", "32"))            # Páginas de la tabla que resume cada entrada del índice BRIN
+
+INTERVALS = ("month", "day")
+
+# Las particiones se nombran por su primer día, p. ej. datos_sensor_p202610 o datos_sensor_p20261018.
+# Las filas fuera de todas las particiones (o sin fecha) van a datos_sensor_por_defecto.
+DEFAULT_PARTITION = f"{SENSOR_TABLE}_por_defecto"
+UNPARTITIONED_TABLE = f"{SENSOR_TABLE}_sin_particionar"  # La tabla original, que la migración conserva
+PARTITION_PATTERN = re.compile(rf"^{re.escape(SENSOR_TABLE)}_p(\d{{6}}|\d{{8}})$")
+
+def period_start(day, interval):
+    return day.replace(day=1) if interval == "month" else day
+
+def next_period(start, interval):
+    if interval == "day":
+        return start + timedelta(days=1)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+def period_ahead(day, interval, ahead):
+    """Inicio del periodo que está `ahead` periodos después del de `day`."""
+    start = period_start(day, interval)
+    for _ in range(ahead):
+        start = next_period(start, interval)
+    return start
+
+def partition_name(start, interval):
+    return f"{SENSOR_TABLE}_p{start:%Y%m}" if interval == "month" else f"{SENSOR_TABLE}_p{start:%Y%m%d}"
+
+def parse_partition_name(name):
+    """(inicio, intervalo) de una de nuestras particiones, None para cualquier otra tabla."""
+    match = PARTITION_PATTERN.match(name)
+    if not match:
+        return None
+    digits = match.group(1)
+    if len(digits) == 6:
+        return date(int(digits[:4]), int(digits[4:]), 1), "month"
+    return date(int(digits[:4]), int(digits[4:6]), int(digits[6:])), "day"
+
+def table_kind(conn, table=SENSOR_TABLE):
+    """'p' para una tabla particionada, 'r' para una normal, None si no existe."""
+    return conn.execute(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"), {"table": quote_identifier(table)}
+    ).scalar()
+
+def list_partitions(conn):
+    return conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid\n"
+        "WHERE i.inhparent = to_regclass(:table)\n"
+        "ORDER BY c.relname"
+    ), {"table": quote_identifier(SENSOR_TABLE)}).scalars().all()
+
+def partition_interval(conn, default=PARTITION_INTERVAL):
+    """Intervalo de las particiones existentes, así un cambio de PARTITION_INTERVAL nunca crea particiones solapadas."""
+    for name in list_partitions(conn):
+        parsed = parse_partition_name(name)
+        if parsed:
+            return parsed[1]
+    return default
+
+def ensure_brin_index(conn, table=SENSOR_TABLE):
+    """
+    Crea un índice BRIN sobre la fecha si la tabla aún no tiene uno. Las lecturas llegan en orden
+    de tiempo, así que unos pocos kilobytes de rangos de bloques bastan para saltarse la mayor parte
+    de una partición grande, y en una tabla particionada el índice se crea en todas las particiones,
+    actuales y futuras.
+    """
+    exists = conn.execute(text(
+        "SELECT 1 FROM pg_indexes WHERE tablename = :table AND indexdef LIKE '%USING brin%'"
+    ), {"table": table}).first()
+    if exists:
+        return False
+    conn.execute(text(
+        f"CREATE INDEX {quote_identifier(table + '_brin')} ON {quote_identifier(table)}\n"
+        f"USING brin ({quote_identifier(SENSOR_TIME_COLUMN)}) WITH (pages_per_range = {BRIN_PAGES_PER_RANGE})"
+    ))
+    return True
+
+def create_partition(conn, start, interval):
+    """
+    Crea la partición del periodo que empieza en `start` si no existe. Las lecturas de ese periodo
+    que ya estén en la partición por defecto se mueven a ella antes de adjuntarla.
+    """
+    name = partition_name(start, interval)
+    if table_kind(conn, name):
+        return None
+    end = next_period(start, interval)
+    table = quote_identifier(SENSOR_TABLE)
+    partition = quote_identifier(name)
+    ts = quote_identifier(SENSOR_TIME_COLUMN)
+    # Los límites son fechas formateadas aquí, no datos del usuario
+    in_period = f"{ts} >= '{start.isoformat()}' AND {ts} < '{end.isoformat()}'"
+
+    conn.execute(text(f"CREATE TABLE {partition} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    if table_kind(conn, DEFAULT_PARTITION):
+        default = quote_identifier(DEFAULT_PARTITION)
+        conn.execute(text(f"INSERT INTO {partition} SELECT * FROM {default} WHERE {in_period}"))
+        conn.execute(text(f"DELETE FROM {default} WHERE {in_period}"))
+    conn.execute(text(
+        f"ALTER TABLE {table} ATTACH PARTITION {partition}\n"
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+    return name
+
+def ensure_partitions(conn, first, last, interval):
+    """Crea las particiones que faltan desde el periodo de `first` hasta el de `last`. Devuelve sus nombres."""
+    created = []
+    start = period_start(first, interval)
+    while start <= last:
+        name = create_partition(conn, start, interval)
+        if name:
+            created.append(name)
+        start = next_period(start, interval)
+    return created
+
+def drop_expired_partitions(conn, retention_days):
+    """
+    Borra las particiones cuyo periodo completo tiene más de `retention_days` días, y las lecturas
+    vencidas de la partición por defecto. Los agregados por hora y por día conservan sus resúmenes.
+    """
+    if retention_days <= 0:
+        return []
+    cutoff = date.today() - timedelta(days=retention_days)
+    dropped = []
+    for name in list_partitions(conn):
+        parsed = parse_partition_name(name)
+        if parsed and next_period(*parsed) <= cutoff:
+            conn.execute(text(f"DROP TABLE {quote_identifier(name)}"))
+            dropped.append(name)
+    if table_kind(conn, DEFAULT_PARTITION):
+        conn.execute(
+            text(f"DELETE FROM {quote_identifier(DEFAULT_PARTITION)} WHERE {quote_identifier(SENSOR_TIME_COLUMN)} < :cutoff"),
+            {"cutoff": cutoff},
+        )
+    return dropped
+
+def lock_schema(conn):
+    """Solo una migración o mantenimiento a la vez (se libera al terminar la transacción)."""
+    conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {"name": f"{SENSOR_TABLE}_schema"})
+
+def move_sequences(conn, old, new):
+    """Pasa las secuencias de id de la tabla vieja a la nueva, así sus ids siguen contando desde el último."""
+    columns = conn.execute(text(
+        "SELECT attname FROM pg_attribute WHERE attrelid = to_regclass(:table) AND attnum > 0 AND NOT attisdropped"
+    ), {"table": quote_identifier(old)}).scalars().all()
+    for column in columns:
+        sequences = [
+            conn.execute(text("SELECT pg_get_serial_sequence(:table, :column)"),
+                         {"table": quote_identifier(table), "column": column}).scalar()
+            for table in (old, new)
+        ]
+        if sequences[0] is None:
+            continue
+        if sequences[1] is None:  # SERIAL: el valor por defecto de la tabla nueva sigue usando la secuencia vieja
+            conn.execute(text(f"ALTER SEQUENCE {sequences[0]} OWNED BY {quote_identifier(new)}.{quote_identifier(column)}"))
+        else:  # Columna identity: la tabla nueva tiene su propia secuencia
+            conn.execute(
+                text(f"SELECT setval(:sequence, MAX({quote_identifier(column)})) FROM {quote_identifier(new)} "
+                     f"HAVING MAX({quote_identifier(column)}) IS NOT NULL"),
+                {"sequence": sequences[1]},
+            )
+
+def migrate(engine=None, interval=PARTITION_INTERVAL, ahead=PARTITIONS_AHEAD):
+    """
+    Convierte la tabla de lecturas en una tabla particionada por rangos de tiempo (una partición por
+    mes o por día, más una partición por defecto) con un índice BRIN sobre la fecha, y copia las
+    lecturas en ella. La tabla original se conserva como datos_sensor_sin_particionar hasta que se
+    borre a mano. Su clave primaria no se copia: PostgreSQL solo admite claves únicas que incluyan
+    la fecha. Devuelve False si la tabla ya estaba particionada.
+    """
+    if interval not in INTERVALS:
+        raise ValueError(f"Intervalo de partición desconocido {interval!r}, se esperaba uno de: {', '.join(INTERVALS)}")
+    table = quote_identifier(SENSOR_TABLE)
+    old = quote_identifier(UNPARTITIONED_TABLE)
+    ts = quote_identifier(SENSOR_TIME_COLUMN)
+
+    with metrics.span("partition_migration", interval=interval) as migration_span, (engine or get_engine()).begin() as conn:
+        lock_schema(conn)
+        kind = table_kind(conn)
+        if kind is None:
+            raise ValueError(f"La tabla {SENSOR_TABLE} no existe")
+        if kind == "p":
+            print(f"[INFO] {SENSOR_TABLE} ya está particionada.")
+            return False
+        if table_kind(conn, UNPARTITIONED_TABLE):
+            raise ValueError(f"{UNPARTITIONED_TABLE} ya existe, bórrala o renómbrala antes de volver a migrar")
+
+        # Quien escriba espera a la migración y luego inserta en la tabla particionada
+        conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+        conn.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+        conn.execute(text(
+            f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING IDENTITY INCLUDING CONSTRAINTS INCLUDING STORAGE)\n"
+            f"PARTITION BY RANGE ({ts})"
+        ))
+        conn.execute(text(f"CREATE TABLE {quote_identifier(DEFAULT_PARTITION)} PARTITION OF {table} DEFAULT"))
+
+        first, last = conn.execute(text(f"SELECT MIN({ts}), MAX({ts}) FROM {old}")).one()
+        today = date.today()
+        first_day = first.date() if first is not None else today
+        last_day = max(last.date() if last is not None else today, period_ahead(today, interval, ahead))
+        created = ensure_partitions(conn, first_day, last_day, interval)
+        ensure_brin_index(conn)
+
+        rows = conn.execute(text(f"INSERT INTO {table} OVERRIDING SYSTEM VALUE SELECT * FROM {old}")).rowcount
+        move_sequences(conn, UNPARTITIONED_TABLE, SENSOR_TABLE)
+        conn.execute(text(f"ANALYZE {table}"))
+        migration_span.set("rows", rows)
+        migration_span.set("partitions", len(created))
+
+    print(f"[INFO] {SENSOR_TABLE} particionada por {interval}: {rows} lecturas copiadas en {len(created)} particiones.")
+    print(f"[INFO] La tabla original se conservó como {UNPARTITIONED_TABLE}, bórrala cuando los reportes estén bien.")
+    return True
+
+def maintain(engine=None, ahead=PARTITIONS_AHEAD, retention_days=PARTITION_RETENTION_DAYS):
+    """
+    Crea las particiones del periodo actual y de los `ahead` siguientes, y borra las vencidas.
+    No hace nada si la tabla no está particionada. Devuelve {"created": [...], "dropped": [...]}.
+    """
+    with (engine or get_engine()).begin() as conn:
+        if table_kind(conn) != "p":
+            return {"created": [], "dropped": []}
+        with metrics.span("partition_maintenance") as maintenance_span:
+            lock_schema(conn)
+            interval = partition_interval(conn)
+            ensure_brin_index(conn)
+            created = ensure_partitions(conn, date.today(), period_ahead(date.today(), interval, ahead), interval)
+            dropped = drop_expired_partitions(conn, retention_days)
+            maintenance_span.set("created", len(created))
+            maintenance_span.set("dropped", len(dropped))
+
+    if created or dropped:
+        print(f"[INFO] Particiones de {SENSOR_TABLE}: creadas {', '.join(created) or 'ninguna'}, "
+              f"borradas {', '.join(dropped) or 'ninguna'}")
+    return {"created": created, "dropped": dropped}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Particiona la tabla de lecturas por tiempo y mantiene sus particiones.")
+    parser.add_argument("--migrate", action="store_true", help="Convertir la tabla de lecturas en una tabla particionada")
+    parser.add_argument("--interval", choices=INTERVALS, default=PARTITION_INTERVAL, help="Periodo de cada partición")
+    parser.add_argument("--retention-days", type=int, default=PARTITION_RETENTION_DAYS,
+                        help="Borrar las particiones con más de estos días (0 las conserva todas)")
+    args = parser.parse_args()
+    if args.migrate:
+        migrate(interval=args.interval)
+    result = maintain(retention_days=args.retention_days)
+    print(f"[INFO] {len(result['created'])} particiones creadas, {len(result['dropped'])} borradas.")
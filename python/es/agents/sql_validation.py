@@ -0,0 +1,66 @@
+import json
+import re
+from sqlalchemy import text
+from agents import schema
+from agents.aggregation import DAILY_TABLE, HOURLY_TABLE, SENSOR_TABLE
+
+# Tablas que puede leer una consulta escrita por el LLM (más las particiones de la tabla de lecturas)
+ALLOWED_TABLES = {SENSOR_TABLE, HOURLY_TABLE, DAILY_TABLE, schema.DEFAULT_PARTITION}
+
+# Una consulta de reporte solo lee: se rechazan las sentencias y funciones que escriben, bloquean o salen de la base de datos
+FORBIDDEN_KEYWORDS = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|MERGE|UPSERT|INTO|DROP|ALTER|CREATE|TRUNCATE|GRANT|REVOKE|COPY|CALL|DO|"
+    r"VACUUM|ANALYZE|CLUSTER|REINDEX|LOCK|SET|RESET|EXECUTE|PREPARE|DEALLOCATE|LISTEN|NOTIFY|COMMIT|ROLLBACK)\b",
+    re.IGNORECASE,
+)
+FORBIDDEN_FUNCTIONS = re.compile(r"\b(pg_\w+|lo_\w+|dblink\w*|set_config)\s*\(", re.IGNORECASE)
+
+def clean_sql(sql):
+    """Quita los delimitadores de código y el punto y coma final que a veces agrega el modelo."""
+    sql = re.sub(r"^```(?:sql)?\s*|\s*```$", "", sql.strip(), flags=re.IGNORECASE).strip()
+    return sql.rstrip(";").strip()
+
+def check_read_only(sql):
+    """Lanza ValueError salvo que `sql` sea una única sentencia SELECT (o WITH ... SELECT)."""
+    if not re.match(r"^(SELECT|WITH)\b", sql, re.IGNORECASE):
+        raise ValueError("la consulta no es un SELECT")
+    if ";" in sql:
+        raise ValueError("la consulta tiene más de una sentencia")
+    match = FORBIDDEN_KEYWORDS.search(sql) or FORBIDDEN_FUNCTIONS.search(sql)
+    if match:
+        raise ValueError(f"la consulta usa {match.group(1)!r}, que no está permitido")
+
+def plan_relations(plan):
+    """Nombres de las tablas que se recorren en cualquier parte de un plan de EXPLAIN (FORMAT JSON)."""
+    if "Relation Name" in plan:
+        yield plan["Relation Name"]
+    for child in plan.get("Plans", []):
+        yield from plan_relations(child)
+
+def allowed_relation(name):
+    return name in ALLOWED_TABLES or schema.parse_partition_name(name) is not None
+
+def validate_sql(conn, sql, required_columns=None):
+    """
+    Comprueba una consulta escrita por el LLM sin ejecutarla: de solo lectura y una sola sentencia,
+    planificada por PostgreSQL con EXPLAIN (así aparecen los errores de sintaxis, tablas y columnas),
+    que solo lea las tablas permitidas y, si se indican, que devuelva `required_columns`. Devuelve
+    el costo total estimado por el planificador, si no lanza ValueError o el error de la base de datos.
+    """
+    sql = clean_sql(sql)
+    check_read_only(sql)
+    conn.execute(text("SET TRANSACTION READ ONLY"))
+
+    plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+    plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+    refused = sorted({name for name in plan_relations(plan) if not allowed_relation(name)})
+    if refused:
+        raise ValueError(f"la consulta lee tablas no permitidas: {', '.join(refused)}")
+
+    if required_columns:
+        # LIMIT 0 detiene la ejecución antes de leer una fila, solo vuelven las columnas del resultado
+        columns = list(conn.execute(text(f"SELECT * FROM ({sql}) AS candidate LIMIT 0")).keys())
+        missing = [column for column in required_columns if column not in columns]
+        if missing:
+            raise ValueError(f"la consulta no devuelve las columnas {', '.join(missing)}")
+    return plan["Total Cost"]
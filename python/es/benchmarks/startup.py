@@ -0,0 +1,97 @@
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+# Comandos medidos desde un intérprete nuevo, como los arrancaría un usuario o cron
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+COMMANDS = {
+    "main --check": ["main.py", "--check"],
+    "main --help": ["main.py", "--help"],
+    "import agents.scheduler": ["-c", "import agents.scheduler"],
+    "import agents.query_agent": ["-c", "import agents.query_agent"],
+    "import agents.plot_agent": ["-c", "import agents.plot_agent"],
+    "import agents.anomalies": ["-c", "import agents.anomalies"],
+    "import agents.email_agent": ["-c", "import agents.email_agent"],
+}
+BUDGETED_COMMAND = "main --check"
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+def run(arguments, importtime=False):
+    """Ejecuta el intérprete con `arguments` y devuelve su tiempo real en segundos y su stderr."""
+    command = [sys.executable, *(["-X", "importtime"] if importtime else []), *arguments]
+    started = time.perf_counter()
+    completed = subprocess.run(command, cwd=PROJECT_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - started
+    if completed.returncode not in (0, 1):  # --check termina con 1 si la configuración no es válida, la medida sigue valiendo
+        raise RuntimeError(f"{' '.join(arguments)} falló: {completed.stderr.strip().splitlines()[-1:]}")
+    return elapsed, completed.stderr
+
+def slowest_imports(stderr, top):
+    """
+    Paquetes de un reporte de -X importtime, los más lentos primero: los milisegundos acumulados de
+    cada lugar donde algo de fuera del paquete lo importó. Los módulos del proyecto se dejan fuera.
+    """
+    entries = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            entries.append((len(match.group(3)), match.group(4).split(".")[0], int(match.group(2)) / 1000))
+    packages = {}
+    importers = []  # (profundidad, paquete) de los módulos por encima del actual, el reporte los lista después
+    for depth, package, cumulative_ms in reversed(entries):
+        while importers and importers[-1][0] >= depth:
+            importers.pop()
+        if package != "agents" and (not importers or importers[-1][1] != package):
+            packages[package] = packages.get(package, 0) + cumulative_ms
+        importers.append((depth, package))
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return [{"package": package, "cumulative_ms": cumulative_ms} for package, cumulative_ms in slowest]
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide cuánto tardan en arrancar los puntos de entrada, cada uno en un intérprete nuevo.")
+    parser.add_argument("--repeat", type=int, default=5, help="Ejecuciones de cada comando")
+    parser.add_argument("--commands", default=",".join(COMMANDS), help=f"Subconjunto separado por comas de: {', '.join(COMMANDS)}")
+    parser.add_argument("--budget-ms", type=float, default=500,
+                        help=f"Termina con error si el p50 de '{BUDGETED_COMMAND}' es más lento que esto")
+    parser.add_argument("--top", type=int, default=10, help="Paquetes importados más lentos que se muestran de cada comando")
+    parser.add_argument("--json", metavar="PATH", help="También guarda los resultados en JSON")
+    args = parser.parse_args()
+
+    commands = [command.strip() for command in args.commands.split(",") if command.strip()]
+    unknown = set(commands) - set(COMMANDS)
+    if unknown:
+        parser.error(f"Comandos desconocidos: {', '.join(sorted(unknown))}")
+
+    # No hace falta base de datos ni Ollama: los comandos solo importan módulos y leen la configuración
+    results = []
+    imports = {}
+    for name in commands:
+        run(COMMANDS[name])  # Calienta el bytecode y la caché de archivos del sistema, como cada arranque tras el primero
+        seconds = np.array([run(COMMANDS[name])[0] for _ in range(args.repeat)]) * 1000
+        results.append({"command": name, "runs": args.repeat, "p50_ms": np.percentile(seconds, 50),
+                        "p95_ms": np.percentile(seconds, 95), "max_ms": seconds.max()})
+        imports[name] = slowest_imports(run(COMMANDS[name], importtime=True)[1], args.top)
+
+    print(pd.DataFrame(results).to_markdown(index=False, floatfmt=".1f"))
+    for name in commands:
+        print(f"\n[INFO] Importaciones más lentas de '{name}':")
+        print(pd.DataFrame(imports[name], columns=["package", "cumulative_ms"]).to_markdown(index=False, floatfmt=".1f"))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"results": results, "imports": imports}, f, indent=2, default=float)
+        print(f"[INFO] Resultados guardados en {args.json}")
+
+    budgeted = next((result for result in results if result["command"] == BUDGETED_COMMAND), None)
+    if budgeted is not None and budgeted["p50_ms"] > args.budget_ms:
+        print(f"[ERROR] '{BUDGETED_COMMAND}' tardó {budgeted['p50_ms']:.0f} ms, por encima del límite de {args.budget_ms:.0f} ms")
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
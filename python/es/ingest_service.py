@@ -0,0 +1,312 @@
+import csv
+import io
+import json
+import math
+import os
+import signal
+import sys
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from sqlalchemy import create_engine, exc, text
+from agents.aggregation import SENSOR_ID_COLUMN, SENSOR_TABLE, SENSOR_TIME_COLUMN, SENSOR_VALUE_COLUMN, quote_identifier
+from agents.db import get_engine
+from agents.report_data import SENSOR_MAX
+from agents.rollups import mark_late_readings
+
+# Configuración del servicio de ingesta
+INGEST_HOST = os.getenv("INGEST_HOST", "0.0.0.0")
+INGEST_PORT = int(os.getenv("INGEST_PORT", "8080"))
+INGEST_DB_URL = os.getenv("INGEST_DB_URL")  # ej: sqlite:///lecturas.db para pruebas locales, por defecto el PostgreSQL de los agentes
+FLUSH_SIZE = int(os.getenv("INGEST_FLUSH_SIZE", "500"))  # Lecturas acumuladas antes de forzar una escritura
+FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", "2.0"))  # Segundos máximos que una lectura espera en el búfer
+MAX_BUFFERED = int(os.getenv("INGEST_MAX_BUFFERED", "100000"))  # Por encima de esto el servicio responde 503 hasta que la BD se ponga al día
+FLUSH_RETRIES = int(os.getenv("INGEST_FLUSH_RETRIES", "3"))  # Escrituras fallidas de un lote antes de dividirlo para encontrar las lecturas rechazadas
+
+def columns():
+    """Columnas que se escriben para cada lectura: (fecha, valor[, id del sensor])."""
+    names = [SENSOR_TIME_COLUMN, SENSOR_VALUE_COLUMN]
+    if SENSOR_ID_COLUMN:
+        names.append(SENSOR_ID_COLUMN)
+    return names
+
+def parse_reading(value, timestamp=None, sensor_id=None, received_at=None):
+    """Valida una lectura y la devuelve como tupla de fila (ValueError si no es un valor de analogRead)."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Valor de sensor no válido: {value!r}")
+    if not math.isfinite(value) or not 0 <= value <= SENSOR_MAX:
+        raise ValueError(f"Valor de sensor fuera del rango de analogRead 0-{SENSOR_MAX}: {value!r}")
+    if value.is_integer():
+        value = int(value)  # Valores de analogRead(), así COPY funciona con columnas enteras
+    if timestamp:
+        timestamp = datetime.fromisoformat(str(timestamp))
+        if timestamp.tzinfo is None:
+            timestamp = timestamp.astimezone()  # Las fechas sin zona horaria se toman como hora local
+    else:
+        timestamp = received_at or datetime.now().astimezone()
+    row = (timestamp, value)
+    if SENSOR_ID_COLUMN:
+        row += (None if sensor_id in (None, "") else str(sensor_id),)
+    return row
+
+def parse_form(body):
+    """`value=...` (y opcionalmente `sensor_id=...`) tal como lo envía config.ino."""
+    fields = parse_qs(body.decode("utf-8"))
+    return [parse_reading(fields.get("value", [None])[0], fields.get("timestamp", [None])[0],
+                          fields.get("sensor_id", [None])[0])]
+
+def parse_json(body):
+    """Una lista de lecturas (o {"readings": [...]}) con `value` y opcionalmente `timestamp`/`sensor_id`."""
+    payload = json.loads(body)
+    if isinstance(payload, dict):
+        payload = payload.get("readings", [payload])
+    received_at = datetime.now().astimezone()
+    return [parse_reading(item.get("value"), item.get("timestamp"), item.get("sensor_id"), received_at)
+            for item in payload]
+
+def parse_csv(body):
+    """Una lectura por línea: value[,timestamp[,sensor_id]], con una línea de cabecera opcional."""
+    received_at = datetime.now().astimezone()
+    rows = []
+    for fields in csv.reader(io.StringIO(body.decode("utf-8"))):
+        if not fields or (not rows and fields[0].strip().lower() in ("value", "valor")):
+            continue
+        fields = [field.strip() for field in fields] + [None, None]
+        rows.append(parse_reading(fields[0], fields[1], fields[2], received_at))
+    return rows
+
+def copy_rows(raw_connection, rows):
+    """Escribe las filas con COPY de PostgreSQL (psycopg 3 o psycopg2), en la misma transacción que su marca en los agregados."""
+    column_list = ", ".join(quote_identifier(name) for name in columns())
+    copy_sql = f"COPY {quote_identifier(SENSOR_TABLE)} ({column_list}) FROM STDIN"
+    cursor = raw_connection.cursor()
+    try:
+        if hasattr(cursor, "copy"):  # psycopg 3
+            with cursor.copy(copy_sql) as copy:
+                for row in rows:
+                    copy.write_row(row)
+        else:  # psycopg2
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows((timestamp.isoformat(),) + tuple(rest) for timestamp, *rest in rows)
+            buffer.seek(0)
+            cursor.copy_expert(f"{copy_sql} WITH (FORMAT csv)", buffer)
+        mark_late_readings(cursor, min(row[0] for row in rows))  # Cargas atrasadas anteriores a la ventana de los agregados
+        raw_connection.commit()
+    finally:
+        cursor.close()
+
+def write_batch(engine, rows):
+    """Escribe un lote de lecturas: COPY en PostgreSQL, un insert de varias filas en los demás casos (SQLite)."""
+    if engine.dialect.name == "postgresql":
+        raw_connection = engine.raw_connection()  # Se toma del pool del engine (y se devuelve a él)
+        try:
+            copy_rows(raw_connection, rows)
+        finally:
+            raw_connection.close()
+        return
+
+    names = columns()
+    insert = text(
+        f"INSERT INTO {quote_identifier(SENSOR_TABLE)} ({', '.join(quote_identifier(name) for name in names)}) "
+        f"VALUES ({', '.join(':' + name for name in names)})"
+    )
+    with engine.begin() as conn:
+        conn.execute(insert, [dict(zip(names, row)) for row in rows])
+
+def database_unavailable(engine, error):
+    """True para errores de conexión, tras los que las mismas filas se pueden escribir más tarde (no para filas que la base de datos rechaza)."""
+    dbapi = getattr(engine.dialect, "dbapi", None)
+    unavailable = (exc.OperationalError, exc.InterfaceError)
+    if dbapi is not None:
+        unavailable += (dbapi.OperationalError, dbapi.InterfaceError)
+    return isinstance(error, unavailable)
+
+def ensure_sqlite_table(engine):
+    """Crea la tabla de lecturas en modo SQLite, para poder probar el servicio sin PostgreSQL."""
+    definitions = [f"{quote_identifier(SENSOR_TIME_COLUMN)} TIMESTAMP NOT NULL",
+                   f"{quote_identifier(SENSOR_VALUE_COLUMN)} REAL NOT NULL"]
+    if SENSOR_ID_COLUMN:
+        definitions.append(f"{quote_identifier(SENSOR_ID_COLUMN)} TEXT")
+    with engine.begin() as conn:
+        conn.execute(text(f"CREATE TABLE IF NOT EXISTS {quote_identifier(SENSOR_TABLE)} ({', '.join(definitions)})"))
+
+class ReadingBuffer:
+    """
+    Acumula las lecturas en memoria y las escribe por lotes desde un hilo en segundo plano,
+    cuando hay FLUSH_SIZE lecturas esperando o cada FLUSH_INTERVAL segundos.
+    """
+
+    def __init__(self, engine, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.engine = engine
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.rows = []
+        self.flushed = 0
+        self.dropped = 0
+        self.failed_flushes = 0  # Escrituras fallidas seguidas, vuelve a cero con una que funciona
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake_up = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="ingest-flush", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def add(self, rows):
+        """Encola lecturas, devuelve False si el búfer está lleno."""
+        with self.lock:
+            if len(self.rows) + len(rows) > MAX_BUFFERED:
+                return False
+            self.rows.extend(rows)
+            if len(self.rows) >= self.flush_size:
+                self.wake_up.set()
+        return True
+
+    def pending(self):
+        with self.lock:
+            return len(self.rows)
+
+    def requeue(self, rows):
+        with self.lock:
+            self.rows[:0] = rows
+
+    def flush(self):
+        """
+        Escribe todo lo acumulado hasta ahora. Mientras la base de datos no está disponible el lote se
+        guarda para la siguiente escritura, hasta FLUSH_RETRIES veces; cualquier otro fallo (o uno repetido
+        demasiadas veces) divide el lote para descartar solo las lecturas que la base de datos rechaza,
+        así una fila errónea no bloquea el resto.
+        """
+        with self.flush_lock:
+            with self.lock:
+                batch, self.rows = self.rows, []
+            if not batch:
+                return 0
+            try:
+                write_batch(self.engine, batch)
+            except Exception as e:
+                self.failed_flushes += 1
+                if database_unavailable(self.engine, e) and self.failed_flushes <= FLUSH_RETRIES:
+                    print(f"[ERROR] No se pudieron escribir {len(batch)} lecturas, se guardan para la siguiente escritura: {e}")
+                    self.requeue(batch)
+                    return 0
+                print(f"[WARNING] No se pudieron escribir {len(batch)} lecturas, se escriben en lotes más pequeños: {e}")
+                return self.write_isolating(batch)
+            self.failed_flushes = 0
+            self.flushed += len(batch)
+            print(f"[INFO] Escritas {len(batch)} lecturas ({self.flushed} en total)")
+            return len(batch)
+
+    def write_isolating(self, batch):
+        """
+        Escribe el lote en mitades, y las mitades que fallan otra vez en mitades, hasta que cada lectura
+        que la base de datos rechaza queda sola y se puede registrar y descartar. Si la base de datos deja
+        de estar disponible, las lecturas aún sin escribir vuelven al búfer. Devuelve las lecturas escritas.
+        """
+        written = 0
+        parts = [batch]
+        while parts:
+            rows = parts.pop(0)
+            try:
+                write_batch(self.engine, rows)
+                written += len(rows)
+            except Exception as e:
+                if database_unavailable(self.engine, e):
+                    print(f"[ERROR] Base de datos no disponible, se guardan {len(rows) + sum(map(len, parts))} lecturas para la siguiente escritura: {e}")
+                    self.requeue(rows + [row for part in parts for row in part])
+                    break
+                if len(rows) == 1:
+                    self.dropped += 1
+                    print(f"[ERROR] Se descarta una lectura rechazada por la base de datos {rows[0]}: {e}")
+                else:
+                    parts[:0] = [rows[:len(rows) // 2], rows[len(rows) // 2:]]
+        else:
+            self.failed_flushes = 0
+        self.flushed += written
+        print(f"[INFO] Escritas {written} lecturas ({self.flushed} en total, {self.dropped} descartadas)")
+        return written
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wake_up.wait(self.flush_interval)
+            self.wake_up.clear()
+            self.flush()
+
+    def close(self):
+        self.stopped.set()
+        self.wake_up.set()
+        self.thread.join()
+        self.flush()
+
+class IngestHandler(BaseHTTPRequestHandler):
+    buffer = None  # Lo asigna serve()
+
+    def send_text(self, status, body, content_type="text/plain"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_text(404, "No encontrado")
+            return
+        status = {"pending": self.buffer.pending(), "flushed": self.buffer.flushed, "dropped": self.buffer.dropped}
+        self.send_text(200, json.dumps(status), "application/json")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip()
+        try:
+            if self.path == "/insert.php" or content_type == "application/x-www-form-urlencoded":
+                rows = parse_form(body)
+            elif content_type == "application/json":
+                rows = parse_json(body)
+            elif content_type == "text/csv":
+                rows = parse_csv(body)
+            else:
+                self.send_text(415, f"Tipo de contenido no soportado: {content_type}")
+                return
+        except (ValueError, TypeError, AttributeError) as e:
+            self.send_text(400, f"Lecturas no válidas: {e}")
+            return
+
+        if not self.buffer.add(rows):
+            self.send_text(503, "Búfer lleno, reintente más tarde")
+            return
+        self.send_text(200, f"OK {len(rows)}")
+
+    def log_message(self, format, *args):
+        pass  # Una línea por lectura llenaría la salida
+
+def serve(host=INGEST_HOST, port=INGEST_PORT):
+    """Ejecuta el servicio de ingesta hasta que se interrumpe, escribiendo las lecturas pendientes al salir."""
+    if INGEST_DB_URL:
+        engine = create_engine(INGEST_DB_URL)
+        if engine.dialect.name == "sqlite":
+            ensure_sqlite_table(engine)
+    else:
+        engine = get_engine()
+
+    buffer = ReadingBuffer(engine)
+    buffer.start()
+    IngestHandler.buffer = buffer
+    server = ThreadingHTTPServer((host, port), IngestHandler)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # Vaciar el búfer cuando lo detiene un gestor de servicios
+    print(f"[INFO] Servicio de ingesta escuchando en http://{host}:{port} ({engine.dialect.name})")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n[INFO] Deteniendo el servicio de ingesta...")
+    finally:
+        server.server_close()
+        buffer.close()
+
+if __name__ == "__main__":
+    serve()
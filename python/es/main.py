@@ -1,27 +1,140 @@
+import argparse
 import os
-import subprocess
+from datetime import datetime
+from functools import partial
+from agents import locales, routing, scheduler
 
-# El usuario debe ingresar el directorio de salida para los archivos generados (reemplaza con tu propia ruta)
-OUTPUT_DIR = input("Ingrese el directorio de salida para los archivos generados (ejemplo: /ruta/a/tu/directorio): ").strip()
+# Los agentes se ejecutan como etapas de este proceso: comparten los clientes del LLM y el engine
+# de la base de datos, y cada etapa recibe en memoria los resultados de las etapas de las que depende.
+# El gráfico y el borrador del email solo necesitan los resultados de la consulta, así que se
+# ejecutan en paralelo y se unen al armar el mensaje. El control de anomalías lee las lecturas brutas
+# mientras se ejecuta la consulta, y sus hallazgos van al borrador del email.
+# Cada etapa recibe los ajustes del reporte (`job`, ver agents/scheduler.py). Las etapas que leen
+# la base de datos esperan uno de sus DB_CONCURRENCY turnos, así muchas plantas pueden ejecutarse a la vez.
+# Un reporte en varios idiomas (job["languages"]) consulta y analiza los datos una sola vez: los gráficos
+# de cada idioma se dibujan a partir del mismo resumen y los borradores se redactan en paralelo.
+# Solo los módulos de configuración se importan al inicio: los agentes (LangChain, pandas, Matplotlib,
+# SQLAlchemy) los importan las funciones que los ejecutan, así `--check` y `--help` arrancan al instante.
 
-def run_query_agent():
-    print("[INFO] Ejecutando Query_agent.py...")
-    subprocess.run(["python3", "Query_agent.py"], check=True)
+def run_query_agent(job):
+    from agents import db, query_agent
+    from agents.pipeline import limited
+    print("[INFO] Ejecutando agente de consultas...")
+    with limited(db.DB_SLOTS, "db"):
+        df_summary = query_agent.run_workflow(output_dir=job["output_dir"], sensor_id=job["sensor_id"],
+                                              prepare=job.get("prepare", True))
+    if df_summary is None:
+        raise RuntimeError("El agente de consultas no devolvió datos")
+    return df_summary
 
-def run_plot_agent():
-    print("[INFO] Ejecutando Plot_agent.py...")
-    subprocess.run(["python3", "Plot_agent.py"], check=True)
+def run_plot_agent(job, df_summary):
+    from agents import plot_agent
+    print("[INFO] Ejecutando agente de gráficos...")
+    png_paths = plot_agent.main(df_summary, job["output_dir"], job["languages"])
+    if png_paths is None:
+        raise RuntimeError("El agente de gráficos no generó el gráfico")
+    return png_paths
 
-def run_email_agent():
-    print("[INFO] Ejecutando Email_agent.py...")
-    subprocess.run(["python3", "Email_agent.py"], check=True)
+def run_anomaly_detection(job):
+    from agents import anomalies, db, query_agent
+    from agents.pipeline import limited
+    print("[INFO] Buscando anomalías en las lecturas brutas...")
+    with limited(db.DB_SLOTS, "db"):
+        return anomalies.find_anomalies(query_agent.REPORT_WINDOW_DAYS, job["sensor_id"])
 
-def cleanup_files():
-    # Asegúrate de que OUTPUT_DIR esté configurado correctamente por el usuario.
+def run_email_draft(job, language, df_summary, findings):
+    from agents import email_agent
+    print(f"[INFO] Redactando el email ({language})...")
+    email_html = email_agent.draft_email(df_summary, job["recipients"], findings, job["species"], language)
+    if email_html is None:
+        raise RuntimeError(f"El agente de email no redactó el email ({language})")
+    return email_html
+
+def run_email_send(job, png_paths, *drafts):
+    from agents import email_agent
+    print("[INFO] Enviando el email...")
+    email_html = email_agent.combine_drafts(dict(zip(job["languages"], drafts)))
+    msg = email_agent.build_message(email_html, list(png_paths.values()), job["sender_email"], job["languages"])
+    if msg is None or not email_agent.send_message(msg, job["sender_email"], job["sender_password"], job["recipients"]):
+        raise RuntimeError("El agente de email no envió el reporte")
+
+STAGES = {
+    "query": ((), run_query_agent),                     # Ejecuta la consulta y el reporte Markdown
+    "anomalies": ((), run_anomaly_detection),           # Revisa las lecturas brutas mientras se construye el resumen
+    "plot": (("query",), run_plot_agent),               # Ejecuta la generación del gráfico (PNG y actualización del Markdown)
+    "draft": (("query", "anomalies"), run_email_draft), # Redacta el email con el LLM, una vez por idioma
+    "send": (("plot", "draft"), run_email_send),        # Adjunta los gráficos y envía el email
+}
+
+def report_stages(job):
+    """
+    Las STAGES del reporte descrito por `job`. La etapa del borrador se repite para cada idioma del
+    reporte ("draft_es", "draft_en"...) y el email se envía cuando terminaron todas.
+    """
+    stages = {}
+    for name, (dependencies, function) in STAGES.items():
+        if name != "draft":
+            stages[name] = (dependencies, partial(function, job))
+            continue
+        for language in job["languages"]:
+            stages[f"draft_{language}"] = (dependencies, partial(function, job, language))
+    stages["send"] = (("plot", *(f"draft_{language}" for language in job["languages"])), partial(run_email_send, job))
+    return stages
+
+def env_settings():
+    """Ajustes de un solo reporte tomados del entorno, los que faltan son None."""
+    job = {key: os.getenv(variable) for key, variable in scheduler.JOB_SETTINGS.items()}
+    job["name"] = "report"
+    job["languages"] = locales.parse_languages(job["languages"])
+    return job
+
+def ask_settings():
+    """Ajustes de un solo reporte: se toman del entorno y los que faltan se piden al usuario."""
+    from agents import email_agent
+    job = env_settings()
+    if not job["output_dir"]:
+        # El usuario debe ingresar el directorio de salida para los archivos generados (reemplaza con tu propia ruta)
+        job["output_dir"] = input("Ingrese el directorio de salida para los archivos generados (ejemplo: /ruta/a/tu/directorio): ").strip()
+    # Se piden al inicio, el email se redacta mientras se ejecutan otras etapas
+    job["recipients"], job["sender_email"], job["sender_password"] = email_agent.ask_email_settings(
+        job["recipients"], job["sender_email"], job["sender_password"])
+    return job
+
+def report_models():
+    """
+    Modelos a los que llamará el reporte con la configuración actual. El modelo de razonamiento solo
+    redacta los correos de plantas con anomalías, se carga cuando uno lo necesita y no antes de cada reporte.
+    """
+    from agents import plot_agent, query_agent
+    models = {routing.model_for("email")}
+    if query_agent.USE_LLM_SQL:
+        models.add(routing.model_for("sql"))
+    if plot_agent.PLOT_MODE == "llm":
+        models.add(routing.model_for("plot"))
+    return sorted(models)
+
+def warm_up():
+    """
+    Carga los modelos en Ollama y abre una conexión a la base de datos antes de un reporte programado.
+    Los agentes también se importan entonces, así el reporte no los espera.
+    """
+    from agents import anomalies, db, email_agent, llm, plot_agent, query_agent
+    for model in report_models():
+        print(f"[INFO] Cargando {model} en Ollama...")
+        llm.preload(model)
+    db.check_health()
+
+def cleanup_files(output_dir, languages=()):
+    from agents import plot_agent
+    # Asegúrate de que el directorio de salida esté configurado correctamente por el usuario.
     files_to_delete = [
-        os.path.join(OUTPUT_DIR, "humedad_estimado.md"),
-        os.path.join(OUTPUT_DIR, "humedad_suelo.png")
+        os.path.join(output_dir, plot_agent.HUMIDITY_TABLE_FILENAME),
+        os.path.join(output_dir, plot_agent.CHART_FILENAME)
     ]
+    for language in languages:  # Los gráficos de los otros idiomas del reporte
+        chart_path = os.path.join(output_dir, locales.LOCALES[language]["chart_filename"])
+        if chart_path not in files_to_delete:
+            files_to_delete.append(chart_path)
     for file_path in files_to_delete:
         if os.path.exists(file_path):
             os.remove(file_path)
@@ -29,15 +142,105 @@ def cleanup_files():
         else:
             print(f"[INFO] Archivo no encontrado (ya eliminado): {file_path}")
 
-def main():
+def run_report(job):
+    """Ejecuta el reporte completo de `job`. Devuelve True si se envió el email."""
+    from agents import metrics
+    from agents.pipeline import run_stages
+    try:
+        with metrics.span("report", plant=job["name"]):
+            run_stages(report_stages(job))
+        return True
+    except Exception as e:
+        print(f"[ERROR] Ocurrió un error durante el reporte de '{job['name']}': {e}")
+        return False
+    finally:
+        cleanup_files(job["output_dir"], job["languages"])  # Elimina los archivos generados al finalizar el proceso
+
+def run_reports(jobs):
+    """
+    Ejecuta los reportes de `jobs` a la vez: las particiones y los rollups se actualizan una sola vez
+    y luego cada planta ejecuta su propio reporte (agents/fleet.py). Devuelve {nombre de la planta: enviado}.
+    """
+    # Todos los agentes se importan aquí, antes de que empiecen las plantas, y no desde sus hilos a la vez
+    from agents import anomalies, email_agent, fleet, llm_cache, metrics, plot_agent, query_agent
+    metrics.new_run()
     try:
-        run_query_agent()   # Ejecuta la tarea de generación de consulta y reporte Markdown
-        run_plot_agent()    # Ejecuta la tarea de generación del gráfico (PNG y actualización del Markdown)
-        run_email_agent()   # Ejecuta la tarea de redacción y envío del email
-    except subprocess.CalledProcessError as e:
-        print(f"[ERROR] Ocurrió un error durante la ejecución: {e}")
+        with metrics.span("fleet", plants=len(jobs)):
+            try:
+                query_agent.prepare_tables()
+            except Exception as e:
+                print(f"[ERROR] No se pudieron actualizar las tablas de lecturas: {e}")
+                return {job["name"]: False for job in jobs}
+            return fleet.run_fleet([dict(job, prepare=False) for job in jobs], run_report)
     finally:
-        cleanup_files()     # Elimina los archivos generados al finalizar el proceso
+        llm_cache.report_stats()
+        metrics.export()
+
+def check(args):
+    """
+    Valida los ajustes del modo elegido y muestra lo que ejecutaría, sin importar los agentes ni
+    conectarse a nada (`python3 -m agents.db` y `python3 -m agents.routing` comprueban las
+    conexiones). Devuelve el código de salida.
+    """
+    try:
+        if args.daemon or args.fleet:
+            jobs = scheduler.load_jobs(args.config)
+        else:
+            jobs = [env_settings()]
+            missing = [scheduler.JOB_SETTINGS[key] for key in scheduler.REQUIRED_SETTINGS if not jobs[0][key]]
+            if missing:
+                print(f"[INFO] Sin definir, se piden al inicio: {', '.join(missing)}")
+        now = datetime.now()
+        for job in jobs:
+            when = f"horario {job['schedule']}, próximo reporte {job['schedule'].next_after(now):%Y-%m-%d %H:%M}" \
+                if args.daemon else "reporte ahora"
+            print(f"[INFO] {job['name']}: sensor {job['sensor_id'] or 'cualquiera'}, {job['species'] or 'especie por defecto'}, "
+                  f"idiomas {', '.join(job['languages'])}, {when}")
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] Configuración de plantas inválida: {e}")
+        return 1
+    try:
+        routing.validate()
+    except ValueError as e:
+        print(f"[ERROR] Enrutado de modelos inválido: {e}")
+        return 1
+    for task in routing.task_tiers():
+        print(f"[INFO] {task}: {routing.model_for(task)}")
+    print(f"[INFO] Endpoints de Ollama: {', '.join(endpoint.url for endpoint in routing.endpoints())}")
+    print("[INFO] Configuración correcta")
+    return 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Genera el reporte de humedad del suelo y lo envía por email.")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Sigue en ejecución y envía los reportes según su horario, sin preguntar nada")
+    parser.add_argument("--fleet", action="store_true", help="Envía ahora el reporte de cada planta de la configuración")
+    parser.add_argument("--config", help="Archivo JSON con las plantas y sus horarios (DAEMON_CONFIG)")
+    parser.add_argument("--check", "--dry-run", action="store_true",
+                        help="Valida los ajustes del modo elegido y muestra lo que se ejecutaría, sin cargar los agentes")
+    args = parser.parse_args()
+
+    if args.check:
+        raise SystemExit(check(args))
+
+    try:
+        routing.validate()  # Falla antes de hacer ninguna pregunta o cargar ninguna planta
+    except ValueError as e:
+        print(f"[ERROR] Enrutado de modelos inválido: {e}")
+        raise SystemExit(1)
+    if not (args.daemon or args.fleet):
+        run_reports([ask_settings()])
+        return
+    try:
+        jobs = scheduler.load_jobs(args.config)
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] Configuración de plantas inválida: {e}")
+        raise SystemExit(1)
+    if args.fleet:
+        results = run_reports(jobs)
+        raise SystemExit(0 if all(results.values()) else 1)
+    # Los clientes de Ollama, el engine de la base de datos y las sesiones SMTP se mantienen entre reportes
+    scheduler.run_forever(jobs, run_reports, warm_up)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import pytest
+from agents import locales
+from agents.anomalies import KINDS, describe_findings, detect, detect_series
+
+MINUTES = 24 * 60
+HOURS = 72  # Tres días al ritmo del dispositivo, una lectura por hora
+
+def drying_series(seed=0, minutes=MINUTES, freq="min"):
+    """Una lectura por minuto (o por `freq`) de una maceta que se seca despacio (el valor sube), con unas pocas unidades de ruido."""
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range("2024-05-01", periods=minutes, freq=freq)
+    values = np.round(np.linspace(400, 600, minutes) + rng.integers(-3, 4, minutes))
+    return timestamps, values
+
+def hourly_series(seed=0):
+    return drying_series(seed, HOURS, "h")
+
+def kinds(findings):
+    return findings["kind"].tolist() if not findings.empty else []
+
+def test_a_healthy_series_has_no_findings():
+    assert detect_series(*drying_series()).empty
+
+def test_spike_is_an_outlier_and_not_a_watering():
+    timestamps, values = drying_series()
+    values[700] += 250
+    findings = detect_series(timestamps, values)
+    assert kinds(findings) == ["outlier"]
+    assert findings.loc[0, "start"] == timestamps[700] and findings.loc[0, "readings"] == 1
+    assert findings.loc[0, "reference"] == pytest.approx(values[700] - 250, abs=10)
+
+def test_watering_is_a_sudden_drop():
+    timestamps, values = drying_series()
+    values[900:] -= 250
+    findings = detect_series(timestamps, values)
+    assert kinds(findings) == ["sudden_drop"]
+    assert findings.loc[0, "start"] == timestamps[900]
+    assert findings.loc[0, "reference"] == pytest.approx(values[899], abs=10)  # El valor antes del riego
+
+def test_identical_readings_are_a_stuck_sensor():
+    timestamps, values = drying_series()
+    values[300:500] = 512  # 200 minutos sin cambios
+    findings = detect_series(timestamps, values)
+    assert kinds(findings) == ["stuck"]
+    assert findings.loc[0, "readings"] == 200 and findings.loc[0, "low"] == 512
+
+def test_readings_at_the_ends_of_the_scale_are_out_of_range():
+    timestamps, values = drying_series()
+    values[1000:1010] = 1023  # Sensor desconectado
+    values[1200] = 0
+    findings = detect_series(timestamps, values)
+    assert kinds(findings) == ["out_of_range", "out_of_range"]
+    assert findings["readings"].tolist() == [10, 1]
+
+def test_detect_reports_each_sensor_most_serious_first():
+    timestamps, healthy = drying_series(seed=1)
+    _, faulty = drying_series(seed=2)
+    faulty[100] += 250
+    faulty[600:620] = 1023
+    readings = pd.concat([
+        pd.DataFrame({"fecha_hora": timestamps, "valor": healthy, "id_sensor": "plant-1"}),
+        pd.DataFrame({"fecha_hora": timestamps, "valor": faulty, "id_sensor": "plant-2"}),
+    ], ignore_index=True)
+    findings = detect(readings)
+    assert kinds(findings) == ["out_of_range", "outlier"]
+    assert set(findings["id_sensor"]) == {"plant-2"}
+    assert [KINDS.index(kind) for kind in kinds(findings)] == sorted(KINDS.index(kind) for kind in kinds(findings))
+
+def test_a_healthy_hourly_series_has_no_findings():
+    timestamps, values = hourly_series()
+    values[30:33] = values[30]  # El mismo valor tres horas seguidas no es un sensor trabado
+    assert detect_series(timestamps, values).empty
+
+def test_hourly_watering_is_a_sudden_drop():
+    timestamps, values = hourly_series()
+    values[40:] -= 250
+    findings = detect_series(timestamps, values)
+    assert kinds(findings) == ["sudden_drop"]
+    assert findings.loc[0, "start"] == timestamps[40]
+    assert findings.loc[0, "reference"] == values[39]  # Comparado con la lectura anterior, una hora antes
+
+def test_hourly_spike_is_an_outlier():
+    timestamps, values = hourly_series()
+    values[20] += 250
+    findings = detect_series(timestamps, values)
+    assert kinds(findings) == ["outlier"] and findings.loc[0, "start"] == timestamps[20]
+
+def test_hourly_stuck_sensor_needs_enough_readings():
+    timestamps, values = hourly_series()
+    values[10:18] = 512  # Ocho horas sin cambios
+    findings = detect_series(timestamps, values)
+    assert kinds(findings) == ["stuck"] and findings.loc[0, "readings"] == 8
+
+def test_hourly_disconnected_sensor_is_out_of_range():
+    timestamps, values = hourly_series()
+    values[50:53] = 1023
+    assert kinds(detect_series(timestamps, values)) == ["out_of_range"]
+
+def test_describe_findings():
+    assert describe_findings(None) == locales.text(None, "anomalies_unavailable")
+    assert describe_findings(pd.DataFrame()) == locales.text(None, "anomalies_none")
+    timestamps, values = drying_series()
+    for start in range(100, 1400, 100):
+        values[start] += 250
+    findings = detect_series(timestamps, values)
+    assert len(findings) == 13
+    lines = describe_findings(findings, limit=5).splitlines()
+    assert len(lines) == 6 and lines[-1] == locales.text(None, "anomalies_more", count=8)
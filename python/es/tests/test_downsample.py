@@ -0,0 +1,80 @@
+import math
+import numpy as np
+import pandas as pd
+import pytest
+from agents.downsample import downsample_summary, lttb
+from agents.report_data import SUMMARY_COLUMNS
+
+def reference_lttb(x, y, threshold):
+    """Traducción punto a punto del Largest-Triangle-Three-Buckets original (Steinarsson, 2013)."""
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    every = (n - 2) / (threshold - 2)
+    sampled = [0]
+    a = 0
+    for i in range(threshold - 2):
+        avg_start = math.floor((i + 1) * every) + 1
+        avg_end = min(math.floor((i + 2) * every) + 1, n)
+        avg_x = sum(x[avg_start:avg_end]) / (avg_end - avg_start)
+        avg_y = sum(y[avg_start:avg_end]) / (avg_end - avg_start)
+        max_area, next_a = -1, None
+        for j in range(math.floor(i * every) + 1, math.floor((i + 1) * every) + 1):
+            area = abs((x[a] - avg_x) * (y[j] - y[a]) - (x[a] - x[j]) * (avg_y - y[a])) / 2
+            if area > max_area:
+                max_area, next_a = area, j
+        sampled.append(next_a)
+        a = next_a
+    sampled.append(n - 1)
+    return sampled
+
+@pytest.mark.parametrize("n, target", [(10, 3), (10, 9), (100, 10), (1000, 97), (5000, 500), (7919, 1000)])
+def test_lttb_matches_the_reference(n, target):
+    rng = np.random.default_rng(n + target)
+    x = np.cumsum(rng.uniform(0.5, 2.0, n))  # Muestreo irregular
+    y = np.cumsum(rng.normal(0, 1, n))
+    selected = lttb(x, y, target)
+    assert list(selected) == reference_lttb(list(x), list(y), target)
+    assert len(selected) == target and selected[0] == 0 and selected[-1] == n - 1
+    assert np.all(np.diff(selected) > 0)
+
+@pytest.mark.parametrize("target", [2, 50, 51])
+def test_lttb_keeps_every_point_when_there_is_nothing_to_reduce(target):
+    assert list(lttb(range(50), np.zeros(50), target)) == list(range(50))
+
+def test_lttb_keeps_a_spike():
+    y = np.zeros(1000)
+    y[421] = 100
+    assert 421 in lttb(np.arange(1000), y, 20)
+
+def summary(rows):
+    date, low, mean, high = SUMMARY_COLUMNS
+    rng = np.random.default_rng(rows)
+    average = rng.uniform(300, 700, rows)
+    return pd.DataFrame({
+        date: pd.date_range("2024-01-01", periods=rows, freq="h"),
+        low: average - rng.uniform(0, 100, rows),
+        mean: average,
+        high: average + rng.uniform(0, 100, rows),
+    })
+
+def test_downsample_summary_keeps_the_envelope():
+    date, low, mean, high = SUMMARY_COLUMNS
+    df = summary(1000)
+    reduced = downsample_summary(df, 64)
+    assert len(reduced) == 64
+    assert reduced[low].min() == df[low].min() and reduced[high].max() == df[high].max()
+    assert reduced[date].iloc[0] == df[date].iloc[0] and reduced[date].is_monotonic_increasing
+    assert reduced[mean].mean() == pytest.approx(df[mean].mean(), rel=0.01)
+
+def test_downsample_summary_merges_whole_buckets():
+    date, low, mean, high = SUMMARY_COLUMNS
+    df = summary(6)
+    reduced = downsample_summary(df, 3)  # Grupos de las filas 0-1, 2-3 y 4-5
+    assert reduced[low].tolist() == [df[low][0:2].min(), df[low][2:4].min(), df[low][4:6].min()]
+    assert reduced[mean].tolist() == pytest.approx([df[mean][0:2].mean(), df[mean][2:4].mean(), df[mean][4:6].mean()])
+    assert reduced[high].tolist() == [df[high][0:2].max(), df[high][2:4].max(), df[high][4:6].max()]
+
+def test_downsample_summary_leaves_small_summaries_alone():
+    df = summary(10)
+    assert downsample_summary(df, 10) is df
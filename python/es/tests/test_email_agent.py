@@ -0,0 +1,59 @@
+import pytest
+from agents.email_agent import drop_reasoning, stream_email
+
+EMAIL = "<!DOCTYPE html>\n<html><body><p>Riega la monstera mañana.</p></body></html>"
+
+class FakeOllama:
+    """Transmite los fragmentos indicados y registra cuántos se leyeron antes de cerrar la petición."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.cache = None
+        self.read = 0
+        self.closed = False
+        self.options = None
+
+    def stream(self, prompt, options=None):
+        self.options = options
+        def generate():
+            try:
+                for chunk in self.chunks:
+                    self.read += 1
+                    yield chunk
+            finally:
+                self.closed = True
+        return generate()
+
+def chunks_of(text, size):
+    return [text[start:start + size] for start in range(0, len(text), size)]
+
+TAIL = ["\nEl modelo sigue escribiendo"] * 20  # Generado después de </html> hasta agotar num_predict
+
+@pytest.mark.parametrize("chunks", [
+    chunks_of(EMAIL, 5) + TAIL,
+    chunks_of("<think>Suelo seco, mencionar el riego.</think>\n" + EMAIL, 7) + TAIL,
+    ["<think>Suelo seco.", "</think>\n" + EMAIL] + TAIL,  # El razonamiento termina en el fragmento con todo el email
+    ["<think>Suelo seco.</think>" + EMAIL] + TAIL,  # Ambas etiquetas en el único fragmento
+    ["<think>Suelo seco.</thi", "nk>" + EMAIL[:-4], "tml>"] + TAIL,  # Etiquetas divididas entre fragmentos
+])
+def test_generation_stops_at_the_closing_html(chunks):
+    llm = FakeOllama(chunks)
+    assert stream_email("prompt", llm, max_tokens=100) == EMAIL
+    assert llm.read == len(chunks) - len(TAIL) and llm.closed
+    assert llm.options == {"num_predict": 100}
+
+def test_html_inside_the_reasoning_does_not_stop_the_generation():
+    chunks = ["<think>Debería terminar con </html> así.", "</think>\n", EMAIL] + TAIL
+    llm = FakeOllama(chunks)
+    assert stream_email("prompt", llm) == EMAIL
+    assert llm.read == 3
+
+def test_unfinished_draft_is_returned_with_a_warning(capsys):
+    llm = FakeOllama(["<think>Todavía pensando"] * 3)
+    assert stream_email("prompt", llm) == ""
+    assert "[WARNING]" in capsys.readouterr().out
+
+def test_drop_reasoning():
+    assert drop_reasoning("<think>a</think>b") == "b"
+    assert drop_reasoning("<think>still open") == ""
+    assert drop_reasoning("sin razonamiento") == "sin razonamiento"
@@ -0,0 +1,72 @@
+import math
+from datetime import datetime, timezone
+import pytest
+from sqlalchemy import create_engine, text
+import ingest_service
+from ingest_service import ReadingBuffer, parse_csv, parse_json, parse_reading
+
+@pytest.fixture(autouse=True)
+def single_sensor(monkeypatch):
+    """Las pruebas escriben filas (timestamp, valor) salvo que configuren ellas mismas una columna de id de sensor."""
+    monkeypatch.setattr(ingest_service, "SENSOR_ID_COLUMN", None)
+
+@pytest.mark.parametrize("value, expected", [("512", 512), (0, 0), ("1023", 1023), ("511.5", 511.5), (" 7 ", 7)])
+def test_parse_reading_accepts_analog_read_values(value, expected):
+    timestamp, parsed = parse_reading(value)
+    assert parsed == expected
+    assert isinstance(parsed, int) == float(expected).is_integer()
+    assert timestamp.tzinfo is not None
+
+@pytest.mark.parametrize("value", ["nan", "inf", "-inf", "1e308", "-1", "1024", math.nan, "abc", "", None, [512]])
+def test_parse_reading_rejects_invalid_values(value):
+    with pytest.raises(ValueError):
+        parse_reading(value)
+
+def test_parse_reading_timestamps():
+    received_at = datetime(2024, 5, 1, 12, 0, tzinfo=timezone.utc)
+    assert parse_reading(500, received_at=received_at)[0] == received_at
+    assert parse_reading(500, "2024-05-01T10:00:00+02:00")[0] == datetime(2024, 5, 1, 8, 0, tzinfo=timezone.utc)
+    assert parse_reading(500, "2024-05-01T10:00:00")[0].tzinfo is not None  # Sin zona horaria: hora local
+    with pytest.raises(ValueError):
+        parse_reading(500, "yesterday")
+
+def test_parse_reading_sensor_id(monkeypatch):
+    monkeypatch.setattr(ingest_service, "SENSOR_ID_COLUMN", "sensor_id")
+    assert parse_reading(500, sensor_id=3)[2] == "3"
+    assert parse_reading(500, sensor_id="")[2] is None
+
+def test_parse_batches():
+    assert [row[1] for row in parse_json(b'[{"value": 1}, {"value": "2"}]')] == [1, 2]
+    assert [row[1] for row in parse_json(b'{"readings": [{"value": 3}]}')] == [3]
+    assert [row[1] for row in parse_csv(b"value,timestamp\n10\n20,2024-05-01T10:00:00+00:00\n")] == [10, 20]
+    with pytest.raises(ValueError):
+        parse_json(b'[{"value": 1}, {"value": "NaN"}]')
+
+@pytest.fixture
+def engine(tmp_path):
+    """Base de datos SQLite cuya tabla de lecturas rechaza el valor 666, como una restricción que la petición no puede ver."""
+    engine = create_engine(f"sqlite:///{tmp_path / 'readings.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(f'CREATE TABLE {ingest_service.SENSOR_TABLE} ("{ingest_service.SENSOR_TIME_COLUMN}" TIMESTAMP, '
+                          f'"{ingest_service.SENSOR_VALUE_COLUMN}" REAL CHECK ("{ingest_service.SENSOR_VALUE_COLUMN}" <> 666))'))
+    return engine
+
+def stored_values(engine):
+    with engine.connect() as conn:
+        return sorted(conn.execute(text(f'SELECT "{ingest_service.SENSOR_VALUE_COLUMN}" FROM {ingest_service.SENSOR_TABLE}')).scalars())
+
+def test_flush_drops_only_the_rejected_readings(engine):
+    buffer = ReadingBuffer(engine)
+    buffer.add([parse_reading(value) for value in (1, 2, 666, 4, 5, 666, 7)])
+    assert buffer.flush() == 5
+    assert buffer.dropped == 2 and buffer.pending() == 0
+    buffer.add([parse_reading(8)])
+    assert buffer.flush() == 1
+    assert stored_values(engine) == [1, 2, 4, 5, 7, 8]
+
+def test_flush_keeps_the_readings_while_the_database_is_unavailable(tmp_path):
+    buffer = ReadingBuffer(create_engine(f"sqlite:///{tmp_path / 'missing' / 'readings.db'}"))
+    buffer.add([parse_reading(value) for value in (1, 2, 3)])
+    for _ in range(ingest_service.FLUSH_RETRIES + 2):
+        assert buffer.flush() == 0
+    assert buffer.pending() == 3 and buffer.dropped == 0
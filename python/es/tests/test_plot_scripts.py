@@ -0,0 +1,70 @@
+import ast
+import re
+import pytest
+from agents import plot_scripts
+from agents.plot_scripts import check_script, prepare_script, script_key
+
+SCRIPT = """\
+import os
+import matplotlib.pyplot as plt
+import pandas as pd
+data = {'Date': ['2024-05-01'], 'valor_promedio': [512.0]}
+output_dir = '/tmp/old-report'
+df = pd.DataFrame(data)
+os.makedirs(output_dir, exist_ok=True)
+plt.plot(df['Date'], df['valor_promedio'])
+plt.savefig(os.path.join(output_dir, 'plot.png'))
+"""
+
+@pytest.mark.parametrize("code, reason", [
+    ("import subprocess", "importa 'subprocess'"),
+    ("import numpy, socket", "importa 'socket'"),
+    ("from urllib.request import urlopen", "importa 'urllib.request'"),
+    ("from . import secrets", "importa ''"),
+    ("import os\nos.system('rm -rf ~')", "usa os.system"),
+    ("import os\nos.environ['HOME']", "usa os.environ"),
+    ("exec('print(1)')", "usa exec()"),
+    ("f = __import__\nf('os')", "usa __import__()"),
+    ("import os\ngetattr(os, 'system')('id')", "usa getattr()"),
+    ("__builtins__['open']('/etc/passwd')", "usa __builtins__()"),
+    ("().__class__.__base__.__subclasses__()", "usa __subclasses__"),
+])
+def test_scripts_outside_the_allow_list_are_refused(code, reason):
+    with pytest.raises(ValueError, match=f"^el script {re.escape(reason)}$"):
+        check_script(ast.parse(code))
+
+def test_plotting_script_passes():
+    check_script(ast.parse(SCRIPT))
+
+def test_prepare_turns_the_data_and_output_dir_into_inputs():
+    script, reusable = prepare_script(SCRIPT)
+    assert reusable
+    assert "data = PLOT_DATA" in script and "output_dir = OUTPUT_DIR" in script
+    assert "/tmp/old-report" not in script and "512.0" not in script
+
+def test_prepare_keeps_a_script_without_both_inputs():
+    code = SCRIPT.replace("output_dir = '/tmp/old-report'", "OUT = '/tmp/old-report'").replace("output_dir", "OUT")
+    assert prepare_script(code) == (code, False)
+
+def test_prepare_refuses_unsafe_or_broken_scripts():
+    with pytest.raises(ValueError):
+        prepare_script(SCRIPT + "import shutil\nshutil.rmtree(output_dir)\n")
+    with pytest.raises(SyntaxError):
+        prepare_script("plt.plot(")
+
+def test_script_key_depends_on_the_data_shape_not_the_values():
+    data = {"Date": ["2024-05-01"], "valor_promedio": [512.0]}
+    key = script_key("template", data, "llama3.1")
+    assert key == script_key("template", {"Date": ["2024-06-01"], "valor_promedio": [300.0]}, "llama3.1")
+    assert key != script_key("template", {"Date": ["2024-05-01"], "valor_promedio": [512]}, "llama3.1")
+    assert key != script_key("template", data, "deepseek-r1:32b")
+    assert key != script_key("other template", data, "llama3.1")
+
+def test_cached_script_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(plot_scripts, "PLOT_SCRIPT_CACHE_DIR", str(tmp_path / "plot_scripts"))
+    assert plot_scripts.load_script("key") is None
+    plot_scripts.save_script("key", "print('chart')")
+    assert plot_scripts.load_script("key") == "print('chart')"
+    plot_scripts.discard_script("key")
+    assert plot_scripts.load_script("key") is None
+    plot_scripts.discard_script("key")  # Ya no queda nada que borrar
@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta, timezone
+import pytest
+from sqlalchemy import create_engine, text
+from agents.aggregation import DAILY_TABLE, HOURLY_TABLE, SENSOR_TABLE, SENSOR_TIME_COLUMN, SENSOR_VALUE_COLUMN, quote_identifier
+from agents.rollups import STATE_TABLE, refresh_rollups
+from ingest_service import parse_reading, write_batch
+
+START = datetime(2024, 5, 1, 8, tzinfo=timezone.utc)
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    """Un PostgreSQL desechable para el módulo (pip install pgserver, sin él las pruebas se omiten)."""
+    pgserver = pytest.importorskip("pgserver")
+    server = pgserver.get_server(tmp_path_factory.mktemp("postgres"), cleanup_mode="delete")
+    yield server
+    server.cleanup()
+
+@pytest.fixture
+def engine(server):
+    engine = create_engine("postgresql+psycopg://" + server.get_uri()[len("postgresql://"):])
+    with engine.begin() as conn:
+        for table in (SENSOR_TABLE, HOURLY_TABLE, DAILY_TABLE, STATE_TABLE):
+            conn.execute(text(f"DROP TABLE IF EXISTS {quote_identifier(table)}"))
+        conn.execute(text(
+            f"CREATE TABLE {quote_identifier(SENSOR_TABLE)} (id SERIAL PRIMARY KEY, "
+            f"{quote_identifier(SENSOR_VALUE_COLUMN)} INTEGER NOT NULL, {quote_identifier(SENSOR_TIME_COLUMN)} TIMESTAMPTZ NOT NULL)"
+        ))
+    yield engine
+    engine.dispose()
+
+def insert(engine, *readings):
+    """Inserta lecturas (horas después de START, valor) como lo hace el backend PHP, un INSERT por cada una."""
+    with engine.begin() as conn:
+        conn.execute(
+            text(f"INSERT INTO {quote_identifier(SENSOR_TABLE)} ({quote_identifier(SENSOR_TIME_COLUMN)}, "
+                 f"{quote_identifier(SENSOR_VALUE_COLUMN)}) VALUES (:moment, :value)"),
+            [{"moment": START + timedelta(hours=hours), "value": value} for hours, value in readings],
+        )
+
+def assert_rollups_match_raw(engine):
+    ts, value = quote_identifier(SENSOR_TIME_COLUMN), quote_identifier(SENSOR_VALUE_COLUMN)
+    with engine.connect() as conn:
+        for table, bucket, raw_bucket in ((HOURLY_TABLE, "inicio_hora", f"CAST(date_trunc('hour', {ts}) AS TIMESTAMP)"),
+                                          (DAILY_TABLE, "fecha", f"CAST({ts} AS DATE)")):
+            rolled = conn.execute(text(
+                f"SELECT {bucket}, cantidad_lecturas, suma_valor, valor_min, valor_max FROM {quote_identifier(table)} ORDER BY 1"
+            )).fetchall()
+            raw = conn.execute(text(
+                f"SELECT {raw_bucket}, COUNT(*), CAST(SUM({value}) AS FLOAT), CAST(MIN({value}) AS FLOAT), CAST(MAX({value}) AS FLOAT) "
+                f"FROM {quote_identifier(SENSOR_TABLE)} GROUP BY 1 ORDER BY 1"
+            )).fetchall()
+            assert [tuple(row) for row in rolled] == [tuple(row) for row in raw]
+
+def test_refresh_matches_the_raw_readings(engine):
+    insert(engine, *((hours, 500 + hours) for hours in range(30)))
+    assert refresh_rollups(engine) == START + timedelta(hours=29)
+    assert_rollups_match_raw(engine)
+
+def test_late_reading_without_a_newer_one(engine):
+    insert(engine, (0, 500), (1, 510), (2, 520))
+    refresh_rollups(engine)
+    insert(engine, (1.5, 900))  # Confirmada después de la actualización, y no llega nada más nuevo
+    assert refresh_rollups(engine) == START + timedelta(hours=2)
+    assert_rollups_match_raw(engine)
+
+def test_backfill_through_the_ingest_service(engine):
+    insert(engine, *((hours, 500) for hours in range(48, 52)))
+    refresh_rollups(engine)
+    # Lecturas guardadas por un dispositivo desconectado, enviadas después con sus propias fechas
+    write_batch(engine, [parse_reading(600 + hours, (START + timedelta(hours=hours)).isoformat()) for hours in range(24)])
+    with engine.connect() as conn:
+        late_since = conn.execute(text(f"SELECT tardias_desde FROM {quote_identifier(STATE_TABLE)}")).scalar()
+    assert late_since == START
+    refresh_rollups(engine)
+    assert_rollups_match_raw(engine)
+    with engine.connect() as conn:
+        assert conn.execute(text(f"SELECT tardias_desde FROM {quote_identifier(STATE_TABLE)}")).scalar() is None
+
+def test_recent_batches_do_not_mark_the_rollups(engine):
+    insert(engine, (0, 500), (5, 500))
+    refresh_rollups(engine)
+    write_batch(engine, [parse_reading(700, (START + timedelta(hours=5, minutes=30)).isoformat())])
+    with engine.connect() as conn:
+        assert conn.execute(text(f"SELECT tardias_desde FROM {quote_identifier(STATE_TABLE)}")).scalar() is None
+    refresh_rollups(engine)
+    assert_rollups_match_raw(engine)
+
+def test_ingest_works_before_the_first_refresh(engine):
+    write_batch(engine, [parse_reading(600, START.isoformat())])  # Todavía no hay tablas de agregados
+    refresh_rollups(engine)
+    assert_rollups_match_raw(engine)